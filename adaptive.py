@@ -0,0 +1,269 @@
+# adaptive.py
+# 単語クイズの出題を学習者のレベルに合わせる（Elo 方式）。
+#
+# - word_difficulty: 単語ごとの難易度 rating。初期値は綴りの長さと、読解文（reading_texts）での
+#                    出現頻度から決め、回答が来るたびに更新する。
+# - user_ability   : ユーザーごとの実力 rating。回答が来るたびに更新する。
+#
+# 回答 1 件ごとに「実力 - 難易度」から期待得点を出し、実際の得点（score / 100）との差で
+# 両方を少しずつ動かす。履歴を読み出し時に集計することはない。
+#
+# 出題は、実力より TARGET_OFFSET だけ易しいあたりの難易度帯（BUCKET_WIDTH 刻み）から選ぶ。
+# (bucket, pick) の索引に対して「pick >= 乱数 の先頭 1 件」を引くので、1 回の出題は
+# 索引を数回たどるだけ（O(log n)）。帯が空なら一番近い空でない帯から選ぶ。
+import datetime
+import logging
+import math
+import random
+import re
+from collections import Counter
+
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+BASE_RATING = 1500.0
+BUCKET_WIDTH = 50.0
+TARGET_OFFSET = 150.0     # 実力より少し易しい単語（期待得点 約 70 点）を出す
+TARGET_SPREAD = 75.0      # 毎回同じ帯にならないように散らす幅（標準偏差）
+
+# 回答数が少ないうちは大きく動かし、だんだん落ち着かせる
+USER_K = (64.0, 16.0)
+WORD_K = (32.0, 8.0)
+K_HALF_LIFE = 20
+
+# 初期難易度: 長い単語ほど難しく、読解文によく出る単語ほど易しい
+PRIOR_PER_CHAR = 40.0
+PRIOR_PER_LOG_FREQ = 60.0
+PRIOR_MIN, PRIOR_MAX = 800.0, 2400.0
+
+GUEST_USER_ID = 0         # ゲストは全員で共有なので実力は記録しない
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS word_difficulty (
+        word_id INTEGER PRIMARY KEY,
+        rating REAL NOT NULL,
+        bucket INTEGER NOT NULL,
+        pick REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_word_difficulty_pick ON word_difficulty(bucket, pick)",
+    '''CREATE TABLE IF NOT EXISTS user_ability (
+        user_id INTEGER PRIMARY KEY,
+        rating REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )''',
+]
+
+
+def bucket_of(rating):
+    return int(math.floor(rating / BUCKET_WIDTH))
+
+
+def expected_score(ability, difficulty):
+    """実力 ability の人が難易度 difficulty の単語で取る得点の期待値（0.0〜1.0）"""
+    return 1.0 / (1.0 + 10 ** ((difficulty - ability) / 400.0))
+
+
+def k_factor(attempts, k):
+    k_max, k_min = k
+    return k_min + (k_max - k_min) * K_HALF_LIFE / (K_HALF_LIFE + attempts)
+
+
+# ======================================================
+# 初期化
+# ======================================================
+def corpus_frequencies(corpus_db):
+    """読解文 reading_texts の単語ごとの出現回数（無ければ空）"""
+    counts = Counter()
+    if not corpus_db:
+        return counts
+    try:
+        with db_connect(corpus_db) as conn:
+            for (text,) in conn.execute("SELECT text FROM reading_texts"):
+                counts.update(_WORD_RE.findall((text or "").lower()))
+    except Exception as e:
+        logger.warning("corpus_frequencies: %s", e)
+    return counts
+
+
+def prior_rating(word, freq):
+    rating = (BASE_RATING
+              + PRIOR_PER_CHAR * (len(word or "") - 6)
+              - PRIOR_PER_LOG_FREQ * math.log1p(freq))
+    return min(PRIOR_MAX, max(PRIOR_MIN, rating))
+
+
+def init_adaptive(db_file, corpus_db=None):
+    """
+    テーブルを作り、まだ難易度の無い単語に初期値を入れる。
+    word_difficulty を新しく作ったときは、既存の student_answers を古い順に流して温めておく。
+    """
+    with db_connect(db_file) as conn:
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'word_difficulty'"
+        ).fetchone() is None
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        missing = conn.execute("""
+            SELECT w.id, w.word FROM words w
+            LEFT JOIN word_difficulty d ON d.word_id = w.id
+            WHERE d.word_id IS NULL
+        """).fetchall()
+        if missing:
+            freqs = corpus_frequencies(corpus_db)
+            rows = []
+            for word_id, word in missing:
+                rating = prior_rating(word, freqs[(word or "").lower()])
+                rows.append((word_id, rating, bucket_of(rating), random.random()))
+            conn.executemany(
+                "INSERT INTO word_difficulty (word_id, rating, bucket, pick) VALUES (?, ?, ?, ?)", rows
+            )
+            logger.info("word_difficulty: seeded %d words", len(rows))
+        conn.commit()
+
+    if created:
+        replay_history(db_file)
+
+
+def replay_history(db_file, batch_size=5000):
+    """student_answers を古い順に record_results に通す（初回だけ）"""
+    with db_connect(db_file) as conn:
+        cur = conn.execute(
+            "SELECT user_id, word_id, score FROM student_answers WHERE score IS NOT NULL ORDER BY id"
+        )
+        total = 0
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            _apply(conn, rows)
+            total += len(rows)
+        conn.commit()
+    if total:
+        logger.info("adaptive ratings warmed from %d past answers", total)
+
+
+# ======================================================
+# 回答ごとの更新
+# ======================================================
+def _apply(conn, results):
+    """results [(user_id, word_id, score)] を順に反映する（commit は呼び出し側）"""
+    user_ids = {r[0] for r in results if r[0] != GUEST_USER_ID}
+    word_ids = {r[1] for r in results}
+    users = {}
+    for uid in user_ids:
+        row = conn.execute("SELECT rating, attempts FROM user_ability WHERE user_id = ?", (uid,)).fetchone()
+        users[uid] = list(row) if row else [BASE_RATING, 0]
+    words = {}
+    for wid in word_ids:
+        row = conn.execute("SELECT rating, attempts FROM word_difficulty WHERE word_id = ?", (wid,)).fetchone()
+        if row:
+            words[wid] = list(row)
+
+    for user_id, word_id, score in results:
+        word = words.get(word_id)
+        if word is None:
+            continue
+        user = users.get(user_id, [BASE_RATING, 0])
+        outcome = max(0.0, min(1.0, (score or 0) / 100.0))
+        diff = outcome - expected_score(user[0], word[0])
+        if user_id in users:
+            user[0] += k_factor(user[1], USER_K) * diff
+            user[1] += 1
+        word[0] -= k_factor(word[1], WORD_K) * diff
+        word[1] += 1
+
+    now = datetime.datetime.utcnow().isoformat()
+    conn.executemany(
+        """INSERT INTO user_ability (user_id, rating, attempts, updated_at) VALUES (?, ?, ?, ?)
+           ON CONFLICT(user_id) DO UPDATE SET
+               rating = excluded.rating, attempts = excluded.attempts, updated_at = excluded.updated_at""",
+        [(uid, r, n, now) for uid, (r, n) in users.items()],
+    )
+    conn.executemany(
+        "UPDATE word_difficulty SET rating = ?, bucket = ?, attempts = ? WHERE word_id = ?",
+        [(r, bucket_of(r), n, wid) for wid, (r, n) in words.items()],
+    )
+
+
+def record_results(db_file, results):
+    """回答 [(user_id, word_id, score)] で実力と難易度を更新する（1 トランザクション）"""
+    if not results:
+        return
+    try:
+        with db_connect(db_file) as conn:
+            _apply(conn, results)
+            conn.commit()
+    except Exception as e:
+        # 出題の調整に失敗しても回答の保存は失敗させない
+        logger.error("adaptive record_results error: %s", e)
+
+
+# ======================================================
+# 出題
+# ======================================================
+def get_ability(db_file, user_id):
+    """(rating, attempts)。まだ回答が無ければ (BASE_RATING, 0)"""
+    if user_id == GUEST_USER_ID:
+        return BASE_RATING, 0
+    with db_connect(db_file) as conn:
+        row = conn.execute(
+            "SELECT rating, attempts FROM user_ability WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    return (row[0], row[1]) if row else (BASE_RATING, 0)
+
+
+def _nearest_bucket(conn, center):
+    """center に一番近い、単語のある帯（索引の端を 2 回引くだけ）"""
+    above = conn.execute(
+        "SELECT bucket FROM word_difficulty WHERE bucket >= ? ORDER BY bucket LIMIT 1", (center,)
+    ).fetchone()
+    below = conn.execute(
+        "SELECT bucket FROM word_difficulty WHERE bucket < ? ORDER BY bucket DESC LIMIT 1", (center,)
+    ).fetchone()
+    if above is None or below is None:
+        return (above or below or (None,))[0]
+    return above[0] if above[0] - center <= center - below[0] else below[0]
+
+
+def _pick_in(conn, bucket, rng):
+    row = conn.execute(
+        "SELECT word_id FROM word_difficulty WHERE bucket = ? AND pick >= ? ORDER BY pick LIMIT 1",
+        (bucket, rng.random()),
+    ).fetchone() or conn.execute(
+        "SELECT word_id FROM word_difficulty WHERE bucket = ? ORDER BY pick LIMIT 1", (bucket,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def pick_words(db_file, user_id, n, rng=random):
+    """
+    user_id のレベルに近い単語の id を最大 n 個（重複なし）選ぶ。
+    1 個ごとに索引を数回引くだけなので O(n log N)。同じ単語に当たったら数回まで引き直す。
+    """
+    ability, _attempts = get_ability(db_file, user_id)
+    picked = []
+    seen = set()
+    with db_connect(db_file) as conn:
+        for _ in range(n * 3):
+            if len(picked) >= n:
+                break
+            center = bucket_of(ability - TARGET_OFFSET + rng.gauss(0, TARGET_SPREAD))
+            bucket = _nearest_bucket(conn, center)
+            if bucket is None:
+                break
+            word_id = _pick_in(conn, bucket, rng)
+            if word_id is not None and word_id not in seen:
+                seen.add(word_id)
+                picked.append(word_id)
+    return picked
+
+
+def pick_word(db_file, user_id, rng=random):
+    """user_id のレベルに近い単語の id を 1 つ選ぶ。単語が無ければ None"""
+    picked = pick_words(db_file, user_id, 1, rng)
+    return picked[0] if picked else None
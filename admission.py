@@ -0,0 +1,156 @@
+# admission.py
+# Gemini 呼び出しの受け付け制御。
+#
+#   1. ユーザー（ログイン中は user_id、ゲストはセッション）ごとのトークンバケット
+#      … 連打で 1 人が枠を使い切らないように。足りなければ Shed("rate_limited")
+#   2. 全体の同時呼び出し数の上限（max_in_flight）
+#      … 上限に達していたら最大 max_queue 件まで queue_timeout 秒待つ。
+#        待ち行列が一杯なら Shed("queue_full")、待ちきれなければ Shed("queue_timeout")
+#
+# Shed を受け取った採点フローは、エラーにせずローカルの簡易採点（local_scorer など）で返す。
+#
+# 状態は backend に持つ。既定の MemoryBackend はプロセス内だけで数える。
+# 複数プロセスで共有したい場合は take_token / incr を同じ意味で実装したもの
+# （Redis の INCR とトークンバケットのスクリプトなど）を渡す。
+import asyncio
+import contextlib
+import threading
+import time
+
+import metrics
+
+POLL_INTERVAL = 0.005
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+
+class Shed(Exception):
+    """受け付けなかった（reason: rate_limited / queue_full / queue_timeout）"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class MemoryBackend:
+    """プロセス内の辞書で数える backend"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}    # key -> [tokens, 最終更新時刻]
+        self._counters = {}   # name -> int
+        self._calls = 0
+
+    def take_token(self, key, rate, burst, cost=1.0):
+        """key のバケットから cost だけ取れたら True（毎秒 rate ずつ burst まで回復）"""
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now, rate, burst)
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            ok = tokens >= cost
+            self._buckets[key] = [tokens - cost if ok else tokens, now]
+            return ok
+
+    def _prune(self, now, rate, burst):
+        # 満タンまで回復したバケットは初期状態と同じなので消してよい
+        full_after = burst / rate if rate > 0 else float("inf")
+        for key in [k for k, (_, t) in self._buckets.items() if now - t >= full_after]:
+            del self._buckets[key]
+
+    def incr(self, name, delta=1):
+        """カウンタ name に delta を足し、足した後の値を返す"""
+        with self._lock:
+            value = self._counters.get(name, 0) + delta
+            self._counters[name] = value
+            return value
+
+
+class AdmissionController:
+    def __init__(self, backend=None, user_rate=1.0, user_burst=10, max_in_flight=16,
+                 max_queue=32, queue_timeout=2.0):
+        self.backend = backend or MemoryBackend()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+    # ======================================================
+    # 判定
+    # ======================================================
+    def check_user(self, key, feature):
+        if key is None or self.user_rate <= 0:
+            return
+        if not self.backend.take_token(key, self.user_rate, self.user_burst):
+            self._shed(feature, "rate_limited")
+
+    def _try_slot(self):
+        if self.backend.incr("llm_in_flight") <= self.max_in_flight:
+            return True
+        self.backend.incr("llm_in_flight", -1)
+        return False
+
+    def _release_slot(self):
+        metrics.set_gauge("llm_in_flight", self.backend.incr("llm_in_flight", -1))
+
+    def _enqueue(self, feature):
+        depth = self.backend.incr("llm_queue")
+        if depth > self.max_queue:
+            self.backend.incr("llm_queue", -1)
+            self._shed(feature, "queue_full")
+        metrics.inc("admission_queued_total", feature=feature)
+        metrics.set_gauge("llm_queue_depth", depth)
+
+    def _dequeue(self, feature, waited):
+        metrics.set_gauge("llm_queue_depth", self.backend.incr("llm_queue", -1))
+        metrics.observe("admission_wait_seconds", waited, buckets=WAIT_BUCKETS, feature=feature)
+
+    def _shed(self, feature, reason):
+        metrics.inc("admission_shed_total", feature=feature, reason=reason)
+        raise Shed(reason)
+
+    # ======================================================
+    # 入口（with / async with で Gemini 呼び出しを囲む）
+    # ======================================================
+    @contextlib.contextmanager
+    def admit(self, key, feature):
+        self.check_user(key, feature)
+        if not self._try_slot():
+            self._enqueue(feature)
+            start = time.monotonic()
+            try:
+                while not self._try_slot():
+                    if time.monotonic() - start >= self.queue_timeout:
+                        self._shed(feature, "queue_timeout")
+                    time.sleep(POLL_INTERVAL)
+            finally:
+                self._dequeue(feature, time.monotonic() - start)
+        metrics.set_gauge("llm_in_flight", self.backend.incr("llm_in_flight", 0))
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self, key, feature):
+        """admit の非同期版（待つ間はイベントループを止めない）"""
+        self.check_user(key, feature)
+        if not self._try_slot():
+            self._enqueue(feature)
+            start = time.monotonic()
+            try:
+                while not self._try_slot():
+                    if time.monotonic() - start >= self.queue_timeout:
+                        self._shed(feature, "queue_timeout")
+                    await asyncio.sleep(POLL_INTERVAL)
+            finally:
+                self._dequeue(feature, time.monotonic() - start)
+        metrics.set_gauge("llm_in_flight", self.backend.incr("llm_in_flight", 0))
+        try:
+            yield
+        finally:
+            self._release_slot()
@@ -1,15 +1,44 @@
 # studyST/app.py
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file, abort, has_request_context, Response, stream_with_context
 import sqlite3
+import asyncio
+import atexit
 import datetime
+import functools
+import hmac
 import json
 import os
 import logging
+import random
+import mimetypes
 import shutil
 import re
+import secrets
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import adaptive
+import admission
+import applog
+import archive
+import context_cache
+import distractors
+import export
+import guest_store
+import leaderboard
+import local_scorer
+import metering
+import metrics
+import search_index
+import snapshot
+import static_assets
+import toeic_store
+import word_index
+import word_stats
+import write_behind
+from db import connect as db_connect
+from pos import normalize_pos_string
+
 # ======================================================
 # Flask 初期設定
 # ======================================================
@@ -17,14 +46,32 @@ app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_for_local_only")
 CORS(app, origins="*")
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+# ======================================================
+# ログ（applog.py: 出力はバックグラウンドスレッド、大きいログは間引く）
+# ======================================================
+# LOG_FORMAT: json（Cloud Run の既定）/ text（ローカルの既定）
+# LOG_SAMPLE: event ごとに残す割合。例 "llm_raw=0.05,writing_result=0.05"
+# LOG_MAX_CHARS: メッセージ・extra の文字列の上限
+def _log_context():
+    if not has_request_context():
+        return None
+    return {"endpoint": request.endpoint, "path": request.path}
+
+applog.setup(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "json" if os.getenv("K_SERVICE") else "text"),
+    sample=applog.parse_sample_rates(os.getenv("LOG_SAMPLE", "llm_raw=0.05,writing_result=0.05")),
+    max_chars=int(os.getenv("LOG_MAX_CHARS", "2000")),
+    context=_log_context,
+)
 logger = logging.getLogger(__name__)
 
 # ======================================================
 # DB 設定
 # ======================================================
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TMP_DIR = "/tmp"
+# DB のコピー先（テストでは DB_TMP_DIR で一時ディレクトリにする）
+TMP_DIR = os.getenv("DB_TMP_DIR", "/tmp")
 
 # リポジトリにある DB
 REPO_DB_FILE = os.path.join(BASE_DIR, "english_learning.db")
@@ -49,6 +96,83 @@ for src, dst in [
         shutil.copy(src, dst)
         logger.info(f"DB copied to tmp: {dst}")
 
+# ======================================================
+# 計測（ルートごとの処理時間・DB 時間・Gemini 時間）
+# ======================================================
+# 0 より大きければ、その秒数を超えたリクエストをスタック付きでログ出力
+SLOW_REQUEST_SEC = float(os.getenv("SLOW_REQUEST_SEC", "0"))
+# 設定されていれば /metrics に "Authorization: Bearer <token>" を要求
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+metrics.start_slow_request_sampler(SLOW_REQUEST_SEC)
+
+@app.before_request
+def begin_request_metrics():
+    metrics.begin_request(request.endpoint)
+
+# after_request は登録と逆順に呼ばれるので、最初に登録して最終ステータス（304 等）を記録する
+@app.after_request
+def end_request_metrics(response):
+    metrics.end_request(request.method, response.status_code)
+    return response
+
+# ======================================================
+# HTTP キャッシュ（ハッシュ付き静的 URL + ETag / 条件付き GET）
+# ======================================================
+# 起動時に static/ の内容ハッシュを計算し、URL に埋め込む
+STATIC_MANIFEST = static_assets.build_manifest(app.static_folder)
+STATIC_MAX_AGE = 365 * 24 * 3600  # ハッシュが変われば URL も変わるので 1 年
+# ユーザーに依存しないページ: endpoint -> max-age(秒)
+PUBLIC_PAGES = {"privacy": 3600}
+
+@app.template_global()
+def asset_url(filename):
+    """テンプレート用: {{ asset_url('style.css') }} -> /assets/style.<hash>.css"""
+    hashed = STATIC_MANIFEST.get(filename)
+    if not hashed:
+        return url_for("static", filename=filename)
+    return url_for("hashed_static", hashed=hashed)
+
+@app.route("/assets/<path:hashed>")
+def hashed_static(hashed):
+    original = static_assets.resolve_hashed(hashed, STATIC_MANIFEST)
+    if not original:
+        abort(404)
+    path = os.path.join(app.static_folder, original)
+    # ビルド時に作った .br / .gz があればそのまま返す（実行時に圧縮しない）
+    encoding, serve_path = static_assets.pick_encoding(request.headers.get("Accept-Encoding"), path)
+    mimetype = mimetypes.guess_type(original)[0] or "application/octet-stream"
+    res = send_file(serve_path, mimetype=mimetype, max_age=STATIC_MAX_AGE, conditional=True)
+    if encoding:
+        res.headers["Content-Encoding"] = encoding
+    res.vary.add("Accept-Encoding")
+    res.cache_control.public = True
+    res.cache_control.immutable = True
+    return res
+
+@app.after_request
+def add_page_cache_headers(response):
+    """HTML ページに ETag を付け、本文が同じなら 304 を返す"""
+    if request.method != "GET" or response.status_code != 200 or response.direct_passthrough:
+        return response
+    if response.mimetype != "text/html":
+        return response
+    max_age = PUBLIC_PAGES.get(request.endpoint)
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        # ユーザーごとに内容が変わるページは毎回再検証させる
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.add_etag()
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        metrics.cache_hit("http_etag")
+    else:
+        metrics.cache_miss("http_etag")
+    return response
+
 # ======================================================
 # Gemini 設定（安全に失敗許容）
 # ======================================================
@@ -65,35 +189,221 @@ try:
 except Exception as e:
     logger.error("Gemini init failed: %s", e)
 
+# 負荷試験用の偽 Gemini（例: GEMINI_FAKE="latency_ms=800,error_rate=0.02"。fake_gemini.py 参照）
+FAKE_GEMINI = None
+if os.getenv("GEMINI_FAKE"):
+    import fake_gemini
+    FAKE_GEMINI = fake_gemini.FakeGemini.from_spec(os.getenv("GEMINI_FAKE"))
+    HAS_GEMINI = True
+    logger.warning("Using fake Gemini backend: %r", FAKE_GEMINI)
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+def usage_context():
+    """トークン使用量の記録に付ける (endpoint, user_id)。リクエスト外なら (None, None)"""
+    if not has_request_context():
+        return None, None
+    return request.endpoint, session.get("user_id", 0)
+
 # ======================================================
-# 品詞マップ (英語キー -> 日本語)
-# ======================================================
-POS_JA = {
-    "adjective": "形容詞",
-    "adj": "形容詞",
-    "noun": "名詞",
-    "n": "名詞",
-    "verb": "動詞",
-    "v": "動詞",
-    "adverb": "副詞",
-    "adv": "副詞",
-    "pronoun": "代名詞",
-    "preposition": "前置詞",
-    "conjunction": "接続詞",
-    "interjection": "間投詞",
-    "article": "冠詞",
-    "determiner": "限定詞",
-    "numeral": "数詞",
-    "particle": "助詞",
-    "modal": "法助動詞",
-    "other": "その他",
-}
+# 採点プロンプトの context caching（context_cache.py）
+# ======================================================
+# 採点の指示・出力形式・本文（context）を Gemini 側にキャッシュし、呼び出しごとには
+# 回答ごとの部分だけを送る。CONTEXT_CACHE_MIN_TOKENS より短い context はそのまま送る。
+# CONTEXT_CACHE=0 で無効。
+def _create_cached_content(context, ttl):
+    if FAKE_GEMINI is not None:
+        return FAKE_GEMINI.create_cache(context, ttl)
+    return genai.caching.CachedContent.create(
+        model=f"models/{GEMINI_MODEL}",
+        contents=[context],
+        ttl=datetime.timedelta(seconds=ttl),
+    )
+
+CONTEXT_CACHE = None
+if HAS_GEMINI and os.getenv("CONTEXT_CACHE", "1") != "0":
+    CONTEXT_CACHE = context_cache.ContextCache(
+        _create_cached_content,
+        ttl=float(os.getenv("CONTEXT_CACHE_TTL_SEC", "3600")),
+        min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024")),
+    )
+
+def _model_for(handle):
+    if handle is None:
+        return genai.GenerativeModel(GEMINI_MODEL)
+    return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+def gemini_generate(prompt, feature, context=None, cache_key=None):
+    """
+    Gemini 呼び出しの共通入口。feature（"word" / "reading" / "toeic" など）ごとに
+    レイテンシと成否を metrics に、トークン数と料金を llm_usage（metering.py）に記録する。
+    context（回答によらない部分）は cache_key でキャッシュできればキャッシュを使い、
+    できなければ prompt の前に付けて送る。戻り値は応答テキスト。
+    """
+    handle = None
+    if context and CONTEXT_CACHE is not None:
+        handle = CONTEXT_CACHE.get(cache_key, context)
+    if context and handle is None:
+        prompt = context + prompt
+    cached = context if handle is not None else None
+    with METER.metered(feature, prompt, *usage_context(), cached=cached) as call, metrics.timed_llm(feature):
+        try:
+            if FAKE_GEMINI is not None:
+                text = FAKE_GEMINI.generate(prompt, feature, cached=handle)
+                call.finish(text)
+                return text
+            res = _model_for(handle).generate_content(prompt)
+        except Exception:
+            if handle is not None:
+                # 期限切れ・削除済みのキャッシュかもしれないので、次回は作り直す
+                CONTEXT_CACHE.invalidate(cache_key, handle)
+            raise
+        call.finish(res.text, getattr(res, "usage_metadata", None))
+    return res.text or ""
+
+async def gemini_generate_async(prompt, feature, context=None, cache_key=None):
+    """gemini_generate の非同期版（ASGI モード用）"""
+    handle = None
+    if context and CONTEXT_CACHE is not None:
+        handle = await CONTEXT_CACHE.get_async(cache_key, context)
+    if context and handle is None:
+        prompt = context + prompt
+    cached = context if handle is not None else None
+    with METER.metered(feature, prompt, *usage_context(), cached=cached) as call, metrics.timed_llm(feature):
+        try:
+            if FAKE_GEMINI is not None:
+                text = await FAKE_GEMINI.generate_async(prompt, feature, cached=handle)
+                call.finish(text)
+                return text
+            res = await _model_for(handle).generate_content_async(prompt)
+        except Exception:
+            if handle is not None:
+                CONTEXT_CACHE.invalidate(cache_key, handle)
+            raise
+        call.finish(res.text, getattr(res, "usage_metadata", None))
+    return res.text or ""
+
+# ======================================================
+# Gemini 呼び出しの受け付け制御（admission.py）
+# ======================================================
+# ユーザーごとに毎秒 ADMISSION_USER_RATE 回（最大 ADMISSION_USER_BURST 回まで連続可）、
+# 全体で同時 LLM_MAX_IN_FLIGHT 件まで。あふれた分は LLM_MAX_QUEUE 件まで待たせ、
+# それ以上は admission.Shed を投げて各フローのローカル簡易採点に回す。
+ADMISSION = admission.AdmissionController(
+    user_rate=float(os.getenv("ADMISSION_USER_RATE", "1.0")),
+    user_burst=float(os.getenv("ADMISSION_USER_BURST", "10")),
+    max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "16")),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+    queue_timeout=int(os.getenv("LLM_QUEUE_TIMEOUT_MS", "2000")) / 1000,
+)
+
+def admission_key():
+    """
+    トークンバケットのキー。ゲスト（user_id=0 を共有）はセッションごとのゲスト id で分ける
+    （接続元で分けると、NAT の向こうの教室全体が 1 つのバケットになる）
+    """
+    if not has_request_context():
+        return None
+    return f"user:{learner_id()}"
+
+# ======================================================
+# 採点フロー（同期 / 非同期で共通のコード）
+# ======================================================
+# 採点ルートは Gemini 呼び出しや DB 操作を直接行わず、下の「効果」を yield する
+# ジェネレータとして書く。同じジェネレータを
+#   - run_sync : gunicorn のスレッドでそのまま実行
+#   - run_async: ASGI のイベントループ上で await しながら実行
+# のどちらでも動かせる。例外は yield した箇所に送り返されるので try/except はそのまま使える。
+class LLMCall:
+    """
+    Gemini 呼び出し。yield すると応答テキストが返る。
+    context は回答によらない部分（指示・出力形式・本文）で、cache_key
+    （(プロンプトのバージョン, 本文の id)）があれば context caching の対象になる。
+    """
+    __slots__ = ("prompt", "feature", "context", "cache_key")
+
+    def __init__(self, prompt, feature, context=None, cache_key=None):
+        self.prompt = prompt
+        self.feature = feature
+        self.context = context
+        self.cache_key = cache_key
+
+class DBCall:
+    """DB 操作。yield すると fn(*args) の戻り値が返る（非同期時は別スレッドで実行）"""
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+class Gather:
+    """複数のフローを実行して結果のリストを返す（非同期時は並行実行）"""
+    __slots__ = ("flows",)
+
+    def __init__(self, flows):
+        self.flows = list(flows)
+
+def run_sync(flow):
+    value, error = None, None
+    while True:
+        try:
+            effect = flow.throw(error) if error is not None else flow.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(effect, LLMCall):
+                METER.check(effect.feature)
+                with ADMISSION.admit(admission_key(), effect.feature):
+                    value = gemini_generate(effect.prompt, effect.feature, effect.context, effect.cache_key)
+            elif isinstance(effect, DBCall):
+                value = effect.fn(*effect.args)
+            elif isinstance(effect, Gather):
+                value = [run_sync(f) for f in effect.flows]
+            else:
+                raise TypeError(f"unknown effect: {effect!r}")
+        except Exception as e:
+            error = e
+
+async def run_async(flow):
+    value, error = None, None
+    while True:
+        try:
+            effect = flow.throw(error) if error is not None else flow.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(effect, LLMCall):
+                METER.check(effect.feature)
+                async with ADMISSION.admit_async(admission_key(), effect.feature):
+                    value = await gemini_generate_async(effect.prompt, effect.feature,
+                                                        effect.context, effect.cache_key)
+            elif isinstance(effect, DBCall):
+                value = await asyncio.to_thread(effect.fn, *effect.args)
+            elif isinstance(effect, Gather):
+                value = list(await asyncio.gather(*(run_async(f) for f in effect.flows)))
+            else:
+                raise TypeError(f"unknown effect: {effect!r}")
+        except Exception as e:
+            error = e
+
+# endpoint 名 -> フロー関数（asgi.py がイベントループ上で実行する）
+ASYNC_FLOWS = {}
+
+def grading_view(flow):
+    """フロー関数を通常の Flask ビューとして包み、ASGI 用にも登録する"""
+    @functools.wraps(flow)
+    def view(*args, **kwargs):
+        return run_sync(flow(*args, **kwargs))
+    ASYNC_FLOWS[flow.__name__] = flow
+    return view
 
 # ======================================================
 # DB 初期化（テーブル作成 + 後方互換で pos カラム追加）
 # ======================================================
 def init_db_file(path, create_statements):
-    with sqlite3.connect(path) as conn:
+    with db_connect(path) as conn:
         c = conn.cursor()
         for stmt in create_statements:
             c.execute(stmt)
@@ -102,7 +412,7 @@ def init_db_file(path, create_statements):
 
 def ensure_word_pos_column(path):
     try:
-        with sqlite3.connect(path) as conn:
+        with db_connect(path) as conn:
             c = conn.cursor()
             c.execute("PRAGMA table_info(words)")
             cols = [r[1] for r in c.fetchall()]
@@ -113,6 +423,121 @@ def ensure_word_pos_column(path):
     except Exception as e:
         logger.error("ensure_word_pos_column error: %s", e)
 
+def ensure_reading_answer_reference(path):
+    """reading_answers に模範訳（ローカル採点の参照用）カラムとインデックスを追加する"""
+    try:
+        with db_connect(path) as conn:
+            c = conn.cursor()
+            c.execute("PRAGMA table_info(reading_answers)")
+            cols = [r[1] for r in c.fetchall()]
+            if "correct_answer" not in cols:
+                logger.info("Adding 'correct_answer' column to reading_answers table.")
+                c.execute("ALTER TABLE reading_answers ADD COLUMN correct_answer TEXT DEFAULT NULL")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_reading_answers_passage ON reading_answers(passage_id)")
+            conn.commit()
+    except Exception as e:
+        logger.error("ensure_reading_answer_reference error: %s", e)
+
+def ensure_student_answer_text(path):
+    """student_answers に回答の本文（後から採点し直すため）のカラムを追加する"""
+    try:
+        with db_connect(path) as conn:
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(student_answers)")]
+            if "user_answer" not in cols:
+                logger.info("Adding 'user_answer' column to student_answers table.")
+                conn.execute("ALTER TABLE student_answers ADD COLUMN user_answer TEXT DEFAULT NULL")
+                conn.commit()
+    except Exception as e:
+        logger.error("ensure_student_answer_text error: %s", e)
+
+def migrate_legacy_question_db(path, create_answers_stmt):
+    """
+    旧 question.py（students / student_answers.student_id）のデータを
+    users / student_answers.user_id へ移行する。
+    旧テーブルは legacy_* にリネームして残す。移行済みなら何もしない。
+    """
+    try:
+        with db_connect(path) as conn:
+            c = conn.cursor()
+            c.execute("PRAGMA table_info(student_answers)")
+            cols = [r[1] for r in c.fetchall()]
+            if "student_id" not in cols:
+                return
+            logger.info("Migrating legacy question.py tables in %s", path)
+            c.execute("BEGIN")
+            c.execute("ALTER TABLE student_answers RENAME TO legacy_student_answers")
+            c.execute(create_answers_stmt)
+
+            # students.name -> users.username（パスワード無しユーザーとして作成）
+            mapping = {}
+            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='students'")
+            if c.fetchone():
+                for student_id, name in c.execute("SELECT id, name FROM students").fetchall():
+                    c.execute("SELECT id, password FROM users WHERE username=?", (name,))
+                    row = c.fetchone()
+                    if row and row[0] != 0 and not row[1]:
+                        mapping[student_id] = row[0]
+                        continue
+                    if row:
+                        # 登録ユーザー（とゲスト）に他人の履歴を付けないよう、別名のパスワード無しユーザーにする
+                        renamed = f"{name}（旧{student_id}）"
+                        logger.warning("Legacy student %r collides with a registered user; migrating as %r",
+                                       name, renamed)
+                        name = renamed
+                    c.execute("SELECT id, password FROM users WHERE username=?", (name,))
+                    row = c.fetchone()
+                    if row:
+                        logger.warning("Legacy student %d skipped: username %r is taken", student_id, name)
+                        continue
+                    c.execute("INSERT INTO users (username, password) VALUES (?, '')", (name,))
+                    mapping[student_id] = c.lastrowid
+                c.execute("ALTER TABLE students RENAME TO legacy_students")
+
+            rows = c.execute(
+                "SELECT student_id, word_id, score, feedback, example, attempt_date FROM legacy_student_answers"
+            ).fetchall()
+            migrated = [(mapping[r[0]],) + tuple(r[1:]) for r in rows if r[0] in mapping]
+            c.executemany(
+                """INSERT INTO student_answers (user_id, word_id, score, feedback, example, attempt_date)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                migrated,
+            )
+            conn.commit()
+            logger.info("Legacy migration done: %d users, %d/%d answers", len(mapping), len(migrated), len(rows))
+    except Exception as e:
+        logger.error("migrate_legacy_question_db error: %s", e)
+
+# ======================================================
+# ユーザーデータの永続化（snapshot.py）
+# ======================================================
+# /tmp の DB はインスタンスが入れ替わると消えるので、増えた行だけを SNAPSHOT_URL
+# （"gs://bucket/prefix" か "file:///path"）に SNAPSHOT_INTERVAL_SEC ごとに送り、
+# 起動時にイメージからコピーした DB へ戻す。未設定なら何もしない。
+# ランキング・出題の難易度は回答から作り直すので送らない。
+SNAPSHOT_TABLES = [
+    (DB_FILE, "users"),
+    (DB_FILE, "student_answers"),
+    (DB_FILE, "word_choice_answers"),
+    (DB_FILE, "llm_usage"),
+    (WRITING_DB, "writing_answers"),
+    (READING_DB, "reading_answers"),
+]
+SNAPSHOT_INTERVAL_SEC = int(os.getenv("SNAPSHOT_INTERVAL_SEC", "60"))
+SNAPSHOTS = None
+SNAPSHOT_RESTORED_ROWS = 0
+if os.getenv("SNAPSHOT_URL"):
+    SNAPSHOTS = snapshot.Snapshotter(snapshot.backend_from_url(os.getenv("SNAPSHOT_URL")), SNAPSHOT_TABLES)
+
+def restore_snapshots():
+    global SNAPSHOT_RESTORED_ROWS
+    if SNAPSHOTS is None:
+        return
+    try:
+        SNAPSHOT_RESTORED_ROWS = SNAPSHOTS.restore()
+    except Exception as e:
+        # 戻せなくてもイメージの DB で起動はする
+        logger.error("snapshot restore failed: %s", e, exc_info=True)
+
 def init_all_dbs():
     create_users_words = [
         '''CREATE TABLE IF NOT EXISTS users (
@@ -137,7 +562,17 @@ def init_all_dbs():
             wrong_count INTEGER DEFAULT 0,
             FOREIGN KEY(user_id) REFERENCES users(id),
             FOREIGN KEY(word_id) REFERENCES words(id)
-        )'''
+        )''',
+        # 4 択の回答（自由記述と平均・ランキングを分けるため別の表。user_answer は選んだ意味）
+        '''CREATE TABLE IF NOT EXISTS word_choice_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            word_id INTEGER,
+            score INTEGER,
+            feedback TEXT,
+            attempt_date TEXT,
+            user_answer TEXT
+        )''',
     ]
     create_writing = [
         '''CREATE TABLE IF NOT EXISTS writing_prompts (
@@ -155,7 +590,9 @@ def init_all_dbs():
             attempt_date TEXT,
             is_wrong INTEGER DEFAULT 0,
             wrong_count INTEGER DEFAULT 0
-        )'''
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_writing_answers_prompt ON writing_answers(prompt_id)",
+        export.index_statement("writing_answers"),
     ]
     create_reading = [
         '''CREATE TABLE IF NOT EXISTS reading_passages (
@@ -172,22 +609,197 @@ def init_all_dbs():
             user_answer TEXT,
             score INTEGER,
             feedback TEXT,
-            attempt_date TEXT
-        )'''
+            attempt_date TEXT,
+            correct_answer TEXT
+        )''',
+        export.index_statement("reading_answers"),
     ]
     init_db_file(DB_FILE, create_users_words)
+    migrate_legacy_question_db(DB_FILE, create_users_words[2])
+    # user_id 列は旧スキーマの移行後にしか無いので、索引は移行の後で作る
+    init_db_file(DB_FILE, [
+        "CREATE INDEX IF NOT EXISTS idx_student_answers_user ON student_answers(user_id, score)",
+        export.index_statement("student_answers"),
+        export.index_statement("word_choice_answers"),
+    ])
+    ensure_student_answer_text(DB_FILE)
     init_db_file(WRITING_DB, create_writing)
     init_db_file(READING_DB, create_reading)
     ensure_word_pos_column(DB_FILE)
+    word_index.init_word_version(DB_FILE)
+    ensure_reading_answer_reference(READING_DB)
+    search_index.init_search_index(READING_DB, WRITING_DB)
+    # 難易度の初期化（過去の回答の再生）より前に、永続化してあった回答を戻す
+    restore_snapshots()
+    adaptive.init_adaptive(DB_FILE, READING_DB)
 
     # ゲストユーザー作成
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connect(DB_FILE) as conn:
         c = conn.cursor()
         c.execute("INSERT OR IGNORE INTO users (id, username, password) VALUES (0,'ゲスト','')")
         conn.commit()
 
 init_all_dbs()
 
+# ======================================================
+# 回答の書き込み（write-behind: 数ミリ秒分をまとめて 1 トランザクションで INSERT）
+# ======================================================
+ANSWER_WRITER = write_behind.WriteBehind(
+    flush_interval=int(os.getenv("ANSWER_FLUSH_MS", "5")) / 1000,
+    max_batch=int(os.getenv("ANSWER_FLUSH_ROWS", "200")),
+    enabled=os.getenv("ANSWER_WRITE_BEHIND", "1") != "0",
+)
+# ランキングへの反映もコミット後にまとめて行う（行の先頭が user_id、3 番目が score）
+def on_word_answers_flushed(rows):
+    leaderboard.record_scores(DB_FILE, "word", [(r[0], r[2]) for r in rows])
+    adaptive.record_results(DB_FILE, [(r[0], r[1], r[2]) for r in rows])
+    word_stats.record(DB_FILE, [(r[1], r[2], r[6], r[5]) for r in rows])
+
+ANSWER_WRITER.register(
+    "student_answers", DB_FILE,
+    """INSERT INTO student_answers (user_id, word_id, score, feedback, example, attempt_date, user_answer)
+       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    on_flush=on_word_answers_flushed,
+)
+# 4 択はランキングだけ別の種別（choice）にする。出題の難易度・誤答の集計には自由記述と同じく入れる
+def on_choice_answers_flushed(rows):
+    leaderboard.record_scores(DB_FILE, "choice", [(r[0], r[2]) for r in rows])
+    adaptive.record_results(DB_FILE, [(r[0], r[1], r[2]) for r in rows])
+    word_stats.record(DB_FILE, [(r[1], r[2], r[5], r[4]) for r in rows])
+
+ANSWER_WRITER.register(
+    "word_choice_answers", DB_FILE,
+    """INSERT INTO word_choice_answers (user_id, word_id, score, feedback, attempt_date, user_answer)
+       VALUES (?, ?, ?, ?, ?, ?)""",
+    on_flush=on_choice_answers_flushed,
+)
+ANSWER_WRITER.register(
+    "reading_answers", READING_DB,
+    """INSERT INTO reading_answers (user_id, passage_id, score, user_answer, feedback, attempt_date, correct_answer)
+       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    on_flush=lambda rows: leaderboard.record_scores(DB_FILE, "reading", [(r[0], r[2]) for r in rows]),
+)
+ANSWER_WRITER.register(
+    "writing_answers", WRITING_DB,
+    """INSERT INTO writing_answers (user_id, prompt_id, score, answer, feedback, correct_example, attempt_date)
+       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    on_flush=lambda rows: leaderboard.record_scores(DB_FILE, "writing", [(r[0], r[2]) for r in rows]),
+)
+
+# ======================================================
+# ゲストの回答（guest_store.py: セッションごとにメモリだけに置き、DB には書かない）
+# ======================================================
+# GUEST_TTL_SEC: 最後の操作からこの秒数で消える。GUEST_MAX_SESSIONS を超えたら古いものから消す
+GUEST_STORE = guest_store.GuestStore(
+    ttl=float(os.getenv("GUEST_TTL_SEC", "7200")),
+    max_guests=int(os.getenv("GUEST_MAX_SESSIONS", "5000")),
+    max_answers=int(os.getenv("GUEST_MAX_ANSWERS", "200")),
+)
+
+def learner_id():
+    """
+    回答の持ち主。ログイン中はその user_id、ゲスト（と未ログイン）はセッションごとの
+    ゲスト id（"guest-..."）。まだ振っていなければここで振る。
+    """
+    user_id = session.get("user_id", 0)
+    if user_id and not session.get("is_guest"):
+        return user_id
+    guest_id = session.get("guest_id")
+    if not guest_store.is_guest_id(guest_id):
+        guest_id = session["guest_id"] = GUEST_STORE.new_id()
+    return guest_id
+
+def store_answer(table, row):
+    """回答 1 行を保存する（行の先頭が user_id）。ゲストはメモリ、それ以外は ANSWER_WRITER"""
+    if guest_store.is_guest_id(row[0]):
+        GUEST_STORE.add(row[0], table, row)
+    else:
+        ANSWER_WRITER.add(table, row)
+
+def claim_guest_answers(user_id):
+    """セッションのゲストの回答を user_id のものとして保存し直す。引き継いだ件数を返す"""
+    guest_id = session.pop("guest_id", None)
+    if not guest_store.is_guest_id(guest_id):
+        return 0
+    claimed = 0
+    for table, rows in GUEST_STORE.claim(guest_id).items():
+        for row in rows:
+            ANSWER_WRITER.add(table, (user_id,) + tuple(row[1:]))
+        claimed += len(rows)
+    metrics.inc("guest_answers_claimed_total", claimed)
+    return claimed
+
+# ======================================================
+# Gemini のトークン使用量と 1 日の予算（metering.py）
+# ======================================================
+# 例: LLM_DAILY_BUDGET_TOKENS="reading=500000,toeic=200000,all=2000000"
+#     予算を超えた機能はその日の残りをローカル採点（過去の模範解答との chrF など）で返す
+METER = metering.Meter(
+    DB_FILE,
+    budgets=metering.parse_budgets(os.getenv("LLM_DAILY_BUDGET_TOKENS", "")),
+    price_input_per_m=float(os.getenv("GEMINI_PRICE_INPUT_PER_M", "0.30")),
+    price_output_per_m=float(os.getenv("GEMINI_PRICE_OUTPUT_PER_M", "2.50")),
+    price_cached_per_m=float(os.getenv("GEMINI_PRICE_CACHED_PER_M", "0.075")),
+    writer=lambda row: ANSWER_WRITER.add("llm_usage", row),
+)
+METER.init()
+ANSWER_WRITER.register("llm_usage", DB_FILE, metering.INSERT_SQL)
+
+# 回答はコミットされてから送るので、送る前に write-behind の分を書き出す
+if SNAPSHOTS is not None:
+    SNAPSHOTS.before_ship = ANSWER_WRITER.flush
+    SNAPSHOTS.start(SNAPSHOT_INTERVAL_SEC)
+    atexit.register(SNAPSHOTS.ship)
+
+# ======================================================
+# ランキング（実体化テーブル: 回答ごとに差分更新 + 定期再集計）
+# ======================================================
+LEADERBOARD_SOURCES = {
+    "word": (DB_FILE, "student_answers"),
+    "writing": (WRITING_DB, "writing_answers"),
+    "reading": (READING_DB, "reading_answers"),
+    "choice": (DB_FILE, "word_choice_answers"),
+}
+LEADERBOARD_REFRESH_SEC = int(os.getenv("LEADERBOARD_REFRESH_SEC", "600"))
+RANKING_PER_PAGE = 20
+
+def refresh_leaderboard():
+    leaderboard.rebuild(DB_FILE, LEADERBOARD_SOURCES, pause=ANSWER_WRITER.paused)
+
+leaderboard.init_leaderboard(DB_FILE)
+if SNAPSHOT_RESTORED_ROWS or leaderboard.is_empty(DB_FILE):
+    refresh_leaderboard()
+leaderboard.start_refresh_timer(LEADERBOARD_REFRESH_SEC, refresh_leaderboard)
+
+# ======================================================
+# 単語ごとの正答状況（word_stats.py: 回答ごとに差分更新、初回だけ全件から集計）
+# ======================================================
+# アーカイブで行が移る前に数えたいので、アーカイブのタイマーより前に作り直す
+if word_stats.init_word_stats(DB_FILE) or SNAPSHOT_RESTORED_ROWS:
+    word_stats.rebuild(DB_FILE, pause=ANSWER_WRITER.paused)
+
+# ======================================================
+# 単語クイズの 4 択モードの選択肢（distractors.py: words が変わったときだけ作り直す）
+# ======================================================
+if distractors.init_distractors(DB_FILE):
+    distractors.build(DB_FILE)
+
+# ======================================================
+# 回答履歴のアーカイブ（archive.py）
+# ======================================================
+# ARCHIVE_AFTER_DAYS より古い回答を小さい *_archive テーブルに移し、ユーザー・問題ごとの
+# 回数と合計点だけを残す（ランキングと平均点はそれも足して数える）。あわせて
+# ANALYZE / incremental vacuum。最初の 1 回も ARCHIVE_INTERVAL_SEC 待ってから。0 で止める。
+# incremental vacuum を効かせるには、一度 `python archive.py vacuum` で auto_vacuum を切り替えておく。
+ARCHIVE_SOURCES = {
+    "student_answers": DB_FILE,
+    "writing_answers": WRITING_DB,
+    "reading_answers": READING_DB,
+    "word_choice_answers": DB_FILE,
+}
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+archive.start_timer(int(os.getenv("ARCHIVE_INTERVAL_SEC", "3600")), ARCHIVE_SOURCES, ARCHIVE_AFTER_DAYS)
+
 # ======================================================
 # TOEIC Reading DB 初期化（テーブル作成 + サンプル追加可能）
 # ======================================================
@@ -204,7 +816,7 @@ def init_toeic_reading_db():
     logger.info(f"TOEIC reading DB initialized: {TOEIC_READING_DB}")
 
     # サンプル問題追加（存在しない場合のみ）
-    with sqlite3.connect(TOEIC_READING_DB) as conn:
+    with db_connect(TOEIC_READING_DB) as conn:
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM reading")
         if c.fetchone()[0] == 0:
@@ -219,6 +831,9 @@ def init_toeic_reading_db():
             conn.commit()
             logger.info("Sample TOEIC reading problem inserted.")
 
+    # 設問・選択肢・正答を別々の行に持つ正規化ストア（旧 reading からの移行もここで）
+    toeic_store.init_store(TOEIC_READING_DB)
+
 # Flask 初期化の最後で呼ぶ
 init_toeic_reading_db()
 
@@ -229,11 +844,11 @@ def evaluate_reading(passage, question, correct_answer, user_answer):
     if not user_answer:
         return 0, "回答が入力されていません。"
     if not HAS_GEMINI:
+        metrics.fallback("reading", "no_gemini")
         score = 100 if correct_answer.strip().lower() in user_answer.strip().lower() else 60
         return score, "（簡易採点）内容を確認してください。"
 
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
         prompt = f"""
 次の英文読解問題の採点をしてください。JSON形式で結果を返してください。
 
@@ -255,13 +870,14 @@ def evaluate_reading(passage, question, correct_answer, user_answer):
   "feedback": ""
 }}
 """
-        res = model.generate_content(prompt)
-        data = json.loads(re.search(r"\{.*\}", res.text, re.S).group(0))
+        text = gemini_generate(prompt, "reading")
+        data = json.loads(re.search(r"\{.*\}", text, re.S).group(0))
         score = int(data.get("score", 0))
-        feedback = data.get("feedback", "")
+        feedback = llm_text(data.get("feedback"))
         return score, feedback
     except Exception as e:
         logger.error("Gemini reading error: %s", e)
+        metrics.fallback("reading", "error")
         return 50, "採点に失敗したため簡易スコアを返しました。"
 
 # ======================================================
@@ -269,7 +885,7 @@ def evaluate_reading(passage, question, correct_answer, user_answer):
 # ======================================================
 def get_random_reading():
     try:
-        with sqlite3.connect(READING_DB) as conn:
+        with db_connect(READING_DB) as conn:
             c = conn.cursor()
             c.execute("SELECT id, title, passage, question, correct_answer FROM reading_passages ORDER BY RANDOM() LIMIT 1")
             row = c.fetchone()
@@ -288,13 +904,23 @@ def reading_quiz():
         return redirect(url_for("login"))
 
     user_id = session.get("user_id", 0)
+    words, _terms = get_search_targets(learner_id())
+    focus_words = []
 
     try:
-        # DBからランダムに1件取得（reading_textsテーブル）
-        with sqlite3.connect(READING_DB) as conn:
-            c = conn.cursor()
-            c.execute("SELECT id, text FROM reading_texts ORDER BY RANDOM() LIMIT 1")
-            row = c.fetchone()
+        # 検索語（?q= / ?focus=missed）があれば、それを含む文章の上位から選ぶ
+        row = None
+        hits = search_index.search_reading(READING_DB, words, SEARCH_TOP_K) if words else []
+        if hits:
+            hit = random.choice(hits)
+            row = (hit["id"], hit["text"])
+            focus_words = words
+        else:
+            # DBからランダムに1件取得（reading_textsテーブル）
+            with db_connect(READING_DB) as conn:
+                c = conn.cursor()
+                c.execute("SELECT id, text FROM reading_texts ORDER BY RANDOM() LIMIT 1")
+                row = c.fetchone()
 
         if row:
             passage_id, passage_text = row
@@ -315,17 +941,48 @@ def reading_quiz():
         question="",
         passage_id=passage_id,
         user_id=user_id,
-        current_user=current_user
+        current_user=current_user,
+        focus_words=focus_words,
     )
 
 
+def get_reading_text(passage_id):
+    with db_connect(READING_DB) as conn:
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute("SELECT text FROM reading_texts WHERE id = ?", (passage_id,))
+        row = c.fetchone()
+    return row["text"] if row else None
+
+def get_reading_reference(passage_id):
+    """過去に Gemini が作った模範訳（ローカル採点の参照）。無ければ None"""
+    with db_connect(READING_DB) as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT correct_answer FROM reading_answers
+            WHERE passage_id = ? AND correct_answer IS NOT NULL AND correct_answer NOT LIKE '（模範訳%'
+            ORDER BY id DESC LIMIT 1
+        """, (passage_id,))
+        row = c.fetchone()
+    if row:
+        return row[0]
+    return archive.get_reference(READING_DB, "reading_answers", passage_id)
+
+def save_reading_answer(user_id, passage_id, user_answer, score, feedback, correct_answer=None):
+    """reading_answers に保存する（ANSWER_WRITER 経由。ランキングへの反映もそちらで行う。ゲストはメモリだけ）"""
+    store_answer("reading_answers", (
+        user_id, passage_id, score, user_answer, feedback,
+        datetime.datetime.utcnow().isoformat(), correct_answer
+    ))
+
 @app.route("/submit_reading", methods=["POST"])
+@grading_view
 def submit_reading():
     try:
         # =========================
         # フォーム入力取得
         # =========================
-        user_id = session.get("user_id", 0)
+        user_id = learner_id()
         passage_id = int(request.form.get("passage_id", 0))
         user_answer = request.form.get("answer", "").strip()
         question = request.form.get("question", "").strip()  # ここを追加
@@ -333,19 +990,15 @@ def submit_reading():
         # =========================
         # DBから英文取得
         # =========================
-        with sqlite3.connect(READING_DB) as conn:
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute("SELECT text FROM reading_texts WHERE id = ?", (passage_id,))
-            row = c.fetchone()
-        passage_text = row["text"] if row else "This is a sample English passage for practice."
+        passage_text = (yield DBCall(get_reading_text, passage_id)) or "This is a sample English passage for practice."
+        reference = yield DBCall(get_reading_reference, passage_id)
 
         # =========================
         # Geminiで模範日本語訳と採点
         # =========================
         try:
-            correct_answer_text, score, feedback = generate_and_evaluate_reading(
-                passage_text, user_answer, question
+            correct_answer_text, score, feedback = yield from grade_reading(
+                passage_text, user_answer, question, reference, passage_id
             )
         except Exception:
             logger.exception("generate_and_evaluate_reading failed")
@@ -357,17 +1010,7 @@ def submit_reading():
         # DBに解答結果を保存（失敗しても結果表示は可能）
         # =========================
         try:
-            with sqlite3.connect(READING_DB) as conn:
-                c = conn.cursor()
-                c.execute("""
-                    INSERT INTO reading_answers
-                    (user_id, passage_id, user_answer, score, feedback, attempt_date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    user_id, passage_id, user_answer, score, feedback,
-                    datetime.datetime.utcnow().isoformat()
-                ))
-                conn.commit()
+            yield DBCall(save_reading_answer, user_id, passage_id, user_answer, score, feedback, correct_answer_text)
         except Exception:
             logger.exception("DB保存失敗")
 
@@ -439,48 +1082,54 @@ def parse_json_from_text(text):
         logger.warning("JSON parse failed; fallback to empty dict")
         return {}
 
-# ======================================================
-# 品詞文字列正規化関数
-# ======================================================
-def normalize_pos_string(raw):
+def llm_text(value, default=""):
     """
-    raw: 例 "noun, verb" や "noun/verb" や "Noun Verb" など
-    戻り値: "名詞・動詞" のような日本語結合文字列。情報無しなら "その他"
+    Gemini の JSON の値を文字列にする（そのまま DB に入れるので）。
+    feedback などにリストや dict が返ってくることがあり、そのままでは INSERT でバインドできない。
     """
-    if not raw:
-        return "その他"
-    # 小文字化して分割（カンマ、スラッシュ、全角読点、空白などを区切りとする）
-    parts = re.split(r"[,\u3001/\\\s]+", str(raw).strip().lower())
-    mapped = []
-    for p in parts:
-        if not p:
-            continue
-        # もし p が複数語（like "noun (countable)"), take first token before non-alpha
-        token = re.match(r"[a-z]+", p)
-        key = token.group(0) if token else p
-        ja = POS_JA.get(key, None)
-        if ja:
-            mapped.append(ja)
-        else:
-            # try to map english full words (e.g., "nounplural") fallback to その他 later
-            # skip unknown tokens
-            continue
-    # dedupe while preserving order
-    seen = set()
-    result = []
-    for x in mapped:
-        if x not in seen:
-            seen.add(x)
-            result.append(x)
-    if result:
-        return "・".join(result)
-    return "その他"
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return "、".join(llm_text(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
 
 # ======================================================
 # 採点関数
 # ======================================================
 def evaluate_answer(word, correct_meaning, user_answer, pos_from_db=None):
+    return run_sync(grade_word(word, correct_meaning, user_answer, pos_from_db))
+
+def local_word_grade(word, correct_meaning, user_answer, pos_from_db=None):
+    """Gemini を使わない単語の簡易採点（grade_word と同じ形で返す）"""
+    score = 100 if (correct_meaning and correct_meaning in user_answer) else 60
+    feedback = "（簡易採点）" + ("Good!" if score >= 70 else "もう少し詳しく書いてみよう")
+    example = {"en": f"{word} の使用例（採点対象外）", "jp": ""}
+    pos_ja = normalize_pos_string(pos_from_db or "other")
+    return score, feedback, example, pos_ja, (correct_meaning or "")
+
+# 回答によらない部分（context caching の対象）。文言を変えたら WORD_PROMPT_VERSION を上げる
+WORD_PROMPT_VERSION = "word-v1"
+WORD_GRADING_CONTEXT = """
+英単語の意味を答える問題の採点をしてください。
+以下のJSONを必ず返してください（例のフォーマットに従うこと）:
+{
+  "score": 95,
+  "feedback": "説明テキスト",
+  "example": "He gave his assurance that the project would be completed on time.",
+  "example_jp": "彼はそのプロジェクトが予定通り完了すると保証した。",
+  "pos": "noun, verb",
+  "simple_meaning": "保証、確信、自信"
+}
+(注意) pos は英語のキーで複数ある場合はカンマ区切りで返してください（例: noun, verb）。
+"""
+
+def grade_word(word, correct_meaning, user_answer, pos_from_db=None, variant=None):
     """
+    evaluate_answer のフロー版（yield from で使う）
     戻り値:
       score:int,
       feedback:str,
@@ -488,14 +1137,12 @@ def evaluate_answer(word, correct_meaning, user_answer, pos_from_db=None):
       pos_ja:str (日本語表記),
       simple_meaning:str
     - pos_from_db: DB に入っている英語キー（例: 'noun'）を渡すと非Gemini時に使う。
+    - variant: (プロンプトのバージョン, 指示の文面)。採点し直し・A/B 比較（regrade.py）用
     """
     # 非Geminiの簡易採点（フォールバック）
     if not HAS_GEMINI:
-        score = 100 if (correct_meaning and correct_meaning in user_answer) else 60
-        feedback = "（簡易採点）" + ("Good!" if score >= 70 else "もう少し詳しく書いてみよう")
-        example = {"en": f"{word} の使用例（採点対象外）", "jp": ""}
-        pos_ja = normalize_pos_string(pos_from_db or "other")
-        return score, feedback, example, pos_ja, (correct_meaning or "")
+        metrics.fallback("word", "no_gemini")
+        return local_word_grade(word, correct_meaning, user_answer, pos_from_db)
 
     # Gemini有効時
     try:
@@ -503,45 +1150,82 @@ def evaluate_answer(word, correct_meaning, user_answer, pos_from_db=None):
 単語: {word}
 正しい意味: {correct_meaning}
 回答: {user_answer}
-
-以下のJSONを必ず返してください（例のフォーマットに従うこと）:
-{{
-  "score": 95,
-  "feedback": "説明テキスト",
-  "example": "He gave his assurance that the project would be completed on time.",
-  "example_jp": "彼はそのプロジェクトが予定通り完了すると保証した。",
-  "pos": "noun, verb",
-  "simple_meaning": "保証、確信、自信"
-}}
-(注意) pos は英語のキーで複数ある場合はカンマ区切りで返してください（例: noun, verb）。
 """
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        res = model.generate_content(prompt)
-        data = parse_json_from_text(res.text or "")
+        version, context = variant or (WORD_PROMPT_VERSION, WORD_GRADING_CONTEXT)
+        data = parse_json_from_text((yield LLMCall(prompt, "word", context, (version, None))))
 
         score = max(0, min(100, int(data.get("score", 0))))
-        feedback = data.get("feedback", "") or ""
-        example_en = data.get("example", f"{word} の使用例（採点対象外）")
-        example_jp = data.get("example_jp", "") or ""
-        raw_pos = (data.get("pos") or pos_from_db or "other")
+        feedback = llm_text(data.get("feedback"))
+        example_en = llm_text(data.get("example"), f"{word} の使用例（採点対象外）")
+        example_jp = llm_text(data.get("example_jp"))
+        raw_pos = llm_text(data.get("pos"), pos_from_db or "other")
         pos_ja = normalize_pos_string(raw_pos)
-        simple_meaning = data.get("simple_meaning", correct_meaning or "")
+        simple_meaning = llm_text(data.get("simple_meaning"), correct_meaning or "")
 
         example = {"en": example_en, "jp": example_jp}
         return score, feedback, example, pos_ja, simple_meaning
+    except admission.Shed as e:
+        metrics.fallback("word", e.reason)
+        return local_word_grade(word, correct_meaning, user_answer, pos_from_db)
     except Exception as e:
         logger.error("Gemini Error: %s", e)
+        metrics.fallback("word", "error")
         example = {"en": f"{word} の使用例", "jp": ""}
         pos_ja = normalize_pos_string(pos_from_db or "other")
         return 0, "採点エラー", example, pos_ja, (correct_meaning or "")
 
+# ======================================================
+# ローカル採点（local_scorer の chrF）による事前判定
+# ======================================================
+# 模範解答との一致度がこれ以上 / 以下なら Gemini に送らずローカルの点数で確定する
+LOCAL_ACCEPT_SCORE = int(os.getenv("LOCAL_SCORE_ACCEPT", "95"))
+LOCAL_REJECT_SCORE = int(os.getenv("LOCAL_SCORE_REJECT", "5"))
+
+def prefilter_decides(feature, score):
+    if score >= LOCAL_ACCEPT_SCORE:
+        metrics.inc("grading_prefilter_total", feature=feature, result="accept")
+        return True
+    if score <= LOCAL_REJECT_SCORE:
+        metrics.inc("grading_prefilter_total", feature=feature, result="reject")
+        return True
+    return False
+
 # ======================================================
 # Gemini で模範日本語訳生成＋採点（安全版・改良）
 # ======================================================
-def generate_and_evaluate_reading(passage: str, user_answer: str, question: str = ""):
+def generate_and_evaluate_reading(passage: str, user_answer: str, question: str = "", reference: str = None,
+                                  passage_id: int = None):
+    return run_sync(grade_reading(passage, user_answer, question, reference, passage_id))
+
+READING_PROMPT_VERSION = "reading-v1"
+
+# 回答によらない部分（指示・出力形式・本文）。{passage} に本文が入る。
+# 文言を変えたら READING_PROMPT_VERSION を上げる
+READING_GRADING_TEMPLATE = """
+以下の英文読解問題について、学生の回答に対する日本語の模範訳と採点結果(100点満点)を返してください。
+JSON形式のみで出力してください。余計な説明は不要です。
+出力形式:
+{
+  "correct_answer": "",
+  "score": 0,
+  "feedback": ""
+}
+
+文章:
+{passage}
+"""
+
+def reading_grading_context(passage, template=READING_GRADING_TEMPLATE):
+    return template.replace("{passage}", passage)
+
+def grade_reading(passage: str, user_answer: str, question: str = "", reference: str = None,
+                  passage_id: int = None, variant=None):
     """
-    Gemini で模範日本語訳を生成し、採点も行う。
-    失敗時はフォールバック。
+    Gemini で模範日本語訳を生成し、採点も行う（フロー版）。
+    失敗時はフォールバック。reference（過去の模範訳）があれば
+    フォールバックと事前判定はそれとの一致度（chrF）で採点する。
+    passage_id があれば本文ごと context caching に載せる。
+    variant: (プロンプトのバージョン, READING_GRADING_TEMPLATE の代わりのテンプレート)
     戻り値:
       correct_answer_text:str
       score:int
@@ -560,44 +1244,39 @@ def generate_and_evaluate_reading(passage: str, user_answer: str, question: str
     if not user_answer.strip():
         return correct_answer_text, 0, "回答が入力されていません。"
 
+    # ----------------------------
+    # 模範訳があればローカル採点をフォールバックにする
+    # ----------------------------
+    if reference:
+        correct_answer_text = reference
+        score, feedback = local_scorer.grade(user_answer, reference)
+        if prefilter_decides("reading", score):
+            return correct_answer_text, score, feedback
+
     # ----------------------------
     # Gemini API 未使用 or キーなし
     # ----------------------------
     if not HAS_GEMINI:
-        correct_answer_text = "（模範訳未生成）"
-        score = 60
-        feedback = "（簡易採点）内容を確認してください。"
-        return correct_answer_text, score, feedback
+        metrics.fallback("reading", "no_gemini")
+        if reference:
+            return correct_answer_text, score, feedback
+        return "（模範訳未生成）", 60, "（簡易採点）内容を確認してください。"
 
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-
         # ----------------------------
         # プロンプトを明確化
         # ----------------------------
         prompt = f"""
-以下の英文読解問題について、学生の回答に対する日本語の模範訳と採点結果(100点満点)を返してください。
-文章:
-{passage}
-
 質問:
 {question or '（質問なし）'}
 
 学生の回答:
 {user_answer}
-
-JSON形式のみで出力してください。余計な説明は不要です。
-出力形式:
-{{
-  "correct_answer": "",
-  "score": 0,
-  "feedback": ""
-}}
 """
-
-        res = model.generate_content(prompt)
-        raw_text = res.text or ""
-        logger.info("Gemini raw response: %s", raw_text)
+        version, template = variant or (READING_PROMPT_VERSION, READING_GRADING_TEMPLATE)
+        cache_key = (version, passage_id) if passage_id is not None else None
+        raw_text = yield LLMCall(prompt, "reading", reading_grading_context(passage, template), cache_key)
+        logger.info("Gemini raw response: %s", raw_text, extra={"event": "llm_raw", "feature": "reading"})
 
         # ----------------------------
         # JSON抽出（最初の{}のみ、安全にパース）
@@ -606,16 +1285,25 @@ JSON形式のみで出力してください。余計な説明は不要です。
         if match:
             try:
                 data = json.loads(match.group(0))
-                correct_answer_text = data.get("correct_answer") or "（模範訳生成失敗）"
+                correct_answer_text = llm_text(data.get("correct_answer"), "（模範訳生成失敗）")
                 score = max(0, min(100, int(data.get("score", 0))))
-                feedback = data.get("feedback") or "採点結果なし"
+                feedback = llm_text(data.get("feedback"), "採点結果なし")
             except Exception as e:
                 logger.warning("JSON parse failed, using fallback: %s", e)
+                metrics.fallback("reading", "bad_json")
         else:
             logger.warning("No valid JSON found in Gemini response, using fallback.")
-
+            metrics.fallback("reading", "bad_json")
+
+    except admission.Shed as e:
+        # 混雑時・連打時は Gemini を使わずに返す
+        metrics.fallback("reading", e.reason)
+        if reference:
+            return correct_answer_text, score, feedback
+        return "（模範訳未生成）", 60, "（簡易採点）内容を確認してください。"
     except Exception as e:
         logger.exception("Gemini generate_and_evaluate_reading error: %s", e)
+        metrics.fallback("reading", "error")
 
     # ----------------------------
     # 必ず3つ返す
@@ -623,6 +1311,66 @@ JSON形式のみで出力してください。余計な説明は不要です。
     return correct_answer_text, score, feedback
 
 
+# ======================================================
+# 英作文 採点関数
+# ======================================================
+def evaluate_writing(prompt_text, user_answer, reference=None):
+    return run_sync(grade_writing(prompt_text, user_answer, reference))
+
+def local_writing_grade(user_answer, reference):
+    """Gemini を使わない英作文の採点。模範英文があれば chrF、無ければ長さで見る"""
+    if reference:
+        score, feedback = local_scorer.grade(user_answer, reference)
+        return score, feedback, reference
+    return min(100, len(user_answer) * 2), "（簡易採点）内容を確認してください。", ""
+
+WRITING_PROMPT_VERSION = "writing-v1"
+WRITING_GRADING_CONTEXT = """
+以下の日本語を英訳した学生の回答を採点してください（100点満点）。
+JSON形式のみで出力してください。余計な説明は不要です。
+出力形式:
+{
+  "score": 0,
+  "feedback": "日本語でのアドバイス",
+  "correct_example": "模範英文"
+}
+"""
+
+def grade_writing(prompt_text, user_answer, reference=None, variant=None):
+    """
+    日本語のお題に対する英作文を採点する（フロー版）。
+    戻り値:
+      score:int
+      feedback:str
+      correct_example:str（模範英文）
+    Gemini の失敗は例外のまま返す（submit_writing 側で簡易採点に切り替える）。
+    reference（過去の模範英文）との一致度で決着がつく回答は Gemini に送らない。
+    variant: (プロンプトのバージョン, 指示の文面)。採点し直し・A/B 比較（regrade.py）用
+    """
+    if reference:
+        local = local_writing_grade(user_answer, reference)
+        if prefilter_decides("writing", local[0]):
+            return local
+    if not HAS_GEMINI:
+        metrics.fallback("writing", "no_gemini")
+        return local_writing_grade(user_answer, reference)
+
+    prompt = f"""
+日本語:
+{prompt_text}
+
+学生の英訳:
+{user_answer}
+"""
+    version, context = variant or (WRITING_PROMPT_VERSION, WRITING_GRADING_CONTEXT)
+    data = parse_json_from_text((yield LLMCall(prompt, "writing", context, (version, None))))
+    if not data:
+        raise ValueError("no JSON in Gemini writing response")
+    score = max(0, min(100, int(data.get("score", 0))))
+    feedback = llm_text(data.get("feedback"), "採点結果なし")
+    correct_example = llm_text(data.get("correct_example"))
+    return score, feedback, correct_example
+
 # ======================================================
 # DB操作系
 # ======================================================
@@ -633,7 +1381,7 @@ def get_random_word():
     pos カラムが存在していれば値を返す（英語キーを想定）。
     """
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        with db_connect(DB_FILE) as conn:
             c = conn.cursor()
             c.execute("PRAGMA table_info(words)")
             cols = [r[1] for r in c.fetchall()]
@@ -651,20 +1399,134 @@ def get_random_word():
         logger.error("DB get_random_word error: %s", e)
         return None
 
-def get_average_score(user_id):
+def adaptive_user(user_id):
+    """ゲストの実力は記録しないので、出題はゲスト共通（adaptive.GUEST_USER_ID）の扱いにする"""
+    return adaptive.GUEST_USER_ID if guest_store.is_guest_id(user_id) else user_id
+
+def get_adaptive_word(user_id):
+    """
+    user_id のレベルに合った単語（adaptive.py）。戻り値は get_random_word と同じ形。
+    難易度表がまだ無い・選べないときは get_random_word にフォールバック。
+    """
+    try:
+        word_id = adaptive.pick_word(DB_FILE, adaptive_user(user_id))
+        row = get_word_by_id(word_id) if word_id is not None else None
+        if row:
+            metrics.inc("word_picks_total", mode="adaptive")
+            return (word_id, *row)
+    except Exception as e:
+        logger.error("adaptive pick error: %s", e)
+    metrics.inc("word_picks_total", mode="random")
+    return get_random_word()
+
+def get_word_session(user_id, n):
+    """
+    クイズ n 問分の単語 [{"word_id", "word"}] をまとめて選ぶ（意味は渡さない）。
+    足りない分は ORDER BY RANDOM() で補う。
+    """
+    ids = []
     try:
-        with sqlite3.connect(DB_FILE) as conn:
+        ids = adaptive.pick_words(DB_FILE, adaptive_user(user_id), n)
+    except Exception as e:
+        logger.error("adaptive pick error: %s", e)
+    metrics.inc("word_picks_total", len(ids), mode="adaptive")
+    with db_connect(DB_FILE) as conn:
+        c = conn.cursor()
+        rows = []
+        if ids:
+            marks = ",".join("?" * len(ids))
+            c.execute(f"SELECT id, word FROM words WHERE id IN ({marks})", ids)
+            by_id = dict(c.fetchall())
+            rows = [(i, by_id[i]) for i in ids if i in by_id]
+        if len(rows) < n:
+            marks = ",".join("?" * len(rows))
+            c.execute(
+                f"SELECT id, word FROM words WHERE id NOT IN ({marks}) ORDER BY RANDOM() LIMIT ?",
+                [r[0] for r in rows] + [n - len(rows)],
+            )
+            extra = c.fetchall()
+            metrics.inc("word_picks_total", len(extra), mode="random")
+            rows += extra
+    return [{"word_id": i, "word": w} for i, w in rows]
+
+def get_word_by_id(word_id):
+    """
+    RETURN:
+      (word, definition_ja, pos_en_or_none) / 見つからなければ None
+    """
+    with db_connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("PRAGMA table_info(words)")
+        cols = [r[1] for r in c.fetchall()]
+        if "pos" in cols:
+            c.execute("SELECT word,definition_ja,pos FROM words WHERE id=?", (word_id,))
+            return c.fetchone()
+        c.execute("SELECT word,definition_ja FROM words WHERE id=?", (word_id,))
+        row = c.fetchone()
+        return (row[0], row[1], None) if row else None
+
+# 綴りでの検索用（words_version が変わったら読み直す）
+WORD_INDEX = word_index.WordIndex(DB_FILE)
+
+def save_word_answer(user_id, word_id, score, feedback, example_en, user_answer=None):
+    """student_answers に保存する（ANSWER_WRITER 経由。ランキングへの反映もそちらで行う。ゲストはメモリだけ）"""
+    store_answer("student_answers", (
+        user_id, word_id, score, feedback, example_en, datetime.datetime.utcnow().isoformat(), user_answer
+    ))
+
+def save_choice_answer(user_id, word_id, score, feedback, chosen):
+    """4 択の回答を word_choice_answers に保存する（user_answer は選んだ意味）"""
+    store_answer("word_choice_answers", (
+        user_id, word_id, score, feedback, datetime.datetime.utcnow().isoformat(), chosen
+    ))
+
+def get_or_create_name_user(name):
+    """
+    名前入力クイズ用: パスワード無しユーザーを名前で引く（無ければ作る）。
+    パスワード付きの登録ユーザー名とゲスト（id 0）は乗っ取れないように None を返す。
+    """
+    with db_connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, password FROM users WHERE username=?", (name,))
+        row = c.fetchone()
+        if row:
+            if row[0] == 0 or row[1]:
+                return None
+            return row[0]
+        c.execute("INSERT INTO users (username, password) VALUES (?, '')", (name,))
+        conn.commit()
+        return c.lastrowid
+
+def get_average_score(user_id, table="student_answers"):
+    """単語クイズの平均点（4 択は table="word_choice_answers" で別に数える）"""
+    if guest_store.is_guest_id(user_id):
+        return GUEST_STORE.average(user_id, table)
+
+    # まだ書き込まれていない自分の回答も平均に入れる（read-your-writes）
+    def average(pending):
+        with db_connect(DB_FILE) as conn:
+            # アーカイブの移動と食い違わないように、hot とアーカイブ分を同じトランザクションで読む
+            conn.execute("BEGIN")
             c = conn.cursor()
-            c.execute("SELECT AVG(score) FROM student_answers WHERE user_id=?", (user_id,))
-            r = c.fetchone()
-            return round(r[0], 2) if r and r[0] else 0
+            c.execute(f"SELECT COALESCE(SUM(score), 0), COUNT(score) FROM {table} WHERE user_id=?", (user_id,))
+            total, count = c.fetchone()
+            archived_total, archived_count = archive.total_for_user(conn, table, user_id)
+        total += archived_total
+        count += archived_count
+        scores = [p[2] for p in pending if p[0] == user_id and p[2] is not None]
+        total += sum(scores)
+        count += len(scores)
+        return round(total / count, 2) if count and total else 0
+
+    try:
+        return ANSWER_WRITER.read(table, average)
     except Exception as e:
         logger.error("DB avg error: %s", e)
         return 0
 
 def get_random_prompt():
     try:
-        with sqlite3.connect(WRITING_DB) as conn:
+        with db_connect(WRITING_DB) as conn:
             c = conn.cursor()
             c.execute("SELECT id, prompt_text FROM writing_prompts ORDER BY RANDOM() LIMIT 1")
             row = c.fetchone()
@@ -673,6 +1535,56 @@ def get_random_prompt():
         logger.error("DB prompt error: %s", e)
         return {"id": None, "text": "エラー"}
 
+# ======================================================
+# 苦手な単語・トピックで出題を絞る（search_index の FTS5 検索）
+# ======================================================
+MISSED_SCORE = 60        # これ未満の単語クイズを「間違えた」とみなす
+MISSED_WORDS_LIMIT = 10
+SEARCH_TOP_K = 20        # 関連度の上位 K 件からランダムに 1 件出す
+
+def get_recent_missed_words(user_id, limit=MISSED_WORDS_LIMIT):
+    """最近間違えた単語を新しい順に [(word, definition_ja)] で返す"""
+    if guest_store.is_guest_id(user_id):
+        word_ids = []
+        for row in reversed(GUEST_STORE.answers(user_id, "student_answers")):
+            # word_id はフォームの文字列のまま入っていることがある
+            if row[2] is not None and row[2] < MISSED_SCORE and int(row[1]) not in word_ids:
+                word_ids.append(int(row[1]))
+        word_ids = word_ids[:limit]
+        with db_connect(DB_FILE) as conn:
+            marks = ",".join("?" * len(word_ids))
+            found = {r[0]: (r[1], r[2]) for r in conn.execute(
+                f"SELECT id, word, definition_ja FROM words WHERE id IN ({marks})", word_ids)}
+        return [found[i] for i in word_ids if i in found]
+    with db_connect(DB_FILE) as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT w.word, w.definition_ja
+            FROM student_answers a JOIN words w ON w.id = a.word_id
+            WHERE a.user_id = ? AND a.score < ?
+            GROUP BY a.word_id
+            ORDER BY MAX(a.id) DESC
+            LIMIT ?
+        """, (user_id, MISSED_SCORE, limit))
+        return c.fetchall()
+
+def get_search_targets(user_id):
+    """
+    ?q=<語> ならその語、?focus=missed なら最近間違えた単語を検索対象にする。
+    戻り値: (英文用の英単語のリスト, 英作文のお題用の日本語の語のリスト)。指定が無ければ両方空。
+    """
+    q = request.args.get("q", "").strip()
+    if q:
+        return q.split(), q.split()
+    if request.args.get("focus") == "missed" and user_id:
+        try:
+            rows = get_recent_missed_words(user_id)
+        except Exception:
+            logger.exception("get_recent_missed_words error")
+            return [], []
+        return [r[0] for r in rows], search_index.writing_terms(r[1] for r in rows)
+    return [], []
+
 # ======================================================
 # 認証
 # ======================================================
@@ -681,7 +1593,7 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        with sqlite3.connect(DB_FILE) as conn:
+        with db_connect(DB_FILE) as conn:
             c = conn.cursor()
             c.execute("SELECT id,password FROM users WHERE username=?", (username,))
             row = c.fetchone()
@@ -693,7 +1605,7 @@ def login():
 
 @app.route("/guest_login", methods=["POST"])
 def guest_login():
-    session.update({"user_id": 0, "username": "ゲスト", "is_guest": True})
+    session.update({"user_id": 0, "username": "ゲスト", "is_guest": True, "guest_id": GUEST_STORE.new_id()})
     return redirect(url_for("index"))
 
 @app.route("/register", methods=["GET", "POST"])
@@ -702,66 +1614,83 @@ def register():
         username = request.form.get("username")
         password = request.form.get("password")
         if not username or not password:
-            return render_template("register.html", error="必須項目です")
+            return register_page(error="必須項目です")
         hashed = generate_password_hash(password)
         try:
-            with sqlite3.connect(DB_FILE) as conn:
+            with db_connect(DB_FILE) as conn:
                 c = conn.cursor()
                 c.execute("SELECT id FROM users WHERE username=?", (username,))
                 if c.fetchone():
-                    return render_template("register.html", error="既に登録されています")
+                    return register_page(error="既に登録されています")
                 c.execute("INSERT INTO users (username,password) VALUES (?,?)", (username, hashed))
+                new_user_id = c.lastrowid
                 conn.commit()
+            # ゲストで解いた分を引き継ぐ（チェックを外せば捨てる）
+            claimed = claim_guest_answers(new_user_id) if request.form.get("claim") else 0
+            if claimed:
+                flash(f"登録完了！ゲストで解いた {claimed} 問の結果を引き継ぎました。ログインしてください")
+            else:
                 flash("登録完了！ログインしてください")
-                return redirect(url_for("login"))
+            return redirect(url_for("login"))
         except Exception as e:
             logger.error("Register Error: %s", e)
-            return render_template("register.html", error="登録中にエラー")
-    return render_template("register.html")
+            return register_page(error="登録中にエラー")
+    return register_page()
+
+def register_page(**context):
+    guest_id = session.get("guest_id")
+    guest_answers = GUEST_STORE.count(guest_id) if guest_store.is_guest_id(guest_id) else 0
+    return render_template("register.html", guest_answers=guest_answers, **context)
 
 # ======================================================
 # API
 # ======================================================
+WORD_SESSION_SIZE = 10
+WORD_SESSION_MAX = 50
+
+@app.route("/api/word_session")
+def api_word_session():
+    """
+    単語クイズ n 問分を 1 回で返す。クライアントは手元で次の問題へ進み、
+    採点は /api/submit_answer（平均スコアも一緒に返る）で 1 問ずつ行う。
+    mode=choice なら 4 択の選択肢付き（採点は /api/submit_choice）。
+    """
+    user_id = learner_id()
+    n = max(1, min(request.args.get("n", WORD_SESSION_SIZE, type=int), WORD_SESSION_MAX))
+    choice = request.args.get("mode") == "choice"
+    try:
+        if choice:
+            items = get_choice_session(user_id, n)
+        else:
+            items = get_word_session(user_id, n)
+    except Exception:
+        logger.exception("api_word_session error")
+        return jsonify({"error": "internal server error"}), 500
+    table = "word_choice_answers" if choice else "student_answers"
+    return jsonify({"items": items, "average_score": get_average_score(user_id, table)})
+
 @app.route("/api/submit_answer", methods=["POST"])
+@grading_view
 def api_submit_answer():
     try:
-        user_id = session.get("user_id", 0)
-        word_id = request.form.get("word_id")
+        user_id = learner_id()
+        # 数字でない word_id は None（下で 404）。文字列のまま保存すると word_stats の集計が壊れる
+        word_id = request.form.get("word_id", type=int)
         answer = request.form.get("answer", "")
 
         # words テーブルから pos も取得する（存在すれば）
-        pos_from_db = None
-        with sqlite3.connect(DB_FILE) as conn:
-            c = conn.cursor()
-            c.execute("PRAGMA table_info(words)")
-            cols = [r[1] for r in c.fetchall()]
-            if "pos" in cols:
-                c.execute("SELECT word,definition_ja,pos FROM words WHERE id=?", (word_id,))
-                row = c.fetchone()
-                if not row:
-                    return jsonify({"error": "単語が見つかりません"}), 404
-                word, correct_meaning, pos_from_db = row
-            else:
-                c.execute("SELECT word,definition_ja FROM words WHERE id=?", (word_id,))
-                row = c.fetchone()
-                if not row:
-                    return jsonify({"error": "単語が見つかりません"}), 404
-                word, correct_meaning = row
+        row = yield DBCall(get_word_by_id, word_id)
+        if not row:
+            return jsonify({"error": "単語が見つかりません"}), 404
+        word, correct_meaning, pos_from_db = row
 
         # 採点（pos_from_db を渡す）
-        score, feedback, example, pos_ja, simple_meaning = evaluate_answer(word, correct_meaning, answer, pos_from_db=pos_from_db)
+        score, feedback, example, pos_ja, simple_meaning = yield from grade_word(word, correct_meaning, answer, pos_from_db)
 
         # student_answers に例文（英語）を保存（互換性のため）
-        with sqlite3.connect(DB_FILE) as conn:
-            c = conn.cursor()
-            c.execute(
-                """INSERT INTO student_answers (user_id,word_id,score,feedback,example,attempt_date)
-                   VALUES (?,?,?,?,?,?)""",
-                (user_id, word_id, score, feedback, example.get("en", ""), datetime.datetime.utcnow().isoformat()),
-            )
-            conn.commit()
+        yield DBCall(save_word_answer, user_id, word_id, score, feedback, example.get("en", ""), answer)
 
-        avg = get_average_score(user_id)
+        avg = yield DBCall(get_average_score, user_id)
         # フロント向け返却（正解意味は渡さない設計）
         return jsonify({
             "score": score,
@@ -778,6 +1707,123 @@ def api_submit_answer():
         logger.exception("api_submit_answer error")
         return jsonify({"error": "internal server error"}), 500
 
+# ======================================================
+# 4 択モード（distractors.py の索引から出題し、Gemini を使わずに採点する）
+# ======================================================
+# 自由記述の採点がどうせローカルの簡易採点になるとき（予算切れ・待ち行列あり）は
+# /word_quiz を 4 択で出す。WORD_CHOICE_AUTO=0 で止める（?mode=choice / text で選ぶのはいつでも可）
+WORD_CHOICE_AUTO = os.getenv("WORD_CHOICE_AUTO", "1") != "0"
+# 出した問題（1 問 1 回だけ採点する）。WORD_CHOICE_TTL_SEC たつか、WORD_CHOICE_MAX_ISSUED を超えると古いものから消える
+CHOICE_ISSUES = distractors.IssuedChoices(
+    ttl=float(os.getenv("WORD_CHOICE_TTL_SEC", "3600")),
+    max_issued=int(os.getenv("WORD_CHOICE_MAX_ISSUED", "100000")),
+)
+
+def gemini_saturated():
+    """Gemini の単語採点の予算を使い切った・呼び出しが待たされているとき True"""
+    if METER.over_budget("word") is not None:
+        return True
+    return ADMISSION.backend.incr("llm_queue", 0) > 0
+
+def choice_nonce():
+    """セッションごとの乱数（選択肢の token と出した問題をこのセッションに結びつける）"""
+    nonce = session.get("choice_nonce")
+    if not nonce:
+        nonce = session["choice_nonce"] = secrets.token_hex(8)
+    return nonce
+
+def choice_token(nonce, issue, word_id, choice_id):
+    """
+    選択肢に付ける値。どれが正解かはクライアントから分からないように、
+    (セッション, 出した問題, 出題した単語, 選択肢の意味の単語) を secret_key で署名したものにする。
+    問題ごとに値が変わるので、一度見た正解の token を別の問題・別のセッションで使い回せない。
+    """
+    message = f"{nonce}:{issue}:{word_id}:{choice_id}".encode()
+    return hmac.new(app.secret_key.encode(), message, "sha256").hexdigest()[:20]
+
+def get_choice_session(user_id, n):
+    """
+    get_word_session の 4 択版。各問に "issue"（出した問題の id）と
+    "choices": [{"token", "meaning"}]（順番はばらばら）を付ける。
+    選択肢の索引が無い単語は除き、索引のある単語から補う。
+    """
+    items = get_word_session(user_id, n)
+    choices = distractors.choices_for(DB_FILE, [i["word_id"] for i in items])
+    items = [i for i in items if i["word_id"] in choices]
+    if len(items) < n:
+        extra = distractors.random_words(DB_FILE, n - len(items), [i["word_id"] for i in items])
+        choices.update(distractors.choices_for(DB_FILE, extra))
+        if extra:
+            with db_connect(DB_FILE) as conn:
+                marks = ",".join("?" * len(extra))
+                rows = conn.execute(f"SELECT id, word FROM words WHERE id IN ({marks})", extra).fetchall()
+            items += [{"word_id": i, "word": w} for i, w in rows if i in choices]
+    nonce = choice_nonce()
+    for item in items:
+        issue = item["issue"] = CHOICE_ISSUES.issue(nonce, item["word_id"])
+        options = [
+            {"token": choice_token(nonce, issue, item["word_id"], choice_id), "meaning": meaning}
+            for choice_id, meaning in choices[item["word_id"]]
+        ]
+        random.shuffle(options)
+        item["choices"] = options
+    return items
+
+@app.route("/api/submit_choice", methods=["POST"])
+def api_submit_choice():
+    """
+    4 択の採点。選んだ選択肢が出題した単語そのものの意味なら 100 点、ほかの単語の意味なら 0 点。
+    採点するのは出した問題（issue）1 つにつき 1 回だけ。
+    """
+    try:
+        user_id = learner_id()
+        nonce = session.get("choice_nonce")
+        issue = request.form.get("issue", "")
+        word_id = CHOICE_ISSUES.peek(nonce, issue) if nonce else None
+        if word_id is None:
+            return jsonify({"error": "この問題は採点済みか、期限が切れています"}), 409
+        if request.form.get("word_id", word_id, type=int) != word_id:
+            return jsonify({"error": "選択肢が正しくありません"}), 400
+        token = request.form.get("choice", "").encode()
+        choices = distractors.choices_for(DB_FILE, [word_id]).get(word_id)
+        if not choices:
+            return jsonify({"error": "単語が見つかりません"}), 404
+        chosen = next((meaning for choice_id, meaning in choices
+                       if hmac.compare_digest(token, choice_token(nonce, issue, word_id, choice_id).encode())), None)
+        if chosen is None:
+            return jsonify({"error": "選択肢が正しくありません"}), 400
+        if not CHOICE_ISSUES.take(nonce, issue):
+            # 同じ問題が同時に送られ、もう一方が先に採点した
+            return jsonify({"error": "この問題は採点済みか、期限が切れています"}), 409
+        row = get_word_by_id(word_id)
+        word, correct_meaning, pos_from_db = row
+        correct = hmac.compare_digest(token, choice_token(nonce, issue, word_id, word_id).encode())
+
+        score = 100 if correct else 0
+        if correct:
+            feedback = "（4択）正解！"
+        else:
+            feedback = f"（4択）「{chosen}」は別の単語の意味です。{word} は「{correct_meaning}」という意味です。"
+        metrics.inc("word_choice_answers_total", result="correct" if correct else "wrong")
+        # 誤答として選ばれた意味が word_stats の「よくある誤答」に出るように、選んだ意味を回答として残す
+        save_choice_answer(user_id, word_id, score, feedback, chosen)
+
+        return jsonify({
+            "score": score,
+            "correct": correct,
+            "feedback": feedback,
+            "example_en": "",
+            "example_jp": "",
+            "pos": normalize_pos_string(pos_from_db or "other"),
+            "simple_meaning": correct_meaning or "",
+            "average_score": get_average_score(user_id, "word_choice_answers"),
+            "user_answer": chosen
+        })
+
+    except Exception:
+        logger.exception("api_submit_choice error")
+        return jsonify({"error": "internal server error"}), 500
+
 # ======================================================
 # 各ページ
 # ======================================================
@@ -795,37 +1841,114 @@ def index():
 
 @app.route("/word_quiz")
 def word_quiz():
-    user_id = session.get("user_id", 0)
+    user_id = learner_id()
     review = request.args.get("review") == "1"
-    word_data = get_random_word()
-    if not word_data:
+    mode = request.args.get("mode")
+    auto_choice = mode is None and WORD_CHOICE_AUTO and gemini_saturated()
+    if auto_choice:
+        metrics.inc("word_choice_auto_total")
+    # 最初の 1 問だけでなく WORD_SESSION_SIZE 問分を渡し、次の問題はページ内で表示する
+    items = get_choice_session(user_id, WORD_SESSION_SIZE) if mode == "choice" or auto_choice else []
+    choice_mode = bool(items)
+    if not choice_mode:
+        items = get_word_session(user_id, WORD_SESSION_SIZE)
+    if not items:
         flash("単語が登録されていません。")
         return redirect(url_for("index"))
-    # get_random_word は (id, word, definition_ja, pos_or_none) を返す
-    if len(word_data) == 4:
-        word_id, word, definition_ja, pos_from_db = word_data
-    else:
-        word_id, word, definition_ja = word_data
-        pos_from_db = None
 
     # current_user をテンプレ向けに簡易 dict で渡す（テンプレが .is_authenticated を参照するため）
     current_user = {"is_authenticated": bool(session.get("user_id"))}
 
     return render_template(
         "word_quiz.html",
-        word_id=word_id,
-        word=word,
-        average_score=get_average_score(user_id),
+        word_id=items[0]["word_id"],
+        word=items[0]["word"],
+        items=items,
+        average_score=get_average_score(user_id, "word_choice_answers" if choice_mode else "student_answers"),
         review=review,
+        choice_mode=choice_mode,
+        auto_choice=auto_choice and choice_mode,
         current_user=current_user,
     )
 
+# --- 名前入力だけで遊べる単語クイズ（旧 question.py の機能） ---
+@app.route("/name_quiz", methods=["GET", "POST"])
+def name_quiz():
+    if request.method == "POST":
+        name = request.form.get("name", "").strip()
+        word_id = request.form.get("word_id", type=int)
+        answer = request.form.get("answer", "")
+        if not name:
+            flash("名前を入力してください")
+            return redirect(url_for("name_quiz"))
+
+        user_id = get_or_create_name_user(name)
+        if user_id is None:
+            flash("その名前は登録済みです。ログインしてから挑戦してください。")
+            return redirect(url_for("name_quiz"))
+        row = get_word_by_id(word_id)
+        if not row:
+            flash("単語が見つかりません")
+            return redirect(url_for("name_quiz"))
+        word, correct_meaning, pos_from_db = row
+
+        score, feedback, example, pos_ja, simple_meaning = evaluate_answer(word, correct_meaning, answer, pos_from_db=pos_from_db)
+        save_word_answer(user_id, word_id, score, feedback, example.get("en", ""), answer)
+
+        session["quiz_name"] = name
+        result = {
+            "word": word,
+            "score": score,
+            "feedback": feedback,
+            "example_en": example.get("en", ""),
+            "example_jp": example.get("jp", ""),
+            "pos": pos_ja,
+            "simple_meaning": simple_meaning,
+        }
+        return render_template(
+            "name_quiz.html",
+            result=result,
+            name=name,
+            average_score=get_average_score(user_id),
+        )
+
+    name = session.get("quiz_name", "")
+    user_id = get_or_create_name_user(name) if name else None
+    word_data = get_adaptive_word(user_id or 0)
+    if not word_data:
+        return "DBに単語がありません。"
+    word_id, word, _definition_ja, _pos = word_data
+
+    average_score = None
+    if user_id is not None:
+        average_score = get_average_score(user_id)
+    return render_template(
+        "name_quiz.html",
+        result=None,
+        name=name,
+        word_id=word_id,
+        word=word,
+        average_score=average_score,
+    )
+
 @app.route("/writing_quiz")
 def writing_quiz():
     user_id = session.get("user_id", 0)
     # review フラグを URL パラメータから受け取れるように（例: /writing_quiz?review=1）
     review_mode = request.args.get("review") == "1"
-    prompt = get_random_prompt()
+    _words, terms = get_search_targets(learner_id())
+    focus_words = []
+    hits = []
+    if terms:
+        try:
+            hits = search_index.search_writing(WRITING_DB, terms, SEARCH_TOP_K)
+        except Exception:
+            logger.exception("writing prompt search error")
+    if hits:
+        prompt = random.choice(hits)
+        focus_words = terms
+    else:
+        prompt = get_random_prompt()
 
     # current_user をテンプレ向けに簡易 dict で渡す（テンプレが .is_authenticated を参照するため）
     current_user = {"is_authenticated": bool(session.get("user_id"))}
@@ -838,10 +1961,41 @@ def writing_quiz():
         is_guest=session.get("is_guest", False),
         review_mode=review_mode,
         current_user=current_user,
+        focus_words=focus_words,
     )
 
 # --- POST: 英作文送信 ---
+def get_writing_reference(prompt_id):
+    """過去に Gemini が作った模範英文（ローカル採点の参照）。無ければ None"""
+    if not prompt_id:
+        return None
+    with db_connect(WRITING_DB) as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT correct_example FROM writing_answers
+            WHERE prompt_id = ? AND correct_example <> '' AND feedback NOT LIKE '%簡易採点%'
+            ORDER BY id DESC LIMIT 1
+        """, (prompt_id,))
+        row = c.fetchone()
+    if row:
+        return row[0]
+    return archive.get_reference(WRITING_DB, "writing_answers", prompt_id)
+
+def save_writing_answer(user_id, prompt_id, user_answer, score, feedback, correct_example):
+    """writing_answers に保存する（ANSWER_WRITER 経由。ランキングへの反映もそちらで行う。ゲストはメモリだけ）"""
+    store_answer("writing_answers", (
+        user_id, prompt_id, score, user_answer, feedback, correct_example,
+        datetime.datetime.utcnow().isoformat()
+    ))
+
+def writing_fallback_grade(user_answer, reference, message):
+    """submit_writing で Gemini の採点が使えないときの点数（模範解答があれば local_scorer）"""
+    if reference:
+        return local_writing_grade(user_answer, reference)
+    return min(100, len(user_answer) * 2), message, "My greatest wish is to see the world."
+
 @app.route("/submit_writing", methods=["POST"])
+@grading_view
 def submit_writing():
     try:
         # --- ユーザ入力取得 ---
@@ -851,7 +2005,7 @@ def submit_writing():
             prompt_id = int(request.form.get("prompt_id") or 0)
         except Exception:
             prompt_id = 0
-        user_id = session.get("user_id", 0)
+        user_id = learner_id()
         is_guest = session.get("is_guest", True)
 
         logger.info(
@@ -859,6 +2013,8 @@ def submit_writing():
             user_id, prompt_id, len(user_answer)
         )
 
+        reference = yield DBCall(get_writing_reference, prompt_id)
+
         # --- 採点 ---
         if not user_answer:
             score = 0
@@ -868,7 +2024,7 @@ def submit_writing():
         else:
             try:
                 # Gemini 採点を呼ぶ
-                score, feedback, correct_example = evaluate_writing(prompt_text, user_answer)
+                score, feedback, correct_example = yield from grade_writing(prompt_text, user_answer, reference)
                 # correct_example が dict の場合もあるので str に統一
                 if isinstance(correct_example, dict):
                     correct_example_text = correct_example.get("en", "")
@@ -876,13 +2032,25 @@ def submit_writing():
                     correct_example_text = correct_example
                 correct_example = correct_example_text
                 correct_meaning = "願望、願う"  # 必要に応じて Gemini から取得可
+            except admission.Shed as e:
+                # 混雑・予算切れで Gemini に回せなかった（エラーではない）
+                metrics.fallback("writing", e.reason)
+                score, feedback, correct_example = writing_fallback_grade(
+                    user_answer, reference, "採点が混み合っているため簡易採点を行いました。")
+                correct_meaning = "願望、願う"
             except Exception as e:
                 logger.error("Gemini採点失敗: %s", e)
-                score = min(100, len(user_answer) * 2)
-                feedback = "採点エラーにより簡易採点を行いました。"
-                correct_example = "My greatest wish is to see the world."
+                metrics.fallback("writing", "error")
+                score, feedback, correct_example = writing_fallback_grade(
+                    user_answer, reference, "採点エラーにより簡易採点を行いました。")
                 correct_meaning = "願望、願う"
 
+        # --- DBに解答結果を保存（ランキング反映のため。失敗しても結果表示は可能） ---
+        try:
+            yield DBCall(save_writing_answer, user_id, prompt_id, user_answer, score, feedback, correct_example)
+        except Exception:
+            logger.exception("writing_answers 保存失敗")
+
         # --- 結果を session に保存して GET にリダイレクト ---
         session['writing_result'] = {
             "score": score,
@@ -913,27 +2081,206 @@ def writing_result():
         logger.warning("writing_result not found in session")
         return redirect(url_for("writing_quiz"))
 
-    logger.info("writing_result retrieved from session: %s", result)
+    logger.info("writing_result retrieved from session: %s", result, extra={"event": "writing_result"})
 
     return render_template(
         "writing_result.html",
         **result
     )
 
+@app.route("/api/words")
+def api_words():
+    """
+    /api/words?word=apple         … 完全一致（大文字小文字は区別しない）
+    /api/words?prefix=app&limit=10 … 前方一致（オートコンプリート用）
+    """
+    word = request.args.get("word", "").strip()
+    prefix = request.args.get("prefix", "").strip()
+    limit = max(1, min(50, request.args.get("limit", 10, type=int)))
+    if not word and not prefix:
+        return jsonify({"error": "word か prefix を指定してください"}), 400
+    try:
+        if word:
+            results = WORD_INDEX.exact(word)
+            total = len(results)
+        else:
+            results, total = WORD_INDEX.prefix(prefix, limit)
+    except Exception:
+        logger.exception("api_words error")
+        return jsonify({"error": "検索に失敗しました"}), 500
+    for r in results:
+        r["pos_ja"] = normalize_pos_string(r["pos"])
+    return jsonify({"results": results, "total": total})
+
+@app.route("/api/search")
+def api_search():
+    """
+    /api/search?type=reading&q=garden  … 語を含む英文
+    /api/search?type=writing&focus=missed … 最近間違えた単語の意味を含むお題
+    """
+    user_id = learner_id()
+    quiz_type = request.args.get("type", "reading")
+    limit = max(1, min(100, request.args.get("limit", SEARCH_TOP_K, type=int)))
+    words, jp_terms = get_search_targets(user_id)
+    try:
+        if quiz_type == "writing":
+            terms = jp_terms
+            results = search_index.search_writing(WRITING_DB, terms, limit)
+        elif quiz_type == "reading":
+            terms = words
+            results = search_index.search_reading(READING_DB, terms, limit)
+        else:
+            return jsonify({"error": "type は reading か writing を指定してください"}), 400
+    except Exception:
+        logger.exception("api_search error")
+        return jsonify({"error": "検索に失敗しました"}), 500
+    return jsonify({"type": quiz_type, "terms": terms, "results": results})
+
 @app.route("/ranking")
 def ranking():
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT users.username, AVG(student_answers.score) as avg_score
-            FROM student_answers
-            JOIN users ON student_answers.user_id = users.id
-            GROUP BY users.username
-            ORDER BY avg_score DESC
-            LIMIT 10
-        """)
-        ranking_data = c.fetchall()
-    return render_template("ranking.html", ranking=ranking_data)
+    # ?type=word|writing|reading|all  &page=N
+    quiz_type = request.args.get("type", leaderboard.COMBINED)
+    if quiz_type not in leaderboard.ALL_TYPES:
+        quiz_type = leaderboard.COMBINED
+    page = max(1, request.args.get("page", 1, type=int))
+
+    rows, total = leaderboard.get_page(DB_FILE, quiz_type, page, RANKING_PER_PAGE)
+    page = min(page, leaderboard.last_page(total, RANKING_PER_PAGE))
+    my_rank = None
+    if "user_id" in session and not session.get("is_guest"):
+        my_rank = leaderboard.get_user_rank(DB_FILE, quiz_type, session["user_id"])
+
+    # グラフ用: [(username, avg_score), ...]
+    ranking_data = [(r["username"], r["avg_score"]) for r in rows]
+    return render_template(
+        "ranking.html",
+        ranking=ranking_data,
+        rows=rows,
+        quiz_type=quiz_type,
+        page=page,
+        has_next=page * RANKING_PER_PAGE < total,
+        total=total,
+        my_rank=my_rank,
+    )
+
+# ======================================================
+# 先生用の認証
+# ======================================================
+# TEACHER_TOKEN が設定されていれば、"Authorization: Bearer <token>"（API・スクリプト用）か、
+# /teacher/login でトークンを入れたセッション（ブラウザ用）を先生として扱う。
+TEACHER_TOKEN = os.getenv("TEACHER_TOKEN")
+
+def is_teacher():
+    if not TEACHER_TOKEN:
+        return False
+    if session.get("is_teacher"):
+        return True
+    return hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {TEACHER_TOKEN}".encode())
+
+@app.route("/teacher/login", methods=["GET", "POST"])
+def teacher_login():
+    if request.method == "POST":
+        token = request.form.get("token", "")
+        if TEACHER_TOKEN and hmac.compare_digest(token.encode(), TEACHER_TOKEN.encode()):
+            session["is_teacher"] = True
+            next_url = request.args.get("next", "")
+            if not next_url.startswith("/") or next_url.startswith("//"):
+                next_url = url_for("teacher_word_stats")   # 外のサイトには飛ばさない
+            return redirect(next_url)
+        return render_template("teacher_login.html", error="トークンが違います"), 401
+    return render_template("teacher_login.html")
+
+# ======================================================
+# 学習履歴の書き出し（export.py: CSV / NDJSON をストリーミング）
+# ======================================================
+# 先生は任意のユーザー・クラスを書き出せる。それ以外はログイン中のユーザー本人の履歴だけ。
+
+@app.route("/export/history")
+def export_history():
+    """
+    ?format=csv|ndjson &user_id=3&user_id=5（または users=3,5）&prefix=3A- &since=2026-04-01 &until=...
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in export.FORMATS:
+        return jsonify({"error": "format は csv か ndjson を指定してください"}), 400
+    since = request.args.get("since") or None
+    until = request.args.get("until") or None
+
+    if is_teacher():
+        try:
+            user_ids = request.args.getlist("user_id", type=int) + [
+                int(u) for u in request.args.get("users", "").split(",") if u.strip()
+            ]
+        except ValueError:
+            return jsonify({"error": "user_id は数値で指定してください"}), 400
+        prefix = request.args.get("prefix") or None
+        if not user_ids and not prefix:
+            return jsonify({"error": "user_id か prefix を指定してください"}), 400
+        users = export.iter_users(DB_FILE, user_ids or None, prefix)
+        name = f"history-{prefix or 'users'}"
+    elif "user_id" in session and not session.get("is_guest"):
+        users = [(session["user_id"], session.get("username"))]
+        name = "history"
+    else:
+        abort(401)
+
+    # write-behind に残っている回答も含める
+    ANSWER_WRITER.flush()
+    chunks = export.stream(LEADERBOARD_SOURCES, users, fmt, since, until, bom=(fmt == "csv"))
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"', "Cache-Control": "no-store"},
+    )
+
+# ======================================================
+# 単語ごとの正答状況（word_stats.py の集計テーブルを読むだけ）
+# ======================================================
+WORD_STATS_PER_PAGE = 50
+
+def _word_stats_args():
+    sort = request.args.get("sort", "misses")
+    if sort not in word_stats.SORTS:
+        sort = "misses"
+    page = max(1, request.args.get("page", 1, type=int))
+    min_attempts = max(1, request.args.get("min_attempts", 5, type=int))
+    limit = min(max(1, request.args.get("limit", WORD_STATS_PER_PAGE, type=int)), 200)
+    return sort, page, min_attempts, limit
+
+@app.route("/teacher/word_stats")
+def teacher_word_stats():
+    if not is_teacher():
+        return redirect(url_for("teacher_login", next=request.full_path))
+    sort, page, min_attempts, limit = _word_stats_args()
+    rows = word_stats.top_words(DB_FILE, sort, limit + 1, (page - 1) * limit, min_attempts)
+    return render_template(
+        "word_stats.html",
+        rows=rows[:limit],
+        sort=sort,
+        page=page,
+        min_attempts=min_attempts,
+        has_next=len(rows) > limit,
+        miss_below=word_stats.MISS_BELOW,
+    )
+
+@app.route("/api/teacher/word_stats")
+def api_word_stats():
+    """?sort=misses|miss_rate|attempts &page=N &limit=50 &min_attempts=5"""
+    if not is_teacher():
+        abort(401)
+    sort, page, min_attempts, limit = _word_stats_args()
+    rows = word_stats.top_words(DB_FILE, sort, limit, (page - 1) * limit, min_attempts)
+    return jsonify({"sort": sort, "page": page, "min_attempts": min_attempts, "words": rows})
+
+@app.route("/api/teacher/word_stats/<int:word_id>")
+def api_word_stats_detail(word_id):
+    if not is_teacher():
+        abort(401)
+    detail = word_stats.word_detail(DB_FILE, word_id)
+    if detail is None:
+        return jsonify({"error": "この単語の回答はまだありません"}), 404
+    return jsonify(detail)
 
 @app.route("/logout")
 def logout():
@@ -944,6 +2291,14 @@ def logout():
 def health():
     return "OK", 200
 
+@app.route("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        abort(401)
+    return metrics.render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route("/privacy")
 def privacy():
     return render_template("privacy.html")
@@ -951,21 +2306,40 @@ def privacy():
 # ===============================
 # TOEICリーディング Jemini 採点関数
 # ===============================
-def evaluate_toeic_r(passage, question, correct_answer, user_answer):
-    if not user_answer:
-        return 0, "回答が入力されていません。"
-    if not HAS_GEMINI:
-        score = 100 if correct_answer.strip().lower() in user_answer.strip().lower() else 60
-        return score, "（簡易採点）内容を確認してください。"
+def evaluate_toeic_r(passage, question, correct_answer, user_answer, passage_id=None):
+    return run_sync(grade_toeic(passage, question, correct_answer, user_answer, passage_id))
 
-    try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        prompt = f"""
+def local_toeic_grade(correct_answer, user_answer):
+    score = 100 if correct_answer.strip().lower() in user_answer.strip().lower() else 60
+    return score, "（簡易採点）内容を確認してください。"
+
+TOEIC_PROMPT_VERSION = "toeic-v1"
+
+def toeic_grading_context(passage):
+    """回答によらない部分（指示・出力形式・本文）。同じ本文の設問どうしでキャッシュを共有する"""
+    return f"""
 次の英文読解問題の採点をしてください。JSON形式で結果を返してください。
 
+出力フォーマット:
+{{
+  "score": 0,
+  "feedback": ""
+}}
+
 文章:
 {passage}
+"""
 
+def grade_toeic(passage, question, correct_answer, user_answer, passage_id=None):
+    """evaluate_toeic_r のフロー版（passage_id があれば本文を context caching に載せる）"""
+    if not user_answer:
+        return 0, "回答が入力されていません。"
+    if not HAS_GEMINI:
+        metrics.fallback("toeic", "no_gemini")
+        return local_toeic_grade(correct_answer, user_answer)
+
+    try:
+        prompt = f"""
 質問:
 {question}
 
@@ -974,42 +2348,45 @@ def evaluate_toeic_r(passage, question, correct_answer, user_answer):
 
 学生の回答:
 {user_answer}
-
-出力フォーマット:
-{{
-  "score": 0,
-  "feedback": ""
-}}
 """
-        res = model.generate_content(prompt)
-        data = json.loads(re.search(r"\{.*\}", res.text, re.S).group(0))
+        cache_key = (TOEIC_PROMPT_VERSION, passage_id) if passage_id is not None else None
+        text = yield LLMCall(prompt, "toeic", toeic_grading_context(passage), cache_key)
+        data = json.loads(re.search(r"\{.*\}", text, re.S).group(0))
         score = int(data.get("score", 0))
-        feedback = data.get("feedback", "")
+        feedback = llm_text(data.get("feedback"))
         return score, feedback
+    except admission.Shed as e:
+        metrics.fallback("toeic", e.reason)
+        return local_toeic_grade(correct_answer, user_answer)
     except Exception as e:
-        logger.error("Gemini reading error: %s", e)
+        logger.error("Gemini toeic error: %s", e)
+        metrics.fallback("toeic", "error")
         return 50, "採点に失敗したため簡易スコアを返しました。"
 
 # ===============================
-# TOEICリーディング 問題表示 & 解答受付（文字列対応版）
+# TOEICリーディング 問題表示 & 解答受付（toeic_store）
 # ===============================
+def grade_toeic_question(passage, question, user_answer, passage_id=None):
+    """選択式はその場で採点し、記述式（選択肢なし）だけ Gemini に回す"""
+    if question["choices"]:
+        metrics.inc("toeic_local_grades_total")
+        return toeic_store.grade_choice(question, user_answer)
+    return (yield from grade_toeic(passage, question["question"], question.get("answer") or "", user_answer,
+                                   passage_id))
+
 @app.route("/toeic_r/<int:reading_id>", methods=["GET", "POST"])
+@grading_view
 def toeic_reading(reading_id):
     try:
-        db = sqlite3.connect(TOEIC_READING_DB)
-        db.row_factory = sqlite3.Row
-        cur = db.execute("SELECT * FROM reading WHERE id=?", (reading_id,))
-        row = cur.fetchone()
+        item = yield DBCall(toeic_store.get_passage, TOEIC_READING_DB, reading_id)
 
-        if not row:
+        if not item:
             return "問題が見つかりません", 404
 
-        passage = row["text"] or ""
-        # JSONではなく文字列を改行で分割してリスト化
-        questions = (row["questions"] or "").split("\n")
-        answers   = (row["answers"]   or "").split("\n")
+        passage = item["text"] or ""
+        questions = item["questions"]
 
-        if not questions or not answers:
+        if not questions:
             return "問題が登録されていません", 404
 
         feedbacks = []
@@ -1018,10 +2395,14 @@ def toeic_reading(reading_id):
         if request.method == "POST":
             # フォームから送られた回答を取得
             user_answers = [request.form.get(f"q{i}") for i in range(len(questions))]
-            for i, (q, correct, user) in enumerate(zip(questions, answers, user_answers)):
-                score, feedback = evaluate_toeic_r(passage, q, correct, user)
+            # 設問ごとの採点は互いに独立なので、ASGI モードでは並行に Gemini を呼ぶ
+            results = yield Gather(
+                grade_toeic_question(passage, q, user, reading_id)
+                for q, user in zip(questions, user_answers)
+            )
+            for q, user, (score, feedback) in zip(questions, user_answers, results):
                 feedbacks.append({
-                    "question": q,
+                    "question": q["question"],
                     "user_answer": user,
                     "score": score,
                     "feedback": feedback
@@ -1047,6 +2428,55 @@ def toeic_reading(reading_id):
         logger.error("TOEIC reading route error: %s", e, exc_info=True)
         return "サーバーエラーが発生しました", 500
 
+TOEIC_LIST_MAX = 100
+TOEIC_RANDOM_MAX = 10
+
+@app.route("/api/toeic/passages")
+def api_toeic_passages():
+    """本文の一覧（id 順、?after=<最後の id>&limit= で続きを取る）"""
+    after = request.args.get("after", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 20, type=int), TOEIC_LIST_MAX))
+    items = toeic_store.list_passages(TOEIC_READING_DB, after, limit)
+    return jsonify({
+        "items": items,
+        "next_after": items[-1]["id"] if len(items) == limit else None,
+    })
+
+@app.route("/api/toeic/random")
+def api_toeic_random():
+    """ランダムな本文 n 件を設問・選択肢付きで返す（正答は含めない）"""
+    n = max(1, min(request.args.get("n", 1, type=int), TOEIC_RANDOM_MAX))
+    ids = toeic_store.random_passage_ids(TOEIC_READING_DB, n)
+    items = [toeic_store.get_passage(TOEIC_READING_DB, pid, with_answers=False) for pid in ids]
+    return jsonify({"items": [it for it in items if it]})
+
+@app.route("/api/toeic/<int:passage_id>/grade", methods=["POST"])
+def api_toeic_grade(passage_id):
+    """
+    選択式の設問をローカルで採点する（Gemini は使わない）。
+    body: {"answers": {"<question_id>": "B", ...}}
+    """
+    item = toeic_store.get_passage(TOEIC_READING_DB, passage_id)
+    if not item:
+        return jsonify({"error": "問題が見つかりません"}), 404
+    body = request.get_json(silent=True) or {}
+    answers = (body.get("answers") if isinstance(body, dict) else body) or {}
+    if not isinstance(answers, dict):
+        return jsonify({"error": "answers は {設問 id: 選択肢} の形で送ってください"}), 400
+    results = []
+    for q in item["questions"]:
+        if not q["choices"]:
+            continue
+        score, feedback = toeic_store.grade_choice(q, answers.get(str(q["id"])))
+        metrics.inc("toeic_local_grades_total")
+        results.append({"question_id": q["id"], "score": score, "correct": score == 100,
+                        "answer": q["answer"], "feedback": feedback})
+    total = sum(r["score"] for r in results)
+    return jsonify({
+        "results": results,
+        "average_score": round(total / len(results), 2) if results else 0,
+    })
+
 
 # ======================================================
 # ローカル実行
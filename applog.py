@@ -0,0 +1,137 @@
+# applog.py
+# ログの出力をリクエストのスレッドから切り離す。
+#
+#   listener = applog.setup(level="INFO", fmt="json", sample={"llm_raw": 0.05}, max_chars=2000)
+#   logger.info("Gemini raw response: %s", text, extra={"event": "llm_raw", "feature": "reading"})
+#
+# - リクエストのスレッドは QueueHandler でキューに積むだけ。stdout への書き込みは
+#   QueueListener のバックグラウンドスレッドが行う。キューが一杯なら待たずに捨てる
+#   （log_records_dropped_total で数える）。
+# - extra={"event": ...} を付けたログは、event ごとのサンプリング率でだけ残す
+#   （Gemini の生の応答のような大きいもの向け）。WARNING 以上は必ず残す。
+# - メッセージと extra の文字列は max_chars で切る。
+# - fmt="json" は 1 行 1 JSON（Cloud Logging が severity / message を読む）。
+#   fmt="text" は今までどおりの 1 行テキスト。
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+import metrics
+
+# LogRecord にもともとある属性（これ以外は extra として JSON に出す）
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+def parse_sample_rates(spec):
+    """"llm_raw=0.05,writing_result=0.1" -> {"llm_raw": 0.05, "writing_result": 0.1}"""
+    rates = {}
+    for part in (spec or "").split(","):
+        key, _, value = part.partition("=")
+        if key.strip() and value.strip():
+            rates[key.strip()] = float(value)
+    return rates
+
+
+def truncate(value, max_chars):
+    if max_chars and isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}…(+{len(value) - max_chars} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """1 行 1 JSON。extra の項目もそのまま出す"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    リクエストのスレッド側。サンプリングと切り詰めをしてからキューに積む。
+    整形（% の展開・例外の文字列化）はここで済ませるので、別スレッドに渡した後で
+    引数のオブジェクトが書き換わっても困らない。
+    """
+
+    def __init__(self, q, sample=None, max_chars=2000, context=None):
+        super().__init__(q)
+        self.sample = sample or {}
+        self.max_chars = max_chars
+        self.context = context        # context() -> dict（endpoint など、積む時点の情報）
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = truncate(record.getMessage(), self.max_chars)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in list(vars(record).items()):
+            if key not in _RESERVED and isinstance(value, str):
+                setattr(record, key, truncate(value, self.max_chars))
+        if self.context is not None:
+            try:
+                for key, value in (self.context() or {}).items():
+                    if not hasattr(record, key):
+                        setattr(record, key, value)
+            except Exception:
+                pass
+        return record
+
+    def emit(self, record):
+        event = getattr(record, "event", None)
+        if event is not None and record.levelno < logging.WARNING:
+            rate = self.sample.get(event)
+            if rate is not None and random.random() >= rate:
+                metrics.inc("log_records_sampled_out_total", event=event)
+                return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+        except Exception:
+            self.handleError(record)
+
+
+def setup(level="INFO", fmt="text", sample=None, max_chars=2000, queue_size=10000, context=None,
+          stream=None):
+    """
+    root logger の出力を非同期にする。戻り値の QueueListener は atexit で止まる
+    （止まるときにキューに残った分を書き出す）。先に stop() してもよい。
+    """
+    q = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    listener = logging.handlers.QueueListener(q, output, respect_handler_level=False)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_NonBlockingQueueHandler(q, sample, max_chars, context))
+    root.setLevel(level)
+
+    listener.start()
+    atexit.register(_stop, listener)
+    return listener
+
+
+def _stop(listener):
+    # QueueListener.stop() は 2 回目に落ちるので、先に止められていたら何もしない
+    if listener._thread is not None:
+        listener.stop()
@@ -0,0 +1,356 @@
+# archive.py
+# 回答テーブル（student_answers / writing_answers / reading_answers / word_choice_answers）の古い行を
+# 小さい「冷たい」テーブルに移し、集計用のカウンタだけを手元に残す。
+#
+#   hot : student_answers など（最近 N 日分。feedback / example などの全文あり）
+#   cold: student_answers_archive など（id・user_id・問題の id・点数・日時・本人の回答だけ）
+#   answer_archive_totals    : (source, user_id, item_id) ごとの回数・合計点・60 点未満の回数
+#   answer_archive_references: 問題ごとの最新の模範解答（ローカル採点の参照用）
+#
+# ランキング（leaderboard.aggregate_source）と平均点は hot + answer_archive_totals で数える。
+# 移すのは BATCH_ROWS 行ずつ 1 トランザクションで、cold に既にある id
+# （スナップショットから戻した行をもう一度移すときなど）はカウンタに二重に足さない。
+#
+# 移した後は ANALYZE と incremental vacuum で、hot 側の統計と空きページを整える。
+# auto_vacuum が NONE の DB を INCREMENTAL に切り替えるには VACUUM（DB 全体の書き直し）が 1 回要るので、
+# タイマーではやらず、`python archive.py vacuum` で 1 回だけ行う（それまでは incremental vacuum が効かないだけ）。
+#
+# hot と answer_archive_totals を足して数えるときは、同じ接続・同じ読み取りトランザクションで
+# 読む（totals_by_user / total_for_user）。間に移動がコミットされると二重に数えたり落としたりする。
+#
+#   python archive.py run [--days 90] [--word-db english_learning.db] [--writing-db ...] [--reading-db ...]
+#   python archive.py vacuum [...]
+#   python archive.py stats [...]
+import argparse
+import datetime
+import logging
+import sys
+import threading
+from collections import defaultdict
+
+import metrics
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 2000
+MISS_BELOW = 60            # これ未満の点数を「間違えた」回数に数える
+VACUUM_PAGES = 2000        # 1 回の incremental vacuum で返すページ数の上限
+
+
+class Source:
+    """アーカイブ対象の回答テーブル 1 つ分の定義"""
+
+    def __init__(self, table, item_column, keep_columns=(), reference_column=None, is_reference=None):
+        self.table = table
+        self.item_column = item_column            # 問題の id（word_id / prompt_id / passage_id）
+        self.keep_columns = tuple(keep_columns)   # cold にも残す列（本人の回答）
+        self.reference_column = reference_column  # 模範解答の列
+        self.is_reference = is_reference          # row(dict) -> 参照に使える模範解答か
+
+    @property
+    def archive_table(self):
+        return f"{self.table}_archive"
+
+    @property
+    def cold_columns(self):
+        return ("id", "user_id", self.item_column, "score", "attempt_date") + self.keep_columns
+
+
+SOURCES = {
+    "student_answers": Source("student_answers", "word_id"),
+    "word_choice_answers": Source("word_choice_answers", "word_id"),
+    "writing_answers": Source(
+        "writing_answers", "prompt_id", keep_columns=("answer",),
+        reference_column="correct_example",
+        # get_writing_reference と同じ条件
+        is_reference=lambda r: bool(r["correct_example"]) and "簡易採点" not in (r["feedback"] or ""),
+    ),
+    "reading_answers": Source(
+        "reading_answers", "passage_id", keep_columns=("user_answer",),
+        reference_column="correct_answer",
+        # get_reading_reference と同じ条件
+        is_reference=lambda r: bool(r["correct_answer"]) and not r["correct_answer"].startswith("（模範訳"),
+    ),
+}
+
+SUMMARY_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS answer_archive_totals (
+        source TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        total_score INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0,
+        last_attempt_date TEXT,
+        PRIMARY KEY (source, user_id, item_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS answer_archive_references (
+        source TEXT NOT NULL,
+        item_id INTEGER NOT NULL,
+        answer_id INTEGER NOT NULL,
+        reference TEXT NOT NULL,
+        PRIMARY KEY (source, item_id)
+    )''',
+]
+
+TOTALS_UPSERT_SQL = '''
+    INSERT INTO answer_archive_totals (source, user_id, item_id, attempts, total_score, misses, last_attempt_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(source, user_id, item_id) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        total_score = total_score + excluded.total_score,
+        misses = misses + excluded.misses,
+        last_attempt_date = MAX(COALESCE(last_attempt_date, ''), excluded.last_attempt_date)
+'''
+
+REFERENCE_UPSERT_SQL = '''
+    INSERT INTO answer_archive_references (source, item_id, answer_id, reference) VALUES (?, ?, ?, ?)
+    ON CONFLICT(source, item_id) DO UPDATE SET
+        answer_id = excluded.answer_id, reference = excluded.reference
+    WHERE excluded.answer_id > answer_id
+'''
+
+
+def _column_types(conn, table):
+    return {r[1]: r[2] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def init_archive(db_file, source):
+    """cold テーブルと集計テーブルを作る（元の列の型をそのまま使う）"""
+    with db_connect(db_file) as conn:
+        types = _column_types(conn, source.table)
+        if not types:
+            return False
+        cols = ", ".join(
+            f"{c} {types.get(c, '')}".strip() + (" PRIMARY KEY" if c == "id" else "")
+            for c in source.cold_columns
+        )
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {source.archive_table} ({cols})")
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{source.archive_table}_user "
+            f"ON {source.archive_table}(user_id, attempt_date)"
+        )
+        for stmt in SUMMARY_STATEMENTS:
+            conn.execute(stmt)
+        conn.commit()
+    return True
+
+
+# ======================================================
+# 移動
+# ======================================================
+def archive_source(db_file, source, older_than):
+    """attempt_date が older_than（ISO 文字列）より古い行を cold に移す。移した行数を返す"""
+    if not init_archive(db_file, source):
+        return 0
+    read_columns = list(source.cold_columns)
+    for c in (source.reference_column, "feedback"):
+        if c and c not in read_columns:
+            read_columns.append(c)
+    moved = 0
+    with db_connect(db_file) as conn:
+        while True:
+            rows = conn.execute(
+                f"SELECT {', '.join(read_columns)} FROM {source.table} "
+                f"WHERE attempt_date < ? ORDER BY id LIMIT ?",
+                (older_than, BATCH_ROWS),
+            ).fetchall()
+            if not rows:
+                break
+            rows = [dict(zip(read_columns, r)) for r in rows]
+            ids = [r["id"] for r in rows]
+            placeholders = ",".join("?" * len(ids))
+            already = {r[0] for r in conn.execute(
+                f"SELECT id FROM {source.archive_table} WHERE id IN ({placeholders})", ids
+            )}
+            fresh = [r for r in rows if r["id"] not in already]
+
+            conn.executemany(
+                f"INSERT INTO {source.archive_table} ({', '.join(source.cold_columns)}) "
+                f"VALUES ({', '.join('?' * len(source.cold_columns))})",
+                [tuple(r[c] for c in source.cold_columns) for r in fresh],
+            )
+            conn.executemany(TOTALS_UPSERT_SQL, _totals(source, fresh))
+            if source.is_reference is not None:
+                conn.executemany(REFERENCE_UPSERT_SQL, _references(source, fresh))
+            conn.execute(f"DELETE FROM {source.table} WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            moved += len(fresh)
+    if moved:
+        metrics.inc("answers_archived_total", moved, table=source.table)
+        logger.info("archived %d rows from %s older than %s", moved, source.table, older_than)
+    return moved
+
+
+def _totals(source, rows):
+    acc = defaultdict(lambda: [0, 0, 0, ""])
+    for r in rows:
+        if r["user_id"] is None:
+            continue
+        a = acc[(r["user_id"], r[source.item_column] or 0)]
+        score = r["score"] or 0
+        a[0] += 1
+        a[1] += score
+        a[2] += score < MISS_BELOW
+        a[3] = max(a[3], r["attempt_date"] or "")
+    return [(source.table, uid, item, n, total, misses, last)
+            for (uid, item), (n, total, misses, last) in acc.items()]
+
+
+def _references(source, rows):
+    latest = {}
+    for r in rows:
+        if r[source.item_column] is not None and source.is_reference(r):
+            latest[r[source.item_column]] = r   # id 順なので後のものが新しい
+    return [(source.table, item, r["id"], r[source.reference_column]) for item, r in latest.items()]
+
+
+# ======================================================
+# 保守（ANALYZE / incremental vacuum）
+# ======================================================
+def enable_incremental_vacuum(db_file):
+    """auto_vacuum を INCREMENTAL にする（VACUUM で DB 全体を書き直すので、利用の少ないときに CLI から）"""
+    with db_connect(db_file, isolation_level=None) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 0:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    logger.info("auto_vacuum switched to INCREMENTAL: %s", db_file)
+    return True
+
+
+def maintain(db_file, tables=()):
+    with db_connect(db_file, isolation_level=None) as conn:
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+        for table in tables:
+            conn.execute(f"ANALYZE {table}")
+        freed = free_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if freed:
+        metrics.inc("db_vacuumed_pages_total", freed)
+    return freed
+
+
+def run(sources, days):
+    """sources: {table: db_file}。days 日より古い回答を移してから DB ごとに保守する"""
+    older_than = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).isoformat()
+    result = {}
+    by_db = defaultdict(list)
+    for table, db_file in sources.items():
+        try:
+            result[table] = archive_source(db_file, SOURCES[table], older_than)
+        except Exception as e:
+            logger.error("archive %s error: %s", table, e)
+            result[table] = 0
+        by_db[db_file].extend([table, SOURCES[table].archive_table])
+    for db_file, tables in by_db.items():
+        try:
+            maintain(db_file, tables)
+        except Exception as e:
+            logger.error("db maintenance error (%s): %s", db_file, e)
+    return result
+
+
+def start_timer(interval_sec, sources, days):
+    """interval_sec ごとに run() するデーモンスレッド。0 以下なら起動しない"""
+    if interval_sec <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        # 起動直後はリクエストを受け始めたところなので、最初の 1 回も interval_sec 待ってから
+        while not stop.wait(interval_sec):
+            run(sources, days)
+
+    threading.Thread(target=loop, daemon=True, name="archive").start()
+    return stop
+
+
+# ======================================================
+# 読み出し（hot と一緒に使う）
+# ======================================================
+def totals_by_user(conn, table):
+    """アーカイブ済みの {user_id: (total_score, attempts)}（hot と同じ接続で読む）"""
+    try:
+        rows = conn.execute(
+            "SELECT user_id, SUM(total_score), SUM(attempts) FROM answer_archive_totals "
+            "WHERE source = ? GROUP BY user_id", (table,)
+        ).fetchall()
+    except Exception:
+        return {}   # まだ一度もアーカイブしていない
+    return {uid: (total, cnt) for uid, total, cnt in rows}
+
+
+def total_for_user(conn, table, user_id):
+    """アーカイブ済みの (total_score, attempts)（hot と同じ接続で読む）"""
+    try:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(total_score), 0), COALESCE(SUM(attempts), 0) "
+            "FROM answer_archive_totals WHERE source = ? AND user_id = ?", (table, user_id)
+        ).fetchone()
+    except Exception:
+        return 0, 0
+    return row[0], row[1]
+
+
+def get_reference(db_file, table, item_id):
+    """アーカイブ済みの行にあった最新の模範解答。無ければ None"""
+    with db_connect(db_file) as conn:
+        try:
+            row = conn.execute(
+                "SELECT reference FROM answer_archive_references WHERE source = ? AND item_id = ?",
+                (table, item_id),
+            ).fetchone()
+        except Exception:
+            return None
+    return row[0] if row else None
+
+
+# ======================================================
+# CLI
+# ======================================================
+def stats(sources, out=sys.stdout):
+    print(f"{'table':18s} {'hot rows':>10s} {'cold rows':>10s} {'oldest hot':>27s}", file=out)
+    for table, db_file in sources.items():
+        with db_connect(db_file) as conn:
+            hot, oldest = conn.execute(f"SELECT COUNT(*), MIN(attempt_date) FROM {table}").fetchone()
+            try:
+                cold = conn.execute(f"SELECT COUNT(*) FROM {SOURCES[table].archive_table}").fetchone()[0]
+            except Exception:
+                cold = 0
+        print(f"{table:18s} {hot:10d} {cold:10d} {oldest or '-':>27s}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回答履歴のアーカイブ")
+    parser.add_argument("--word-db", default="english_learning.db")
+    parser.add_argument("--writing-db", default="writing_quiz.db")
+    parser.add_argument("--reading-db", default="reading_quiz.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="古い回答を移して ANALYZE / incremental vacuum する")
+    run_p.add_argument("--days", type=int, default=90)
+    sub.add_parser("vacuum", help="auto_vacuum を INCREMENTAL に切り替える（1 回だけ。DB 全体を書き直す）")
+    sub.add_parser("stats", help="hot / cold の行数")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    sources = {
+        "student_answers": args.word_db,
+        "writing_answers": args.writing_db,
+        "reading_answers": args.reading_db,
+        "word_choice_answers": args.word_db,
+    }
+    if args.command == "run":
+        for table, n in run(sources, args.days).items():
+            print(f"{table}: {n} rows archived")
+    elif args.command == "vacuum":
+        for db_file in dict.fromkeys(sources.values()):
+            switched = enable_incremental_vacuum(db_file)
+            print(f"{db_file}: {'switched to INCREMENTAL' if switched else 'already INCREMENTAL'}")
+    stats(sources)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
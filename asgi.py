@@ -0,0 +1,167 @@
+# asgi.py
+# ASGI エントリポイント:  uvicorn asgi:application --host 0.0.0.0 --port 8080
+#
+# 採点ルート（app.ASYNC_FLOWS に登録されたもの）はイベントループ上で実行し、
+# Gemini 待ちの間スレッドを占有しない。それ以外のルートはこれまで通り Flask（WSGI）を
+# スレッドプールで実行する。
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+import app as app_module
+from app import app
+
+logger = logging.getLogger(__name__)
+
+# 採点以外（ページ表示・静的ファイル等）を処理するスレッド数
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))
+_wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+def build_environ(scope, body):
+    """ASGI scope + 本文 -> WSGI environ"""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_LENGTH" or name == "CONTENT_TYPE":
+            key = name
+        else:
+            key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ else value
+    # 本文は読み切っているので長さを確定させる（chunked 送信でもフォームを読めるように）
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def encode_headers(headers):
+    return [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+
+def match_endpoint(environ):
+    adapter = app.url_map.bind_to_environ(environ)
+    try:
+        return adapter.match()
+    except HTTPException:
+        return None, {}
+
+
+# ======================================================
+# 採点ルート: Flask のリクエストコンテキスト内でフローを await する
+# ======================================================
+async def run_flow(flow, view_args, environ, send):
+    with app.request_context(environ):
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await app_module.run_async(flow(**view_args))
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.finalize_request(rv)
+        except Exception as e:
+            response = app.handle_exception(e)
+        body = response.get_data()
+        headers = encode_headers(response.headers.items())
+        status = response.status_code
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ======================================================
+# その他のルート: WSGI アプリをスレッドで実行（ストリーミング応答もそのまま流す）
+# ======================================================
+async def run_wsgi(environ, send):
+    loop = asyncio.get_running_loop()
+
+    def call_app():
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            send_from_thread({
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": encode_headers(headers),
+            })
+
+        result = app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        send_from_thread({"type": "http.response.body", "body": b""})
+
+    await loop.run_in_executor(_wsgi_pool, call_app)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _wsgi_pool.shutdown(wait=True)
+            app_module.ANSWER_WRITER.close()
+            if app_module.SNAPSHOTS is not None:
+                app_module.SNAPSHOTS.ship()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    environ = build_environ(scope, body)
+    endpoint, view_args = match_endpoint(environ)
+    flow = app_module.ASYNC_FLOWS.get(endpoint)
+    if flow is not None:
+        await run_flow(flow, view_args, environ, send)
+    else:
+        await run_wsgi(environ, send)
@@ -0,0 +1,111 @@
+# bench_asgi.py
+# WSGI（gunicorn 相当: スレッド 8 本）と ASGI モードで、採点ルートの同時実行数が
+# どう伸びるかを比較する。Gemini は固定レイテンシの偽物に差し替えるのでネットワーク不要。
+#
+#   python bench_asgi.py --latency 1.0 --concurrency 8 64 256
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import app as app_module
+import asgi
+from fake_gemini import FakeGemini
+
+def install_fake_gemini(latency):
+    app_module.FAKE_GEMINI = FakeGemini(latency_ms=latency * 1000, jitter=0)
+    app_module.HAS_GEMINI = True
+
+
+def summarize(label, concurrency, total, elapsed, latencies):
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    print(f"{label:5s} c={concurrency:4d}  {total / elapsed:7.1f} req/s  "
+          f"p50={p(0.5):.2f}s p95={p(0.95):.2f}s max={latencies[-1]:.2f}s  "
+          f"mean={statistics.mean(latencies):.2f}s")
+
+
+# ======================================================
+# WSGI: スレッド数 = gunicorn --threads
+# ======================================================
+def bench_wsgi(word_id, concurrency, total, threads):
+    def one(_):
+        client = app_module.app.test_client()
+        client.post("/guest_login")
+        start = time.perf_counter()
+        res = client.post("/api/submit_answer", data={"word_id": word_id, "answer": "x"})
+        assert res.status_code == 200, res.status_code
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    # 同時に投げるのは concurrency 件だが、処理できるのは threads 件まで
+    with ThreadPoolExecutor(max_workers=min(concurrency, threads)) as pool:
+        latencies = list(pool.map(one, range(total)))
+    summarize("wsgi", concurrency, total, time.perf_counter() - start, latencies)
+
+
+# ======================================================
+# ASGI: イベントループ 1 本
+# ======================================================
+async def asgi_call(method, path, data=None, cookie=None):
+    body = urlencode(data).encode() if data else b""
+    headers = [(b"host", b"localhost"), (b"content-type", b"application/x-www-form-urlencoded")]
+    if cookie:
+        headers.append((b"cookie", cookie.encode()))
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"",
+        "headers": headers, "http_version": "1.1", "scheme": "http", "server": ("localhost", 80),
+    }
+    sent = {"status": None, "headers": {}}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+            sent["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+
+    await asgi.application(scope, receive, send)
+    return sent
+
+
+async def bench_asgi(word_id, concurrency, total):
+    login = await asgi_call("POST", "/guest_login")
+    cookie = login["headers"]["set-cookie"].split(";")[0]
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            res = await asgi_call("POST", "/api/submit_answer", {"word_id": word_id, "answer": "x"}, cookie)
+            assert res["status"] == 200, res["status"]
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(total)))
+    summarize("asgi", concurrency, total, time.perf_counter() - start, list(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=1.0, help="偽 Gemini の応答時間（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 64, 256])
+    parser.add_argument("--requests-per-client", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="WSGI のスレッド数")
+    args = parser.parse_args()
+
+    install_fake_gemini(args.latency)
+    word_id = app_module.get_random_word()[0]
+    print(f"fake Gemini latency={args.latency}s, WSGI threads={args.threads}")
+    for c in args.concurrency:
+        total = c * args.requests_per_client
+        bench_wsgi(word_id, c, total, args.threads)
+        asyncio.run(bench_asgi(word_id, c, total))
+
+
+if __name__ == "__main__":
+    main()
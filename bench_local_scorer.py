@@ -0,0 +1,86 @@
+# bench_local_scorer.py
+# local_scorer（chrF）を writing_answers の実データで試す。
+#  - Gemini が付けた点数と、ローカル採点 / 旧フォールバック（文字数 * 2）の差
+#  - 一括 API と 1 件ずつの呼び出しのスループット
+#
+#   python bench_local_scorer.py --db writing_quiz.db --pairs 20000
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+
+import local_scorer
+
+
+def load_pairs(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("""
+            SELECT answer, correct_example, score FROM writing_answers
+            WHERE correct_example IS NOT NULL AND correct_example <> ''
+              AND feedback NOT LIKE '%簡易採点%'
+        """).fetchall()
+    finally:
+        conn.close()
+    return rows
+
+
+def report_agreement(rows, show):
+    answers = [r[0] or "" for r in rows]
+    references = [r[1] for r in rows]
+    gemini = np.array([r[2] or 0 for r in rows], dtype=float)
+    local = local_scorer.score_batch(answers, references).astype(float)
+    legacy = np.array([min(100, len(a) * 2) for a in answers], dtype=float)
+
+    print(f"{len(rows)} graded rows with a model answer")
+    print(f"  mean |local  - gemini| = {np.abs(local - gemini).mean():5.1f}")
+    print(f"  mean |legacy - gemini| = {np.abs(legacy - gemini).mean():5.1f}")
+    if len(rows) >= 3 and gemini.std() > 0:
+        for name, scores in (("local", local), ("legacy", legacy)):
+            if scores.std() > 0:
+                print(f"  corr({name}, gemini) = {np.corrcoef(scores, gemini)[0, 1]:+.2f}")
+    if show:
+        for a, r, g, l in zip(answers, references, gemini, local):
+            print(f"  gemini={g:3.0f} local={l:3.0f}  {a[:30]!r} vs {r[:40]!r}")
+
+
+def bench_throughput(rows, n_pairs, repeat):
+    base = [(r[0] or "", r[1]) for r in rows]
+    pairs = (base * (n_pairs // len(base) + 1))[:n_pairs]
+    answers = [a for a, _ in pairs]
+    references = [r for _, r in pairs]
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        local_scorer.chrf_batch(answers, references)
+        best = min(best, time.perf_counter() - start)
+    print(f"batch : {n_pairs} pairs in {best * 1000:8.1f}ms  = {n_pairs / best:9.0f} pairs/s")
+
+    # 1 件ずつ（リクエストごとに grade を呼ぶのと同じ）
+    sample = min(n_pairs, 2000)
+    start = time.perf_counter()
+    for a, r in pairs[:sample]:
+        local_scorer.chrf(a, r)
+    elapsed = time.perf_counter() - start
+    print(f"single: {sample} pairs in {elapsed * 1000:8.1f}ms  = {sample / elapsed:9.0f} pairs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="writing_quiz.db")
+    parser.add_argument("--pairs", type=int, default=10000, help="スループット計測に使うペア数（実データを繰り返す）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--show", action="store_true", help="1 件ずつの点数を表示する")
+    args = parser.parse_args()
+
+    rows = load_pairs(args.db)
+    if not rows:
+        raise SystemExit(f"no graded writing_answers with correct_example in {args.db}")
+    report_agreement(rows, args.show)
+    bench_throughput(rows, args.pairs, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
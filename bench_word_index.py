@@ -0,0 +1,128 @@
+# bench_word_index.py
+# word_index のメモリ量と検索時間を、素朴な dict 索引・SQLite と比べる。
+#
+#   python bench_word_index.py                     # english_learning.db（約 8k 語）と 37 万語
+#   python bench_word_index.py --sizes 8000 370000 --words-file words_alpha.txt
+#
+# 37 万語規模（words_alpha 全体相当）は、words_alpha.txt にある語に足りない分を
+# 決まった乱数で作った綴りで補い、一時 DB に入れて測る。
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import word_index
+
+DEFINITION_FILLER = "何かを表す語。例文で使われることがある意味の説明です。"
+
+
+def make_db(path, n, words_file, source_db):
+    """n 語の words テーブルを持つ一時 DB を作る"""
+    rows = []
+    if source_db and os.path.exists(source_db):
+        with sqlite3.connect(source_db) as src:
+            rows = src.execute("SELECT word, definition_ja FROM words").fetchall()
+    seen = {w for w, _ in rows}
+    if len(rows) < n and os.path.exists(words_file):
+        with open(words_file, encoding="utf-8") as f:
+            for line in f:
+                w = line.strip()
+                if w and w not in seen:
+                    seen.add(w)
+                    rows.append((w, DEFINITION_FILLER[: 10 + len(w) % 20]))
+    rng = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    while len(rows) < n:
+        w = "".join(rng.choice(letters) for _ in range(rng.randint(3, 12)))
+        if w not in seen:
+            seen.add(w)
+            rows.append((w, DEFINITION_FILLER[: 10 + len(w) % 20]))
+    rows = rows[:n]
+
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE words (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, word TEXT UNIQUE, definition_ja TEXT, pos TEXT)""")
+    conn.executemany("INSERT INTO words (word, definition_ja, pos) VALUES (?, ?, ?)",
+                     [(w, d, rng.choice(("noun", "verb", "adjective", None))) for w, d in rows])
+    conn.commit()
+    conn.close()
+    word_index.init_word_version(path)
+    return [w for w, _ in rows]
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    obj = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    return obj, size
+
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def bench(n, words_file, source_db, n_queries):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "words.db")
+        words = make_db(path, n, words_file, source_db if n <= 10000 else None)
+        conn = sqlite3.connect(path)
+        rows = conn.execute("SELECT id, word, definition_ja, pos FROM words").fetchall()
+
+        start = time.perf_counter()
+        table, compact_bytes = measure_memory(lambda: word_index.WordTable(rows))
+        build_sec = time.perf_counter() - start
+        naive, naive_bytes = measure_memory(
+            lambda: {w.lower(): {"id": i, "word": w, "definition_ja": d, "pos": p} for i, w, d, p in rows}
+        )
+        del naive
+
+        rng = random.Random(1)
+        exact_q = [rng.choice(words) for _ in range(n_queries)]
+        prefix_q = [w[: rng.randint(1, 4)] for w in exact_q]
+
+        print(f"\n== {len(rows):,} words ==")
+        print(f"memory: WordTable {compact_bytes / 2**20:6.1f} MiB   dict of dicts {naive_bytes / 2**20:6.1f} MiB"
+              f"   (build {build_sec:.2f}s)")
+        print(f"{'':28s} {'p50':>8s} {'p99':>8s}")
+        for label, fn, qs in (
+            ("WordTable.exact", table.exact, exact_q),
+            ("WordTable.prefix(limit=10)", lambda q: table.prefix(q, 10), prefix_q),
+            ("sqlite exact", lambda q: conn.execute(
+                "SELECT id, word, definition_ja, pos FROM words WHERE word = ?", (q,)).fetchall(), exact_q),
+            ("sqlite prefix(limit=10)", lambda q: (
+                conn.execute("SELECT id, word, definition_ja, pos FROM words WHERE word >= ? AND word < ? "
+                             "ORDER BY word LIMIT 10", (q, q + "\U0010ffff")).fetchall(),
+                conn.execute("SELECT COUNT(*) FROM words WHERE word >= ? AND word < ?",
+                             (q, q + "\U0010ffff")).fetchone()), prefix_q),
+        ):
+            p50, p99 = timed(fn, qs)
+            print(f"{label:28s} {p50:6.1f}us {p99:6.1f}us")
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8000, 370000])
+    parser.add_argument("--words-file", default="words_alpha.txt")
+    parser.add_argument("--db", default="english_learning.db", help="小さい規模で使う実データ")
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+    for n in args.sizes:
+        bench(n, args.words_file, args.db, args.queries)
+
+
+if __name__ == "__main__":
+    main()
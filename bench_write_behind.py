@@ -0,0 +1,112 @@
+# bench_write_behind.py
+# 回答の保存を「1 件ごとに接続 + INSERT + COMMIT（+ ランキング更新）」した場合と
+# write_behind.WriteBehind でまとめて書いた場合で比べる。
+#
+#   python bench_write_behind.py                   # 16 スレッド x 500 件
+#   python bench_write_behind.py --threads 32 --rows 1000 --flush-ms 5
+#
+# 一時ディレクトリに student_answers と leaderboard だけの DB を作って測る。
+# write-behind 側の時間には最後の flush（全件コミットされるまで）も含める。
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+import leaderboard
+import write_behind
+from db import connect as db_connect
+
+INSERT_SQL = """INSERT INTO student_answers (user_id, word_id, score, feedback, example, attempt_date)
+                VALUES (?, ?, ?, ?, ?, ?)"""
+
+
+def make_db(path):
+    with db_connect(path) as conn:
+        conn.execute("""CREATE TABLE student_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, word_id INTEGER, score INTEGER,
+            feedback TEXT, example TEXT, attempt_date TEXT)""")
+        conn.execute("CREATE INDEX idx_student_answers_user ON student_answers(user_id)")
+        conn.commit()
+    leaderboard.init_leaderboard(path)
+
+
+def row(user_id, i):
+    return (user_id, i % 500 + 1, (user_id * 7 + i) % 101, "feedback " * 8, "example sentence",
+            datetime.datetime.utcnow().isoformat())
+
+
+def direct_save(path, params):
+    with db_connect(path) as conn:
+        conn.execute(INSERT_SQL, params)
+        conn.commit()
+    leaderboard.record_score(path, "word", params[0], params[2])
+
+
+def run(n_threads, n_rows, save):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(user_id):
+        local = []
+        for i in range(n_rows):
+            start = time.perf_counter()
+            save(row(user_id, i))
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(u + 1,)) for u in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def count_rows(path):
+    with db_connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM student_answers").fetchone()[0]
+
+
+def report(label, total, elapsed, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{label:14s} {total / elapsed:9.0f} rows/s   call p50 {p50:7.3f}ms   p99 {p99:7.3f}ms"
+          f"   ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=500, help="スレッドあたりの件数")
+    parser.add_argument("--flush-ms", type=float, default=5)
+    parser.add_argument("--flush-rows", type=int, default=200)
+    args = parser.parse_args()
+    total = args.threads * args.rows
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "direct.db")
+        make_db(path)
+        elapsed, latencies = run(args.threads, args.rows, lambda p: direct_save(path, p))
+        assert count_rows(path) == total
+        report("direct", total, elapsed, latencies)
+
+        path = os.path.join(tmp, "behind.db")
+        make_db(path)
+        writer = write_behind.WriteBehind(flush_interval=args.flush_ms / 1000, max_batch=args.flush_rows)
+        writer.register("student_answers", path, INSERT_SQL,
+                        on_flush=lambda rows: leaderboard.record_scores(
+                            path, "word", [(r[0], r[2]) for r in rows]))
+        start = time.perf_counter()
+        _, latencies = run(args.threads, args.rows, lambda p: writer.add("student_answers", p))
+        writer.close()
+        elapsed = time.perf_counter() - start
+        assert count_rows(path) == total
+        report("write-behind", total, elapsed, latencies)
+
+
+if __name__ == "__main__":
+    main()
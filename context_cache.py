@@ -0,0 +1,106 @@
+# context_cache.py
+# 採点プロンプトの「毎回同じ部分」（採点の指示・出力形式・本文）を Gemini の
+# context caching に載せ、呼び出しごとには回答ごとの部分だけを送る。
+#
+#   cache = ContextCache(create=..., ttl=3600)
+#   handle = cache.get(("toeic-v1", passage_id), context)   # 無ければ作る。小さすぎれば None
+#   if handle is None: 全文（context + prompt）を送る
+#   else:              handle を使って prompt だけ送る
+#
+# キーは (プロンプトのバージョン, 本文の id)。プロンプトの文言を変えたらバージョンを上げる。
+# 期限（ttl）の REFRESH_MARGIN 秒前になったら作り直し、max_entries を超えたら古いものから忘れる。
+# 作り直した・忘れたキャッシュは消さない（ほかのスレッドがまだ使っているかもしれないので、
+# サーバー側の期限切れに任せる）。
+# create は app.py が渡す（本物の Gemini と fake_gemini.FakeGemini のどちらでも動く）。
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import metering
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN = 60.0
+
+
+class ContextCache:
+    def __init__(self, create, ttl=3600.0, min_tokens=1024, max_entries=256):
+        self.create = create          # create(context, ttl_sec) -> handle
+        self.ttl = ttl
+        self.min_tokens = min_tokens  # Gemini はこれより小さい内容をキャッシュできない
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (handle, expires_at, context)
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+
+    def cacheable(self, context):
+        return metering.estimate_tokens(context) >= self.min_tokens
+
+    def lookup(self, key, context):
+        """作らずに探す。使えるものが無ければ None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            handle, expires_at, cached_context = entry
+            if cached_context != context or expires_at - now <= REFRESH_MARGIN:
+                return None
+            self._entries.move_to_end(key)
+            return handle
+
+    def get(self, key, context):
+        """key のキャッシュを返す（無い・期限切れ間近なら作る）。キャッシュしない場合は None"""
+        handle = self.lookup(key, context) if key is not None else None
+        if handle is not None:
+            metrics.inc("context_cache_total", result="hit")
+            return handle
+        if key is None or not self.cacheable(context):
+            metrics.inc("context_cache_total", result="inline")
+            return None
+        with self._create_lock:
+            # 同じキーを同時に作らないよう、ロックを取ってからもう一度見る
+            handle = self.lookup(key, context)
+            if handle is not None:
+                metrics.inc("context_cache_total", result="hit")
+                return handle
+            try:
+                handle = self.create(context, self.ttl)
+            except Exception as e:
+                logger.warning("context cache create failed for %s: %s", key, e)
+                metrics.inc("context_cache_total", result="error")
+                return None
+            metrics.inc("context_cache_total", result="miss")
+            self._put(key, handle, context)
+        return handle
+
+    async def get_async(self, key, context):
+        """get の非同期版。作る（Gemini へのリクエスト）ときだけ別スレッドで待つ"""
+        handle = self.lookup(key, context) if key is not None else None
+        if handle is not None:
+            metrics.inc("context_cache_total", result="hit")
+            return handle
+        return await asyncio.to_thread(self.get, key, context)
+
+    def _put(self, key, handle, context):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (handle, time.monotonic() + self.ttl, context)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key, handle):
+        """
+        handle での呼び出しに失敗したら捨てる（次回作り直す）。ほかのスレッドがもう
+        作り直していれば、その新しい handle は捨てない。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == handle:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
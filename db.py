@@ -0,0 +1,59 @@
+# db.py
+# sqlite3.connect の薄いラッパー。実行・フェッチ・コミットにかかった時間を metrics に積む。
+import sqlite3
+import time
+
+import metrics
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            metrics.add_db_time(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            metrics.add_db_time(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.add_db_time(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.add_db_time(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self.cursor().executemany(*args, **kwargs)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.add_db_time(time.perf_counter() - start)
+
+
+def connect(path, **kwargs):
+    """sqlite3.connect と同じ使い方（with 文もそのまま使える）"""
+    return sqlite3.connect(path, factory=TimedConnection, **kwargs)
@@ -0,0 +1,306 @@
+# distractors.py
+# 単語クイズの 4 択モードで使う「まちがいの選択肢」の索引（Gemini を使わずに出題・採点する）。
+#
+#   word_distractors : word_id ごとに、選択肢にするほかの単語 3 つ（d1, d2, d3）
+#   distractors_meta : 作ったときの words_version（word_index.py のトリガーで増える）
+#
+# build() は全単語を読み、品詞（pos の先頭）ごとに難易度（adaptive の word_difficulty.rating）
+# の順に並べて、前後 WINDOW 語の中から意味がかぶらない 3 語を選ぶ。同じ品詞で 3 語そろわない
+# 単語は、品詞を問わず難易度の近い語から補う。それでもそろわない単語は 4 択には出さない。
+# 出題時は choices_for() の SELECT 1 回、採点は選んだ選択肢が正解かどうかを比べるだけ。
+# 出した問題は IssuedChoices に 1 問ずつ id（issue）を振って覚えておき、採点したら消す
+# （同じ問題を何度も送って点数を稼げないように、1 問につき 1 回だけ採点する）。
+#
+# words が変わると（load_words.py / fetch_words.py で足したなど）words_version がずれるので、
+# 起動時に init_distractors() が True を返したら作り直す。
+#
+#   python distractors.py build [--db english_learning.db] [--seed 0]
+#   python distractors.py show WORD [--db english_learning.db]
+import argparse
+import itertools
+import logging
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import adaptive
+import metrics
+from db import connect as db_connect
+from pos import normalize_pos_string
+
+logger = logging.getLogger(__name__)
+
+CHOICES = 3          # まちがいの選択肢の数（正解と合わせて 4 択）
+WINDOW = 25          # 難易度順で前後何語までを候補にするか
+BATCH_ROWS = 5000
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS word_distractors (
+        word_id INTEGER PRIMARY KEY,
+        d1 INTEGER NOT NULL,
+        d2 INTEGER NOT NULL,
+        d3 INTEGER NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS distractors_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        words_version INTEGER NOT NULL,
+        built_at TEXT
+    )''',
+]
+
+# 「保証、確信（自信）」-> ("保証", "確信", "自信") のように意味を区切る（NFKC の後なので全角の記号は半角になっている）
+_MEANING_SPLIT = re.compile(r"[、。,.;:・/()「」『』\[\]!?\s]+")
+
+
+def _words_version(conn):
+    row = conn.execute("SELECT version FROM words_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def init_distractors(db_file):
+    """テーブルを作る。まだ作っていない・words が変わっていたら True（呼び出し側で build する）"""
+    with db_connect(db_file) as conn:
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        conn.commit()
+        row = conn.execute("SELECT words_version FROM distractors_meta WHERE id = 1").fetchone()
+        return row is None or row[0] != _words_version(conn)
+
+
+def meaning_keys(definition):
+    """意味のかぶりを調べるためのキー: (区切った意味, それを "|" でつないだ文字列)"""
+    text = unicodedata.normalize("NFKC", definition or "").lower()
+    keys = tuple(dict.fromkeys(k for k in _MEANING_SPLIT.split(text) if k))
+    return keys, "|".join(keys)
+
+
+def _overlaps(a, b):
+    """a, b（meaning_keys）の意味がかぶるか。片方の意味がもう片方の意味に含まれるものもかぶりとみなす"""
+    return any(k in b[1] for k in a[0]) or any(k in a[1] for k in b[0])
+
+
+# ======================================================
+# 作成
+# ======================================================
+def _load_words(conn):
+    """(word_id, 品詞, 難易度, meaning_keys) のリスト。意味の無い単語は選択肢にも使わない"""
+    has_difficulty = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'word_difficulty'"
+    ).fetchone() is not None
+    if has_difficulty:
+        rows = conn.execute("""
+            SELECT w.id, w.word, w.definition_ja, w.pos, d.rating FROM words w
+            LEFT JOIN word_difficulty d ON d.word_id = w.id
+            WHERE w.definition_ja IS NOT NULL AND w.definition_ja != ''
+        """)
+    else:
+        rows = conn.execute("""
+            SELECT id, word, definition_ja, pos, NULL FROM words
+            WHERE definition_ja IS NOT NULL AND definition_ja != ''
+        """)
+    pos_labels = {}
+    words = []
+    for word_id, word, definition, pos, rating in rows:
+        keys = meaning_keys(definition)
+        if not keys[0]:
+            continue
+        label = pos_labels.get(pos)
+        if label is None:
+            label = pos_labels[pos] = normalize_pos_string(pos or "other").split("・")[0]
+        if rating is None:
+            rating = adaptive.prior_rating(word, 0)
+        words.append((word_id, label, rating, keys))
+    return words
+
+
+def _pick(order, at, keys_of, rng, taken):
+    """order（難易度順の添字）の at 番目の近くから、意味がかぶらない語を taken に足す"""
+    target = keys_of[order[at]]
+    lo, hi = max(0, at - WINDOW), min(len(order), at + WINDOW + 1)
+    size = hi - lo
+    # 窓の中から何回か乱数で引き、足りなければ乱数の位置から窓を一周する（窓全体を混ぜるより速い）
+    probes = [lo + int(rng.random() * size) for _ in range(CHOICES * 2)]
+    start = lo + int(rng.random() * size)
+    for j in itertools.chain(probes, range(start, hi), range(lo, start)):
+        if len(taken) >= CHOICES:
+            break
+        i = order[j]
+        if j == at or i in taken or _overlaps(keys_of[i], target):
+            continue
+        if any(_overlaps(keys_of[i], keys_of[t]) for t in taken):
+            continue
+        taken.append(i)
+    return taken
+
+
+def build(db_file, seed=None):
+    """索引を作り直す。選択肢を作れた単語の数を返す"""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    with db_connect(db_file) as conn:
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        version = _words_version(conn)
+        words = _load_words(conn)
+
+    keys_of = [w[3] for w in words]
+    everyone = sorted(range(len(words)), key=lambda i: words[i][2])
+    rank_in_all = {i: at for at, i in enumerate(everyone)}
+    groups = {}
+    for i in everyone:
+        groups.setdefault(words[i][1], []).append(i)
+
+    rows = []
+    for order in groups.values():
+        for at, i in enumerate(order):
+            taken = _pick(order, at, keys_of, rng, [])
+            if len(taken) < CHOICES:
+                _pick(everyone, rank_in_all[i], keys_of, rng, taken)
+            if len(taken) == CHOICES:
+                rows.append((words[i][0], *(words[t][0] for t in taken)))
+
+    with db_connect(db_file) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM word_distractors")
+        for start in range(0, len(rows), BATCH_ROWS):
+            conn.executemany(
+                "INSERT INTO word_distractors (word_id, d1, d2, d3) VALUES (?, ?, ?, ?)",
+                rows[start:start + BATCH_ROWS],
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO distractors_meta (id, words_version, built_at) "
+            "VALUES (1, ?, datetime('now'))", (version,)
+        )
+        conn.commit()
+    logger.info("word_distractors: %d / %d words (%.1fs)", len(rows), len(words), time.perf_counter() - started)
+    return len(rows)
+
+
+# ======================================================
+# 出題
+# ======================================================
+def choices_for(db_file, word_ids):
+    """
+    {word_id: [(word_id, 意味), ...]}（先頭が正解、残り 3 つがまちがい。並べ替えは呼び出し側で）。
+    索引に無い単語・選択肢の単語が消えていた単語は入らない。
+    """
+    word_ids = list(word_ids)
+    if not word_ids:
+        return {}
+    marks = ",".join("?" * len(word_ids))
+    with db_connect(db_file) as conn:
+        rows = conn.execute(f"""
+            SELECT x.word_id, w0.definition_ja, x.d1, w1.definition_ja,
+                   x.d2, w2.definition_ja, x.d3, w3.definition_ja
+            FROM word_distractors x
+            JOIN words w0 ON w0.id = x.word_id
+            JOIN words w1 ON w1.id = x.d1
+            JOIN words w2 ON w2.id = x.d2
+            JOIN words w3 ON w3.id = x.d3
+            WHERE x.word_id IN ({marks})
+        """, word_ids).fetchall()
+    return {row[0]: [(row[i], row[i + 1]) for i in range(0, 8, 2)] for row in rows}
+
+
+def random_words(db_file, n, exclude=()):
+    """索引のある単語から n 個（4 択で出せる単語が足りないときの補充用）"""
+    exclude = list(exclude)
+    marks = ",".join("?" * len(exclude))
+    with db_connect(db_file) as conn:
+        return [r[0] for r in conn.execute(
+            f"SELECT word_id FROM word_distractors WHERE word_id NOT IN ({marks}) ORDER BY RANDOM() LIMIT ?",
+            exclude + [n],
+        )]
+
+
+class IssuedChoices:
+    """
+    出した 4 択の問題 {issue: (owner, word_id)}。owner はセッションごとの値（app の choice_nonce）で、
+    ほかのセッションの issue では採点できない。take() で消すので 1 問につき 1 回だけ採点できる。
+    出してから ttl 秒たったもの、max_issued を超えた分は古いものから消す（プロセスのメモリだけ）。
+    """
+
+    def __init__(self, ttl=3600.0, max_issued=100000):
+        self.ttl = ttl
+        self.max_issued = max_issued
+        self._issued = OrderedDict()   # issue -> (owner, word_id, 出した時刻)（出した順）
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        """期限切れと上限超えを古い順に消す（_lock を持った状態で呼ぶ）"""
+        while self._issued:
+            issue, (_, _, issued_at) = next(iter(self._issued.items()))
+            if now - issued_at > self.ttl:
+                reason = "ttl"
+            elif len(self._issued) > self.max_issued:
+                reason = "capacity"
+            else:
+                break
+            del self._issued[issue]
+            metrics.inc("word_choice_expired_total", reason=reason)
+
+    def issue(self, owner, word_id):
+        issue = secrets.token_hex(8)
+        now = time.monotonic()
+        with self._lock:
+            self._issued[issue] = (owner, word_id, now)
+            self._evict(now)
+        return issue
+
+    def peek(self, owner, issue):
+        """まだ採点していない問題なら word_id、無ければ（期限切れ・採点済み・別のセッション）None"""
+        with self._lock:
+            found = self._issued.get(issue)
+        if found is None or found[0] != owner or time.monotonic() - found[2] > self.ttl:
+            return None
+        return found[1]
+
+    def take(self, owner, issue):
+        """問題を消す。消せたら True（同じ問題が同時に 2 回送られても True になるのは 1 回だけ）"""
+        with self._lock:
+            found = self._issued.get(issue)
+            if found is None or found[0] != owner:
+                return False
+            del self._issued[issue]
+        return True
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="4 択クイズの選択肢の索引")
+    parser.add_argument("--db", default="english_learning.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="作り直す")
+    p_build.add_argument("--seed", type=int, default=None, help="乱数の種（同じ種なら同じ選択肢）")
+    p_show = sub.add_parser("show", help="ある単語の選択肢を表示する")
+    p_show.add_argument("word")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "build":
+        build(args.db, seed=args.seed)
+        return 0
+
+    with db_connect(args.db) as conn:
+        row = conn.execute("SELECT id FROM words WHERE word = ?", (args.word,)).fetchone()
+    if row is None:
+        print(f"{args.word}: 単語がありません", file=sys.stderr)
+        return 1
+    choices = choices_for(args.db, [row[0]]).get(row[0])
+    if not choices:
+        print(f"{args.word}: 選択肢がありません（build してください）", file=sys.stderr)
+        return 1
+    for n, (_, meaning) in enumerate(choices):
+        print(("○ " if n == 0 else "  ") + meaning)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
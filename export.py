@@ -0,0 +1,255 @@
+# export.py
+# 学習履歴（単語・英作文・読解の回答）を CSV / NDJSON で書き出す。
+#
+#   for chunk in export.stream(sources, export.iter_users(DB_FILE, user_ids=[3, 5]), fmt="csv"):
+#       ...  # Flask の Response にそのまま流す
+#
+#   python export.py --users 3,5 --format ndjson --out class3.ndjson
+#   python export.py --prefix 3A- --since 2026-04-01 > class3a.csv
+#
+# sources は {"word": (db_file, "student_answers"), ...}（app.LEADERBOARD_SOURCES と同じ形）。
+#
+# - ユーザーごと・表ごとに (user_id, attempt_date, id) のキーセットで PAGE_ROWS 行ずつ読む
+#   （索引は (user_id, attempt_date)。id は rowid なので索引の末尾に入っている）。
+#   1 ページ読むたびに読み取りを終えるので、書き出しの間ずっと DB をつかんだままにはならず、
+#   メモリも全体の行数には比例しない。
+# - アーカイブ済み（archive.py の *_archive）の行も混ぜる（feedback は残っていないので空）。
+# - 3 つの表と hot / cold を heapq.merge で attempt_date 順に 1 本にする。
+#   attempt_date が無い古い行は、そのユーザーの先頭に出す。
+import argparse
+import csv
+import heapq
+import io
+import json
+import logging
+import sys
+
+import metrics
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+PAGE_ROWS = 1000
+USER_PAGE = 500
+CHUNK_CHARS = 64 * 1024      # これくらいたまったら 1 回 yield する
+
+COLUMNS = ("type", "user_id", "username", "answer_id", "attempt_date", "item_id", "item",
+           "answer", "score", "feedback", "archived")
+FORMATS = ("csv", "ndjson")
+
+
+class Source:
+    """書き出す回答テーブル 1 つ分の定義"""
+
+    def __init__(self, item_column, item_table, label_expr, answer_column):
+        self.item_column = item_column      # 問題の id（word_id / prompt_id / passage_id）
+        self.item_table = item_table        # 問題の表（同じ DB にある。SELECT では i）
+        self.label_expr = label_expr        # 問題として出す式（単語・お題・本文の書き出し）
+        self.answer_column = answer_column  # 本人の回答
+
+
+SOURCES = {
+    "student_answers": Source("word_id", "words", "i.word", "user_answer"),
+    "word_choice_answers": Source("word_id", "words", "i.word", "user_answer"),
+    "writing_answers": Source("prompt_id", "writing_prompts", "i.prompt_text", "answer"),
+    # 読解の passage_id は reading_texts の id（題名は無いので本文の先頭 80 字）
+    "reading_answers": Source("passage_id", "reading_texts", "substr(i.text, 1, 80)", "user_answer"),
+}
+
+
+def index_statement(table):
+    return f"CREATE INDEX IF NOT EXISTS idx_{table}_user_date ON {table}(user_id, attempt_date)"
+
+
+# ======================================================
+# 読み出し
+# ======================================================
+def _columns(db_file, table):
+    with db_connect(db_file) as conn:
+        return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _select_sql(db_file, table, source, archived):
+    """1 ページ分の SELECT（WHERE / ORDER BY の前まで）。表が無ければ None"""
+    cols = _columns(db_file, table)
+    if not cols:
+        return None
+    answer = f"a.{source.answer_column}" if source.answer_column in cols else "NULL"
+    feedback = "a.feedback" if "feedback" in cols else "NULL"
+    return (
+        f"SELECT a.id, a.attempt_date, a.{source.item_column}, {source.label_expr}, "
+        f"{answer}, a.score, {feedback}, {int(archived)} "
+        f"FROM {table} a LEFT JOIN {source.item_table} i ON i.id = a.{source.item_column}"
+    )
+
+
+def _iter_table(db_file, select_sql, user_id, since=None, until=None, page_rows=PAGE_ROWS):
+    """1 ユーザー・1 表の行を (attempt_date, id) 順に返す"""
+    until_sql = " AND a.attempt_date < ?" if until else ""
+    until_args = (until,) if until else ()
+    if since is None:
+        # attempt_date が NULL の行（索引では先頭に並ぶ）を id 順に
+        last_id = 0
+        while True:
+            with db_connect(db_file) as conn:
+                rows = conn.execute(
+                    f"{select_sql} WHERE a.user_id = ? AND a.attempt_date IS NULL AND a.id > ? "
+                    f"ORDER BY a.id LIMIT ?", (user_id, last_id, page_rows)
+                ).fetchall()
+            yield from rows
+            if len(rows) < page_rows:
+                break
+            last_id = rows[-1][0]
+    last_date, last_id = since or "", 0
+    while True:
+        with db_connect(db_file) as conn:
+            rows = conn.execute(
+                f"{select_sql} WHERE a.user_id = ? AND (a.attempt_date, a.id) > (?, ?){until_sql} "
+                f"ORDER BY a.attempt_date, a.id LIMIT ?",
+                (user_id, last_date, last_id) + until_args + (page_rows,),
+            ).fetchall()
+        yield from rows
+        if len(rows) < page_rows:
+            return
+        last_id, last_date = rows[-1][0], rows[-1][1]
+
+
+def _sort_key(record):
+    return (record["attempt_date"] is not None, record["attempt_date"] or "", record["type"],
+            record["answer_id"])
+
+
+def iter_users(db_file, user_ids=None, prefix=None):
+    """(user_id, username) を id 順に返す。user_ids も prefix も無ければ全員（ゲストを除く）"""
+    if user_ids is not None:
+        for uid in sorted(set(user_ids)):
+            with db_connect(db_file) as conn:
+                row = conn.execute("SELECT username FROM users WHERE id = ?", (uid,)).fetchone()
+            if row is not None:
+                yield uid, row[0]
+        return
+    pattern = None
+    if prefix:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = escaped + "%"
+    last_id = 0
+    while True:
+        with db_connect(db_file) as conn:
+            if pattern is None:
+                rows = conn.execute(
+                    "SELECT id, username FROM users WHERE id > ? ORDER BY id LIMIT ?", (last_id, USER_PAGE)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, username FROM users WHERE id > ? AND username LIKE ? ESCAPE '\\' "
+                    "ORDER BY id LIMIT ?", (last_id, pattern, USER_PAGE)
+                ).fetchall()
+        yield from rows
+        if len(rows) < USER_PAGE:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_records(sources, users, since=None, until=None, page_rows=PAGE_ROWS):
+    """
+    sources: {"word": (db_file, "student_answers"), ...}
+    users: (user_id, username) の iterable（iter_users の戻り値など）
+    ユーザーごとに、全部の表の回答を attempt_date 順に dict で返す
+    """
+    selects = []
+    for kind, (db_file, table) in sources.items():
+        source = SOURCES[table]
+        for name, archived in ((table, False), (f"{table}_archive", True)):
+            sql = _select_sql(db_file, name, source, archived)
+            if sql is not None:
+                selects.append((kind, db_file, sql))
+
+    def records(kind, db_file, sql, user_id, username):
+        for row in _iter_table(db_file, sql, user_id, since, until, page_rows):
+            answer_id, attempt_date, item_id, item, answer, score, feedback, archived = row
+            yield {
+                "type": kind, "user_id": user_id, "username": username, "answer_id": answer_id,
+                "attempt_date": attempt_date, "item_id": item_id, "item": item, "answer": answer,
+                "score": score, "feedback": feedback, "archived": archived,
+            }
+
+    for user_id, username in users:
+        yield from heapq.merge(
+            *(records(kind, db_file, sql, user_id, username) for kind, db_file, sql in selects),
+            key=_sort_key,
+        )
+
+
+# ======================================================
+# 書き出し
+# ======================================================
+def stream(sources, users, fmt="csv", since=None, until=None, bom=False):
+    """CSV / NDJSON の文字列を少しずつ返す（Response にも、ファイルの write にも使える）"""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n") if fmt == "csv" else None
+    if bom and fmt == "csv":
+        buf.write("\ufeff")   # Excel で日本語が化けないように
+    if writer is not None:
+        writer.writerow(COLUMNS)
+    count = 0
+    try:
+        for record in iter_records(sources, users, since, until):
+            if writer is not None:
+                writer.writerow([record[c] for c in COLUMNS])
+            else:
+                buf.write(json.dumps(record, ensure_ascii=False))
+                buf.write("\n")
+            count += 1
+            if buf.tell() >= CHUNK_CHARS:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        # 途中で切断されたときも、そこまでの行数は数える
+        metrics.inc("export_rows_total", count, format=fmt)
+        logger.info("export finished: %d rows (%s)", count, fmt)
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="学習履歴の書き出し（CSV / NDJSON）")
+    parser.add_argument("--word-db", default="english_learning.db")
+    parser.add_argument("--writing-db", default="writing_quiz.db")
+    parser.add_argument("--reading-db", default="reading_quiz.db")
+    parser.add_argument("--users", help="カンマ区切りの user_id")
+    parser.add_argument("--prefix", help="ユーザー名の先頭（クラス名など）")
+    parser.add_argument("--since", help="この日時以降（ISO 形式。例 2026-04-01）")
+    parser.add_argument("--until", help="この日時より前")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--bom", action="store_true", help="CSV の先頭に BOM を付ける（Excel 用）")
+    parser.add_argument("--out", help="出力先（省略時は標準出力）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    sources = {
+        "word": (args.word_db, "student_answers"),
+        "writing": (args.writing_db, "writing_answers"),
+        "reading": (args.reading_db, "reading_answers"),
+        "choice": (args.word_db, "word_choice_answers"),
+    }
+    user_ids = [int(u) for u in args.users.split(",") if u.strip()] if args.users else None
+    users = iter_users(args.word_db, user_ids, args.prefix)
+    chunks = stream(sources, users, args.format, args.since, args.until, args.bom)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# fake_gemini.py
+# ネットワーク無しで負荷試験・ベンチマークするための偽 Gemini。
+#
+# 環境変数で有効化する（app.py が読む）:
+#   GEMINI_FAKE="latency_ms=800,jitter=0.5,error_rate=0.02,bad_json_rate=0.01,seed=1"
+#
+#   latency_ms    : 応答時間の中央値（ミリ秒）
+#   jitter        : 対数正規分布の sigma（0 なら常に latency_ms）
+#   error_rate    : 例外を投げる割合（Gemini の 5xx / quota エラー相当）
+#   bad_json_rate : JSON でない応答を返す割合
+#   timeout_rate  : timeout_ms 待ってから例外を投げる割合
+#   timeout_ms    : タイムアウトまでの時間
+#   ms_per_1k_tokens : 送ったプロンプト 1000 トークンあたりに足す待ち時間（入力の長さの影響）
+#   seed          : 乱数シード（再現用）
+#
+# context caching の代わりに create_cache / delete_cache もある。キャッシュを使った呼び出しは
+# キャッシュ分を送らないので ms_per_1k_tokens の分だけ速くなる（cache_hits で使われた回数が分かる）。
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+
+class FakeGeminiError(Exception):
+    pass
+
+
+class FakeGemini:
+    def __init__(self, latency_ms=800, jitter=0.5, error_rate=0.0, bad_json_rate=0.0,
+                 timeout_rate=0.0, timeout_ms=30000, ms_per_1k_tokens=0.0, seed=None):
+        self.latency_ms = float(latency_ms)
+        self.jitter = float(jitter)
+        self.error_rate = float(error_rate)
+        self.bad_json_rate = float(bad_json_rate)
+        self.timeout_rate = float(timeout_rate)
+        self.timeout_ms = float(timeout_ms)
+        self.ms_per_1k_tokens = float(ms_per_1k_tokens)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.caches = {}              # name -> (context, 期限)
+        self.cache_creates = 0
+        self.cache_hits = 0
+
+    @classmethod
+    def from_spec(cls, spec):
+        """"latency_ms=800,error_rate=0.02" 形式の文字列から作る"""
+        kwargs = {}
+        for part in (spec or "").split(","):
+            if not part.strip() or part.strip() in ("1", "true"):
+                continue
+            key, _, value = part.partition("=")
+            kwargs[key.strip()] = int(value) if key.strip() == "seed" else float(value)
+        return cls(**kwargs)
+
+    def __repr__(self):
+        return (f"FakeGemini(latency_ms={self.latency_ms}, jitter={self.jitter}, "
+                f"error_rate={self.error_rate}, bad_json_rate={self.bad_json_rate}, "
+                f"timeout_rate={self.timeout_rate}, ms_per_1k_tokens={self.ms_per_1k_tokens})")
+
+    # ======================================================
+    # 乱数で「どう振る舞うか」を決める
+    # ======================================================
+    def sample(self):
+        """戻り値: (待ち時間[秒], outcome)  outcome は ok / error / bad_json / timeout"""
+        with self._lock:
+            self.calls += 1
+            r = self._rng.random()
+            if self.jitter > 0 and self.latency_ms > 0:
+                delay = self._rng.lognormvariate(math.log(self.latency_ms), self.jitter) / 1000
+            else:
+                delay = self.latency_ms / 1000
+        if r < self.timeout_rate:
+            return self.timeout_ms / 1000, "timeout"
+        r -= self.timeout_rate
+        if r < self.error_rate:
+            return delay, "error"
+        r -= self.error_rate
+        if r < self.bad_json_rate:
+            return delay, "bad_json"
+        return delay, "ok"
+
+    def response_text(self, prompt, feature, outcome):
+        if outcome == "bad_json":
+            return "申し訳ありません、採点できませんでした。"
+        # 同じプロンプトには同じ点数（再現性のため）
+        score = 40 + int(hashlib.md5(prompt.encode("utf-8")).hexdigest()[:4], 16) % 61
+        # どの採点関数のフォーマットにも合うようにキーをまとめて返す
+        return json.dumps({
+            "score": score,
+            "feedback": f"（偽Gemini/{feature}）よくできています。",
+            "example": "This is a fake example sentence.",
+            "example_jp": "これは偽の例文です。",
+            "pos": "noun",
+            "simple_meaning": "（偽）意味",
+            "correct_answer": "（偽）模範訳",
+            "correct_example": "This is a fake model answer.",
+        }, ensure_ascii=False)
+
+    def _finish(self, prompt, feature, outcome):
+        if outcome in ("error", "timeout"):
+            raise FakeGeminiError(f"fake gemini {outcome}")
+        return self.response_text(prompt, feature, outcome)
+
+    # ======================================================
+    # gemini_generate / gemini_generate_async の代わり
+    # ======================================================
+    def _input_delay(self, prompt, cached):
+        if cached is not None:
+            with self._lock:
+                entry = self.caches.get(cached)
+                if entry is None or entry[1] < time.monotonic():
+                    raise FakeGeminiError(f"cached content not found: {cached}")
+                self.cache_hits += 1
+        # 1 トークン ≒ 4 文字として、送った分（キャッシュ分を除く）だけ遅くする
+        return len(prompt) / 4 / 1000 * self.ms_per_1k_tokens / 1000
+
+    def generate(self, prompt, feature, cached=None):
+        delay, outcome = self.sample()
+        time.sleep(delay + self._input_delay(prompt, cached))
+        return self._finish(prompt, feature, outcome)
+
+    async def generate_async(self, prompt, feature, cached=None):
+        delay, outcome = self.sample()
+        await asyncio.sleep(delay + self._input_delay(prompt, cached))
+        return self._finish(prompt, feature, outcome)
+
+    # ======================================================
+    # context caching の代わり
+    # ======================================================
+    def create_cache(self, context, ttl_sec):
+        with self._lock:
+            self.cache_creates += 1
+            name = f"cachedContents/fake-{self.cache_creates}"
+            self.caches[name] = (context, time.monotonic() + ttl_sec)
+        return name
+
+    def delete_cache(self, name):
+        with self._lock:
+            self.caches.pop(name, None)
@@ -3,6 +3,8 @@ import requests
 import sqlite3
 import re
 
+import search_index
+
 # ================================
 # DB作成
 # ================================
@@ -21,6 +23,8 @@ def init_db():
         )
         """)
         conn.commit()
+        # 全文検索インデックス（以降の INSERT はトリガーで反映される）
+        search_index.ensure_reading_index(conn)
     print(f"DB initialized: {DB_FILE}")
 
 # ================================
@@ -86,17 +90,13 @@ def main():
             text = fetch_gutenberg_text(url)
             if not text:
                 continue
-            chunks = split_text(text, max_words=30)
-            for chunk in chunks:
-                chunk = chunk.strip()
-                if not chunk:
-                    continue
-                c.execute(
-                    "INSERT INTO reading_texts (text, level, topic, source_url) VALUES (?, ?, ?, ?)",
-                    (chunk, "初級〜中級", "高校レベル", url)
-                )
-                inserted_count += 1
-        conn.commit()
+            chunks = [chunk.strip() for chunk in split_text(text, max_words=30) if chunk.strip()]
+            c.executemany(
+                "INSERT INTO reading_texts (text, level, topic, source_url) VALUES (?, ?, ?, ?)",
+                [(chunk, "初級〜中級", "高校レベル", url) for chunk in chunks]
+            )
+            inserted_count += len(chunks)
+            conn.commit()
     print(f"DB作成・データ格納完了！ {inserted_count} 件挿入されました。")
 
 if __name__ == "__main__":
@@ -4,6 +4,8 @@ from tqdm import tqdm
 import re
 import time
 
+import search_index
+
 DB_FILE = "writing_quiz.db"
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -22,6 +24,7 @@ def create_table():
         )
     """)
     conn.commit()
+    search_index.ensure_writing_index(conn)
     conn.close()
     print("✅ テーブル確認・作成完了")
 
@@ -60,6 +63,8 @@ def insert_prompts(japanese_sentences):
     for sentence in tqdm(japanese_sentences, desc="登録中"):
         c.execute("INSERT INTO writing_prompts (prompt_text) VALUES (?)", (sentence,))
     conn.commit()
+    # 全文検索インデックスに追加分を反映
+    search_index.index_writing_prompts(conn)
     conn.close()
     print(f"✅ {len(japanese_sentences)} 件の問題をDBに登録しました。")
 
@@ -0,0 +1,125 @@
+# guest_store.py
+# ゲストの回答をメモリだけに置く（DB には書かない）。
+#
+#   store = GuestStore(ttl=7200, max_guests=5000, max_answers=200)
+#   gid = store.new_id()                                   # ゲストログインごとに 1 つ
+#   store.add(gid, "student_answers", row)                 # row は ANSWER_WRITER に渡す行と同じ形
+#   store.average(gid, "student_answers")                  # そのゲストの平均点
+#   rows = store.claim(gid)                                # 登録時: {table: [row, ...]} を取り出して消す
+#
+# 以前はゲスト全員が user_id=0 を共有していたので、ゲストの回答が 0 番の履歴に積もり続け、
+# 平均点も「今までの全ゲスト」の平均になっていた。ここではゲストごとに別の id
+# （"guest-" で始まる文字列。DB の user_id とぶつからない）を振る。
+#
+# - 最後に使ってから ttl 秒たったゲストは消える。max_guests を超えたら一番古いものから消す。
+# - 回答は表ごとに新しい max_answers 件だけ持つ。平均点用の合計・件数はそれとは別に全件分持つ。
+# - 行の先頭（user_id）にはゲストの id が入る。claim で取り出した側で本物の user_id に置き換える。
+# - プロセスのメモリにあるので、インスタンスが入れ替わると消える（ゲストなのでそれでよい）。
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+ID_PREFIX = "guest-"
+SCORE_INDEX = 2      # ANSWER_WRITER の行は どの表も 3 番目が score
+
+
+def is_guest_id(user_id):
+    return isinstance(user_id, str) and user_id.startswith(ID_PREFIX)
+
+
+class _Guest:
+    __slots__ = ("last_seen", "answers", "totals")
+
+    def __init__(self, now):
+        self.last_seen = now
+        self.answers = {}   # table -> deque(row)
+        self.totals = {}    # table -> [合計点, 件数]
+
+
+class GuestStore:
+    def __init__(self, ttl=7200.0, max_guests=5000, max_answers=200):
+        self.ttl = ttl
+        self.max_guests = max_guests
+        self.max_answers = max_answers
+        self._guests = OrderedDict()   # guest_id -> _Guest（最後に使った順）
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        return ID_PREFIX + secrets.token_hex(8)
+
+    def _evict(self, now):
+        """期限切れと上限超えを古い順に消す（_lock を持った状態で呼ぶ）"""
+        while self._guests:
+            guest_id, guest = next(iter(self._guests.items()))
+            if now - guest.last_seen > self.ttl:
+                reason = "ttl"
+            elif len(self._guests) > self.max_guests:
+                reason = "capacity"
+            else:
+                break
+            del self._guests[guest_id]
+            metrics.inc("guest_sessions_evicted_total", reason=reason)
+        metrics.set_gauge("guest_sessions", len(self._guests))
+
+    def _get(self, guest_id, create=False):
+        now = time.monotonic()
+        guest = self._guests.get(guest_id)
+        if guest is not None and now - guest.last_seen > self.ttl:
+            guest = None   # 期限切れ（_evict で消える）
+        if guest is None:
+            if not create:
+                return None
+            guest = self._guests[guest_id] = _Guest(now)
+        guest.last_seen = now
+        self._guests.move_to_end(guest_id)
+        self._evict(now)
+        return guest
+
+    def add(self, guest_id, table, row):
+        with self._lock:
+            guest = self._get(guest_id, create=True)
+            answers = guest.answers.get(table)
+            if answers is None:
+                answers = guest.answers[table] = deque(maxlen=self.max_answers)
+            answers.append(tuple(row))
+            score = row[SCORE_INDEX]
+            if score is not None:
+                totals = guest.totals.setdefault(table, [0, 0])
+                totals[0] += score
+                totals[1] += 1
+        metrics.inc("guest_answers_total", table=table)
+
+    def average(self, guest_id, table):
+        """平均点（小数 2 桁）。まだ回答が無ければ 0（get_average_score と同じ）"""
+        with self._lock:
+            guest = self._get(guest_id)
+            total, count = guest.totals.get(table, (0, 0)) if guest else (0, 0)
+        return round(total / count, 2) if count and total else 0
+
+    def answers(self, guest_id, table):
+        """持っている回答（古い順）"""
+        with self._lock:
+            guest = self._get(guest_id)
+            return list(guest.answers.get(table, ())) if guest else []
+
+    def count(self, guest_id):
+        """持っている回答の件数（全部の表の合計）"""
+        with self._lock:
+            guest = self._get(guest_id)
+            return sum(len(rows) for rows in guest.answers.values()) if guest else 0
+
+    def claim(self, guest_id):
+        """回答を {table: [row]} で取り出して、そのゲストを消す"""
+        with self._lock:
+            guest = self._get(guest_id)
+            if guest is None:
+                return {}
+            del self._guests[guest_id]
+            metrics.set_gauge("guest_sessions", len(self._guests))
+            return {table: list(rows) for table, rows in guest.answers.items() if rows}
+
+    def __len__(self):
+        return len(self._guests)
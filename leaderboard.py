@@ -0,0 +1,268 @@
+# leaderboard.py
+# ランキングの実体化テーブル（クイズ種別ごと + 総合）
+#
+# 回答の INSERT ごとに record_score() で 1 行だけ UPSERT し、
+# 別 DB にある回答テーブルからの全再集計 rebuild() はバックグラウンドで定期実行する
+# （置き換える間は回答の書き込みを止め、その間に増えた分も足してから置き換える）。
+# /ranking は leaderboard テーブルの索引を読むだけになる。
+# 4 択（choice）は自由記述より点が取りやすいので別の種別にし、総合には入れない。
+import contextlib
+import datetime
+import logging
+import sqlite3
+import threading
+
+import archive
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+QUIZ_TYPES = ("word", "writing", "reading", "choice")
+COMBINED_TYPES = ("word", "writing", "reading")   # 総合に数える種別
+COMBINED = "all"
+ALL_TYPES = QUIZ_TYPES + (COMBINED,)
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS leaderboard (
+        quiz_type TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        total_score INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        avg_score REAL NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        PRIMARY KEY (quiz_type, user_id)
+    )''',
+    '''CREATE INDEX IF NOT EXISTS idx_leaderboard_rank
+        ON leaderboard (quiz_type, avg_score DESC, attempts DESC, user_id)''',
+]
+
+UPSERT_SQL = '''
+    INSERT INTO leaderboard (quiz_type, user_id, total_score, attempts, avg_score, updated_at)
+    VALUES (?, ?, ?, 1, ?, ?)
+    ON CONFLICT(quiz_type, user_id) DO UPDATE SET
+        total_score = total_score + excluded.total_score,
+        attempts = attempts + 1,
+        avg_score = CAST(total_score + excluded.total_score AS REAL) / (attempts + 1),
+        updated_at = excluded.updated_at
+'''
+
+
+def init_leaderboard(db_file):
+    with db_connect(db_file) as conn:
+        c = conn.cursor()
+        for stmt in CREATE_STATEMENTS:
+            c.execute(stmt)
+        conn.commit()
+
+
+def is_empty(db_file):
+    with db_connect(db_file) as conn:
+        return conn.execute("SELECT 1 FROM leaderboard LIMIT 1").fetchone() is None
+
+
+# ======================================================
+# 差分更新（回答 1 件ごと）
+# ======================================================
+def record_score(db_file, quiz_type, user_id, score):
+    """種別の行と（総合に数える種別なら）総合の行を 1 トランザクションで更新する"""
+    record_scores(db_file, quiz_type, [(user_id, score)])
+
+
+def record_scores(db_file, quiz_type, scores):
+    """record_score の複数件版（まとめて書き込まれた回答 [(user_id, score)] 用）"""
+    if quiz_type not in QUIZ_TYPES:
+        raise ValueError(f"unknown quiz_type: {quiz_type}")
+    now = datetime.datetime.utcnow().isoformat()
+    params = []
+    for user_id, score in scores:
+        score = int(score or 0)
+        params.append((quiz_type, user_id, score, float(score), now))
+        if quiz_type in COMBINED_TYPES:
+            params.append((COMBINED, user_id, score, float(score), now))
+    try:
+        with db_connect(db_file) as conn:
+            conn.executemany(UPSERT_SQL, params)
+            conn.commit()
+    except Exception as e:
+        # ランキング更新失敗で回答保存を失敗させない（次回 rebuild で整合する）
+        logger.error("leaderboard record error: %s", e)
+
+
+# ======================================================
+# 全再集計（起動時 / タイマー）
+# ======================================================
+def _aggregate(db_path, table):
+    """({user_id: (total_score, attempts)}, 読んだ最大 id)（アーカイブ済みの分も含む）"""
+    try:
+        with db_connect(db_path) as conn:
+            # hot とアーカイブの集計は 1 つの読み取りトランザクションで読む
+            # （間にアーカイブの移動がコミットされると、移った行を二重に数えたり落としたりする）
+            conn.execute("BEGIN")
+            upto_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            rows = conn.execute(
+                f"SELECT user_id, COALESCE(SUM(score), 0), COUNT(*) FROM {table} "
+                "WHERE user_id IS NOT NULL AND id <= ? GROUP BY user_id", (upto_id,)
+            ).fetchall()
+            totals = archive.totals_by_user(conn, table)
+    except sqlite3.OperationalError as e:
+        logger.warning("leaderboard source %s.%s unavailable: %s", db_path, table, e)
+        return {}, None
+    for uid, total, cnt in rows:
+        t, n = totals.get(uid, (0, 0))
+        totals[uid] = (t + total, n + cnt)
+    return totals, upto_id
+
+
+def aggregate_source(db_path, table):
+    """{user_id: (total_score, attempts)}（アーカイブ済みの分も含む）"""
+    return _aggregate(db_path, table)[0]
+
+
+def _catch_up(db_path, table, after_id, totals):
+    """集計を読んだ後に書き込まれた回答（id > after_id）を totals に足す"""
+    with db_connect(db_path) as conn:
+        for uid, total, cnt in conn.execute(
+            f"SELECT user_id, COALESCE(SUM(score), 0), COUNT(*) FROM {table} "
+            "WHERE user_id IS NOT NULL AND id > ? GROUP BY user_id", (after_id,)
+        ):
+            t, n = totals.get(uid, (0, 0))
+            totals[uid] = (t + total, n + cnt)
+
+
+def rebuild(db_file, sources, pause=None):
+    """
+    sources: { "word": (db_path, "student_answers"), ... }
+    各 DB を個別に集計し、leaderboard を丸ごと置き換える。
+
+    pause は回答の書き込み（とコミット後の record_scores）を止める context manager を返す関数
+    （app.py では ANSWER_WRITER.paused）。集計中に書き込まれた回答は、止めている間に
+    id で拾ってから置き換えるので、置き換えで record_scores の分が消えたり二重に数えたりしない。
+    """
+    snapshots = {}
+    for quiz_type, (db_path, table) in sources.items():
+        snapshots[quiz_type] = _aggregate(db_path, table)
+
+    with pause() if pause is not None else contextlib.nullcontext():
+        for quiz_type, (totals, upto_id) in snapshots.items():
+            if upto_id is not None:
+                _catch_up(*sources[quiz_type], upto_id, totals)
+
+        now = datetime.datetime.utcnow().isoformat()
+        rows = []
+        combined = {}
+        for quiz_type, (totals, _) in snapshots.items():
+            for uid, (total, cnt) in totals.items():
+                rows.append((quiz_type, uid, total, cnt, total / cnt, now))
+                if quiz_type not in COMBINED_TYPES:
+                    continue
+                t, n = combined.get(uid, (0, 0))
+                combined[uid] = (t + total, n + cnt)
+        for uid, (total, cnt) in combined.items():
+            rows.append((COMBINED, uid, total, cnt, total / cnt, now))
+
+        with db_connect(db_file, isolation_level=None) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM leaderboard")
+                conn.executemany(
+                    "INSERT INTO leaderboard (quiz_type, user_id, total_score, attempts, avg_score, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    logger.info("leaderboard rebuilt: %d rows", len(rows))
+    return len(rows)
+
+
+def start_refresh_timer(interval_sec, refresh):
+    """interval_sec ごとに refresh() を呼ぶデーモンスレッド。0 以下なら起動しない"""
+    if interval_sec <= 0:
+        return None
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval_sec):
+            try:
+                refresh()
+            except Exception:
+                logger.exception("leaderboard refresh failed")
+
+    t = threading.Thread(target=loop, name="leaderboard-refresh", daemon=True)
+    t.start()
+    return stop
+
+
+# ======================================================
+# 読み出し
+# ======================================================
+def last_page(total, per_page):
+    return max(1, -(-total // per_page))
+
+
+def get_page(db_file, quiz_type, page=1, per_page=20):
+    """
+    戻り値: ([{rank, user_id, username, avg_score, attempts}, ...], total_users)
+    同点は同順位（1, 2, 2, 4 ...）。page は最後のページまでに丸める（last_page）。
+    """
+    with db_connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM leaderboard WHERE quiz_type=?", (quiz_type,))
+        total = c.fetchone()[0]
+        # 大きすぎる page で OFFSET があふれないように、先に件数で丸める
+        page = min(max(1, int(page)), last_page(total, per_page))
+        offset = (page - 1) * per_page
+        c.execute('''
+            SELECT l.user_id, COALESCE(u.username, '名無し'), l.avg_score, l.attempts
+            FROM leaderboard l
+            LEFT JOIN users u ON u.id = l.user_id
+            WHERE l.quiz_type = ?
+            ORDER BY l.avg_score DESC, l.attempts DESC, l.user_id
+            LIMIT ? OFFSET ?
+        ''', (quiz_type, per_page, offset))
+        rows = c.fetchall()
+        if not rows:
+            return [], total
+        # ページ先頭の順位だけ索引で数え、以降はページ内で計算する
+        c.execute(
+            "SELECT COUNT(*) FROM leaderboard WHERE quiz_type=? AND avg_score > ?",
+            (quiz_type, rows[0][2]),
+        )
+        rank = c.fetchone()[0] + 1
+
+    result = []
+    prev_avg = None
+    for i, (uid, username, avg, attempts) in enumerate(rows):
+        if prev_avg is not None and avg < prev_avg:
+            rank = offset + i + 1
+        prev_avg = avg
+        result.append({
+            "rank": rank,
+            "user_id": uid,
+            "username": username,
+            "avg_score": round(avg, 2),
+            "attempts": attempts,
+        })
+    return result, total
+
+
+def get_user_rank(db_file, quiz_type, user_id):
+    """自分の順位。ランキングに載っていなければ None"""
+    with db_connect(db_file) as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT avg_score, attempts FROM leaderboard WHERE quiz_type=? AND user_id=?",
+            (quiz_type, user_id),
+        )
+        row = c.fetchone()
+        if not row:
+            return None
+        avg, attempts = row
+        c.execute(
+            "SELECT COUNT(*) FROM leaderboard WHERE quiz_type=? AND avg_score > ?",
+            (quiz_type, avg),
+        )
+        rank = c.fetchone()[0] + 1
+    return {"rank": rank, "avg_score": round(avg, 2), "attempts": attempts}
@@ -0,0 +1,320 @@
+# load_words.py
+# 手元の辞書ファイルから words テーブルをまとめて作る（fetch_words.py のネットワークを使わない版）。
+#
+#   python load_words.py --db english_learning.db --wordlist words_alpha.txt \
+#       --tsv my_dict.tsv --jmdict JMdict_e.xml --wordnet english-wordnet-2024.xml
+#
+# 読める形式（どれもファイル全体を読み込まず、1 件ずつ読んでは捨てる）
+#   --tsv     : 1 行 1 語のタブ区切り。列は --tsv-columns（既定 word,pos,definition_en,definition_ja）。
+#               # で始まる行と、1 行目が見出し（word ...）なら読み飛ばす
+#   --jmdict  : JMdict（和英辞書）の XML。英語の訳語（gloss）が単語リストの語と同じなら、その
+#               見出し語（漢字、無ければかな）を definition_ja にする。よく使う語（*_pri のあるもの）が先
+#   --wordnet : WordNet の WN-LMF 形式の XML（Open English WordNet など）。最初の語義の定義を
+#               definition_en に、品詞を pos に使う（LexicalEntry が Synset より前にある前提）
+#
+# 同じ項目が複数のファイルにあれば --tsv > --jmdict > --wordnet の順で使う（TSV は手で直したもの想定）。
+# 品詞は pos.POS_JA のキー（"noun, verb" など。normalize_pos_string が読める形）にそろえて入れる。
+#
+# 単語リスト（--wordlist）にある語だけを、リストの順に入れる。
+# - まだ無い語は definition_ja が取れたものだけ追加する（クイズに意味が要るので）
+# - 既にある語は空の項目だけ埋める（--overwrite なら取れた値で上書き）
+# 書き込みは 1 トランザクションで executemany する。
+import argparse
+import csv
+import functools
+import logging
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from db import connect as db_connect
+from pos import POS_JA, normalize_pos_string
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("definition_en", "definition_ja", "pos")
+TSV_COLUMNS = "word,pos,definition_en,definition_ja"
+MAX_JA_MEANINGS = 3          # JMdict から取る訳の数（"、" でつなぐ）
+
+# 日本語 -> 代表の英語キー（"形容詞" -> "adjective"。POS_JA で先に書いてある方）
+_POS_KEY = {}
+for _key, _ja in POS_JA.items():
+    _POS_KEY.setdefault(_ja, _key)
+
+# JMdict の品詞（実体参照を展開した説明文か、展開前の名前）-> normalize_pos_string が読める語
+_JMDICT_POS = [
+    (re.compile(r"^(noun|n$|n-)"), "noun"),
+    (re.compile(r"\bverb\b|^v[0-9a-z]"), "verb"),
+    (re.compile(r"adjective|^adj"), "adjective"),
+    (re.compile(r"^adverb|^adv"), "adverb"),
+    (re.compile(r"^pronoun|^pn$"), "pronoun"),
+    (re.compile(r"^conjunction|^conj$"), "conjunction"),
+    (re.compile(r"^interjection|^int$"), "interjection"),
+    (re.compile(r"^particle|^prt$"), "particle"),
+    (re.compile(r"^numeric|^num$"), "numeral"),
+]
+
+# WN-LMF の partOfSpeech
+_WORDNET_POS = {"n": "noun", "v": "verb", "a": "adjective", "s": "adjective", "r": "adverb",
+                "c": "conjunction", "p": "preposition"}
+
+
+@functools.lru_cache(maxsize=1024)
+def canonical_pos(tags):
+    """品詞の候補 ("noun", "adj", ...) -> "noun, adjective"。分からなければ None"""
+    ja = normalize_pos_string(", ".join(t for t in tags if t))
+    if ja == POS_JA["other"]:
+        return None
+    return ", ".join(_POS_KEY[p] for p in ja.split("・"))
+
+
+def read_wordlist(path):
+    """単語リスト（1 行 1 語）を小文字で、重複を除いて順番どおりに"""
+    words = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            word = line.strip().lower()
+            if word and word not in words:
+                words[word] = None
+    return list(words)
+
+
+def _strip_ns(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iter_elements(path, *tags):
+    """path の tags 要素を 1 つずつ返す（返した後で中身を捨てるので、メモリは要素 1 つ分）"""
+    parents = []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = elem.tag
+        if tag in tags or (tag[0] == "{" and _strip_ns(tag) in tags):
+            yield elem
+            # 読み終わった要素は親から外す（親には処理済みの兄弟しか残っていない）
+            if parents:
+                del parents[-1][:]
+
+
+# ======================================================
+# 読み込み（どれも {word: {field: value}} に足していく）
+# ======================================================
+def load_tsv(path, wanted, entries, columns=TSV_COLUMNS):
+    columns = [c.strip() for c in columns.split(",")]
+    if "word" not in columns:
+        raise ValueError("--tsv-columns に word がありません")
+    found = 0
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if not row or row[0].startswith("#"):
+                continue
+            record = dict(zip(columns, (v.strip() for v in row)))
+            word = record.get("word", "").lower()
+            if word == "word" or word not in wanted:
+                continue
+            entry = entries.setdefault(word, {})
+            for field in ("definition_en", "definition_ja"):
+                if record.get(field) and field not in entry:
+                    entry[field] = record[field]
+            if record.get("pos") and "pos" not in entry:
+                pos = canonical_pos(tuple(re.split(r"[,/;]", record["pos"])))
+                if pos:
+                    entry["pos"] = pos
+            found += 1
+    return found
+
+
+def _gloss_key(gloss):
+    """"to eat (something)" -> "eat"（単語リストと突き合わせる形）"""
+    text = re.sub(r"\([^)]*\)", "", gloss or "").strip().lower()
+    if text.startswith("to "):
+        text = text[3:]
+    return text.strip()
+
+
+def _jmdict_pos(text):
+    text = (text or "").strip().lower()
+    for pattern, key in _JMDICT_POS:
+        if pattern.search(text):
+            return key
+    return None
+
+
+def load_jmdict(path, wanted, entries):
+    candidates = {}   # word -> [(0: よく使う語 / 1: それ以外, 出てきた順, 見出し語, 品詞)]
+    order = 0
+    for entry in _iter_elements(path, "entry"):
+        kanji = [k.text for k in entry.iter("keb") if k.text]
+        kana = [r.text for r in entry.iter("reb") if r.text]
+        headword = (kanji or kana or [None])[0]
+        if headword is None:
+            continue
+        common = any(True for _ in entry.iter("ke_pri")) or any(True for _ in entry.iter("re_pri"))
+        pos = []
+        for sense in entry.iter("sense"):
+            # pos の無い sense は直前の sense の品詞を引き継ぐ（JMdict の決まり）
+            sense_pos = [_jmdict_pos(p.text) for p in sense.iter("pos")]
+            if sense_pos:
+                pos = [p for p in sense_pos if p]
+            for gloss in sense.iter("gloss"):
+                lang = gloss.get("{http://www.w3.org/XML/1998/namespace}lang", "eng")
+                if lang != "eng":
+                    continue
+                word = _gloss_key(gloss.text)
+                if word in wanted:
+                    candidates.setdefault(word, []).append((0 if common else 1, order, headword, tuple(pos)))
+                    order += 1
+    for word, items in candidates.items():
+        items.sort()
+        meanings = []
+        for _, _, headword, _ in items:
+            if headword not in meanings:
+                meanings.append(headword)
+        entry = entries.setdefault(word, {})
+        entry.setdefault("definition_ja", "、".join(meanings[:MAX_JA_MEANINGS]))
+        pos = canonical_pos(items[0][3])
+        if pos:
+            entry.setdefault("pos", pos)
+    return len(candidates)
+
+
+def load_wordnet(path, wanted, entries):
+    need = {}        # synset id -> [word]（最初の語義の定義がほしい語）
+    asked = set()    # need に入れた語
+    pos_by_word = {}
+    found = 0
+    for elem in _iter_elements(path, "LexicalEntry", "Synset"):
+        if _strip_ns(elem.tag) == "LexicalEntry":
+            lemma = next((e for e in elem if _strip_ns(e.tag) == "Lemma"), None)
+            if lemma is None:
+                continue
+            word = (lemma.get("writtenForm") or "").lower()
+            if word not in wanted:
+                continue
+            pos_by_word.setdefault(word, []).append(_WORDNET_POS.get(lemma.get("partOfSpeech"), ""))
+            sense = next((e for e in elem if _strip_ns(e.tag) == "Sense"), None)
+            if sense is not None and word not in asked:
+                asked.add(word)
+                need.setdefault(sense.get("synset"), []).append(word)
+        elif elem.get("id") in need:
+            definition = next((e.text for e in elem if _strip_ns(e.tag) == "Definition" and e.text), None)
+            for word in need.pop(elem.get("id")):
+                if definition:
+                    entries.setdefault(word, {}).setdefault("definition_en", definition.strip())
+                    found += 1
+    for word, tags in pos_by_word.items():
+        pos = canonical_pos(tuple(tags))
+        if pos:
+            entries.setdefault(word, {}).setdefault("pos", pos)
+    return len(pos_by_word)
+
+
+# ======================================================
+# 書き込み
+# ======================================================
+def ensure_columns(conn):
+    """古い DB（fetch_words.py で作ったもの）には definition_en / pos が無いことがある"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(words)")}
+    if not columns:
+        raise SystemExit("words テーブルがありません（先に app.py を一度起動してください）")
+    for column in ("definition_en", "pos"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE words ADD COLUMN {column} TEXT")
+
+
+def _merge_sql(overwrite):
+    if overwrite:
+        return "COALESCE(excluded.{0}, words.{0})"
+    return "COALESCE(NULLIF(words.{0}, ''), excluded.{0})"
+
+
+def write_words(db_path, words, entries, overwrite=False, batch_size=5000):
+    """words（単語リストの順）のうち entries にあるものを入れる。(追加, 更新) の件数を返す"""
+    merge = _merge_sql(overwrite)
+    upsert = (
+        "INSERT INTO words (word, definition_ja, definition_en, pos) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(word) DO UPDATE SET "
+        + ", ".join(f"{f} = {merge.format(f)}" for f in ("definition_ja", "definition_en", "pos"))
+    )
+    # definition_ja が無い語は追加しない（既にある語の空欄だけ埋める）
+    update = (
+        "UPDATE words SET "
+        + ", ".join(f"{f} = {merge.format(f).replace('excluded.' + f, '?')}" for f in ("definition_en", "pos"))
+        + " WHERE word = ?"
+    )
+    with db_connect(db_path) as conn:
+        ensure_columns(conn)
+        before = conn.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+        conn.execute("BEGIN IMMEDIATE")
+        upserts, updates = [], []
+        changed = 0
+        for word in words:
+            entry = entries.get(word)
+            if not entry:
+                continue
+            if entry.get("definition_ja"):
+                upserts.append((word, entry["definition_ja"], entry.get("definition_en"), entry.get("pos")))
+            else:
+                updates.append((entry.get("definition_en"), entry.get("pos"), word))
+            if len(upserts) >= batch_size:
+                changed += conn.executemany(upsert, upserts).rowcount
+                upserts.clear()
+            if len(updates) >= batch_size:
+                changed += conn.executemany(update, updates).rowcount
+                updates.clear()
+        changed += conn.executemany(upsert, upserts).rowcount
+        changed += conn.executemany(update, updates).rowcount
+        conn.commit()
+        after = conn.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+    return after - before, changed - (after - before)
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="手元の辞書ファイルから words テーブルをまとめて作る")
+    parser.add_argument("--db", default="english_learning.db")
+    parser.add_argument("--wordlist", default="words_alpha.txt", help="入れる語のリスト（1 行 1 語）")
+    parser.add_argument("--tsv", action="append", default=[], help="タブ区切りの辞書（複数可）")
+    parser.add_argument("--tsv-columns", default=TSV_COLUMNS, help="TSV の列の並び（使わない列は _ など）")
+    parser.add_argument("--jmdict", action="append", default=[], help="JMdict の XML（複数可）")
+    parser.add_argument("--wordnet", action="append", default=[], help="WN-LMF 形式の WordNet XML（複数可）")
+    parser.add_argument("--overwrite", action="store_true", help="既にある語の項目も取れた値で上書きする")
+    parser.add_argument("--dry-run", action="store_true", help="読むだけで DB には書かない")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if not (args.tsv or args.jmdict or args.wordnet):
+        parser.error("--tsv / --jmdict / --wordnet のどれかを指定してください")
+
+    started = time.perf_counter()
+    words = read_wordlist(args.wordlist)
+    wanted = set(words)
+    logger.info("単語リスト: %d 語", len(words))
+
+    entries = {}
+    loaders = ([(load_tsv, p, {"columns": args.tsv_columns}) for p in args.tsv]
+               + [(load_jmdict, p, {}) for p in args.jmdict]
+               + [(load_wordnet, p, {}) for p in args.wordnet])
+    for loader, path, options in loaders:
+        t = time.perf_counter()
+        found = loader(path, wanted, entries, **options)
+        logger.info("%s: %d 語（%.1f 秒）", path, found, time.perf_counter() - t)
+
+    counts = {f: sum(1 for e in entries.values() if e.get(f)) for f in FIELDS}
+    logger.info("取れた項目: %s", ", ".join(f"{f}={n}" for f, n in counts.items()))
+    if args.dry_run:
+        return 0
+
+    inserted, updated = write_words(args.db, words, entries, overwrite=args.overwrite)
+    logger.info("追加 %d 語 / 既存 %d 語を更新（全体 %.1f 秒）", inserted, updated, time.perf_counter() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
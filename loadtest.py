@@ -0,0 +1,383 @@
+# loadtest.py
+# ネットワーク無しで回せる負荷試験。合成ユーザーが
+#   登録 → ログイン → word_quiz → /api/submit_answer → ranking
+# と、英作文・和訳・TOEIC の各フローを回し、ルートごとのスループット・
+# p50/p95/p99・DB 時間（/metrics の差分）を出す。標準ライブラリだけで動く。
+#
+#   # 偽 Gemini 付きでサーバーを起動して 60 秒回す
+#   python loadtest.py --spawn asgi --users 32 --duration 60 --fake-gemini "latency_ms=800,error_rate=0.02"
+#
+#   # 既に起動しているサーバーに対して（サーバー側で GEMINI_FAKE を設定しておく）
+#   python loadtest.py --url http://127.0.0.1:8080 --users 16
+#
+#   # ベースラインを保存し、最適化後に比較する
+#   python loadtest.py --spawn wsgi --save bench/baseline.json
+#   python loadtest.py --spawn wsgi --compare bench/baseline.json
+#
+#   # 単語クイズをまとめて出題する API（/api/word_session）で回す
+#   python loadtest.py --spawn wsgi --mix word_session=1
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+# シナリオの既定の重み（単語クイズが一番多い想定）
+DEFAULT_MIX = "word=6,writing=2,reading=1,toeic=1"
+TOEIC_IDS = (1, 2, 3, 4)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """リダイレクトは追わない（POST → 302 → GET を別ルートとして計測するため）"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# ======================================================
+# 計測結果の集計
+# ======================================================
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)   # route -> [秒]
+        self.errors = defaultdict(int)       # route -> 件数
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, seconds, status, ok):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+            if not ok:
+                self.errors[route] += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+# ======================================================
+# 合成ユーザー
+# ======================================================
+class User:
+    def __init__(self, base_url, name, recorder, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.name = name
+        self.recorder = recorder
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(self, route, method, path, data=None, expect=(200, 302)):
+        """1 リクエスト送って計測する。戻り値は (status, 本文)"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as res:
+                status, text = res.status, res.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            status, text = e.code, e.read().decode("utf-8", "replace")
+        except Exception as e:
+            status, text = 0, str(e)
+        self.recorder.record(route, time.perf_counter() - start, status, status in expect)
+        return status, text
+
+    def login(self):
+        password = "loadtest-password"
+        self.request("POST /register", "POST", "/register",
+                     {"username": self.name, "password": password})
+        status, _ = self.request("POST /login", "POST", "/login",
+                                 {"username": self.name, "password": password}, expect=(302,))
+        return status == 302
+
+    # --- シナリオ ---
+    def word_flow(self):
+        _, html = self.request("GET /word_quiz", "GET", "/word_quiz")
+        m = re.search(r'id="word-id" value="(\d+)"', html)
+        if not m:
+            return
+        self.request("POST /api/submit_answer", "POST", "/api/submit_answer",
+                     {"word_id": m.group(1), "answer": "テスト"}, expect=(200,))
+        self.request("GET /ranking", "GET", "/ranking")
+
+    def word_session_flow(self):
+        """/api/word_session で数問まとめて受け取り、ページを読み直さずに答える"""
+        _, text = self.request("GET /api/word_session", "GET", "/api/word_session?n=5", expect=(200,))
+        try:
+            items = json.loads(text).get("items", [])
+        except ValueError:
+            return
+        for item in items:
+            self.request("POST /api/submit_answer", "POST", "/api/submit_answer",
+                         {"word_id": item["word_id"], "answer": "テスト"}, expect=(200,))
+
+    def writing_flow(self):
+        _, html = self.request("GET /writing_quiz", "GET", "/writing_quiz")
+        prompt = re.search(r'name="prompt" value="([^"]*)"', html)
+        prompt_id = re.search(r'name="prompt_id" value="(\d+)"', html)
+        if not prompt:
+            return
+        self.request("POST /submit_writing", "POST", "/submit_writing", {
+            "prompt": _unescape(prompt.group(1)),
+            "prompt_id": prompt_id.group(1) if prompt_id else "0",
+            "answer": "I think this is a good idea because it helps many people.",
+        })
+        self.request("GET /writing_result", "GET", "/writing_result")
+
+    def reading_flow(self):
+        _, html = self.request("GET /reading_quiz", "GET", "/reading_quiz")
+        passage_id = re.search(r'name="passage_id" value="(\d+)"', html)
+        if not passage_id:
+            return
+        self.request("POST /submit_reading", "POST", "/submit_reading",
+                     {"passage_id": passage_id.group(1), "answer": "これはテストの和訳です。"})
+        self.request("GET /reading_result", "GET", "/reading_result")
+
+    def toeic_flow(self):
+        reading_id = random.choice(TOEIC_IDS)
+        path = f"/toeic_r/{reading_id}"
+        _, html = self.request("GET /toeic_r", "GET", path)
+        # 選択式（radio）は "A"、記述式（textarea）は適当な文を送る
+        fields = {name: ("A" if kind.startswith("input") else "テスト") for kind, name in
+                  re.findall(r'<(input type="radio"|textarea) name="(q\d+)"', html)}
+        self.request("POST /toeic_r", "POST", path, fields, expect=(200,))
+
+
+FLOWS = {"word": User.word_flow, "word_session": User.word_session_flow, "writing": User.writing_flow,
+         "reading": User.reading_flow, "toeic": User.toeic_flow}
+
+
+def _unescape(s):
+    return (s.replace("&#34;", '"').replace("&#39;", "'").replace("&quot;", '"')
+            .replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&"))
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in FLOWS:
+            raise SystemExit(f"unknown scenario: {name} (choose from {', '.join(FLOWS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_user(user, mix, deadline, think, start_barrier):
+    start_barrier.wait()
+    if not user.login():
+        return
+    names, weights = list(mix), list(mix.values())
+    while time.time() < deadline:
+        FLOWS[random.choices(names, weights)[0]](user)
+        if think:
+            time.sleep(random.uniform(0, 2 * think))
+
+
+# ======================================================
+# /metrics から DB 時間を取る
+# ======================================================
+_METRIC_LINE = re.compile(r'^(\w+)\{([^}]*)\} ([0-9.eE+-]+)$')
+
+
+def scrape_db_time(base_url, token=None):
+    """endpoint -> (DB 時間の合計秒, リクエスト数)"""
+    req = urllib.request.Request(base_url.rstrip("/") + "/metrics")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(req, timeout=10) as res:
+            text = res.read().decode()
+    except Exception:
+        return {}
+    result = defaultdict(lambda: [0.0, 0])
+    for line in text.splitlines():
+        m = _METRIC_LINE.match(line)
+        if not m or not m.group(1).startswith("http_request_db_seconds_"):
+            continue
+        endpoint = dict(re.findall(r'(\w+)="([^"]*)"', m.group(2))).get("endpoint")
+        if m.group(1).endswith("_sum"):
+            result[endpoint][0] = float(m.group(3))
+        elif m.group(1).endswith("_count"):
+            result[endpoint][1] = int(float(m.group(3)))
+    return dict(result)
+
+
+def db_time_delta(before, after):
+    delta = {}
+    for endpoint, (total, count) in after.items():
+        b_total, b_count = before.get(endpoint, (0.0, 0))
+        if count > b_count:
+            delta[endpoint] = {"db_ms_avg": (total - b_total) / (count - b_count) * 1000,
+                               "db_sec_total": total - b_total,
+                               "requests": count - b_count}
+    return delta
+
+
+# ======================================================
+# サーバーの起動（--spawn）
+# ======================================================
+def spawn_server(mode, port, fake_gemini, threads, log_path):
+    env = dict(os.environ, GEMINI_FAKE=fake_gemini, PORT=str(port))
+    env.pop("GEMINI_API_KEY", None)
+    if mode == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+               "--workers", "1", "--threads", str(threads), "--timeout", "300", "app:app"]
+    # サーバーのログはパイプに溜めると詰まるのでファイルに流す
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        if proc.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                raise SystemExit(f"server exited (see {log_path}):\n{f.read()[-2000:]}")
+        try:
+            urllib.request.urlopen(url + "/health", timeout=1).read()
+            return proc, url
+        except Exception:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("server did not become healthy")
+
+
+# ======================================================
+# レポート
+# ======================================================
+def build_report(recorder, elapsed, db_delta, config):
+    routes = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        routes[route] = {
+            "count": len(values),
+            "errors": recorder.errors.get(route, 0),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+            "statuses": {str(k): v for k, v in recorder.statuses[route].items()},
+        }
+    total = sum(r["count"] for r in routes.values())
+    return {"config": config, "elapsed_sec": elapsed, "total_requests": total,
+            "total_rps": total / elapsed, "routes": routes, "db": db_delta}
+
+
+def print_report(report, baseline=None):
+    print(f"\n{report['total_requests']} requests in {report['elapsed_sec']:.1f}s "
+          f"= {report['total_rps']:.1f} req/s")
+    header = f"{'route':26s} {'count':>6s} {'err':>4s} {'req/s':>7s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'max':>8s}"
+    print(header)
+    print("-" * len(header))
+    base_routes = (baseline or {}).get("routes", {})
+    for route, r in report["routes"].items():
+        line = (f"{route:26s} {r['count']:6d} {r['errors']:4d} {r['rps']:7.1f} "
+                f"{r['p50_ms']:7.0f}ms {r['p95_ms']:7.0f}ms {r['p99_ms']:7.0f}ms {r['max_ms']:7.0f}ms")
+        b = base_routes.get(route)
+        if b:
+            line += f"   p95 {_delta(r['p95_ms'], b['p95_ms'])}  req/s {_delta(r['rps'], b['rps'])}"
+        print(line)
+
+    if report["db"]:
+        print(f"\n{'endpoint (server side)':26s} {'reqs':>6s} {'db avg':>9s} {'db total':>9s}")
+        base_db = (baseline or {}).get("db", {})
+        for endpoint, d in sorted(report["db"].items()):
+            line = f"{endpoint:26s} {d['requests']:6d} {d['db_ms_avg']:7.2f}ms {d['db_sec_total']:8.2f}s"
+            if endpoint in base_db:
+                line += f"   db avg {_delta(d['db_ms_avg'], base_db[endpoint]['db_ms_avg'])}"
+            print(line)
+    if baseline:
+        print(f"\ntotal req/s {_delta(report['total_rps'], baseline['total_rps'])} vs baseline")
+
+
+def _delta(now, before):
+    if not before:
+        return "   n/a"
+    return f"{(now - before) / before * 100:+6.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="english-flask-app の負荷試験")
+    parser.add_argument("--url", help="既に起動しているサーバーの URL")
+    parser.add_argument("--spawn", choices=["wsgi", "asgi"], help="サーバーを起動して試験する")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--threads", type=int, default=8, help="--spawn wsgi のスレッド数")
+    parser.add_argument("--fake-gemini", default="latency_ms=800,jitter=0.4,error_rate=0.02,bad_json_rate=0.01",
+                        help="--spawn 時の GEMINI_FAKE（fake_gemini.py 参照）")
+    parser.add_argument("--server-log", default="loadtest-server.log", help="--spawn したサーバーのログ")
+    parser.add_argument("--users", type=int, default=16, help="同時ユーザー数")
+    parser.add_argument("--duration", type=float, default=30, help="秒")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="シナリオの重み")
+    parser.add_argument("--think-ms", type=float, default=0, help="フロー間の平均待ち時間")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN"))
+    parser.add_argument("--save", help="結果を JSON で保存する")
+    parser.add_argument("--compare", help="ベースライン JSON と比較する")
+    args = parser.parse_args()
+
+    if not args.url and not args.spawn:
+        parser.error("--url か --spawn のどちらかを指定してください")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    proc = None
+    url = args.url
+    if args.spawn:
+        proc, url = spawn_server(args.spawn, args.port, args.fake_gemini, args.threads, args.server_log)
+    try:
+        mix = parse_mix(args.mix)
+        recorder = Recorder()
+        run_id = f"{int(time.time()) % 100000}_{random.randint(0, 9999)}"
+        users = [User(url, f"loadtest_{run_id}_{i}", recorder, args.timeout) for i in range(args.users)]
+
+        db_before = scrape_db_time(url, args.metrics_token)
+        barrier = threading.Barrier(len(users) + 1)
+        deadline = time.time() + args.duration
+        threads = [threading.Thread(target=run_user, args=(u, mix, deadline, args.think_ms / 1000, barrier),
+                                    daemon=True) for u in users]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        db_after = scrape_db_time(url, args.metrics_token)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    config = {"url": url, "spawn": args.spawn, "users": args.users, "duration": args.duration,
+              "mix": args.mix, "fake_gemini": args.fake_gemini if args.spawn else None}
+    report = build_report(recorder, elapsed, db_time_delta(db_before, db_after), config)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nsaved {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# local_scorer.py
+# Gemini を使わない文単位の採点。学習者の回答と模範解答を文字 n-gram の
+# chrF（n-gram の適合率・再現率を平均した F_beta）で比べる。
+#
+# 文字列ごとに Python で n-gram を数えるのではなく、全テキストのコードポイントを
+# 1 本の配列につなげ、各次数の n-gram を多項式ハッシュ（uint64）で一括計算する。
+# 回答側・模範側それぞれを np.unique で疎なカウントベクトル（(ペア, 次数, n-gram) -> 件数）
+# にし、np.intersect1d で共通部分の min を取るので、数千ペアでも 1 回の呼び出しで済む。
+#
+#   chrf_batch(answers, references) -> np.ndarray[float]   # 0.0〜1.0
+#   score_batch(answers, references) -> np.ndarray[int]    # 0〜100
+#   grade(answer, reference) -> (score, feedback)
+import re
+import unicodedata
+
+import numpy as np
+
+MAX_ORDER = 6   # chrF の既定（文字 6-gram まで）
+BETA = 2.0      # 再現率を重視（訳し漏れを強めに減点）
+
+_HASH_BASE = np.uint64(1099511628211)        # FNV prime
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)    # 下位ビットを捨てる前に全ビットを上位へ混ぜる
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text):
+    """全角半角・大文字小文字をそろえ、空白を除く（chrF は空白を数えない）"""
+    return _SPACES.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def _ngram_table(texts, max_order):
+    """
+    全テキストの n-gram を数える。
+    戻り値: (keys, groups, counts)
+      groups = テキスト番号 * max_order + (n - 1)
+      keys は上位ビットが n-gram ハッシュ、下位ビットが groups（groups ごとに一意）
+    """
+    encoded = [normalize(t).encode("utf-32-le") for t in texts]
+    lengths = np.fromiter((len(e) // 4 for e in encoded), dtype=np.int64, count=len(encoded))
+    codes = np.frombuffer(b"".join(encoded), dtype=np.uint32).astype(np.uint64)
+    owner = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+    all_hashes, all_groups = [], []
+    h = np.zeros(len(codes), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for n in range(1, max_order + 1):
+            m = len(codes) - n + 1
+            if m <= 0:
+                break
+            # n-gram のハッシュは (n-1)-gram のハッシュから 1 文字ずらして作る（uint64 で桁あふれさせる）
+            h = h[:m] * _HASH_BASE + codes[n - 1:n - 1 + m]
+            # テキストの境界をまたぐ窓は捨てる
+            valid = owner[:m] == owner[n - 1:n - 1 + m]
+            all_hashes.append(h[valid])
+            all_groups.append(owner[:m][valid] * max_order + (n - 1))
+
+    if not all_hashes:
+        empty = np.zeros(0, dtype=np.uint64)
+        return empty, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # グループ番号を下位ビットにそのまま入れておけば、np.unique（安定ソート不要）の後に取り出せる
+    group_bits = np.uint64(max(1, int(len(texts) * max_order - 1).bit_length()))
+    mask = (np.uint64(1) << group_bits) - np.uint64(1)
+    with np.errstate(over="ignore"):
+        mixed = np.concatenate(all_hashes) * _HASH_MIX
+    combined = (mixed & ~mask) | np.concatenate(all_groups).astype(np.uint64)
+    keys, counts = np.unique(combined, return_counts=True)
+    return keys, (keys & mask).astype(np.int64), counts
+
+
+def chrf_batch(answers, references, max_order=MAX_ORDER, beta=BETA):
+    """
+    answers[i] と references[i] の chrF を一括で計算する（0.0〜1.0 の配列）。
+    どちらかが空のペアは 0.0。
+    """
+    if len(answers) != len(references):
+        raise ValueError("answers and references must have the same length")
+    n_pairs = len(answers)
+    if n_pairs == 0:
+        return np.zeros(0)
+    size = n_pairs * max_order
+
+    hyp_keys, hyp_groups, hyp_counts = _ngram_table(answers, max_order)
+    ref_keys, ref_groups, ref_counts = _ngram_table(references, max_order)
+
+    hyp_total = np.bincount(hyp_groups, weights=hyp_counts, minlength=size)
+    ref_total = np.bincount(ref_groups, weights=ref_counts, minlength=size)
+    _, hi, ri = np.intersect1d(hyp_keys, ref_keys, assume_unique=True, return_indices=True)
+    matches = np.bincount(hyp_groups[hi], weights=np.minimum(hyp_counts[hi], ref_counts[ri]),
+                          minlength=size)
+
+    hyp_total = hyp_total.reshape(n_pairs, max_order)
+    ref_total = ref_total.reshape(n_pairs, max_order)
+    matches = matches.reshape(n_pairs, max_order)
+
+    # 両側に n-gram がある次数だけで平均する（短い回答で高次の n-gram が無い場合）
+    effective = (hyp_total > 0) & (ref_total > 0)
+    n_effective = effective.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(effective, matches / hyp_total, 0.0).sum(axis=1) / n_effective
+        recall = np.where(effective, matches / ref_total, 0.0).sum(axis=1) / n_effective
+        b2 = beta * beta
+        f = (1 + b2) * precision * recall / (b2 * precision + recall)
+    return np.nan_to_num(f, nan=0.0)
+
+
+def chrf(answer, reference, max_order=MAX_ORDER, beta=BETA):
+    return float(chrf_batch([answer], [reference], max_order, beta)[0])
+
+
+def score_batch(answers, references):
+    """chrF を 0〜100 点に直したもの"""
+    return np.rint(chrf_batch(answers, references) * 100).astype(np.int64)
+
+
+def feedback_for(score):
+    if score >= 90:
+        text = "模範解答とほぼ一致しています。"
+    elif score >= 70:
+        text = "模範解答に近い回答です。細かい表現を見直してみましょう。"
+    elif score >= 40:
+        text = "部分的に合っています。模範解答と比べて抜けている内容を確認しましょう。"
+    else:
+        text = "模範解答との共通部分が少ないです。もう一度挑戦してみましょう。"
+    return f"（簡易採点）{text}"
+
+
+def grade(answer, reference):
+    """1 件だけ採点する。戻り値: (score:int, feedback:str)"""
+    score = int(score_batch([answer], [reference])[0])
+    return score, feedback_for(score)
@@ -0,0 +1,271 @@
+# metering.py
+# Gemini 呼び出しごとのトークン数・レイテンシ・料金の記録と、機能ごとの 1 日の予算。
+#
+#   METER = metering.Meter(DB_FILE, budgets={"reading": 500000}, writer=...)
+#   METER.check("reading")                       # 今日の予算を超えていたら admission.Shed("budget")
+#   with METER.metered("reading", prompt, endpoint, user_id) as call:
+#       res = model.generate_content(prompt)
+#       call.finish(res.text, res.usage_metadata)
+#
+# context caching（context_cache.py）を使った呼び出しは metered(..., cached=context) と渡す。
+# キャッシュから読んだ分は cached_tokens に分けて記録し、割安の price_cached_per_m で計算する。
+#
+# トークン数は Gemini の usage_metadata があればそれを使い、無ければ（偽 Gemini など）
+# 文字数から見積もる。記録は llm_usage テーブルに 1 呼び出し 1 行で、書き込みは
+# writer（app.py では ANSWER_WRITER の group commit）に任せる。
+#
+# 予算の判定に使う「今日の使用量」はプロセス内で足していき、REFRESH_SEC ごとに
+# DB の合計（他のプロセスの分も含む）で置き換える。
+#
+# どこでトークンを使っているかの集計:
+#   python metering.py report [--db english_learning.db] [--days 7]
+import argparse
+import contextlib
+import datetime
+import logging
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import admission
+import metrics
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SEC = 60
+ALL = "all"   # 予算のキー: 全機能の合計
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        endpoint TEXT,
+        user_id INTEGER,
+        prompt_tokens INTEGER NOT NULL,
+        output_tokens INTEGER NOT NULL,
+        cached_tokens INTEGER NOT NULL DEFAULT 0,
+        latency_ms REAL NOT NULL,
+        cost_usd REAL NOT NULL,
+        outcome TEXT NOT NULL
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_llm_usage_day ON llm_usage(day, feature)",
+]
+
+INSERT_SQL = """INSERT INTO llm_usage
+    (day, created_at, feature, endpoint, user_id, prompt_tokens, output_tokens, cached_tokens,
+     latency_ms, cost_usd, outcome)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+def estimate_tokens(text):
+    """usage_metadata が無いときの見積もり: ASCII は 4 文字で 1、それ以外（日本語など）は 1 文字 1"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def parse_budgets(spec):
+    """"reading=500000,all=2000000" -> {"reading": 500000, "all": 2000000}"""
+    budgets = {}
+    for part in (spec or "").split(","):
+        key, _, value = part.partition("=")
+        if key.strip() and value.strip():
+            budgets[key.strip()] = int(value)
+    return budgets
+
+
+def today():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d")
+
+
+class _Call:
+    __slots__ = ("text", "usage")
+
+    def __init__(self):
+        self.text = ""
+        self.usage = None
+
+    def finish(self, text, usage=None):
+        self.text = text or ""
+        self.usage = usage
+
+
+class Meter:
+    def __init__(self, db_file, budgets=None, price_input_per_m=0.30, price_output_per_m=2.50,
+                 price_cached_per_m=0.075, writer=None):
+        self.db_file = db_file
+        self.budgets = budgets or {}
+        self.price_input = price_input_per_m / 1e6
+        self.price_output = price_output_per_m / 1e6
+        self.price_cached = price_cached_per_m / 1e6
+        self.writer = writer          # writer(row)。None ならその場で INSERT
+        self._lock = threading.Lock()
+        self._day = None
+        self._used = defaultdict(int)  # feature -> 今日のトークン数
+        self._refreshed_at = 0.0
+
+    def init(self):
+        with db_connect(self.db_file) as conn:
+            for stmt in CREATE_STATEMENTS:
+                conn.execute(stmt)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(llm_usage)")}
+            if "cached_tokens" not in columns:
+                conn.execute("ALTER TABLE llm_usage ADD COLUMN cached_tokens INTEGER NOT NULL DEFAULT 0")
+            conn.commit()
+        self._refresh()
+
+    # ======================================================
+    # 予算
+    # ======================================================
+    def _refresh(self):
+        day = today()
+        with db_connect(self.db_file) as conn:
+            rows = conn.execute(
+                "SELECT feature, SUM(prompt_tokens + output_tokens) FROM llm_usage WHERE day = ? GROUP BY feature",
+                (day,),
+            ).fetchall()
+        with self._lock:
+            self._day = day
+            self._used = defaultdict(int, {f: int(n or 0) for f, n in rows})
+            self._refreshed_at = time.monotonic()
+
+    def used_today(self, feature=ALL):
+        if self._day != today() or time.monotonic() - self._refreshed_at >= REFRESH_SEC:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error("metering refresh error: %s", e)
+        with self._lock:
+            if feature == ALL:
+                return sum(self._used.values())
+            return self._used[feature]
+
+    def over_budget(self, feature):
+        for key in (feature, ALL):
+            limit = self.budgets.get(key)
+            if limit is not None and self.used_today(key) >= limit:
+                return key
+        return None
+
+    def check(self, feature):
+        """今日の予算を使い切っていたら admission.Shed("budget") を投げる（採点はローカルに回る）"""
+        if not self.budgets:
+            return
+        key = self.over_budget(feature)
+        if key is not None:
+            metrics.inc("llm_budget_exceeded_total", feature=feature, budget=key)
+            raise admission.Shed("budget")
+
+    # ======================================================
+    # 記録
+    # ======================================================
+    def cost(self, prompt_tokens, output_tokens, cached_tokens=0):
+        return (prompt_tokens * self.price_input + output_tokens * self.price_output
+                + cached_tokens * self.price_cached)
+
+    @contextlib.contextmanager
+    def metered(self, feature, prompt, endpoint=None, user_id=None, cached=None):
+        """cached: キャッシュ済みの context（prompt には含めずに送った分）"""
+        call = _Call()
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield call
+            outcome = "ok"
+        finally:
+            try:
+                self.record(feature, prompt, call.text, call.usage, time.perf_counter() - start,
+                            outcome, endpoint, user_id, cached)
+            except Exception as e:
+                logger.error("metering record error: %s", e)
+
+    def record(self, feature, prompt, text, usage, latency, outcome, endpoint=None, user_id=None,
+               cached=None):
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None)
+        if cached_tokens is None:
+            cached_tokens = estimate_tokens(cached) if cached else 0
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(prompt)
+        else:
+            # Gemini の prompt_token_count はキャッシュ分を含むので、送った分だけにする
+            prompt_tokens = max(0, prompt_tokens - cached_tokens)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(text)
+        cost = self.cost(prompt_tokens, output_tokens, cached_tokens)
+        now = datetime.datetime.utcnow()
+        row = (now.strftime("%Y-%m-%d"), now.isoformat(), feature, endpoint, user_id,
+               prompt_tokens, output_tokens, cached_tokens, latency * 1000, cost, outcome)
+        with self._lock:
+            if self._day == row[0]:
+                self._used[feature] += prompt_tokens + output_tokens
+        metrics.inc("llm_tokens_total", prompt_tokens, feature=feature, kind="prompt")
+        metrics.inc("llm_tokens_total", output_tokens, feature=feature, kind="output")
+        if cached_tokens:
+            metrics.inc("llm_tokens_total", cached_tokens, feature=feature, kind="cached")
+        metrics.inc("llm_cost_usd_total", cost, feature=feature)
+        if self.writer is not None:
+            self.writer(row)
+        else:
+            with db_connect(self.db_file) as conn:
+                conn.execute(INSERT_SQL, row)
+                conn.commit()
+
+
+# ======================================================
+# 集計レポート
+# ======================================================
+def report(db_file, days=7, out=sys.stdout):
+    since = (datetime.datetime.utcnow() - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    with db_connect(db_file) as conn:
+        total = conn.execute(
+            "SELECT COUNT(*), SUM(prompt_tokens + output_tokens), SUM(cost_usd) FROM llm_usage WHERE day >= ?",
+            (since,),
+        ).fetchone()
+        sections = []
+        for title, key in (("feature", "feature"), ("endpoint", "COALESCE(endpoint, '-')"), ("day", "day")):
+            sections.append((title, conn.execute(f"""
+                SELECT {key}, COUNT(*), SUM(prompt_tokens), SUM(output_tokens), SUM(cached_tokens),
+                       SUM(cost_usd), AVG(latency_ms), SUM(outcome != 'ok')
+                FROM llm_usage WHERE day >= ? GROUP BY 1
+                ORDER BY SUM(prompt_tokens + output_tokens) DESC
+            """, (since,)).fetchall()))
+        users = conn.execute("""
+            SELECT COALESCE(user_id, '-'), COUNT(*), SUM(prompt_tokens), SUM(output_tokens), SUM(cached_tokens),
+                   SUM(cost_usd), AVG(latency_ms), SUM(outcome != 'ok')
+            FROM llm_usage WHERE day >= ? GROUP BY 1
+            ORDER BY SUM(prompt_tokens + output_tokens) DESC LIMIT 10
+        """, (since,)).fetchall()
+    sections.append(("user (top 10)", users))
+
+    calls, tokens, cost = total[0], total[1] or 0, total[2] or 0.0
+    print(f"LLM usage since {since}: {calls} calls, {tokens:,} tokens, ${cost:.4f}", file=out)
+    for title, rows in sections:
+        print(f"\n{title:24s} {'calls':>7s} {'prompt':>11s} {'output':>10s} {'cached':>11s} {'share':>6s} "
+              f"{'cost $':>9s} {'avg ms':>8s} {'errors':>6s}", file=out)
+        for name, n, p, o, cached, c, lat, err in rows:
+            share = (p + o) / tokens * 100 if tokens else 0
+            print(f"{str(name)[:24]:24s} {n:7d} {p:11,d} {o:10,d} {cached:11,d} {share:5.1f}% "
+                  f"{c:9.4f} {lat:8.0f} {err:6d}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini のトークン使用量の集計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="機能・ルート・日・ユーザーごとの使用量")
+    rep.add_argument("--db", default="english_learning.db")
+    rep.add_argument("--days", type=int, default=7)
+    args = parser.parse_args(argv)
+    report(args.db, args.days)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
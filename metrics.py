@@ -0,0 +1,305 @@
+# metrics.py
+# リクエスト計測（ルートごとの処理時間・DB 時間・Gemini 時間・キャッシュ / フォールバック回数）
+# と Prometheus テキスト形式での出力、遅いリクエストのスタックサンプリング。
+import contextvars
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# 秒単位のヒストグラム境界（Gemini 待ちは数秒かかるので上を広めに）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)         # (name, labels) -> value
+_gauges = defaultdict(float)           # (name, labels) -> value
+_histograms = {}                       # (name, labels) -> [bucket_counts, sum, count]
+_help = {}                             # name -> (type, help)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def describe(name, metric_type, help_text):
+    _help[name] = (metric_type, help_text)
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def gauge_add(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [[0] * len(buckets), 0.0, 0, buckets]
+        for i, b in enumerate(h[3]):
+            if value <= b:
+                h[0][i] += 1
+        h[1] += value
+        h[2] += 1
+
+
+def cache_hit(cache):
+    inc("cache_requests_total", cache=cache, result="hit")
+
+
+def cache_miss(cache):
+    inc("cache_requests_total", cache=cache, result="miss")
+
+
+def fallback(feature, reason):
+    """Gemini を使わず簡易採点に落ちた回数"""
+    inc("grading_fallback_total", feature=feature, reason=reason)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+# ======================================================
+# リクエスト単位の計測
+# ======================================================
+class RequestStats:
+    __slots__ = ("endpoint", "start", "db_time", "llm_time", "llm_calls", "thread_id", "samples")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.llm_time = 0.0
+        self.llm_calls = 0
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+_active = {}  # id(stats) -> RequestStats（スタックサンプリング用。ASGI では同じスレッドを共有する）
+
+
+def begin_request(endpoint):
+    stats = RequestStats(endpoint or "unknown")
+    _current.set(stats)
+    with _lock:
+        _active[id(stats)] = stats
+    gauge_add("http_requests_in_flight", 1)
+    return stats
+
+
+def end_request(method, status):
+    stats = _current.get()
+    if stats is None:
+        return None
+    _current.set(None)
+    with _lock:
+        _active.pop(id(stats), None)
+    gauge_add("http_requests_in_flight", -1)
+
+    wall = stats.elapsed()
+    ep = stats.endpoint
+    inc("http_requests_total", endpoint=ep, method=method, status=str(status))
+    observe("http_request_duration_seconds", wall, endpoint=ep)
+    observe("http_request_db_seconds", stats.db_time, endpoint=ep)
+    if stats.llm_calls:
+        observe("http_request_llm_seconds", stats.llm_time, endpoint=ep)
+
+    if SLOW_REQUEST_SEC > 0 and wall >= SLOW_REQUEST_SEC:
+        log_slow_request(stats, wall, method, status)
+    return stats
+
+
+def add_db_time(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.db_time += seconds
+    inc("db_time_seconds_total", seconds)
+
+
+class timed_llm:
+    """with timed_llm("word"): model.generate_content(...)"""
+
+    def __init__(self, feature):
+        self.feature = feature
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stats = _current.get()
+        if stats is not None:
+            stats.llm_time += elapsed
+            stats.llm_calls += 1
+        outcome = "error" if exc_type else "ok"
+        inc("llm_calls_total", feature=self.feature, outcome=outcome)
+        observe("llm_call_duration_seconds", elapsed, feature=self.feature)
+        return False
+
+
+# ======================================================
+# 遅いリクエストのログ（スタックサンプリング）
+# ======================================================
+SLOW_REQUEST_SEC = 0.0
+SAMPLE_INTERVAL_SEC = 0.05
+_sampler_started = False
+
+
+def start_slow_request_sampler(threshold_sec, interval_sec=SAMPLE_INTERVAL_SEC):
+    """
+    threshold_sec を超えて実行中のリクエストのスタックを interval_sec ごとに採取し、
+    終了時に多かったスタックをログに出す。threshold_sec <= 0 なら無効。
+    """
+    global SLOW_REQUEST_SEC, SAMPLE_INTERVAL_SEC, _sampler_started
+    SLOW_REQUEST_SEC = threshold_sec
+    SAMPLE_INTERVAL_SEC = interval_sec
+    if threshold_sec <= 0 or _sampler_started:
+        return
+    _sampler_started = True
+    t = threading.Thread(target=_sampler_loop, name="slow-request-sampler", daemon=True)
+    t.start()
+
+
+def _sampler_loop():
+    while True:
+        time.sleep(SAMPLE_INTERVAL_SEC)
+        with _lock:
+            slow = [s for s in _active.values() if s.elapsed() >= SLOW_REQUEST_SEC]
+        if not slow:
+            continue
+        frames = sys._current_frames()
+        for stats in slow:
+            frame = frames.get(stats.thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=12)
+            sig = " <- ".join(f"{f.name}({f.filename.rsplit('/', 1)[-1]}:{f.lineno})" for f in reversed(stack))
+            stats.samples[sig] += 1
+
+
+def log_slow_request(stats, wall, method, status):
+    inc("slow_requests_total", endpoint=stats.endpoint)
+    top = stats.samples.most_common(3)
+    logger.warning(
+        "slow request: %s %s status=%s wall=%.3fs db=%.3fs llm=%.3fs(%d calls) samples=%d%s",
+        method, stats.endpoint, status, wall, stats.db_time, stats.llm_time, stats.llm_calls,
+        sum(stats.samples.values()),
+        "".join(f"\n  [{n}x] {sig}" for sig, n in top),
+    )
+
+
+# ======================================================
+# Prometheus テキスト形式
+# ======================================================
+describe("http_requests_total", "counter", "HTTP requests by endpoint, method and status.")
+describe("http_requests_in_flight", "gauge", "HTTP requests currently being served.")
+describe("http_request_duration_seconds", "histogram", "Wall time per request.")
+describe("http_request_db_seconds", "histogram", "Time spent in SQLite per request.")
+describe("http_request_llm_seconds", "histogram", "Time spent waiting on Gemini per request.")
+describe("db_time_seconds_total", "counter", "Total time spent in SQLite.")
+describe("llm_calls_total", "counter", "Gemini calls by feature and outcome.")
+describe("llm_call_duration_seconds", "histogram", "Latency of individual Gemini calls.")
+describe("cache_requests_total", "counter", "Cache lookups by cache and result.")
+describe("grading_fallback_total", "counter", "Gradings that used the local fallback scorer.")
+describe("grading_prefilter_total", "counter", "Gradings settled by the local scorer without calling Gemini.")
+describe("answer_flushes_total", "counter", "Group commits of queued answer rows.")
+describe("answer_flush_rows", "histogram", "Rows written per answer group commit.")
+describe("answer_write_errors_total", "counter", "Answer rows dropped because they could not be written.")
+describe("word_picks_total", "counter", "Word quiz questions picked, by selection mode (adaptive or random).")
+describe("admission_shed_total", "counter", "Gemini calls refused by admission control, by reason.")
+describe("admission_queued_total", "counter", "Gemini calls that waited for a free in-flight slot.")
+describe("admission_wait_seconds", "histogram", "Time spent waiting for an in-flight Gemini slot.")
+describe("llm_in_flight", "gauge", "Gemini calls currently in flight.")
+describe("llm_queue_depth", "gauge", "Gemini calls currently waiting for a slot.")
+describe("toeic_local_grades_total", "counter", "TOEIC multiple-choice questions graded locally without Gemini.")
+describe("llm_tokens_total", "counter", "Gemini tokens by feature and kind (prompt, output or cached).")
+describe("llm_cost_usd_total", "counter", "Estimated Gemini cost in USD by feature.")
+describe("llm_budget_exceeded_total", "counter", "Gemini calls skipped because a daily token budget was used up.")
+describe("slow_requests_total", "counter", "Requests slower than the slow-request threshold.")
+describe("context_cache_total", "counter", "Grading context lookups by result (hit, miss, inline or error).")
+describe("log_records_dropped_total", "counter", "Log records dropped because the log queue was full.")
+describe("log_records_sampled_out_total", "counter", "Verbose log records skipped by per-event sampling.")
+describe("snapshot_shipped_rows_total", "counter", "User data rows shipped to durable snapshot storage.")
+describe("snapshot_shipped_bytes_total", "counter", "Compressed bytes shipped to durable snapshot storage.")
+describe("snapshot_restored_rows_total", "counter", "User data rows restored from snapshot storage at startup.")
+describe("snapshot_compactions_total", "counter", "Snapshot segment compactions.")
+describe("snapshot_errors_total", "counter", "Failed periodic snapshot shipments.")
+describe("answers_archived_total", "counter", "Answer rows moved from hot tables to archive tables.")
+describe("db_vacuumed_pages_total", "counter", "Free pages returned to the filesystem by incremental vacuum.")
+describe("export_rows_total", "counter", "Answer history rows streamed by the export endpoint and CLI, by format.")
+describe("guest_sessions", "gauge", "Guest sessions currently held in memory.")
+describe("guest_answers_total", "counter", "Guest answers kept in memory instead of the database, by table.")
+describe("guest_sessions_evicted_total", "counter", "Guest sessions dropped from memory, by reason (ttl or capacity).")
+describe("guest_answers_claimed_total", "counter", "Guest answers moved into a newly registered account.")
+describe("word_choice_answers_total", "counter", "Multiple-choice word answers graded locally without Gemini, by result.")
+describe("word_choice_auto_total", "counter", "Word quiz pages switched to multiple choice because Gemini was over budget or queued.")
+describe("word_choice_expired_total", "counter", "Issued multiple-choice questions dropped unanswered, by reason (ttl/capacity).")
+
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+def _fmt_value(v):
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+def render_prometheus():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {k: (list(v[0]), v[1], v[2], v[3]) for k, v in _histograms.items()}
+
+    by_name = defaultdict(list)
+    for (name, labels), v in counters.items():
+        by_name[name].append(("c", labels, v))
+    for (name, labels), v in gauges.items():
+        by_name[name].append(("g", labels, v))
+    for (name, labels), v in histograms.items():
+        by_name[name].append(("h", labels, v))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = _help.get(name, (None, None))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        if metric_type:
+            lines.append(f"# TYPE {name} {metric_type}")
+        for kind, labels, v in sorted(by_name[name], key=lambda x: x[1]):
+            if kind != "h":
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}")
+                continue
+            bucket_counts, total, count, buckets = v
+            for b, n in zip(buckets, bucket_counts):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', b)])} {n}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,66 @@
+# pos.py
+# 品詞の英語キー（words.pos に入っている "noun" など）と日本語表記。
+# app.py の採点結果の表示と、load_words.py の取り込みで使う。
+import re
+
+# ======================================================
+# 品詞マップ (英語キー -> 日本語)
+# ======================================================
+POS_JA = {
+    "adjective": "形容詞",
+    "adj": "形容詞",
+    "noun": "名詞",
+    "n": "名詞",
+    "verb": "動詞",
+    "v": "動詞",
+    "adverb": "副詞",
+    "adv": "副詞",
+    "pronoun": "代名詞",
+    "preposition": "前置詞",
+    "conjunction": "接続詞",
+    "interjection": "間投詞",
+    "article": "冠詞",
+    "determiner": "限定詞",
+    "numeral": "数詞",
+    "particle": "助詞",
+    "modal": "法助動詞",
+    "other": "その他",
+}
+
+
+# ======================================================
+# 品詞文字列正規化関数
+# ======================================================
+def normalize_pos_string(raw):
+    """
+    raw: 例 "noun, verb" や "noun/verb" や "Noun Verb" など
+    戻り値: "名詞・動詞" のような日本語結合文字列。情報無しなら "その他"
+    """
+    if not raw:
+        return "その他"
+    # 小文字化して分割（カンマ、スラッシュ、全角読点、空白などを区切りとする）
+    parts = re.split(r"[,\u3001/\\\s]+", str(raw).strip().lower())
+    mapped = []
+    for p in parts:
+        if not p:
+            continue
+        # もし p が複数語（like "noun (countable)"), take first token before non-alpha
+        token = re.match(r"[a-z]+", p)
+        key = token.group(0) if token else p
+        ja = POS_JA.get(key, None)
+        if ja:
+            mapped.append(ja)
+        else:
+            # try to map english full words (e.g., "nounplural") fallback to その他 later
+            # skip unknown tokens
+            continue
+    # dedupe while preserving order
+    seen = set()
+    result = []
+    for x in mapped:
+        if x not in seen:
+            seen.add(x)
+            result.append(x)
+    if result:
+        return "・".join(result)
+    return "その他"
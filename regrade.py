@@ -0,0 +1,523 @@
+# regrade.py
+# 過去の回答を、今の（または別の版の）採点プロンプトで採点し直す。
+#
+#   python regrade.py run --source writing [--run-id ID] [--since 2026-01-01] [--limit 1000]
+#                         [--workers 8] [--rate 4] [--local] [--variant writing-v2=prompts/writing_v2.txt]
+#                         [--apply] [--retry-failed]
+#   python regrade.py ab --source writing --a writing-v1 --b writing-v2=prompts/writing_v2.txt [--sample 200]
+#   python regrade.py report --source writing --run-id ID
+#
+# - 採点は app.py の grade_word / grade_writing / grade_reading（画面からの採点と同じフロー）を
+#   run_sync で呼ぶ。--local なら Gemini を使わずローカルの簡易採点（chrF など）だけで付ける。
+# - 回答は id 順に PAGE 行ずつ読み、スレッドプール（--workers）で並行に採点する。
+#   Gemini を呼ぶ回数は --rate（毎秒）まで。
+# - 結果はページごとに regrade_results に書き、そのあと regrade_runs.last_id（どこまで済んだか）を
+#   進める。途中で止めても同じ --run-id で続きから動く。採点に失敗した回答は regrade_failures に
+#   残り、--retry-failed を付けると同じ --run-id の失敗した回答だけをもう一度採点する。
+# - --apply を付けると回答テーブルの score / feedback も書き換え、最後にランキング（単語なら
+#   word_stats も）を再集計する。
+#   アーカイブ済み（archive.py）の行は対象外。
+# - --apply のときに SNAPSHOT_URL（snapshot.py）が設定されていれば、始める前に送ってあった行を
+#   DB に戻し、書き換えた行はページごとに送り直す（last_id を進める前なので、途中で落ちても
+#   続きから動かせば送り直される）。app の import ではスナップショットを動かさない。
+# - --variant は "<バージョン>=<ファイル>"。ファイルの文面を指示（読解は {passage} 入りのテンプレート）
+#   として使う。バージョンだけなら今の app.py の文面。
+# - ab は同じ回答の抜き出しを 2 つの版で採点し、点数の差を並べる（回答テーブルは書き換えない）。
+#
+# 単語クイズは回答の本文（student_answers.user_answer）を保存し始めてからの行だけが対象。
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# app を import する前に、バックグラウンドの再集計・アーカイブ・スナップショットを止めておく
+# （スナップショットはここで Snapshotter を作り、書き換えた行だけを送る）
+os.environ.setdefault("LEADERBOARD_REFRESH_SEC", "0")
+os.environ.setdefault("ARCHIVE_INTERVAL_SEC", "0")
+SNAPSHOT_URL = os.environ.get("SNAPSHOT_URL", "")
+os.environ["SNAPSHOT_URL"] = ""
+
+import admission   # noqa: E402
+import app as app_module   # noqa: E402
+import local_scorer   # noqa: E402
+import snapshot   # noqa: E402
+import word_stats   # noqa: E402
+from db import connect as db_connect   # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+PAGE_PER_WORKER = 10
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS regrade_runs (
+        run_id TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        variant TEXT NOT NULL,
+        options TEXT,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        graded INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT,
+        updated_at TEXT,
+        finished_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS regrade_results (
+        run_id TEXT NOT NULL,
+        answer_id INTEGER NOT NULL,
+        old_score INTEGER,
+        new_score INTEGER,
+        feedback TEXT,
+        fallback INTEGER NOT NULL DEFAULT 0,
+        graded_at TEXT,
+        PRIMARY KEY (run_id, answer_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS regrade_failures (
+        run_id TEXT NOT NULL,
+        answer_id INTEGER NOT NULL,
+        error TEXT,
+        failed_at TEXT,
+        PRIMARY KEY (run_id, answer_id)
+    )''',
+]
+
+
+# ======================================================
+# 対象ごとの読み出しと採点
+# ======================================================
+class Source:
+    def __init__(self, name, table, db_file, columns, answer_column, version, prompt):
+        self.name = name
+        self.table = table
+        self.db_file = db_file
+        self.columns = columns            # 読み出す列（先頭は id）
+        self.answer_column = answer_column
+        self.version = version            # 今の app.py のプロンプトのバージョン
+        self.prompt = prompt              # 今の app.py の文面
+
+
+SOURCES = {
+    "word": Source(
+        "word", "student_answers", app_module.DB_FILE,
+        ("id", "user_id", "word_id", "score", "user_answer"), "user_answer",
+        app_module.WORD_PROMPT_VERSION, app_module.WORD_GRADING_CONTEXT,
+    ),
+    "writing": Source(
+        "writing", "writing_answers", app_module.WRITING_DB,
+        ("id", "user_id", "prompt_id", "score", "answer"), "answer",
+        app_module.WRITING_PROMPT_VERSION, app_module.WRITING_GRADING_CONTEXT,
+    ),
+    "reading": Source(
+        "reading", "reading_answers", app_module.READING_DB,
+        ("id", "user_id", "passage_id", "score", "user_answer"), "user_answer",
+        app_module.READING_PROMPT_VERSION, app_module.READING_GRADING_TEMPLATE,
+    ),
+}
+
+
+def parse_variant(source, spec):
+    """"writing-v2=path.txt" -> ("writing-v2", 文面)。バージョンだけなら今の文面（同じ名前のときだけ）"""
+    if not spec:
+        return source.version, source.prompt
+    version, _, path = spec.partition("=")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return version, f.read()
+    if version != source.version:
+        raise SystemExit(f"{version}: no prompt file given (current version is {source.version})")
+    return source.version, source.prompt
+
+
+def get_writing_prompt_text(prompt_id):
+    with db_connect(app_module.WRITING_DB) as conn:
+        row = conn.execute("SELECT prompt_text FROM writing_prompts WHERE id = ?", (prompt_id,)).fetchone()
+    return row[0] if row else ""
+
+
+def grade_row(source, row, variant, local):
+    """(score, feedback, fallback) を返す。fallback は Gemini を使わずに付けた点数なら True"""
+    m = app_module
+    answer = row[source.answer_column] or ""
+    if source.name == "word":
+        found = m.get_word_by_id(row["word_id"])
+        if not found:
+            raise LookupError(f"word {row['word_id']} not found")
+        word, meaning, pos = found
+        if local:
+            score, feedback, *_ = m.local_word_grade(word, meaning, answer, pos)
+            return score, feedback, True
+        score, feedback, *_ = m.run_sync(m.grade_word(word, meaning, answer, pos, variant))
+        if feedback == "採点エラー":
+            raise RuntimeError("Gemini word grading failed")
+        return score, feedback, feedback.startswith("（簡易採点）")
+
+    if source.name == "writing":
+        prompt_text = get_writing_prompt_text(row["prompt_id"])
+        reference = m.get_writing_reference(row["prompt_id"])
+        if local:
+            score, feedback, _ = m.local_writing_grade(answer, reference)
+            return score, feedback, True
+        try:
+            score, feedback, _ = m.run_sync(m.grade_writing(prompt_text, answer, reference, variant))
+            return score, feedback, False
+        except admission.Shed:
+            raise
+        except Exception as e:
+            # submit_writing と同じく、Gemini の失敗は簡易採点にする
+            logger.warning("writing %s: %s", row["id"], e)
+            score, feedback, _ = m.local_writing_grade(answer, reference)
+            return score, feedback, True
+
+    passage = m.get_reading_text(row["passage_id"]) or ""
+    reference = m.get_reading_reference(row["passage_id"])
+    if local:
+        if not reference:
+            raise LookupError(f"no reference translation for passage {row['passage_id']}")
+        score, feedback = local_scorer.grade(answer, reference)
+        return score, feedback, True
+    _, score, feedback = m.run_sync(
+        m.grade_reading(passage, answer, "", reference, row["passage_id"], variant)
+    )
+    if feedback.startswith("採点エラー"):
+        raise RuntimeError("Gemini reading grading failed")
+    return score, feedback, "簡易" in (feedback or "")
+
+
+# ======================================================
+# 実行
+# ======================================================
+def init_tables(db_file):
+    with db_connect(db_file) as conn:
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        conn.commit()
+
+
+def load_run(db_file, run_id):
+    with db_connect(db_file) as conn:
+        row = conn.execute(
+            "SELECT source, variant, last_id, graded, failed, finished_at FROM regrade_runs WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+    return row
+
+
+def failed_ids(db_file, run_id):
+    with db_connect(db_file) as conn:
+        return [r[0] for r in conn.execute(
+            "SELECT answer_id FROM regrade_failures WHERE run_id = ? ORDER BY answer_id", (run_id,)
+        )]
+
+
+def open_snapshots(url=None):
+    """SNAPSHOT_URL があれば Snapshotter を作り、送ってあった行を DB に戻す（無ければ None）"""
+    url = SNAPSHOT_URL if url is None else url
+    if not url:
+        return None
+    snaps = snapshot.Snapshotter(snapshot.backend_from_url(url), app_module.SNAPSHOT_TABLES)
+    snaps.restore()
+    return snaps
+
+
+def iter_pages(source, after_id, page_size, since=None, ids=None):
+    """id 順に page_size 行ずつ（ids を渡せばその id だけ）"""
+    cols = ", ".join(source.columns)
+    if ids is not None:
+        pending = sorted(i for i in ids if i > after_id)
+        for start in range(0, len(pending), page_size):
+            chunk = pending[start:start + page_size]
+            with db_connect(source.db_file) as conn:
+                rows = conn.execute(
+                    f"SELECT {cols} FROM {source.table} WHERE id IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                    chunk,
+                ).fetchall()
+            yield [dict(zip(source.columns, r)) for r in rows], chunk[-1]
+        return
+    where = f"id > ? AND {source.answer_column} IS NOT NULL"
+    params = []
+    if since:
+        where += " AND attempt_date >= ?"
+        params.append(since)
+    while True:
+        with db_connect(source.db_file) as conn:
+            rows = conn.execute(
+                f"SELECT {cols} FROM {source.table} WHERE {where} ORDER BY id LIMIT ?",
+                [after_id] + params + [page_size],
+            ).fetchall()
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        yield [dict(zip(source.columns, r)) for r in rows], after_id
+
+
+class RateLimiter:
+    """毎秒 rate 回まで（admission のトークンバケットを使い、足りなければ待つ）"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.backend = admission.MemoryBackend()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        while not self.backend.take_token("regrade", self.rate, max(1.0, self.rate)):
+            time.sleep(1.0 / self.rate / 2)
+
+
+def regrade(source, run_id, variant, workers=8, rate=0.0, local=False, apply=False,
+            since=None, limit=None, ids=None, retry_failed=False, snapshots=None, out=sys.stdout):
+    """
+    run_id の続きから採点し直す（retry_failed なら失敗した回答だけ）。戻り値は (採点した数, 失敗した数)。
+    snapshots（Snapshotter）を渡すと、apply で書き換えた行を送り直す。
+    """
+    init_tables(source.db_file)
+    version, prompt = variant
+    existing = load_run(source.db_file, run_id)
+    if existing:
+        if existing[0] != source.name or existing[1] != version:
+            raise SystemExit(f"run {run_id} was {existing[0]}/{existing[1]}, not {source.name}/{version}")
+        after_id, graded, failed = existing[2], existing[3], existing[4]
+        if retry_failed:
+            ids = failed_ids(source.db_file, run_id)
+            print(f"retrying {len(ids)} failed answers of {run_id}", file=out)
+        elif existing[5]:
+            print(f"run {run_id} already finished", file=out)
+            return graded, failed
+        else:
+            print(f"resuming {run_id} after id {after_id} ({graded} graded)", file=out)
+    elif retry_failed:
+        raise SystemExit(f"no run {run_id}")
+    else:
+        after_id, graded, failed = 0, 0, 0
+        now = datetime.datetime.utcnow().isoformat()
+        options = json.dumps({"local": local, "apply": apply, "since": since, "limit": limit,
+                              "ids": len(ids) if ids is not None else None})
+        with db_connect(source.db_file) as conn:
+            conn.execute(
+                "INSERT INTO regrade_runs (run_id, source, variant, options, started_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (run_id, source.name, version, options, now, now),
+            )
+            conn.commit()
+
+    limiter = RateLimiter(0 if local else rate)
+    use_variant = None if (version, prompt) == (source.version, source.prompt) else (version, prompt)
+
+    def work(row):
+        limiter.wait()
+        try:
+            return row, grade_row(source, row, use_variant, local), None
+        except Exception as e:
+            return row, None, e
+
+    page_size = max(1, workers * PAGE_PER_WORKER)
+    start = time.perf_counter()
+    done_now = 0          # --limit は 1 回の実行あたり（続きは同じ --run-id でもう一度）
+    exhausted = True
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="regrade") as pool:
+        # 失敗した回答は last_id より前にあるので、最初から（ids だけを）見る
+        pages = iter_pages(source, 0 if retry_failed else after_id, page_size, since, ids)
+        for rows, page_last_id in pages:
+            if limit is not None and done_now >= limit:
+                exhausted = False
+                break
+            if limit is not None and len(rows) > limit - done_now:
+                rows = rows[:limit - done_now]
+                page_last_id = rows[-1]["id"]
+                exhausted = False
+            results = list(pool.map(work, rows))
+            now = datetime.datetime.utcnow().isoformat()
+            ok = [(row, res) for row, res, err in results if err is None]
+            errors = [(row, err) for row, _, err in results if err is not None]
+            for row, err in errors:
+                logger.warning("regrade %s %s failed: %s", source.table, row["id"], err)
+            applied = []
+            if apply:
+                # Gemini で採点し直すときは、簡易採点に落ちた分で元の点数を上書きしない
+                applied = [(score, feedback, row["id"]) for row, (score, feedback, fb) in ok if local or not fb]
+            with db_connect(source.db_file) as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO regrade_results "
+                    "(run_id, answer_id, old_score, new_score, feedback, fallback, graded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, row["id"], row["score"], score, feedback, int(fb), now)
+                     for row, (score, feedback, fb) in ok],
+                )
+                conn.executemany(
+                    f"UPDATE {source.table} SET score = ?, feedback = ? WHERE id = ?", applied
+                )
+                conn.commit()
+            if snapshots is not None and applied:
+                # 送れてから last_id を進める（送れなければここで止まり、続きから動かすと送り直す）
+                snapshots.ship_rows(source.db_file, source.table, [a[2] for a in applied])
+            with db_connect(source.db_file) as conn:
+                conn.executemany(
+                    "DELETE FROM regrade_failures WHERE run_id = ? AND answer_id = ?",
+                    [(run_id, row["id"]) for row, _ in ok],
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO regrade_failures (run_id, answer_id, error, failed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(run_id, row["id"], f"{type(err).__name__}: {err}", now) for row, err in errors],
+                )
+                # 失敗の数は「今も失敗のままの回答」の数（やり直して採点できたものは外れる）
+                failed = conn.execute(
+                    "SELECT COUNT(*) FROM regrade_failures WHERE run_id = ?", (run_id,)
+                ).fetchone()[0]
+                graded += len(ok)
+                done_now += len(results)
+                if not retry_failed:
+                    after_id = page_last_id
+                conn.execute(
+                    "UPDATE regrade_runs SET last_id = ?, graded = ?, failed = ?, updated_at = ? WHERE run_id = ?",
+                    (after_id, graded, failed, now, run_id),
+                )
+                conn.commit()
+            elapsed = time.perf_counter() - start
+            print(f"{run_id}: {graded} graded, {failed} failed, up to id {page_last_id} "
+                  f"({done_now / elapsed if elapsed else 0:.1f}/s)", file=out)
+
+    if exhausted and not retry_failed:
+        with db_connect(source.db_file) as conn:
+            conn.execute("UPDATE regrade_runs SET finished_at = ? WHERE run_id = ?",
+                         (datetime.datetime.utcnow().isoformat(), run_id))
+            conn.commit()
+    if apply and graded:
+        app_module.refresh_leaderboard()
+        if source.table == "student_answers":
+            word_stats.rebuild(source.db_file)
+    return graded, failed
+
+
+# ======================================================
+# 集計
+# ======================================================
+def run_results(db_file, run_id):
+    with db_connect(db_file) as conn:
+        return conn.execute(
+            "SELECT answer_id, old_score, new_score, fallback FROM regrade_results WHERE run_id = ? ORDER BY answer_id",
+            (run_id,),
+        ).fetchall()
+
+
+def _mean(xs):
+    return statistics.fmean(xs) if xs else 0.0
+
+
+def report(source, run_id, out=sys.stdout):
+    rows = run_results(source.db_file, run_id)
+    run = load_run(source.db_file, run_id)
+    if run is None:
+        raise SystemExit(f"no run {run_id}")
+    pairs = [(o, n) for _, o, n, _ in rows if o is not None and n is not None]
+    print(f"run {run_id} ({run[0]}/{run[1]}): {len(rows)} graded, {run[4]} failed, "
+          f"{sum(r[3] for r in rows)} local fallback, {'finished' if run[5] else f'stopped after id {run[2]}'}",
+          file=out)
+    if pairs:
+        print(f"  mean score  old {_mean([o for o, _ in pairs]):6.1f}  new {_mean([n for _, n in pairs]):6.1f}",
+              file=out)
+        print(f"  mean |new - old| {_mean([abs(n - o) for o, n in pairs]):6.1f}", file=out)
+
+
+def compare(source, run_a, run_b, out=sys.stdout):
+    a = {r[0]: r for r in run_results(source.db_file, run_a)}
+    b = {r[0]: r for r in run_results(source.db_file, run_b)}
+    common = sorted(set(a) & set(b))
+    print(f"A={run_a}  B={run_b}  {len(common)} answers graded by both", file=out)
+    if not common:
+        return
+    sa = [a[i][2] for i in common]
+    sb = [b[i][2] for i in common]
+    old = [a[i][1] for i in common if a[i][1] is not None]
+    print(f"  mean score      A {_mean(sa):6.1f}  B {_mean(sb):6.1f}  stored {_mean(old):6.1f}", file=out)
+    print(f"  stdev           A {statistics.pstdev(sa):6.1f}  B {statistics.pstdev(sb):6.1f}", file=out)
+    print(f"  mean |A - B|      {_mean([abs(x - y) for x, y in zip(sa, sb)]):6.1f}", file=out)
+    print(f"  within 10 pts     {sum(abs(x - y) <= 10 for x, y in zip(sa, sb)) / len(common) * 100:5.1f}%", file=out)
+    if len(common) >= 3 and statistics.pstdev(sa) > 0 and statistics.pstdev(sb) > 0:
+        print(f"  corr(A, B)        {statistics.correlation(sa, sb):+.2f}", file=out)
+    print(f"  local fallback  A {sum(a[i][3] for i in common)}  B {sum(b[i][3] for i in common)}", file=out)
+
+
+def sample_ids(source, n, since=None, seed=None):
+    """比べる回答の id を n 個。seed が同じなら同じものを選ぶ（続きから動かせるように）"""
+    where = f"{source.answer_column} IS NOT NULL"
+    params = []
+    if since:
+        where += " AND attempt_date >= ?"
+        params.append(since)
+    with db_connect(source.db_file) as conn:
+        ids = [r[0] for r in conn.execute(f"SELECT id FROM {source.table} WHERE {where} ORDER BY id", params)]
+    return sorted(random.Random(seed).sample(ids, min(n, len(ids))))
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="過去の回答の採点し直し・採点プロンプトの A/B 比較")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--source", choices=sorted(SOURCES), required=True)
+        p.add_argument("--workers", type=int, default=8)
+        p.add_argument("--rate", type=float, default=4.0, help="Gemini 呼び出し / 秒（0 で無制限）")
+        p.add_argument("--local", action="store_true", help="Gemini を使わずローカルの簡易採点で付ける")
+        p.add_argument("--since", help="attempt_date がこれ以降の回答だけ（ISO 日付）")
+
+    run_p = sub.add_parser("run", help="採点し直して regrade_results に書く")
+    common(run_p)
+    run_p.add_argument("--run-id")
+    run_p.add_argument("--variant", help='"<バージョン>=<文面のファイル>"（省略時は今の app.py の文面）')
+    run_p.add_argument("--limit", type=int)
+    run_p.add_argument("--apply", action="store_true", help="回答テーブルの score / feedback も書き換える")
+    run_p.add_argument("--retry-failed", action="store_true", help="--run-id の採点に失敗した回答だけをやり直す")
+
+    ab_p = sub.add_parser("ab", help="同じ回答を 2 つの版で採点して比べる")
+    common(ab_p)
+    ab_p.add_argument("--a", required=True)
+    ab_p.add_argument("--b", required=True)
+    ab_p.add_argument("--sample", type=int, default=200)
+    ab_p.add_argument("--run-id", help="続きから動かすときの名前（省略時は日時）")
+
+    rep_p = sub.add_parser("report", help="run の結果")
+    rep_p.add_argument("--source", choices=sorted(SOURCES), required=True)
+    rep_p.add_argument("--run-id", required=True)
+    rep_p.add_argument("--compare", help="もう 1 つの run-id と比べる")
+
+    args = parser.parse_args(argv)
+    source = SOURCES[args.source]
+    if args.command == "run" and args.retry_failed and not args.run_id:
+        parser.error("--retry-failed needs --run-id")
+
+    try:
+        if args.command == "run":
+            variant = parse_variant(source, args.variant)
+            run_id = args.run_id or f"{source.name}-{variant[0]}-{datetime.datetime.utcnow():%Y%m%d%H%M%S}"
+            regrade(source, run_id, variant, args.workers, args.rate, args.local, args.apply,
+                    args.since, args.limit, retry_failed=args.retry_failed,
+                    snapshots=open_snapshots() if args.apply else None)
+            report(source, run_id)
+        elif args.command == "ab":
+            base = args.run_id or f"ab-{source.name}-{datetime.datetime.utcnow():%Y%m%d%H%M%S}"
+            # 抜き出しは run-id で決まるので、同じ --run-id なら続きから同じ回答で動く
+            ids = sample_ids(source, args.sample, args.since, seed=base)
+            for suffix, spec in (("a", args.a), ("b", args.b)):
+                regrade(source, f"{base}-{suffix}", parse_variant(source, spec), args.workers, args.rate,
+                        args.local, False, ids=ids)
+            compare(source, f"{base}-a", f"{base}-b")
+        else:
+            report(source, args.run_id)
+            if args.compare:
+                compare(source, args.run_id, args.compare)
+    finally:
+        # Gemini の使用量（llm_usage）を書き出す
+        app_module.ANSWER_WRITER.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# search_index.py
+# reading_texts（英文）と writing_prompts（日本語）の FTS5 全文検索インデックス。
+#
+# - reading_texts_fts : reading_texts を content に持つ外部コンテンツ表（porter 語幹化）。
+#                       INSERT / UPDATE / DELETE はトリガーで自動反映されるので、
+#                       fetchread.py はテーブル作成時に ensure_reading_index() を呼ぶだけでよい。
+# - writing_prompts_fts: 日本語は空白で区切られないので、文字 bigram を空白区切りにした列を
+#                       索引する（contentless）。語の検索は bigram のフレーズ検索になる。
+#                       fetchwrite.py / 起動時に index_writing_prompts() で未索引分を追加する。
+#
+# 検索は MATCH + ORDER BY rank（bm25）で、LIKE '%...%' の全件走査はしない。
+import logging
+import re
+import unicodedata
+
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+READING_STATEMENTS = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS reading_texts_fts USING fts5(
+        text, content='reading_texts', content_rowid='id', tokenize='porter unicode61'
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS reading_texts_fts_ai AFTER INSERT ON reading_texts BEGIN
+        INSERT INTO reading_texts_fts(rowid, text) VALUES (new.id, new.text);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS reading_texts_fts_ad AFTER DELETE ON reading_texts BEGIN
+        INSERT INTO reading_texts_fts(reading_texts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS reading_texts_fts_au AFTER UPDATE OF text ON reading_texts BEGIN
+        INSERT INTO reading_texts_fts(reading_texts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO reading_texts_fts(rowid, text) VALUES (new.id, new.text);
+    END''',
+]
+
+WRITING_STATEMENTS = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS writing_prompts_fts USING fts5(
+        grams, content='', tokenize='unicode61'
+    )''',
+]
+
+# 日本語の意味（definition_ja）から検索語を取り出すときの区切りと括弧書き
+_TERM_SPLIT = re.compile(r"[、，,。;；:：/／・「」『』\s]+")
+_PARENS = re.compile(r"[（(\[][^）)\]]*[）)\]]")
+MAX_TERM_LEN = 6   # 語釈の文（「〜すること。」）は検索語にしない
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+    ).fetchone() is not None
+
+
+# ======================================================
+# インデックスの作成・更新（conn を受け取るので取り込みスクリプトからも呼べる）
+# ======================================================
+def ensure_reading_index(conn):
+    """reading_texts_fts とトリガーを作る。新規作成なら既存行から一括構築する"""
+    created = not _table_exists(conn, "reading_texts_fts")
+    for stmt in READING_STATEMENTS:
+        conn.execute(stmt)
+    if created:
+        conn.execute("INSERT INTO reading_texts_fts(reading_texts_fts) VALUES ('rebuild')")
+        logger.info("reading_texts_fts built")
+    conn.commit()
+
+
+def to_bigrams(text):
+    """日本語テキスト -> 空白区切りの文字 bigram（記号をまたぐものは除く）"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return " ".join(
+        text[i:i + 2] for i in range(len(text) - 1)
+        if text[i].isalnum() and text[i + 1].isalnum()
+    )
+
+
+def ensure_writing_index(conn):
+    for stmt in WRITING_STATEMENTS:
+        conn.execute(stmt)
+    conn.commit()
+
+
+def index_writing_prompts(conn, batch_size=1000):
+    """まだ索引していない writing_prompts（rowid が索引の最大値より大きいもの）を追加する"""
+    ensure_writing_index(conn)
+    last = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM writing_prompts_fts").fetchone()[0]
+    cur = conn.execute("SELECT id, prompt_text FROM writing_prompts WHERE id > ? ORDER BY id", (last,))
+    added = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO writing_prompts_fts(rowid, grams) VALUES (?, ?)",
+            [(pid, to_bigrams(text)) for pid, text in rows],
+        )
+        added += len(rows)
+    conn.commit()
+    if added:
+        logger.info("writing_prompts_fts: indexed %d prompts", added)
+    return added
+
+
+def init_search_index(reading_db, writing_db):
+    """アプリ起動時に呼ぶ"""
+    try:
+        with db_connect(reading_db) as conn:
+            ensure_reading_index(conn)
+        with db_connect(writing_db) as conn:
+            index_writing_prompts(conn)
+    except Exception as e:
+        logger.error("init_search_index error: %s", e)
+
+
+# ======================================================
+# 検索クエリの組み立て
+# ======================================================
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def reading_query(words):
+    """英単語のリスト -> FTS5 の OR クエリ（含む語が多い文章ほど bm25 が高い）"""
+    terms = {w.strip().lower() for w in words if w and w.strip()}
+    return " OR ".join(_phrase(t) for t in sorted(terms))
+
+
+def writing_terms(meanings):
+    """
+    definition_ja -> 検索語のリスト。
+    語釈は「払い戻し」「願望、願う」のような訳語と、長い説明文が混ざっているので、
+    括弧書きを除いた先頭の区切りまでを取り、2〜MAX_TERM_LEN 文字のものだけ使う。
+    """
+    terms = set()
+    for meaning in meanings:
+        head = _TERM_SPLIT.split(_PARENS.sub("", meaning or "").strip(), maxsplit=1)[0]
+        if 2 <= len(head) <= MAX_TERM_LEN:
+            terms.add(head)
+    return sorted(terms)
+
+
+def writing_query(terms):
+    """日本語の語 -> bigram のフレーズ検索を OR でつないだもの"""
+    phrases = [to_bigrams(t) for t in terms]
+    return " OR ".join(_phrase(p) for p in phrases if p)
+
+
+# ======================================================
+# 検索
+# ======================================================
+def search_reading(db_file, words, limit=20):
+    """words を含む reading_texts を関連度順に返す: [{"id", "text", "snippet"}]"""
+    query = reading_query(words)
+    if not query:
+        return []
+    with db_connect(db_file) as conn:
+        rows = conn.execute("""
+            SELECT rowid, text, snippet(reading_texts_fts, 0, '[', ']', '…', 16)
+            FROM reading_texts_fts
+            WHERE reading_texts_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        """, (query, limit)).fetchall()
+    return [{"id": r[0], "text": r[1], "snippet": r[2]} for r in rows]
+
+
+def search_writing(db_file, terms, limit=20):
+    """日本語の語 terms を含む writing_prompts を関連度順に返す: [{"id", "text"}]"""
+    query = writing_query(terms)
+    if not query:
+        return []
+    with db_connect(db_file) as conn:
+        rows = conn.execute("""
+            SELECT p.id, p.prompt_text
+            FROM (SELECT rowid, rank FROM writing_prompts_fts
+                  WHERE writing_prompts_fts MATCH ? ORDER BY rank LIMIT ?) AS f
+            JOIN writing_prompts p ON p.id = f.rowid
+            ORDER BY f.rank
+        """, (query, limit)).fetchall()
+    return [{"id": r[0], "text": r[1]} for r in rows]
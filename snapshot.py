@@ -0,0 +1,354 @@
+# snapshot.py
+# /tmp の SQLite にあるユーザーデータ（アカウント・回答など）を、増えた分だけ
+# 永続ストレージに送り、起動時に戻す。
+#
+#   snap = Snapshotter(LocalDirBackend("/mnt/snapshots"), [(DB_FILE, "users"), (DB_FILE, "student_answers"), ...])
+#   snap.restore()        # 起動時: イメージからコピーした DB に、送ってあった行を足す
+#   snap.start(60)        # 以後 60 秒ごとに、前回から増えた行だけを送る
+#   snap.ship()           # 終了時など、今すぐ送る
+#   snap.ship_rows(DB_FILE, "student_answers", ids)   # 送った後に書き換えた行（regrade.py --apply）をもう一度送る
+#
+# 対象のテーブルは「id INTEGER PRIMARY KEY AUTOINCREMENT で、行は追加しかしない」もの
+# （users と各回答テーブル、llm_usage）。テーブルごとに「送った id の最大値」を覚えておき、
+# それより大きい id の行を 1 つのセグメント（gzip した JSON）にまとめて送る。
+# ランキングや出題の難易度など、回答から作り直せるものは送らない（起動時に再集計される）。
+#
+# 送る量・戻す時間はイメージ以降に増えた行の数で決まり、DB 全体の大きさ（単語・読解文など
+# イメージに入っている部分）には比例しない。セグメントが COMPACT_EVERY 個を超えたら
+# 1 つにまとめ直す（同じ id は後のもので上書きするので、途中で落ちても戻し方は変わらない）。
+#
+# 書き込むのは 1 インスタンスだけ、という前提（Cloud Run の max-instances=1、
+# Dockerfile の --workers 1）。複数のインスタンスが同じ場所に送ると id がぶつかる。
+# 行を書き換えるのは regrade.py --apply だけで、書き換えた行は ship_rows で送り直す
+# （同じ id は後のセグメントが勝つ）。セグメントの番号は送るたびに保存先の一覧から決めるので、
+# アプリと regrade.py が同じ場所に送っても名前はぶつからない。
+#
+# backend は list / get / put / delete を持つもの。
+#   LocalDirBackend("/path")          … ローカルのディレクトリ（テスト・マウントしたボリューム用）
+#   GCSBackend("bucket", "prefix")    … Cloud Storage（google-cloud-storage が必要）
+#   backend_from_url("file:///path" / "gs://bucket/prefix")
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".json.gz"
+COMPACT_EVERY = 100
+BATCH_ROWS = 5000
+
+
+# ======================================================
+# 保存先
+# ======================================================
+class LocalDirBackend:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def list(self):
+        return sorted(n for n in os.listdir(self.path) if n.endswith(SEGMENT_SUFFIX))
+
+    def get(self, name):
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    def put(self, name, data):
+        # 書きかけのファイルを読まれないよう、別名で書いてから置き換える
+        tmp = os.path.join(self.path, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, name))
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f"LocalDirBackend({self.path!r})"
+
+
+class GCSBackend:
+    def __init__(self, bucket, prefix=""):
+        from google.cloud import storage  # 使うときだけ必要
+        self.bucket = storage.Client().bucket(bucket)
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def list(self):
+        names = (b.name[len(self.prefix):] for b in self.bucket.list_blobs(prefix=self.prefix))
+        return sorted(n for n in names if n.endswith(SEGMENT_SUFFIX) and "/" not in n)
+
+    def get(self, name):
+        return self.bucket.blob(self.prefix + name).download_as_bytes()
+
+    def put(self, name, data):
+        self.bucket.blob(self.prefix + name).upload_from_string(data, content_type="application/gzip")
+
+    def delete(self, name):
+        self.bucket.blob(self.prefix + name).delete()
+
+    def __repr__(self):
+        return f"GCSBackend({self.bucket.name!r}, {self.prefix!r})"
+
+
+def backend_from_url(url):
+    if url.startswith("gs://"):
+        bucket, _, prefix = url[len("gs://"):].partition("/")
+        return GCSBackend(bucket, prefix)
+    if url.startswith("file://"):
+        return LocalDirBackend(url[len("file://"):])
+    return LocalDirBackend(url)
+
+
+# ======================================================
+# セグメント
+# ======================================================
+def segment_name(seq):
+    return f"{seq:012d}{SEGMENT_SUFFIX}"
+
+
+def segment_seq(name):
+    return int(name[:-len(SEGMENT_SUFFIX)])
+
+
+def encode_segment(tables):
+    """tables: {"english_learning.db:users": {"schema": ..., "columns": [...], "rows": [[...]]}}"""
+    return gzip.compress(json.dumps({"tables": tables}, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+
+
+def decode_segment(data):
+    return json.loads(gzip.decompress(data).decode("utf-8"))["tables"]
+
+
+def merge_segments(segments):
+    """古い順のセグメントを 1 つにまとめる（同じ id は後のものが勝つ）"""
+    merged = {}
+    for tables in segments:
+        for key, part in tables.items():
+            entry = merged.setdefault(key, {"schema": part.get("schema"), "columns": part["columns"], "rows": {}})
+            if part["columns"] != entry["columns"]:
+                # 列が増えた（ALTER された）後のセグメント: 以後はその列の並びに揃える
+                entry["rows"] = {
+                    rid: [dict(zip(entry["columns"], row)).get(c) for c in part["columns"]]
+                    for rid, row in entry["rows"].items()
+                }
+                entry["columns"] = part["columns"]
+                entry["schema"] = part.get("schema") or entry["schema"]
+            id_pos = part["columns"].index("id")
+            for row in part["rows"]:
+                entry["rows"][row[id_pos]] = row
+    return {
+        key: {"schema": e["schema"], "columns": e["columns"], "rows": [e["rows"][k] for k in sorted(e["rows"])]}
+        for key, e in merged.items()
+    }
+
+
+# ======================================================
+# 本体
+# ======================================================
+class Snapshotter:
+    def __init__(self, backend, tables, before_ship=None):
+        self.backend = backend
+        self.tables = list(tables)        # [(db_file, table)]
+        self.before_ship = before_ship    # 送る前に呼ぶ（write-behind の flush など）
+        self._by_key = {self.key(db, t): (db, t) for db, t in self.tables}
+        self._watermarks = {}             # key -> 送った（または戻した）id の最大値
+        self._seq = 0
+        self._segments = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @staticmethod
+    def key(db_file, table):
+        return f"{os.path.basename(db_file)}:{table}"
+
+    def _max_id(self, db_file, table):
+        with db_connect(db_file) as conn:
+            try:
+                return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            except Exception:
+                return 0  # まだテーブルが無い
+
+    def _mark_current(self):
+        for db_file, table in self.tables:
+            self._watermarks[self.key(db_file, table)] = self._max_id(db_file, table)
+
+    # ------------------------------------------------------
+    # 起動時
+    # ------------------------------------------------------
+    def restore(self):
+        """送ってあったセグメントを古い順に DB に入れる。戻した行数を返す"""
+        start = time.perf_counter()
+        names = self.backend.list()
+        total = 0
+        for name in names:
+            tables = decode_segment(self.backend.get(name))
+            for key, part in tables.items():
+                if key not in self._by_key:
+                    logger.warning("snapshot %s: unknown table %s, skipped", name, key)
+                    continue
+                db_file, table = self._by_key[key]
+                total += self._apply(db_file, table, part)
+        with self._lock:
+            self._seq = segment_seq(names[-1]) if names else 0
+            self._segments = len(names)
+            self._mark_current()
+        elapsed = time.perf_counter() - start
+        metrics.inc("snapshot_restored_rows_total", total)
+        logger.info("snapshot restored %d rows from %d segments in %.2fs (%r)",
+                    total, len(names), elapsed, self.backend)
+        return total
+
+    def _apply(self, db_file, table, part):
+        columns, rows = part["columns"], part["rows"]
+        if not rows:
+            return 0
+        with db_connect(db_file) as conn:
+            existing = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+            if not existing and part.get("schema"):
+                conn.execute(part["schema"])   # 起動時にはまだ作られないテーブル（llm_usage など）
+                existing = columns
+            for col in columns:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {col}")
+            placeholders = ", ".join("?" for _ in columns)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+            )
+            conn.commit()
+        return len(rows)
+
+    # ------------------------------------------------------
+    # 送る
+    # ------------------------------------------------------
+    def ship(self):
+        """前回から増えた行を 1 セグメントにして送る。送った行数を返す"""
+        if self.before_ship is not None:
+            try:
+                self.before_ship()
+            except Exception as e:
+                logger.warning("snapshot before_ship failed: %s", e)
+        with self._lock:
+            if not self._watermarks:
+                self._mark_current()
+                return 0
+            tables, marks, total = {}, {}, 0
+            for db_file, table in self.tables:
+                key = self.key(db_file, table)
+                part, last_id = self._changes(db_file, table, self._watermarks.get(key, 0))
+                if part["rows"]:
+                    tables[key] = part
+                    marks[key] = last_id
+                    total += len(part["rows"])
+            if not tables:
+                return 0
+            self._put(tables, total)
+            # 送れてから進める（失敗したら次回同じ行をもう一度送る）
+            self._watermarks.update(marks)
+        return total
+
+    def ship_rows(self, db_file, table, ids):
+        """
+        送った後に書き換えた行（regrade.py --apply）を 1 セグメントにして送り直す。送った行数を返す。
+        戻すときは後のセグメントが勝つので、書き換えた後の値になる。
+        """
+        key = self.key(db_file, table)
+        if key not in self._by_key:
+            raise ValueError(f"{key} is not a snapshot table")
+        ids = sorted(set(ids))
+        part = None
+        for start in range(0, len(ids), BATCH_ROWS):
+            chunk = ids[start:start + BATCH_ROWS]
+            got = self._select(db_file, table, f"id IN ({','.join('?' * len(chunk))})", chunk)
+            if part is None:
+                part = got
+            else:
+                part["rows"].extend(got["rows"])
+        if part is None or not part["rows"]:
+            return 0
+        with self._lock:
+            self._put({key: part}, len(part["rows"]))
+        return len(part["rows"])
+
+    def _put(self, tables, total):
+        """セグメントを 1 つ送る（_lock を持った状態で呼ぶ）"""
+        data = encode_segment(tables)
+        # ほかのプロセスが送った分も数えて、次の番号にする
+        names = self.backend.list()
+        if names:
+            self._seq = max(self._seq, segment_seq(names[-1]))
+        self.backend.put(segment_name(self._seq + 1), data)
+        self._seq += 1
+        self._segments = len(names) + 1
+        metrics.inc("snapshot_shipped_rows_total", total)
+        metrics.inc("snapshot_shipped_bytes_total", len(data))
+        if self._segments > COMPACT_EVERY:
+            self._compact()
+
+    def _changes(self, db_file, table, after_id):
+        part = self._select(db_file, table, "id > ?", (after_id,))
+        last_id = part["rows"][-1][part["columns"].index("id")] if part["rows"] else after_id
+        return part, last_id
+
+    def _select(self, db_file, table, where, params):
+        with db_connect(db_file) as conn:
+            schema_row = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if schema_row is None:
+                return {"schema": None, "columns": [], "rows": []}
+            cur = conn.execute(f"SELECT * FROM {table} WHERE {where} ORDER BY id", params)
+            columns = [d[0] for d in cur.description]
+            rows = []
+            while True:
+                batch = cur.fetchmany(BATCH_ROWS)
+                if not batch:
+                    break
+                rows.extend(list(r) for r in batch)
+        return {"schema": schema_row[0], "columns": columns, "rows": rows}
+
+    def _compact(self):
+        """セグメントを 1 つにまとめる（_lock を持った状態で呼ぶ）"""
+        names = self.backend.list()
+        if len(names) <= 1:
+            return
+        merged = merge_segments(decode_segment(self.backend.get(n)) for n in names)
+        # 一番新しい番号で書き直してから古いものを消す。途中で落ちても、古いものを
+        # 先に適用してからまとめたものを適用するだけなので結果は同じ
+        self.backend.put(names[-1], encode_segment(merged))
+        for name in names[:-1]:
+            self.backend.delete(name)
+        self._segments = 1
+        metrics.inc("snapshot_compactions_total")
+        logger.info("snapshot compacted %d segments", len(names))
+
+    # ------------------------------------------------------
+    # 定期実行
+    # ------------------------------------------------------
+    def start(self, interval_sec):
+        """interval_sec ごとに ship する（daemon スレッド）"""
+        with self._lock:
+            if not self._watermarks:
+                self._mark_current()
+
+        def loop():
+            while True:
+                time.sleep(interval_sec)
+                try:
+                    self.ship()
+                except Exception as e:
+                    metrics.inc("snapshot_errors_total")
+                    logger.error("snapshot ship error: %s", e)
+
+        self._timer = threading.Thread(target=loop, daemon=True, name="snapshot")
+        self._timer.start()
@@ -0,0 +1,156 @@
+# static_assets.py
+# 静的ファイルのハッシュ付き URL と事前圧縮（gzip / brotli）
+import gzip
+import hashlib
+import os
+import re
+
+try:
+    import brotli  # pip install Brotli（任意）
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# 事前圧縮の対象拡張子
+COMPRESSIBLE_EXTS = (".css", ".js", ".svg", ".html", ".json", ".txt")
+# 小さすぎるファイルは圧縮しても得がない
+MIN_COMPRESS_SIZE = 512
+
+# Accept-Encoding の優先順（先にあるほど優先）
+ENCODINGS = [
+    ("br", ".br"),
+    ("gzip", ".gz"),
+]
+
+HASH_LEN = 10
+HASHED_NAME_RE = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^.]+)$" % HASH_LEN)
+
+
+# ======================================================
+# マニフェスト（元ファイル名 <-> ハッシュ付きファイル名）
+# ======================================================
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LEN]
+
+
+def hashed_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def iter_static_files(static_dir=STATIC_DIR):
+    for root, _dirs, files in os.walk(static_dir):
+        for name in files:
+            if name.endswith((".gz", ".br")):
+                continue
+            full = os.path.join(root, name)
+            yield os.path.relpath(full, static_dir).replace(os.sep, "/")
+
+
+def build_manifest(static_dir=STATIC_DIR):
+    """
+    戻り値: { "style.css": "style.3f2a1b9c0d.css", ... }
+    起動時に一度だけ計算する（ファイル数は少ない）。
+    """
+    manifest = {}
+    for rel in iter_static_files(static_dir):
+        digest = file_digest(os.path.join(static_dir, rel))
+        manifest[rel] = hashed_name(rel, digest)
+    return manifest
+
+
+def resolve_hashed(hashed, manifest):
+    """ハッシュ付き名 -> 元ファイル名。ハッシュが古い / 不明なら None"""
+    m = HASHED_NAME_RE.match(hashed)
+    if not m:
+        return None
+    original = m.group("stem") + m.group("ext")
+    if manifest.get(original) != hashed:
+        return None
+    return original
+
+
+# ======================================================
+# 事前圧縮（イメージビルド時に実行）
+# ======================================================
+def precompress_file(path):
+    """path.gz / path.br を作成し、作成したファイルのリストを返す"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+
+    written = []
+    gz_path = path + ".gz"
+    # mtime=0 で出力を決定的にする（ビルドキャッシュが効く）
+    with open(gz_path, "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(gz_path)
+
+    if HAS_BROTLI:
+        br_path = path + ".br"
+        with open(br_path, "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+        written.append(br_path)
+    return written
+
+
+def precompress_all(static_dir=STATIC_DIR):
+    written = []
+    for rel in iter_static_files(static_dir):
+        if not rel.endswith(COMPRESSIBLE_EXTS):
+            continue
+        written.extend(precompress_file(os.path.join(static_dir, rel)))
+    return written
+
+
+def pick_encoding(accept_encoding, original_path):
+    """
+    クライアントが受け付け、かつ事前圧縮ファイルが存在するエンコーディングを選ぶ。
+    元ファイルより古い圧縮ファイル（前のビルドの残り）は使わない。
+    戻り値: (encoding, path) または (None, original_path)
+    """
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and is_fresh(original_path + suffix, original_path):
+            return encoding, original_path + suffix
+    return None, original_path
+
+
+def is_fresh(compressed_path, original_path):
+    """圧縮ファイルがあり、元ファイル以降に作られていれば True"""
+    try:
+        return os.path.getmtime(compressed_path) >= os.path.getmtime(original_path)
+    except OSError:
+        return False
+
+
+def main():
+    written = precompress_all()
+    for path in written:
+        print(f"precompressed: {os.path.relpath(path, BASE_DIR)} ({os.path.getsize(path)} bytes)")
+    if not HAS_BROTLI:
+        print("Brotli 未インストールのため .br は作成していません。")
+    print(f"完了！ {len(written)} 件作成しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# tests/conftest.py
+# リポジトリ直下のモジュール（app.py など）をそのまま import できるようにする。
+#
+#   python -m pytest -q
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    app を一時ディレクトリにコピーした DB で読み込む（プロセスで 1 回だけ）。
+    Gemini は偽物（fake_gemini）、ランキングの再集計・アーカイブ・スナップショットのタイマーは止める。
+    """
+    os.environ.update({
+        "DB_TMP_DIR": str(tmp_path_factory.mktemp("db")),
+        "GEMINI_FAKE": "latency_ms=0",
+        "LEADERBOARD_REFRESH_SEC": "0",
+        "ARCHIVE_INTERVAL_SEC": "0",
+        "SNAPSHOT_URL": "",
+    })
+    import app
+    yield app
+    app.ANSWER_WRITER.close()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+import adaptive
+from db import connect as db_connect
+
+
+def make_db(path, words, answers=()):
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT)")
+        conn.execute("CREATE TABLE student_answers (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                     "word_id INTEGER, score INTEGER)")
+        conn.executemany("INSERT INTO words (id, word) VALUES (?, ?)", words)
+        conn.executemany("INSERT INTO student_answers (user_id, word_id, score) VALUES (?, ?, ?)", answers)
+        conn.commit()
+    return path
+
+
+def difficulty(path, word_id):
+    with db_connect(path) as conn:
+        return conn.execute("SELECT rating, bucket, attempts FROM word_difficulty WHERE word_id = ?",
+                            (word_id,)).fetchone()
+
+
+def test_expected_score_and_k_factor():
+    assert adaptive.expected_score(1500, 1500) == pytest.approx(0.5)
+    assert adaptive.expected_score(1900, 1500) == pytest.approx(10 / 11)
+    assert adaptive.expected_score(1500, 1900) == pytest.approx(1 / 11)
+    assert adaptive.k_factor(0, adaptive.USER_K) == adaptive.USER_K[0]
+    assert adaptive.USER_K[1] < adaptive.k_factor(1000, adaptive.USER_K) < adaptive.USER_K[0]
+
+
+def test_prior_prefers_short_and_frequent_words():
+    assert adaptive.prior_rating("cat", 50) < adaptive.prior_rating("cat", 0) < adaptive.prior_rating("catastrophe", 0)
+    assert adaptive.prior_rating("x" * 200, 0) == adaptive.PRIOR_MAX
+    assert adaptive.prior_rating("", 10 ** 9) == adaptive.PRIOR_MIN
+
+
+def test_init_seeds_words_and_replays_history(tmp_path):
+    path = make_db(str(tmp_path / "a.db"), [(1, "cat"), (2, "dog")], answers=[(7, 1, 100), (7, 1, 100)])
+    adaptive.init_adaptive(path)
+
+    rating, bucket, attempts = difficulty(path, 1)
+    assert attempts == 2
+    assert rating < adaptive.prior_rating("cat", 0)
+    assert bucket == adaptive.bucket_of(rating)
+    assert difficulty(path, 2)[2] == 0
+    assert adaptive.get_ability(path, 7)[0] > adaptive.BASE_RATING
+
+    # 2 回目は履歴を流し直さない
+    adaptive.init_adaptive(path)
+    assert difficulty(path, 1)[2] == 2
+
+
+def test_record_results_moves_user_and_word_in_opposite_directions(tmp_path):
+    path = make_db(str(tmp_path / "a.db"), [(1, "cat")])
+    adaptive.init_adaptive(path)
+    word_before = difficulty(path, 1)[0]
+
+    adaptive.record_results(path, [(3, 1, 0)])
+
+    assert adaptive.get_ability(path, 3) == (pytest.approx(adaptive.BASE_RATING - 64 * adaptive.expected_score(
+        adaptive.BASE_RATING, word_before)), 1)
+    assert difficulty(path, 1)[0] > word_before
+
+
+def test_guest_and_unknown_words_are_ignored(tmp_path):
+    path = make_db(str(tmp_path / "a.db"), [(1, "cat")])
+    adaptive.init_adaptive(path)
+
+    adaptive.record_results(path, [(adaptive.GUEST_USER_ID, 1, 100), (4, 999, 100)])
+
+    assert adaptive.get_ability(path, adaptive.GUEST_USER_ID) == (adaptive.BASE_RATING, 0)
+    with db_connect(path) as conn:
+        assert conn.execute("SELECT user_id FROM user_ability").fetchall() == [(4,)]
+    # ゲストの回答でも単語の難易度は動く
+    assert difficulty(path, 1)[2] == 1
+
+
+def test_pick_words_targets_the_users_level(tmp_path):
+    words = [(i, f"w{i}") for i in range(1, 401)]
+    path = make_db(str(tmp_path / "a.db"), words)
+    adaptive.init_adaptive(path)
+    # 難易度を 800〜2400 に均等に並べ直す
+    with db_connect(path) as conn:
+        for i in range(1, 401):
+            rating = 800 + 4 * i
+            conn.execute("UPDATE word_difficulty SET rating = ?, bucket = ? WHERE word_id = ?",
+                         (rating, adaptive.bucket_of(rating), i))
+        conn.execute("INSERT INTO user_ability (user_id, rating, attempts) VALUES (5, 2000, 10)")
+        conn.commit()
+
+    picked = adaptive.pick_words(path, 5, 20, rng=random.Random(0))
+
+    assert len(picked) == len(set(picked)) == 20
+    ratings = [800 + 4 * i for i in picked]
+    target = 2000 - adaptive.TARGET_OFFSET
+    assert abs(sum(ratings) / len(ratings) - target) < 2 * adaptive.TARGET_SPREAD
+
+
+def test_pick_falls_back_to_nearest_bucket(tmp_path):
+    path = make_db(str(tmp_path / "a.db"), [(1, "cat")])
+    adaptive.init_adaptive(path)
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO user_ability (user_id, rating, attempts) VALUES (5, 9000, 10)")
+        conn.commit()
+    assert adaptive.pick_word(path, 5, rng=random.Random(1)) == 1
+    assert adaptive.pick_words(path, 5, 3, rng=random.Random(1)) == [1]
+
+    empty = make_db(str(tmp_path / "b.db"), [])
+    adaptive.init_adaptive(empty)
+    assert adaptive.pick_word(empty, 5) is None
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+import pytest
+
+import admission
+import metrics
+
+
+def counter(name, **labels):
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+def test_token_bucket_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    backend = admission.MemoryBackend()
+
+    assert [backend.take_token("u", rate=1.0, burst=2) for _ in range(3)] == [True, True, False]
+    now[0] += 1.0
+    assert backend.take_token("u", rate=1.0, burst=2)
+    assert not backend.take_token("u", rate=1.0, burst=2)
+    # ほかのキーは別のバケット
+    assert backend.take_token("v", rate=1.0, burst=2)
+
+
+def test_rate_limited_is_shed():
+    controller = admission.AdmissionController(user_rate=0.001, user_burst=1)
+    before = counter("admission_shed_total", feature="word", reason="rate_limited")
+
+    with controller.admit("user:1", "word"):
+        pass
+    with pytest.raises(admission.Shed) as info:
+        with controller.admit("user:1", "word"):
+            pass
+
+    assert info.value.reason == "rate_limited"
+    assert counter("admission_shed_total", feature="word", reason="rate_limited") == before + 1
+    # キーが無ければ（リクエスト外）数えない
+    with controller.admit(None, "word"):
+        pass
+
+
+def test_queue_full_and_timeout_release_their_counters():
+    controller = admission.AdmissionController(user_rate=0, max_in_flight=1, max_queue=0, queue_timeout=0.02)
+    with controller.admit("a", "word"):
+        with pytest.raises(admission.Shed) as full:
+            with controller.admit("b", "word"):
+                pass
+        assert full.value.reason == "queue_full"
+
+        controller.max_queue = 1
+        with pytest.raises(admission.Shed) as timeout:
+            with controller.admit("b", "word"):
+                pass
+        assert timeout.value.reason == "queue_timeout"
+
+    assert controller.backend.incr("llm_in_flight", 0) == 0
+    assert controller.backend.incr("llm_queue", 0) == 0
+
+
+def test_queued_call_gets_the_freed_slot():
+    controller = admission.AdmissionController(user_rate=0, max_in_flight=1, max_queue=1, queue_timeout=5)
+    entered, release = threading.Event(), threading.Event()
+
+    def hold():
+        with controller.admit("a", "word"):
+            entered.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    entered.wait()
+    threading.Timer(0.05, release.set).start()
+
+    with controller.admit("b", "word"):
+        assert controller.backend.incr("llm_in_flight", 0) == 1
+    holder.join()
+    assert controller.backend.incr("llm_in_flight", 0) == 0
+
+
+def test_async_admit_times_out_without_blocking_the_loop():
+    controller = admission.AdmissionController(user_rate=0, max_in_flight=1, max_queue=4, queue_timeout=0.05)
+
+    async def call():
+        async with controller.admit_async(None, "reading"):
+            await asyncio.sleep(0.2)
+
+    async def main():
+        return await asyncio.gather(call(), call(), return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert first is None
+    assert isinstance(second, admission.Shed) and second.reason == "queue_timeout"
+    assert controller.backend.incr("llm_in_flight", 0) == 0
+
+
+def test_shed_writing_falls_back_to_local_grade(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMISSION", admission.AdmissionController(user_rate=0.001, user_burst=0))
+    before = counter("grading_fallback_total", feature="writing", reason="rate_limited")
+
+    resp = client.post("/submit_writing", data={"prompt": "将来の夢", "prompt_id": "0", "answer": "I want to travel."})
+
+    assert resp.status_code == 302
+    with client.session_transaction() as sess:
+        result = sess["writing_result"]
+    assert result["feedback"] == "採点が混み合っているため簡易採点を行いました。"
+    assert result["score"] == len("I want to travel.") * 2
+    assert counter("grading_fallback_total", feature="writing", reason="rate_limited") == before + 1
+
+
+
+def test_guests_get_a_bucket_per_session(app_module):
+    def key(**sess):
+        # 同じ接続元（127.0.0.1）からのリクエスト
+        with app_module.app.test_request_context(environ_base={"REMOTE_ADDR": "127.0.0.1"}):
+            app_module.session.update(sess)
+            return app_module.admission_key(), app_module.session.get("guest_id")
+
+    first, gid = key(user_id=0, is_guest=True)
+    assert first.startswith("user:guest-")
+    assert key(user_id=0, is_guest=True, guest_id=gid)[0] == first
+    assert key(user_id=0, is_guest=True)[0] != first
+    assert key(user_id=5)[0] == "user:5"
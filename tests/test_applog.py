@@ -0,0 +1,111 @@
+import io
+import json
+import logging
+import queue
+
+import pytest
+
+import applog
+import metrics
+
+
+def counter(name, **labels):
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+def make_logger(handler):
+    logger = logging.getLogger(f"test_applog.{id(handler)}")
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_parse_sample_rates_and_truncate():
+    assert applog.parse_sample_rates("llm_raw=0.05, writing_result = 1,,x") == {"llm_raw": 0.05, "writing_result": 1.0}
+    assert applog.parse_sample_rates(None) == {}
+    assert applog.truncate("abcdef", 3) == "abc…(+3 chars)"
+    assert applog.truncate("abc", 3) == "abc"
+    assert applog.truncate("abcdef", 0) == "abcdef"
+    assert applog.truncate(12345, 2) == 12345
+
+
+def test_handler_formats_truncates_and_adds_context():
+    q = queue.Queue()
+    handler = applog._NonBlockingQueueHandler(q, max_chars=5, context=lambda: {"endpoint": "quiz", "feature": "ctx"})
+    logger = make_logger(handler)
+    args = ["long argument"]
+
+    logger.info("got %s", args, extra={"feature": "word", "raw": "0123456789"})
+    args.append("changed later")
+
+    record = q.get_nowait()
+    assert record.getMessage() == "got […(+16 chars)"
+    assert record.raw == "01234…(+5 chars)"
+    # extra が優先で、無い項目だけ context から足す
+    assert (record.feature, record.endpoint) == ("word", "quiz")
+
+
+def test_sampling_keeps_warnings(monkeypatch):
+    q = queue.Queue()
+    logger = make_logger(applog._NonBlockingQueueHandler(q, sample={"llm_raw": 0.0}))
+    before = counter("log_records_sampled_out_total", event="llm_raw")
+
+    logger.info("raw", extra={"event": "llm_raw"})
+    logger.warning("raw but important", extra={"event": "llm_raw"})
+    logger.info("other event", extra={"event": "something_else"})
+
+    assert [q.get_nowait().getMessage() for _ in range(q.qsize())] == ["raw but important", "other event"]
+    assert counter("log_records_sampled_out_total", event="llm_raw") == before + 1
+
+
+def test_full_queue_drops_without_blocking():
+    q = queue.Queue(maxsize=1)
+    logger = make_logger(applog._NonBlockingQueueHandler(q))
+    before = counter("log_records_dropped_total")
+
+    logger.info("first")
+    logger.info("second")
+
+    assert q.qsize() == 1
+    assert counter("log_records_dropped_total") == before + 1
+
+
+def test_json_formatter():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("app", logging.ERROR, __file__, 1, "失敗 %d", (3,), None)
+        record.exc_text = logging.Formatter().formatException(__import__("sys").exc_info())
+    record.feature = "word"
+
+    entry = json.loads(applog.JsonFormatter().format(record))
+
+    assert entry["severity"] == "ERROR"
+    assert entry["message"] == "失敗 3"
+    assert entry["feature"] == "word"
+    assert "ValueError: boom" in entry["exception"]
+    assert "args" not in entry and "levelno" not in entry
+
+
+@pytest.fixture
+def restore_root():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_setup_writes_json_from_the_listener_thread(restore_root):
+    out = io.StringIO()
+    listener = applog.setup(level="INFO", fmt="json", stream=out)
+    logging.getLogger("test_applog").info("hello", extra={"event": "greeting"})
+    logging.getLogger("test_applog").debug("hidden")
+    listener.stop()
+
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(e["message"], e["event"]) for e in lines] == [("hello", "greeting")]
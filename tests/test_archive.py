@@ -0,0 +1,111 @@
+import io
+
+import pytest
+
+import archive
+import leaderboard
+from db import connect as db_connect
+
+OLD, NEW, CUTOFF = "2024-01-01T00:00:00", "2025-06-01T00:00:00", "2025-01-01T00:00:00"
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "answers.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+        conn.execute("CREATE TABLE student_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                     "word_id INTEGER, score INTEGER, feedback TEXT, attempt_date TEXT)")
+        conn.execute("CREATE TABLE writing_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                     "prompt_id INTEGER, answer TEXT, score INTEGER, feedback TEXT, correct_example TEXT, "
+                     "attempt_date TEXT)")
+        conn.executemany(
+            "INSERT INTO student_answers (user_id, word_id, score, feedback, attempt_date) VALUES (?, ?, ?, ?, ?)",
+            [(1, 10, 90, "long feedback", OLD), (1, 10, 40, "", OLD), (2, 11, 70, "", OLD), (1, 12, 80, "", NEW)],
+        )
+        conn.executemany(
+            "INSERT INTO writing_answers (user_id, prompt_id, answer, score, feedback, correct_example, attempt_date) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(1, 5, "a1", 80, "good", "Example one.", OLD),
+             (1, 5, "a2", 30, "（簡易採点）", "Local guess.", OLD),
+             (2, 6, "a3", 70, "good", "", OLD)],
+        )
+        conn.commit()
+    return path
+
+
+def test_archive_moves_old_rows_and_keeps_totals(db):
+    source = archive.SOURCES["student_answers"]
+
+    assert archive.archive_source(db, source, CUTOFF) == 3
+    assert archive.archive_source(db, source, CUTOFF) == 0
+
+    with db_connect(db) as conn:
+        assert conn.execute("SELECT id FROM student_answers").fetchall() == [(4,)]
+        assert conn.execute("SELECT * FROM student_answers_archive ORDER BY id").fetchall() == [
+            (1, 1, 10, 90, OLD), (2, 1, 10, 40, OLD), (3, 2, 11, 70, OLD)]
+        assert conn.execute(
+            "SELECT user_id, item_id, attempts, total_score, misses, last_attempt_date FROM answer_archive_totals "
+            "ORDER BY user_id").fetchall() == [(1, 10, 2, 130, 1, OLD), (2, 11, 1, 70, 0, OLD)]
+        assert archive.totals_by_user(conn, "student_answers") == {1: (130, 2), 2: (70, 1)}
+        assert archive.total_for_user(conn, "student_answers", 1) == (130, 2)
+        assert archive.total_for_user(conn, "writing_answers", 1) == (0, 0)
+
+
+def test_rows_already_in_cold_are_not_counted_twice(db):
+    source = archive.SOURCES["student_answers"]
+    archive.archive_source(db, source, CUTOFF)
+    # スナップショットから戻した行が hot にもう一度現れた
+    with db_connect(db) as conn:
+        conn.execute("INSERT INTO student_answers (id, user_id, word_id, score, feedback, attempt_date) "
+                      "VALUES (1, 1, 10, 90, '', ?)", (OLD,))
+        conn.commit()
+
+    assert archive.archive_source(db, source, CUTOFF) == 0
+    with db_connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM student_answers WHERE id = 1").fetchone()[0] == 0
+        assert archive.total_for_user(conn, "student_answers", 1) == (130, 2)
+
+
+def test_writing_references_skip_local_grades(db):
+    archive.archive_source(db, archive.SOURCES["writing_answers"], CUTOFF)
+
+    assert archive.get_reference(db, "writing_answers", 5) == "Example one."
+    assert archive.get_reference(db, "writing_answers", 6) is None
+    with db_connect(db) as conn:
+        assert conn.execute("SELECT answer FROM writing_answers_archive ORDER BY id").fetchall() == [
+            ("a1",), ("a2",), ("a3",)]
+
+
+def test_leaderboard_counts_archived_answers(db):
+    leaderboard.init_leaderboard(db)
+    sources = {"word": (db, "student_answers")}
+    leaderboard.rebuild(db, sources)
+    before, _ = leaderboard.get_page(db, "word", 1, 10)
+
+    archive.run({"student_answers": db}, days=365 * 100)   # 何も移らない
+    archive.archive_source(db, archive.SOURCES["student_answers"], CUTOFF)
+    leaderboard.rebuild(db, sources)
+    after, _ = leaderboard.get_page(db, "word", 1, 10)
+
+    assert [(r["user_id"], r["attempts"]) for r in after] == [(r["user_id"], r["attempts"]) for r in before]
+    assert leaderboard.aggregate_source(db, "student_answers") == {1: (210, 3), 2: (70, 1)}
+
+
+def test_run_and_stats(db):
+    result = archive.run({"student_answers": db, "writing_answers": db}, days=0)
+    assert result == {"student_answers": 4, "writing_answers": 3}
+
+    out = io.StringIO()
+    archive.stats({"student_answers": db}, out=out)
+    assert out.getvalue().splitlines()[1].split()[:3] == ["student_answers", "0", "4"]
+
+
+def test_timer_waits_before_the_first_run(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(archive, "run", lambda sources, days: calls.append(days))
+
+    assert archive.start_timer(0, {"student_answers": db}, 90) is None
+    stop = archive.start_timer(60, {"student_answers": db}, 90)
+    stop.set()
+    assert calls == []
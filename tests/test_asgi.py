@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+import pytest
+
+from db import connect as db_connect
+
+
+@pytest.fixture(scope="module")
+def asgi(app_module):
+    import asgi
+    return asgi
+
+
+def call(asgi, method, path, body=b"", headers=(), query=b""):
+    """application を 1 回呼び、(status, ヘッダー, 本文) を返す"""
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query, "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers], "client": ("127.0.0.1", 1234),
+    }
+    asyncio.run(asgi.application(scope, receive, send))
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return start["status"], dict((k.decode(), v.decode()) for k, v in start["headers"]), body
+
+
+def test_build_environ(asgi):
+    scope = {
+        "method": "POST", "path": "/app/api/x", "root_path": "/app", "query_string": b"a=1",
+        "headers": [(b"content-type", b"text/plain"), (b"x-test", b"1"), (b"x-test", b"2")],
+        "client": ("10.0.0.1", 5555), "server": ("example", 8080),
+    }
+
+    environ = asgi.build_environ(scope, b"hello")
+
+    assert environ["SCRIPT_NAME"] == "/app"
+    assert environ["PATH_INFO"] == "/api/x"
+    assert environ["QUERY_STRING"] == "a=1"
+    assert environ["CONTENT_TYPE"] == "text/plain"
+    assert environ["CONTENT_LENGTH"] == "5"
+    assert environ["HTTP_X_TEST"] == "1,2"
+    assert environ["REMOTE_ADDR"] == "10.0.0.1"
+    assert environ["wsgi.input"].read() == b"hello"
+
+
+def test_match_endpoint(asgi, app_module):
+    environ = asgi.build_environ({"method": "POST", "path": "/api/submit_answer"}, b"")
+    endpoint, _ = asgi.match_endpoint(environ)
+    assert endpoint in app_module.ASYNC_FLOWS
+    assert asgi.match_endpoint(asgi.build_environ({"method": "GET", "path": "/no-such-page"}, b"")) == (None, {})
+
+
+def test_wsgi_route(asgi):
+    status, headers, body = call(asgi, "GET", "/login")
+    assert status == 200
+    assert headers["content-type"].startswith("text/html")
+    assert body
+
+
+def test_grading_flow_route(asgi, app_module):
+    with db_connect(app_module.DB_FILE) as conn:
+        word_id = conn.execute("SELECT id FROM words ORDER BY id LIMIT 1").fetchone()[0]
+
+    status, _, body = call(
+        asgi, "POST", "/api/submit_answer", body=f"word_id={word_id}&answer=test".encode(),
+        headers=[("content-type", "application/x-www-form-urlencoded")],
+    )
+
+    assert status == 200
+    data = json.loads(body)
+    assert 0 <= data["score"] <= 100
+    assert data["user_answer"] == "test"
+
+
+def test_grading_flow_not_found(asgi):
+    status, _, body = call(
+        asgi, "POST", "/api/submit_answer", body=b"word_id=abc&answer=x",
+        headers=[("content-type", "application/x-www-form-urlencoded")],
+    )
+    assert status == 404
+    assert "error" in json.loads(body)
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+
+import context_cache
+import fake_gemini
+
+LONG = "x" * 4096       # 1024 トークン相当
+SHORT = "短い指示"
+
+
+@pytest.fixture
+def fake():
+    return fake_gemini.FakeGemini(latency_ms=0, jitter=0)
+
+
+def make_cache(fake, **kwargs):
+    return context_cache.ContextCache(create=fake.create_cache, **kwargs)
+
+
+def test_hit_after_miss_and_inline_when_small(fake):
+    cache = make_cache(fake)
+
+    first = cache.get(("v1", 1), LONG)
+    assert first is not None
+    assert cache.get(("v1", 1), LONG) == first
+    assert cache.get(("v1", 1), SHORT) is None
+    assert cache.get(None, LONG) is None
+    assert len(cache) == 1
+
+
+def test_changed_context_or_near_expiry_recreates(fake, monkeypatch):
+    cache = make_cache(fake, ttl=120)
+    first = cache.get(("v1", 1), LONG)
+
+    second = cache.get(("v1", 1), LONG + "y")
+    assert second != first
+
+    now = context_cache.time.monotonic()
+    monkeypatch.setattr(context_cache.time, "monotonic", lambda: now + 61)
+    third = cache.get(("v1", 1), LONG + "y")
+    assert third != second
+    # 作り直した古いキャッシュは消さない（期限まで使える）
+    assert len(fake.caches) == 3
+
+
+def test_evicts_oldest_beyond_max_entries(fake):
+    cache = make_cache(fake, max_entries=2)
+    a = cache.get("a", LONG)
+    b = cache.get("b", LONG)
+    cache.get("a", LONG)          # a を使ったので b が一番古い
+    cache.get("c", LONG)
+
+    assert cache.lookup("a", LONG) == a
+    assert cache.lookup("b", LONG) is None
+    assert b in fake.caches
+
+
+def test_create_failure_and_invalidate(fake):
+    def broken(context, ttl):
+        raise RuntimeError("quota")
+
+    assert context_cache.ContextCache(create=broken).get("k", LONG) is None
+
+    cache = make_cache(fake)
+    handle = cache.get("k", LONG)
+    cache.invalidate("k", handle)
+    assert len(cache) == 0
+    fresh = cache.get("k", LONG)
+    assert fresh != handle
+    # 古い handle の失敗では、作り直した分を捨てない
+    cache.invalidate("k", handle)
+    assert cache.lookup("k", LONG) == fresh
+
+
+def test_concurrent_gets_create_once(fake):
+    created = []
+    gate = threading.Event()
+
+    def slow_create(context, ttl):
+        gate.wait()
+        created.append(context)
+        return fake.create_cache(context, ttl)
+
+    cache = context_cache.ContextCache(create=slow_create)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("k", LONG))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join()
+
+    assert len(created) == 1
+    assert len(set(results)) == 1
+
+
+def test_refresh_while_others_still_use_the_old_handle(fake, monkeypatch):
+    cache = make_cache(fake, ttl=120)
+    stale = cache.get("k", LONG)
+    now = context_cache.time.monotonic()
+    holding = threading.Barrier(9)
+    refreshed = threading.Event()
+    errors = []
+
+    def grade():
+        handle = cache.get("k", LONG)
+        holding.wait()            # 全員が古い handle を持ったところで作り直させる
+        refreshed.wait()
+        try:
+            fake.generate("answer", "reading", cached=handle)
+        except fake_gemini.FakeGeminiError:
+            errors.append(handle)
+            cache.invalidate("k", handle)
+
+    threads = [threading.Thread(target=grade) for _ in range(8)]
+    for t in threads:
+        t.start()
+    holding.wait()
+    monkeypatch.setattr(context_cache.time, "monotonic", lambda: now + 61)
+    fresh = cache.get("k", LONG)
+    refreshed.set()
+    for t in threads:
+        t.join()
+
+    assert fresh != stale
+    assert errors == []
+    assert fake.cache_hits == 8
+    cache.invalidate("k", stale)
+    assert cache.lookup("k", LONG) == fresh
+
+
+def test_get_async(fake):
+    cache = make_cache(fake)
+
+    async def main():
+        return await cache.get_async("k", LONG), await cache.get_async("k", LONG)
+
+    first, again = asyncio.run(main())
+    assert first is not None and first == again
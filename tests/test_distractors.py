@@ -0,0 +1,142 @@
+import pytest
+
+import distractors
+import metrics
+import word_index
+from db import connect as db_connect
+
+MEANINGS = ["りんご", "走る", "美しい", "速く", "本", "食べる", "赤い", "静かに", "机", "泳ぐ",
+            "大きい", "ゆっくり", "猫", "書く", "新しい", "よく", "川", "歌う", "高い", "すぐに"]
+POS = ["noun", "verb", "adjective", "adverb"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "words.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY AUTOINCREMENT, word TEXT UNIQUE, "
+                     "definition_ja TEXT, pos TEXT)")
+        conn.executemany("INSERT INTO words (word, definition_ja, pos) VALUES (?, ?, ?)",
+                         [(f"w{i}", m, POS[i % 4]) for i, m in enumerate(MEANINGS)])
+        # 意味がかぶる語と、意味の無い語
+        conn.execute("INSERT INTO words (word, definition_ja, pos) VALUES ('apple', 'りんご（果物）', 'noun')")
+        conn.execute("INSERT INTO words (word, definition_ja, pos) VALUES ('blank', '', 'noun')")
+        conn.commit()
+    word_index.init_word_version(path)
+    return path
+
+
+def word_id(path, word):
+    with db_connect(path) as conn:
+        return conn.execute("SELECT id FROM words WHERE word = ?", (word,)).fetchone()[0]
+
+
+def test_meaning_overlap():
+    assert distractors.meaning_keys("保証、確信（自信）")[0] == ("保証", "確信", "自信")
+    assert distractors._overlaps(distractors.meaning_keys("りんご"), distractors.meaning_keys("りんご（果物）"))
+    assert not distractors._overlaps(distractors.meaning_keys("りんご"), distractors.meaning_keys("本"))
+
+
+def test_build_picks_three_distinct_non_overlapping_choices(db):
+    assert distractors.init_distractors(db)
+    built = distractors.build(db, seed=1)
+
+    assert built == len(MEANINGS) + 1
+    assert not distractors.init_distractors(db)
+    apple, w0, blank = word_id(db, "apple"), word_id(db, "w0"), word_id(db, "blank")
+    choices = distractors.choices_for(db, [apple, w0, blank])
+    assert set(choices) == {apple, w0}
+    for target, options in choices.items():
+        ids = [i for i, _ in options]
+        assert ids[0] == target and len(set(ids)) == 4 and blank not in ids
+        keys = [distractors.meaning_keys(m) for _, m in options]
+        assert not any(distractors._overlaps(keys[0], k) for k in keys[1:])
+    # 同じ種なら同じ選択肢
+    distractors.build(db, seed=1)
+    assert distractors.choices_for(db, [apple, w0]) == choices
+    assert distractors.choices_for(db, []) == {}
+
+
+def test_words_change_requires_rebuild(db):
+    distractors.build(db)
+    with db_connect(db) as conn:
+        conn.execute("INSERT INTO words (word, definition_ja, pos) VALUES ('dog', '犬', 'noun')")
+        conn.commit()
+    assert distractors.init_distractors(db)
+    assert sorted(distractors.random_words(db, 100, exclude=[word_id(db, "w0")])) == sorted(
+        word_id(db, w) for w in [f"w{i}" for i in range(1, len(MEANINGS))] + ["apple"])
+
+
+def expired(reason):
+    return metrics._counters.get(metrics._key("word_choice_expired_total", {"reason": reason}), 0)
+
+
+def test_issued_choices_are_single_use_and_owned(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(distractors.time, "monotonic", lambda: now[0])
+    issued = distractors.IssuedChoices(ttl=60, max_issued=2)
+
+    a = issued.issue("me", 1)
+    assert issued.peek("me", a) == 1
+    assert issued.peek("someone else", a) is None
+    assert not issued.take("someone else", a)
+    assert issued.take("me", a)
+    assert not issued.take("me", a)
+    assert issued.peek("me", a) is None
+
+    ttl, capacity = expired("ttl"), expired("capacity")
+    b, c, d = issued.issue("me", 2), issued.issue("me", 3), issued.issue("me", 4)
+    assert issued.peek("me", b) is None      # 上限を超えた分は古いものから消える
+    assert issued.peek("me", c) == 3
+    assert expired("capacity") == capacity + 1
+    now[0] += 61
+    assert issued.peek("me", d) is None
+    issued.issue("me", 5)
+    assert expired("ttl") >= ttl + 1
+
+
+@pytest.fixture
+def choice_item(app_module, client):
+    """4 択の問題を 1 問出し、(問題, 正解の token, まちがいの token) を返す"""
+    items = client.get("/api/word_session?mode=choice&n=1").get_json()["items"]
+    assert items, "4 択で出せる単語がない"
+    item = items[0]
+    with client.session_transaction() as sess:
+        nonce = sess["choice_nonce"]
+    right = app_module.choice_token(nonce, item["issue"], item["word_id"], item["word_id"])
+    wrong = next(c["token"] for c in item["choices"] if c["token"] != right)
+    assert right in [c["token"] for c in item["choices"]]
+    return item, right, wrong
+
+
+def test_submit_choice_scores_once(client, choice_item):
+    item, right, _ = choice_item
+    form = {"issue": item["issue"], "word_id": item["word_id"], "choice": right}
+
+    first = client.post("/api/submit_choice", data=form)
+    assert first.status_code == 200
+    assert first.get_json()["score"] == 100 and first.get_json()["correct"]
+    assert client.post("/api/submit_choice", data=form).status_code == 409
+
+
+def test_submit_choice_wrong_answer(client, choice_item):
+    item, _, wrong = choice_item
+    data = client.post("/api/submit_choice", data={"issue": item["issue"], "choice": wrong}).get_json()
+    assert data["score"] == 0 and not data["correct"]
+    assert data["feedback"].startswith("（4択）「")
+
+
+def test_submit_choice_rejects_bad_requests(app_module, client, choice_item):
+    item, right, _ = choice_item
+    other_word = item["choices"][0]["token"]
+    # 出題と違う単語
+    assert client.post("/api/submit_choice", data={
+        "issue": item["issue"], "word_id": item["word_id"] + 1, "choice": right}).status_code == 400
+    # 署名の合わない token
+    assert client.post("/api/submit_choice", data={"issue": item["issue"], "choice": "0" * 20}).status_code == 400
+    # 別のセッションからは使えない
+    other = app_module.app.test_client()
+    other.get("/api/word_session?mode=choice&n=1")
+    assert other.post("/api/submit_choice", data={"issue": item["issue"], "choice": right}).status_code == 409
+    # ここまでの失敗では消費されない
+    assert client.post("/api/submit_choice", data={"issue": item["issue"], "choice": other_word}).status_code == 200
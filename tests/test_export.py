@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import random
+
+import pytest
+
+import archive
+import export
+from db import connect as db_connect
+
+
+@pytest.fixture
+def dbs(tmp_path):
+    word_db, reading_db = str(tmp_path / "words.db"), str(tmp_path / "reading.db")
+    rng = random.Random(0)
+    with db_connect(word_db) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT)")
+        conn.execute("CREATE TABLE student_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                     "word_id INTEGER, score INTEGER, feedback TEXT, attempt_date TEXT, user_answer TEXT)")
+        conn.executemany("INSERT INTO users VALUES (?, ?)", [(1, "3A_taro"), (2, "3AXjiro"), (3, "3B-hanako")])
+        conn.executemany("INSERT INTO words VALUES (?, ?)", [(1, "apple"), (2, "banana")])
+        # 同じ日時の行もまぜる（(attempt_date, id) で並ぶこと）
+        conn.executemany(
+            "INSERT INTO student_answers (user_id, word_id, score, feedback, attempt_date, user_answer) "
+            "VALUES (?, ?, ?, 'fb', ?, ?)",
+            [(uid, rng.choice([1, 2]), rng.randint(0, 100), f"2025-0{rng.randint(1, 6)}-0{rng.randint(1, 3)}",
+              f"ans{i}") for i in range(60) for uid in (1, 2)]
+            + [(1, 1, 50, None, "no date")],
+        )
+        conn.execute(export.index_statement("student_answers"))
+        conn.commit()
+    with db_connect(reading_db) as conn:
+        conn.execute("CREATE TABLE reading_texts (id INTEGER PRIMARY KEY, text TEXT)")
+        conn.execute("CREATE TABLE reading_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                     "passage_id INTEGER, user_answer TEXT, score INTEGER, feedback TEXT, correct_answer TEXT, "
+                     "attempt_date TEXT)")
+        conn.execute("INSERT INTO reading_texts VALUES (7, ?)", ("A" * 100,))
+        conn.executemany(
+            "INSERT INTO reading_answers (user_id, passage_id, user_answer, score, feedback, correct_answer, "
+            "attempt_date) VALUES (1, 7, ?, 80, 'ok', '', ?)",
+            [(f"訳{i}", f"2025-0{i % 6 + 1}-02") for i in range(7)],
+        )
+        conn.commit()
+    # 古い方を cold に移しておく
+    archive.archive_source(word_db, archive.SOURCES["student_answers"], "2025-03-01")
+    archive.archive_source(reading_db, archive.SOURCES["reading_answers"], "2025-03-01")
+    return {"word": (word_db, "student_answers"), "reading": (reading_db, "reading_answers")}
+
+
+def expected(sources, user_id, since=None, until=None):
+    """全部読んで並べ替えた答え"""
+    rows = []
+    for kind, (db_file, table) in sources.items():
+        for name, archived in ((table, 0), (f"{table}_archive", 1)):
+            with db_connect(db_file) as conn:
+                for answer_id, date in conn.execute(f"SELECT id, attempt_date FROM {name} WHERE user_id = ?",
+                                                    (user_id,)):
+                    if since is not None and (date is None or date < since):
+                        continue
+                    if until is not None and date is not None and date >= until:
+                        continue
+                    rows.append((date is not None, date or "", kind, answer_id, archived))
+    return sorted(rows)
+
+
+def keys(records):
+    return [(r["attempt_date"] is not None, r["attempt_date"] or "", r["type"], r["answer_id"], r["archived"])
+            for r in records]
+
+
+@pytest.mark.parametrize("page_rows", [1, 2, 7, 1000])
+def test_keyset_paging_across_hot_and_archive(dbs, page_rows):
+    for user_id in (1, 2):
+        got = list(export.iter_records(dbs, [(user_id, "u")], page_rows=page_rows))
+        assert keys(got) == expected(dbs, user_id)
+    assert {r["archived"] for r in got} == {0, 1}
+
+
+def test_since_and_until(dbs):
+    got = list(export.iter_records(dbs, [(1, "u")], since="2025-02-02", until="2025-05-01", page_rows=3))
+    assert keys(got) == expected(dbs, 1, since="2025-02-02", until="2025-05-01")
+
+
+def test_labels_and_archived_feedback(dbs):
+    got = list(export.iter_records(dbs, [(1, "u")]))
+    reading = [r for r in got if r["type"] == "reading"]
+    assert {r["item"] for r in reading} == {"A" * 80}
+    assert all(r["feedback"] is None for r in got if r["archived"])
+    assert {r["item"] for r in got if r["type"] == "word"} == {"apple", "banana"}
+    # attempt_date の無い行は先頭
+    assert got[0]["answer"] == "no date"
+
+
+def test_iter_users(dbs):
+    word_db = dbs["word"][0]
+    assert list(export.iter_users(word_db)) == [(1, "3A_taro"), (2, "3AXjiro"), (3, "3B-hanako")]
+    # _ は LIKE のワイルドカードとしては扱わない
+    assert list(export.iter_users(word_db, prefix="3A_")) == [(1, "3A_taro")]
+    assert list(export.iter_users(word_db, user_ids=[3, 99, 1])) == [(1, "3A_taro"), (3, "3B-hanako")]
+
+
+def test_stream_csv_and_ndjson(dbs, monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_CHARS", 100)
+    users = [(1, "3A_taro")]
+    chunks = list(export.stream(dbs, users, "csv", bom=True))
+    assert len(chunks) > 1
+    text = "".join(chunks)
+    assert text.startswith("\ufeff")
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert tuple(rows[0]) == export.COLUMNS
+    assert len(rows) - 1 == len(expected(dbs, 1))
+
+    lines = "".join(export.stream(dbs, users, "ndjson")).splitlines()
+    assert [str(json.loads(line)["answer_id"]) for line in lines] == [r[3] for r in rows[1:]]
+    with pytest.raises(ValueError):
+        list(export.stream(dbs, users, "xml"))
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+
+import fake_gemini
+import loadtest
+
+
+def test_from_spec():
+    fake = fake_gemini.FakeGemini.from_spec("latency_ms=5,jitter=0,error_rate=0.25,seed=3")
+    assert (fake.latency_ms, fake.jitter, fake.error_rate) == (5.0, 0.0, 0.25)
+    assert fake_gemini.FakeGemini.from_spec("1").latency_ms == 800
+
+
+def test_same_prompt_same_score():
+    fake = fake_gemini.FakeGemini(latency_ms=0, jitter=0)
+    first = json.loads(fake.generate("grade this", "word"))
+    again = json.loads(fake.generate("grade this", "word"))
+    assert first["score"] == again["score"]
+    assert 40 <= first["score"] <= 100
+    assert fake.calls == 2
+
+
+def test_outcome_rates_follow_the_spec():
+    fake = fake_gemini.FakeGemini(latency_ms=0, jitter=0, error_rate=0.2, bad_json_rate=0.1, seed=1)
+    outcomes = [fake.sample()[1] for _ in range(5000)]
+    assert outcomes.count("error") / 5000 == pytest.approx(0.2, abs=0.03)
+    assert outcomes.count("bad_json") / 5000 == pytest.approx(0.1, abs=0.03)
+    assert "timeout" not in outcomes
+
+
+def test_errors_and_bad_json():
+    failing = fake_gemini.FakeGemini(latency_ms=0, jitter=0, error_rate=1.0)
+    with pytest.raises(fake_gemini.FakeGeminiError):
+        failing.generate("x", "word")
+    garbled = fake_gemini.FakeGemini(latency_ms=0, jitter=0, bad_json_rate=1.0)
+    with pytest.raises(ValueError):
+        json.loads(asyncio.run(garbled.generate_async("x", "word")))
+
+
+def test_cached_calls():
+    fake = fake_gemini.FakeGemini(latency_ms=0, jitter=0)
+    name = fake.create_cache("long context", ttl_sec=60)
+    fake.generate("question", "reading", cached=name)
+    assert fake.cache_hits == 1
+    fake.delete_cache(name)
+    with pytest.raises(fake_gemini.FakeGeminiError):
+        fake.generate("question", "reading", cached=name)
+
+
+def test_loadtest_helpers():
+    assert loadtest.percentile([], 0.5) == 0.0
+    assert loadtest.percentile([1, 2, 3, 4], 0.5) == 3
+    assert loadtest.percentile([1, 2, 3, 4], 0.99) == 4
+    assert loadtest.parse_mix("word=3,writing") == {"word": 3.0, "writing": 1.0}
+    with pytest.raises(SystemExit):
+        loadtest.parse_mix("nope=1")
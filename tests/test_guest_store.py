@@ -0,0 +1,96 @@
+import pytest
+
+import guest_store
+import metrics
+from db import connect as db_connect
+
+
+def counter(name, **labels):
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(guest_store.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ids():
+    gid = guest_store.GuestStore().new_id()
+    assert guest_store.is_guest_id(gid)
+    assert not guest_store.is_guest_id(0)
+    assert not guest_store.is_guest_id("taro")
+
+
+def test_average_counts_all_answers_but_keeps_only_recent_rows():
+    store = guest_store.GuestStore(max_answers=2)
+    for score in (100, 50, 0, None):
+        store.add("guest-a", "student_answers", ("guest-a", 1, score))
+
+    assert store.average("guest-a", "student_answers") == 50.0
+    assert store.answers("guest-a", "student_answers") == [("guest-a", 1, 0), ("guest-a", 1, None)]
+    assert store.average("guest-a", "writing_answers") == 0
+    assert store.average("guest-nobody", "student_answers") == 0
+    assert store.count("guest-a") == 2
+
+
+def test_ttl_expires_idle_guests(clock):
+    store = guest_store.GuestStore(ttl=60)
+    store.add("guest-a", "student_answers", ("guest-a", 1, 80))
+    store.add("guest-b", "student_answers", ("guest-b", 1, 80))
+    before = counter("guest_sessions_evicted_total", reason="ttl")
+
+    clock[0] += 50
+    assert store.count("guest-b") == 1   # b は使ったので延びる
+    clock[0] += 20
+    assert store.count("guest-a") == 0
+    assert store.count("guest-b") == 1
+    assert len(store) == 1
+    assert counter("guest_sessions_evicted_total", reason="ttl") == before + 1
+
+
+def test_capacity_evicts_least_recently_used(clock):
+    store = guest_store.GuestStore(max_guests=2)
+    before = counter("guest_sessions_evicted_total", reason="capacity")
+    for gid in ("guest-a", "guest-b"):
+        clock[0] += 1
+        store.add(gid, "student_answers", (gid, 1, 50))
+    clock[0] += 1
+    store.answers("guest-a", "student_answers")   # a を使う
+    store.add("guest-c", "student_answers", ("guest-c", 1, 50))
+
+    assert len(store) == 2
+    assert store.count("guest-b") == 0
+    assert store.count("guest-a") == store.count("guest-c") == 1
+    assert counter("guest_sessions_evicted_total", reason="capacity") == before + 1
+
+
+def test_claim_takes_everything_once():
+    store = guest_store.GuestStore()
+    store.add("guest-a", "student_answers", ("guest-a", 1, 80))
+    store.add("guest-a", "writing_answers", ("guest-a", 2, 60))
+
+    assert store.claim("guest-a") == {
+        "student_answers": [("guest-a", 1, 80)], "writing_answers": [("guest-a", 2, 60)]}
+    assert store.claim("guest-a") == {}
+    assert len(store) == 0
+
+
+def test_guest_answers_stay_out_of_the_db_until_registration(app_module, client):
+    with db_connect(app_module.DB_FILE) as conn:
+        word_id = conn.execute("SELECT id FROM words ORDER BY id LIMIT 1").fetchone()[0]
+    client.post("/guest_login")
+    data = client.post("/api/submit_answer", data={"word_id": word_id, "answer": "ゲストの回答"}).get_json()
+    assert data["average_score"] == data["score"]
+
+    def saved():
+        app_module.ANSWER_WRITER.flush()
+        with db_connect(app_module.DB_FILE) as conn:
+            return conn.execute("SELECT u.username FROM student_answers a JOIN users u ON u.id = a.user_id "
+                                "WHERE a.user_answer = 'ゲストの回答'").fetchall()
+
+    assert saved() == []
+    resp = client.post("/register", data={"username": "guest-claimer", "password": "pw", "claim": "1"})
+    assert resp.status_code == 302
+    assert saved() == [("guest-claimer",)]
@@ -0,0 +1,130 @@
+import contextlib
+
+import pytest
+
+import leaderboard
+import write_behind
+from db import connect as db_connect
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "lb.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+        for table in ("student_answers", "word_choice_answers"):
+            conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, user_id INTEGER, score INTEGER)")
+        conn.executemany("INSERT INTO users (id, username) VALUES (?, ?)",
+                         [(i, f"user{i}") for i in range(1, 8)])
+        conn.commit()
+    leaderboard.init_leaderboard(path)
+    return path
+
+
+def add_answers(path, table, scores):
+    with db_connect(path) as conn:
+        conn.executemany(f"INSERT INTO {table} (user_id, score) VALUES (?, ?)", scores)
+        conn.commit()
+
+
+def test_rebuild_ranks_ties_together(db):
+    # 平均 90, 80, 80, 70（同点は同順位、次は 4 位）
+    add_answers(db, "student_answers", [(1, 90), (2, 80), (3, 70), (3, 90), (4, 70)])
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+
+    rows, total = leaderboard.get_page(db, "word", 1, 10)
+
+    assert total == 4
+    assert [(r["user_id"], r["rank"]) for r in rows] == [(1, 1), (3, 2), (2, 2), (4, 4)]
+    # 同点なら回答数の多い順
+    assert rows[1]["attempts"] == 2
+    assert leaderboard.get_user_rank(db, "word", 2)["rank"] == 2
+    assert leaderboard.get_user_rank(db, "word", 7) is None
+
+
+def test_rank_continues_across_pages(db):
+    add_answers(db, "student_answers", [(1, 100), (2, 90), (3, 90), (4, 90), (5, 50)])
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+
+    page2, total = leaderboard.get_page(db, "word", 2, 2)
+    page3, _ = leaderboard.get_page(db, "word", 3, 2)
+
+    assert total == 5
+    assert [r["rank"] for r in page2] == [2, 2]
+    assert [r["rank"] for r in page3] == [5]
+
+
+@pytest.mark.parametrize("page", [0, -3, 10 ** 20])
+def test_page_is_clamped(db, page):
+    add_answers(db, "student_answers", [(i, 10 * i) for i in range(1, 6)])
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+
+    rows, total = leaderboard.get_page(db, "word", page, 2)
+
+    assert total == 5
+    expected = [5, 4] if page < 1 else [1]
+    assert [r["user_id"] for r in rows] == expected
+
+
+def test_last_page():
+    assert leaderboard.last_page(0, 20) == 1
+    assert leaderboard.last_page(20, 20) == 1
+    assert leaderboard.last_page(21, 20) == 2
+
+
+def test_record_scores_matches_rebuild(db):
+    add_answers(db, "student_answers", [(1, 60), (1, 80), (2, 30)])
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+    leaderboard.record_scores(db, "word", [(2, 90), (5, 40)])
+    add_answers(db, "student_answers", [(2, 90), (5, 40)])
+    incremental, _ = leaderboard.get_page(db, leaderboard.COMBINED, 1, 10)
+
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+    rebuilt, _ = leaderboard.get_page(db, leaderboard.COMBINED, 1, 10)
+
+    assert incremental == rebuilt
+
+
+def test_answers_written_during_rebuild_are_kept_once(db):
+    writer = write_behind.WriteBehind(flush_interval=0)
+    writer.register("student_answers", db, "INSERT INTO student_answers (user_id, score) VALUES (?, ?)",
+                    on_flush=lambda rows: leaderboard.record_scores(db, "word", rows))
+    add_answers(db, "student_answers", [(1, 60)])
+    leaderboard.rebuild(db, {"word": (db, "student_answers")})
+
+    @contextlib.contextmanager
+    def pause():
+        # 集計を読んだ後、置き換える前に回答が 1 件コミットされ、ランキングにも反映された
+        writer.add("student_answers", (1, 100))
+        assert writer.flush()
+        with writer.paused():
+            # 止めている間の回答は、置き換えた後で反映される
+            writer.add("student_answers", (2, 40))
+            yield
+
+    leaderboard.rebuild(db, {"word": (db, "student_answers")}, pause=pause)
+    assert writer.flush()
+    writer.close()
+
+    assert leaderboard.get_user_rank(db, "word", 1) == {"rank": 1, "avg_score": 80.0, "attempts": 2}
+    assert leaderboard.get_user_rank(db, "word", 2)["attempts"] == 1
+
+
+def test_unknown_type_is_rejected(db):
+    with pytest.raises(ValueError):
+        leaderboard.record_scores(db, "bogus", [(1, 10)])
+
+
+def test_choice_type_is_not_combined(db):
+    add_answers(db, "student_answers", [(1, 50)])
+    add_answers(db, "word_choice_answers", [(1, 100), (2, 100)])
+    sources = {"word": (db, "student_answers"), "choice": (db, "word_choice_answers")}
+    leaderboard.rebuild(db, sources)
+    leaderboard.record_scores(db, "choice", [(3, 100)])
+
+    combined, total = leaderboard.get_page(db, leaderboard.COMBINED, 1, 10)
+    choice, choice_total = leaderboard.get_page(db, "choice", 1, 10)
+
+    assert total == 1 and combined[0]["avg_score"] == 50
+    assert choice_total == 3
+    assert sorted(r["user_id"] for r in choice) == [1, 2, 3]
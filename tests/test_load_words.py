@@ -0,0 +1,121 @@
+import pytest
+
+import load_words
+from db import connect as db_connect
+from pos import normalize_pos_string
+
+JMDICT = """<?xml version="1.0" encoding="UTF-8"?>
+<JMdict>
+<entry><k_ele><keb>林檎</keb></k_ele><r_ele><reb>りんご</reb><re_pri>news1</re_pri></r_ele>
+  <sense><pos>noun (common) (futsuumeishi)</pos><gloss>apple</gloss><gloss xml:lang="ger">Apfel</gloss></sense></entry>
+<entry><r_ele><reb>アップル</reb></r_ele>
+  <sense><pos>noun (common) (futsuumeishi)</pos><gloss>apple</gloss></sense></entry>
+<entry><k_ele><keb>走る</keb><ke_pri>ichi1</ke_pri></k_ele><r_ele><reb>はしる</reb></r_ele>
+  <sense><pos>Godan verb with 'ru' ending</pos><gloss>to run</gloss></sense>
+  <sense><gloss>to dash (somewhere)</gloss></sense></entry>
+<entry><k_ele><keb>象</keb></k_ele><sense><pos>noun (common) (futsuumeishi)</pos><gloss>elephant</gloss></sense></entry>
+</JMdict>
+"""
+
+WORDNET = """<?xml version="1.0" encoding="UTF-8"?>
+<LexicalResource xmlns:dc="https://globalwordnet.github.io/schemas/dc/">
+<Lexicon id="oewn" label="Open English WordNet" language="en" email="" license="" version="2024">
+  <LexicalEntry id="oewn-apple-n"><Lemma writtenForm="apple" partOfSpeech="n"/>
+    <Sense id="s1" synset="oewn-apple-fruit"/></LexicalEntry>
+  <LexicalEntry id="oewn-run-v"><Lemma writtenForm="run" partOfSpeech="v"/>
+    <Sense id="s2" synset="oewn-run-move"/></LexicalEntry>
+  <LexicalEntry id="oewn-run-n"><Lemma writtenForm="run" partOfSpeech="n"/>
+    <Sense id="s3" synset="oewn-run-score"/></LexicalEntry>
+  <Synset id="oewn-apple-fruit" partOfSpeech="n"><Definition>fruit with red or yellow skin</Definition></Synset>
+  <Synset id="oewn-run-move" partOfSpeech="v"><Definition>move fast by using your feet</Definition></Synset>
+  <Synset id="oewn-run-score" partOfSpeech="n"><Definition>a score in baseball</Definition></Synset>
+</Lexicon>
+</LexicalResource>
+"""
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("noun, verb", "名詞・動詞"), ("Noun/Verb", "名詞・動詞"), ("n v noun", "名詞・動詞"),
+    ("noun (countable)、adj", "名詞・形容詞"), ("xyz", "その他"), ("", "その他"), (None, "その他"),
+])
+def test_normalize_pos_string(raw, expected):
+    assert normalize_pos_string(raw) == expected
+
+
+def test_canonical_pos():
+    assert load_words.canonical_pos(("n", "adj", "noun")) == "noun, adjective"
+    assert load_words.canonical_pos(("", "v")) == "verb"
+    assert load_words.canonical_pos(("unknown",)) is None
+
+
+def test_read_wordlist(tmp_path):
+    path = tmp_path / "words.txt"
+    path.write_text("Apple\nrun\n\napple\nelephant\n", encoding="utf-8")
+    assert load_words.read_wordlist(str(path)) == ["apple", "run", "elephant"]
+
+
+def test_load_tsv(tmp_path):
+    path = tmp_path / "dict.tsv"
+    path.write_text("word\tpos\tdefinition_en\tdefinition_ja\n"
+                    "# comment\n"
+                    "Apple\tn\ta fruit\tりんご\n"
+                    "apple\tverb\tignored\t無視\n"
+                    "zebra\tn\tanimal\tシマウマ\n"
+                    "run\tv/n\t\t走る\n", encoding="utf-8")
+    entries = {}
+
+    assert load_words.load_tsv(str(path), {"apple", "run"}, entries) == 3
+    assert entries == {
+        "apple": {"definition_en": "a fruit", "definition_ja": "りんご", "pos": "noun"},
+        "run": {"definition_ja": "走る", "pos": "verb, noun"},
+    }
+    with pytest.raises(ValueError):
+        load_words.load_tsv(str(path), {"apple"}, {}, columns="pos,definition_ja")
+
+
+def test_load_jmdict_prefers_common_headwords(tmp_path):
+    path = tmp_path / "JMdict_e.xml"
+    path.write_text(JMDICT, encoding="utf-8")
+    entries = {"apple": {"definition_ja": "手で直した訳"}}
+
+    assert load_words.load_jmdict(str(path), {"apple", "run", "dash"}, entries) == 3
+    # 先に入っている項目は上書きしない
+    assert entries["apple"] == {"definition_ja": "手で直した訳", "pos": "noun"}
+    assert entries["run"] == {"definition_ja": "走る", "pos": "verb"}
+    # pos の無い sense は前の sense の品詞を引き継ぐ
+    assert entries["dash"] == {"definition_ja": "走る", "pos": "verb"}
+
+
+def test_load_wordnet_uses_the_first_sense(tmp_path):
+    path = tmp_path / "wn.xml"
+    path.write_text(WORDNET, encoding="utf-8")
+    entries = {}
+
+    assert load_words.load_wordnet(str(path), {"apple", "run"}, entries) == 2
+    assert entries["apple"] == {"definition_en": "fruit with red or yellow skin", "pos": "noun"}
+    assert entries["run"] == {"definition_en": "move fast by using your feet", "pos": "verb, noun"}
+
+
+def test_write_words(tmp_path):
+    db = str(tmp_path / "words.db")
+    with db_connect(db) as conn:
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY AUTOINCREMENT, word TEXT UNIQUE, definition_ja TEXT)")
+        conn.execute("INSERT INTO words (word, definition_ja) VALUES ('apple', 'りんご'), ('run', '')")
+        conn.commit()
+    entries = {
+        "apple": {"definition_ja": "林檎", "pos": "noun"},
+        "run": {"definition_ja": "走る", "pos": "verb"},
+        "dash": {"definition_en": "go fast"},     # 訳が無いので追加しない
+        "elephant": {"definition_ja": "象"},
+    }
+
+    added, updated = load_words.write_words(db, ["apple", "run", "dash", "elephant"], entries, batch_size=1)
+
+    assert (added, updated) == (1, 2)
+    with db_connect(db) as conn:
+        assert conn.execute("SELECT word, definition_ja, pos FROM words ORDER BY id").fetchall() == [
+            ("apple", "りんご", "noun"), ("run", "走る", "verb"), ("elephant", "象", None)]
+
+    load_words.write_words(db, ["apple"], entries, overwrite=True)
+    with db_connect(db) as conn:
+        assert conn.execute("SELECT definition_ja FROM words WHERE word = 'apple'").fetchone() == ("林檎",)
@@ -0,0 +1,74 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import local_scorer
+
+
+def reference_chrf(answer, reference, max_order=local_scorer.MAX_ORDER, beta=local_scorer.BETA):
+    """Counter で素直に数える chrF（chrf_batch と同じく、両側に n-gram がある次数だけで平均）"""
+    hyp, ref = local_scorer.normalize(answer), local_scorer.normalize(reference)
+    precisions, recalls = [], []
+    for n in range(1, max_order + 1):
+        h = Counter(hyp[i:i + n] for i in range(len(hyp) - n + 1))
+        r = Counter(ref[i:i + n] for i in range(len(ref) - n + 1))
+        if not h or not r:
+            continue
+        match = sum((h & r).values())
+        precisions.append(match / sum(h.values()))
+        recalls.append(match / sum(r.values()))
+    if not precisions:
+        return 0.0
+    p, r = sum(precisions) / len(precisions), sum(recalls) / len(recalls)
+    if p == 0 and r == 0:
+        return 0.0
+    return (1 + beta ** 2) * p * r / (beta ** 2 * p + r)
+
+
+def test_identical_and_disjoint():
+    assert local_scorer.chrf("私は学生です。", "私は学生です。") == pytest.approx(1.0)
+    assert local_scorer.chrf("abc", "xyz") == 0.0
+    assert local_scorer.chrf("", "何か") == 0.0
+    assert local_scorer.chrf("何か", "") == 0.0
+
+
+def test_normalize_ignores_width_case_and_spaces():
+    assert local_scorer.chrf("ＡＢＣ def", "abcdef") == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("answer, reference", [
+    ("彼は毎朝公園を走る。", "彼は毎朝、公園でジョギングをする。"),
+    ("I like apples", "I really like green apples"),
+    ("あ", "ああああ"),
+    ("abcabcabc", "abc"),
+])
+def test_matches_reference_implementation(answer, reference):
+    assert local_scorer.chrf(answer, reference) == pytest.approx(reference_chrf(answer, reference))
+
+
+def test_batch_matches_single():
+    rng = random.Random(0)
+    alphabet = "あいうえおかきくけこ学生先abc "
+    answers = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30))) for _ in range(200)]
+    references = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 30))) for _ in range(200)]
+
+    batch = local_scorer.chrf_batch(answers, references)
+
+    singles = np.array([local_scorer.chrf(a, r) for a, r in zip(answers, references)])
+    np.testing.assert_allclose(batch, singles)
+    np.testing.assert_allclose(batch, [reference_chrf(a, r) for a, r in zip(answers, references)])
+
+
+def test_batch_length_mismatch():
+    with pytest.raises(ValueError):
+        local_scorer.chrf_batch(["a"], [])
+    assert len(local_scorer.chrf_batch([], [])) == 0
+
+
+def test_grade():
+    score, feedback = local_scorer.grade("私は学生です。", "私は学生です。")
+    assert score == 100
+    assert feedback.startswith("（簡易採点）")
+    assert local_scorer.grade("xyz", "私は学生です。")[0] == 0
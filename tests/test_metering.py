@@ -0,0 +1,90 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+import metering
+from db import connect as db_connect
+
+
+@pytest.fixture
+def meter(tmp_path):
+    m = metering.Meter(str(tmp_path / "usage.db"), budgets={"reading": 100, "all": 150},
+                       price_input_per_m=1.0, price_output_per_m=10.0, price_cached_per_m=0.25)
+    m.init()
+    return m
+
+
+def usage_rows(meter):
+    with db_connect(meter.db_file) as conn:
+        return conn.execute("SELECT feature, endpoint, prompt_tokens, output_tokens, cached_tokens, outcome "
+                            "FROM llm_usage ORDER BY id").fetchall()
+
+
+def test_parse_budgets():
+    assert metering.parse_budgets("reading=500000, all = 2000000,,bad") == {"reading": 500000, "all": 2000000}
+    assert metering.parse_budgets("") == {}
+    assert metering.parse_budgets(None) == {}
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("", 0), (None, 0), ("abcd", 1), ("abcde", 2), ("日本語", 3), ("ab日本", 3),
+])
+def test_estimate_tokens(text, tokens):
+    assert metering.estimate_tokens(text) == tokens
+
+
+def test_metered_records_usage_metadata_minus_cache(meter):
+    usage = SimpleNamespace(prompt_token_count=50, candidates_token_count=5, cached_content_token_count=40)
+    with meter.metered("reading", "prompt", endpoint="/toeic", user_id=3, cached="x" * 160) as call:
+        call.finish("answer", usage)
+
+    assert usage_rows(meter) == [("reading", "/toeic", 10, 5, 40, "ok")]
+    assert meter.used_today("reading") == 15
+    assert meter.cost(10, 5, 40) == pytest.approx((10 * 1 + 5 * 10 + 40 * 0.25) / 1e6)
+
+
+def test_metered_estimates_and_records_errors(meter):
+    with pytest.raises(RuntimeError):
+        with meter.metered("word", "abcdefgh", cached="日本"):
+            raise RuntimeError("gemini down")
+
+    assert usage_rows(meter) == [("word", None, 2, 0, 2, "error")]
+
+
+def test_budget_per_feature_and_overall(meter):
+    meter.check("reading")
+    meter.record("reading", None, None, SimpleNamespace(prompt_token_count=90, candidates_token_count=10), 0.1, "ok")
+    assert meter.over_budget("reading") == "reading"
+    assert meter.over_budget("word") is None
+    with pytest.raises(admission.Shed) as info:
+        meter.check("reading")
+    assert info.value.reason == "budget"
+
+    meter.record("word", None, None, SimpleNamespace(prompt_token_count=50, candidates_token_count=0), 0.1, "ok")
+    assert meter.over_budget("word") == "all"
+
+
+def test_refresh_reads_other_processes_and_writer_is_used(meter, monkeypatch):
+    written = []
+    other = metering.Meter(meter.db_file, writer=written.append)
+    other.record("reading", "abcd" * 30, "", None, 0.2, "ok")
+    assert len(written) == 1 and usage_rows(meter) == []
+
+    with db_connect(meter.db_file) as conn:
+        conn.execute(metering.INSERT_SQL, written[0])
+        conn.commit()
+    assert meter.used_today("reading") == 0
+    monkeypatch.setattr(metering, "REFRESH_SEC", 0)
+    assert meter.used_today("reading") == 30
+
+
+def test_report(meter):
+    meter.record("reading", "abcd", "ab", None, 0.5, "ok", endpoint="/toeic", user_id=1)
+    meter.record("word", "abcd", "", None, 0.1, "error")
+    out = io.StringIO()
+    metering.report(meter.db_file, days=1, out=out)
+    text = out.getvalue()
+    assert "2 calls, 3 tokens" in text
+    assert "/toeic" in text and "user (top 10)" in text
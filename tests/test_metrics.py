@@ -0,0 +1,61 @@
+import metrics
+from db import connect as db_connect
+
+
+def counter(name, **labels):
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+def test_render_counters_gauges_and_histograms():
+    metrics.describe("test_events_total", "counter", "Events seen by the test.")
+    metrics.inc("test_events_total", kind="a")
+    metrics.inc("test_events_total", 2, kind="a")
+    metrics.set_gauge("test_level", 1.5)
+    metrics.observe("test_seconds", 0.02, buckets=(0.01, 0.1, 1))
+    metrics.observe("test_seconds", 0.5, buckets=(0.01, 0.1, 1))
+
+    text = metrics.render_prometheus()
+
+    assert "# HELP test_events_total Events seen by the test." in text
+    assert "# TYPE test_events_total counter" in text
+    assert 'test_events_total{kind="a"} 3' in text
+    assert "test_level 1.5" in text
+    # バケットは累積
+    assert 'test_seconds_bucket{le="0.01"} 0' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_seconds_count 2" in text
+
+
+def test_request_stats_collect_db_time(tmp_path):
+    stats = metrics.begin_request("test_endpoint")
+    with db_connect(str(tmp_path / "t.db")) as conn:
+        conn.execute("CREATE TABLE t (x)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(100)])
+        conn.execute("SELECT * FROM t").fetchall()
+        conn.commit()
+    before = counter("http_requests_total", endpoint="test_endpoint", method="GET", status="200")
+
+    assert metrics.end_request("GET", 200) is stats
+    assert stats.db_time > 0
+    assert counter("http_requests_total", endpoint="test_endpoint", method="GET", status="200") == before + 1
+    # 終わったリクエストには積まない
+    assert metrics.end_request("GET", 200) is None
+
+
+def test_fallback_counter():
+    before = counter("grading_fallback_total", feature="word", reason="test")
+    metrics.fallback("word", "test")
+    assert counter("grading_fallback_total", feature="word", reason="test") == before + 1
+
+
+def test_metrics_endpoint_token(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "secret-token")
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer ñ"}).status_code == 401
+    resp = client.get("/metrics", headers={"Authorization": "Bearer secret-token"})
+    assert resp.status_code == 200
+    assert "http_requests_total" in resp.get_data(as_text=True)
@@ -0,0 +1,85 @@
+import sqlite3
+
+from db import connect as db_connect
+
+
+def some_word_id(app_module):
+    with db_connect(app_module.DB_FILE) as conn:
+        return conn.execute("SELECT id FROM words ORDER BY id LIMIT 1").fetchone()[0]
+
+
+def answers_of(app_module, username):
+    app_module.ANSWER_WRITER.flush()
+    with db_connect(app_module.DB_FILE) as conn:
+        return conn.execute(
+            "SELECT a.word_id, a.user_answer FROM student_answers a JOIN users u ON u.id = a.user_id "
+            "WHERE u.username = ?", (username,)
+        ).fetchall()
+
+
+def test_get_shows_a_word(client):
+    resp = client.get("/name_quiz")
+    assert resp.status_code == 200
+    assert b'name="word_id"' in resp.data
+
+
+def test_answer_creates_passwordless_user(app_module, client):
+    word_id = some_word_id(app_module)
+
+    resp = client.post("/name_quiz", data={"name": "name-quiz-taro", "word_id": str(word_id), "answer": "テスト"})
+
+    assert resp.status_code == 200
+    with db_connect(app_module.DB_FILE) as conn:
+        assert conn.execute("SELECT password FROM users WHERE username = ?", ("name-quiz-taro",)).fetchone() == ("",)
+    assert answers_of(app_module, "name-quiz-taro") == [(word_id, "テスト")]
+
+
+def test_registered_name_is_rejected(app_module, client):
+    with db_connect(app_module.DB_FILE) as conn:
+        conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", ("name-quiz-member", "hash"))
+        conn.commit()
+
+    resp = client.post("/name_quiz", data={"name": "name-quiz-member", "word_id": str(some_word_id(app_module)),
+                                           "answer": "x"})
+
+    assert resp.status_code == 302
+    assert answers_of(app_module, "name-quiz-member") == []
+
+
+def test_guest_name_is_rejected(app_module, client):
+    assert app_module.get_or_create_name_user("ゲスト") is None
+
+    resp = client.post("/name_quiz", data={"name": "ゲスト", "word_id": str(some_word_id(app_module)), "answer": "x"})
+
+    assert resp.status_code == 302
+    assert answers_of(app_module, "ゲスト") == []
+
+
+def test_migrate_legacy_tables(app_module, tmp_path):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT)")
+        conn.execute("INSERT INTO users (username, password) VALUES ('hanako', '')")
+        conn.execute("INSERT INTO users (username, password) VALUES ('saburo', 'hash')")
+        conn.execute("CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO students (id, name) VALUES (?, ?)", [(7, "hanako"), (8, "jiro"), (9, "saburo")])
+        conn.execute("CREATE TABLE student_answers (id INTEGER PRIMARY KEY, student_id INTEGER, word_id INTEGER, "
+                     "score INTEGER, feedback TEXT, example TEXT, attempt_date TEXT)")
+        conn.executemany(
+            "INSERT INTO student_answers (student_id, word_id, score, feedback, example, attempt_date) "
+            "VALUES (?, ?, ?, '', '', '2020-01-01')", [(7, 1, 80), (8, 2, 40), (8, 3, 60), (9, 4, 20)])
+    create_answers = ("CREATE TABLE student_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                      "word_id INTEGER, score INTEGER, feedback TEXT, example TEXT, attempt_date TEXT)")
+
+    app_module.migrate_legacy_question_db(path, create_answers)
+    app_module.migrate_legacy_question_db(path, create_answers)   # 2 回目は何もしない
+
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute(
+            "SELECT u.username, a.word_id, a.score FROM student_answers a JOIN users u ON u.id = a.user_id "
+            "ORDER BY a.word_id"
+        ).fetchall()
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    # 登録ユーザーと同じ名前の生徒は、別名のパスワード無しユーザーになる
+    assert rows == [("hanako", 1, 80), ("jiro", 2, 40), ("jiro", 3, 60), ("saburo（旧9）", 4, 20)]
+    assert {"legacy_students", "legacy_student_answers"} <= tables
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+import snapshot
+from db import connect as db_connect
+
+
+@pytest.fixture(scope="module")
+def regrade(app_module):
+    import regrade
+    return regrade
+
+
+@pytest.fixture
+def answers(app_module):
+    """単語の回答を 3 件（真ん中は存在しない単語）。戻り値は id のリスト"""
+    with db_connect(app_module.DB_FILE) as conn:
+        word_id, meaning = conn.execute("SELECT id, definition_ja FROM words ORDER BY id LIMIT 1").fetchone()
+        missing = conn.execute("SELECT MAX(id) + 1 FROM words").fetchone()[0]
+        ids = []
+        for wid, answer in ((word_id, meaning), (missing, "なし"), (word_id, "わからない")):
+            cur = conn.execute(
+                "INSERT INTO student_answers (user_id, word_id, score, feedback, attempt_date, user_answer) "
+                "VALUES (0, ?, 1, 'old', '2025-01-01T00:00:00', ?)", (wid, answer))
+            ids.append(cur.lastrowid)
+        conn.commit()
+    return ids, word_id
+
+
+def scores(app_module, ids):
+    with db_connect(app_module.DB_FILE) as conn:
+        return [conn.execute("SELECT score FROM student_answers WHERE id = ?", (i,)).fetchone()[0] for i in ids]
+
+
+def test_local_run_records_results_and_failures(regrade, app_module, answers):
+    ids, _ = answers
+    source = regrade.SOURCES["word"]
+    out = io.StringIO()
+
+    graded, failed = regrade.regrade(source, "test-local", regrade.parse_variant(source, None),
+                                     workers=2, local=True, ids=ids, out=out)
+
+    assert (graded, failed) == (2, 1)
+    assert [r[0] for r in regrade.run_results(app_module.DB_FILE, "test-local")] == [ids[0], ids[2]]
+    assert regrade.failed_ids(app_module.DB_FILE, "test-local") == [ids[1]]
+    # apply しなければ回答テーブルはそのまま
+    assert scores(app_module, ids) == [1, 1, 1]
+    # 終わった run をもう一度動かしても何もしない
+    assert regrade.regrade(source, "test-local", regrade.parse_variant(source, None), local=True, ids=ids,
+                           out=out) == (2, 1)
+    assert "already finished" in out.getvalue()
+
+
+def test_retry_failed_only_regrades_failures(regrade, app_module, answers):
+    ids, word_id = answers
+    source = regrade.SOURCES["word"]
+    variant = regrade.parse_variant(source, None)
+    regrade.regrade(source, "test-retry", variant, workers=1, local=True, ids=ids, out=io.StringIO())
+    with db_connect(app_module.DB_FILE) as conn:
+        conn.execute("UPDATE student_answers SET word_id = ? WHERE id = ?", (word_id, ids[1]))
+        conn.commit()
+
+    graded, failed = regrade.regrade(source, "test-retry", variant, workers=1, local=True,
+                                     retry_failed=True, out=io.StringIO())
+
+    assert (graded, failed) == (3, 0)
+    assert regrade.failed_ids(app_module.DB_FILE, "test-retry") == []
+    run = regrade.load_run(app_module.DB_FILE, "test-retry")
+    assert run[2] == ids[2] and run[4] == 0
+    with pytest.raises(SystemExit):
+        regrade.regrade(source, "no-such-run", variant, local=True, retry_failed=True, out=io.StringIO())
+
+
+def test_apply_rewrites_and_ships_rows(regrade, app_module, answers, tmp_path):
+    ids, _ = answers
+    source = regrade.SOURCES["word"]
+    backend = snapshot.LocalDirBackend(str(tmp_path / "snapshots"))
+    snaps = snapshot.Snapshotter(backend, app_module.SNAPSHOT_TABLES)
+
+    regrade.regrade(source, "test-apply", regrade.parse_variant(source, None), workers=2, local=True,
+                    apply=True, ids=ids, snapshots=snaps, out=io.StringIO())
+
+    new = scores(app_module, ids)
+    assert new[0] == 100 and new[1] == 1 and new[2] == 60
+    shipped = snapshot.merge_segments(snapshot.decode_segment(backend.get(n)) for n in backend.list())
+    part = shipped[snapshot.Snapshotter.key(app_module.DB_FILE, "student_answers")]
+    by_id = {row[part["columns"].index("id")]: row[part["columns"].index("score")] for row in part["rows"]}
+    assert by_id == {ids[0]: 100, ids[2]: 60}
+
+
+def test_parse_variant(regrade, tmp_path):
+    source = regrade.SOURCES["writing"]
+    assert regrade.parse_variant(source, None) == (source.version, source.prompt)
+    path = tmp_path / "v2.txt"
+    path.write_text("新しい指示", encoding="utf-8")
+    assert regrade.parse_variant(source, f"writing-v2={path}") == ("writing-v2", "新しい指示")
+    with pytest.raises(SystemExit):
+        regrade.parse_variant(source, "writing-v2")
+
+
+def test_retry_failed_needs_run_id(regrade):
+    with pytest.raises(SystemExit):
+        regrade.main(["run", "--source", "word", "--retry-failed"])
@@ -0,0 +1,75 @@
+import pytest
+
+import search_index
+from db import connect as db_connect
+
+
+@pytest.fixture
+def reading_db(tmp_path):
+    path = str(tmp_path / "reading.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE reading_texts (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT)")
+        conn.executemany("INSERT INTO reading_texts (text) VALUES (?)", [
+            ("The farmer planted apples and pears in the orchard.",),
+            ("She was running to the station every morning.",),
+            ("Apples, apples everywhere: the apple festival was huge.",),
+        ])
+        conn.commit()
+    return path
+
+
+@pytest.fixture
+def writing_db(tmp_path):
+    path = str(tmp_path / "writing.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE writing_prompts (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt_text TEXT)")
+        conn.executemany("INSERT INTO writing_prompts (prompt_text) VALUES (?)", [
+            ("あなたの将来の夢について書きなさい。",),
+            ("好きな季節とその理由を説明しなさい。",),
+        ])
+        conn.commit()
+    return path
+
+
+def test_reading_search_ranks_and_stems(reading_db, writing_db):
+    search_index.init_search_index(reading_db, writing_db)
+
+    hits = search_index.search_reading(reading_db, ["apple"])
+    assert [h["id"] for h in hits] == [3, 1]
+    assert "[" in hits[0]["snippet"]
+    # porter 語幹化で run が running に当たる
+    assert [h["id"] for h in search_index.search_reading(reading_db, ["run"])] == [2]
+    assert search_index.search_reading(reading_db, []) == []
+
+
+def test_reading_index_follows_inserts_updates_and_deletes(reading_db, writing_db):
+    search_index.init_search_index(reading_db, writing_db)
+    with db_connect(reading_db) as conn:
+        conn.execute("INSERT INTO reading_texts (text) VALUES ('A new text about volcanoes.')")
+        conn.execute("UPDATE reading_texts SET text = 'Nothing about fruit here.' WHERE id = 1")
+        conn.execute("DELETE FROM reading_texts WHERE id = 3")
+        conn.commit()
+
+    assert [h["id"] for h in search_index.search_reading(reading_db, ["volcano"])] == [4]
+    assert search_index.search_reading(reading_db, ["apples"]) == []
+
+
+def test_writing_search_and_incremental_index(reading_db, writing_db):
+    search_index.init_search_index(reading_db, writing_db)
+    assert [h["id"] for h in search_index.search_writing(writing_db, ["将来"])] == [1]
+
+    with db_connect(writing_db) as conn:
+        conn.execute("INSERT INTO writing_prompts (prompt_text) VALUES ('将来住みたい町について書きなさい。')")
+        conn.commit()
+        assert search_index.index_writing_prompts(conn) == 1
+        assert search_index.index_writing_prompts(conn) == 0
+
+    assert sorted(h["id"] for h in search_index.search_writing(writing_db, ["将来"])) == [1, 3]
+
+
+def test_query_builders():
+    assert search_index.to_bigrams("将来の夢！") == "将来 来の の夢"
+    assert search_index.reading_query(["Apple", "apple", 'say "hi"']) == '"apple" OR "say ""hi"""'
+    assert search_index.writing_terms(["払い戻し", "願望、願う", "（法）判決", "とても長い説明の文です。"]) == [
+        "判決", "払い戻し", "願望"]
+    assert search_index.writing_query(["夢", "将来"]) == '"将来"'
@@ -0,0 +1,139 @@
+import shutil
+
+import pytest
+
+import snapshot
+from db import connect as db_connect
+
+
+def make_image(path):
+    """イメージに入っている DB（起動時に /tmp にコピーされるもの）"""
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT)")
+        conn.execute("CREATE TABLE answers (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, score INTEGER)")
+        conn.execute("INSERT INTO users (username) VALUES ('from-image')")
+        conn.commit()
+    return path
+
+
+def dump(path, table):
+    with db_connect(path) as conn:
+        try:
+            return conn.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+        except Exception:
+            return None
+
+
+def boot(image, tmp_path, name, backend):
+    """イメージをコピーして、送ってあった分を戻す（キーはファイル名なので、起動ごとに別ディレクトリの同じ名前）"""
+    (tmp_path / name).mkdir()
+    path = str(tmp_path / name / "english_learning.db")
+    shutil.copy(image, path)
+    snap = snapshot.Snapshotter(backend, [(path, "users"), (path, "answers"), (path, "llm_usage")])
+    snap.restore()
+    return path, snap
+
+
+@pytest.fixture
+def image(tmp_path):
+    return make_image(str(tmp_path / "image.db"))
+
+
+def test_ship_and_restore_round_trip(image, tmp_path):
+    backend = snapshot.LocalDirBackend(str(tmp_path / "snapshots"))
+    path, snap = boot(image, tmp_path, "run1", backend)
+
+    assert snap.ship() == 0   # イメージの行は送らない
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO users (username) VALUES ('taro')")
+        conn.executemany("INSERT INTO answers (user_id, score) VALUES (2, ?)", [(s,) for s in (50, 70, 90)])
+        conn.commit()
+    assert snap.ship() == 4
+    assert snap.ship() == 0   # 増えていなければ送らない
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO answers (user_id, score) VALUES (2, 10)")
+        # 後から作られるテーブルは schema ごと送る
+        conn.execute("CREATE TABLE llm_usage (id INTEGER PRIMARY KEY AUTOINCREMENT, tokens INTEGER)")
+        conn.execute("INSERT INTO llm_usage (tokens) VALUES (123)")
+        conn.commit()
+    assert snap.ship() == 2
+    assert backend.list() == [snapshot.segment_name(1), snapshot.segment_name(2)]
+
+    restored, _ = boot(image, tmp_path, "run2", backend)
+    for table in ("users", "answers", "llm_usage"):
+        assert dump(restored, table) == dump(path, table)
+
+
+def test_ship_rows_resends_rewritten_rows(image, tmp_path):
+    backend = snapshot.LocalDirBackend(str(tmp_path / "snapshots"))
+    path, snap = boot(image, tmp_path, "run1", backend)
+    snap.ship()
+    with db_connect(path) as conn:
+        conn.executemany("INSERT INTO answers (user_id, score) VALUES (1, ?)", [(10,), (20,)])
+        conn.commit()
+    snap.ship()
+    with db_connect(path) as conn:
+        conn.execute("UPDATE answers SET score = 99 WHERE id = 2")
+        conn.commit()
+
+    assert snap.ship_rows(path, "answers", [2, 2, 404]) == 1
+    assert snap.ship_rows(path, "answers", []) == 0
+    with pytest.raises(ValueError):
+        snap.ship_rows(path, "words", [1])
+
+    restored, _ = boot(image, tmp_path, "run2", backend)
+    assert dump(restored, "answers") == [(1, 1, 10), (2, 1, 99)]
+
+
+def test_sequence_follows_the_listing(image, tmp_path):
+    backend = snapshot.LocalDirBackend(str(tmp_path / "snapshots"))
+    path, app_snap = boot(image, tmp_path, "run1", backend)
+    app_snap.ship()
+    # regrade.py のように、別のプロセスが同じ場所に送る
+    other = snapshot.Snapshotter(backend, [(path, "answers")])
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO answers (user_id, score) VALUES (1, 10)")
+        conn.commit()
+    other.ship_rows(path, "answers", [1])
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO answers (user_id, score) VALUES (1, 20)")
+        conn.commit()
+    app_snap.ship()
+
+    assert [snapshot.segment_seq(n) for n in backend.list()] == [1, 2]
+    restored, _ = boot(image, tmp_path, "run2", backend)
+    assert dump(restored, "answers") == [(1, 1, 10), (2, 1, 20)]
+
+
+def test_compaction_keeps_the_latest_rows(image, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "COMPACT_EVERY", 3)
+    backend = snapshot.LocalDirBackend(str(tmp_path / "snapshots"))
+    path, snap = boot(image, tmp_path, "run1", backend)
+    snap.ship()
+    for score in (10, 20, 30, 40):
+        with db_connect(path) as conn:
+            conn.execute("INSERT INTO answers (user_id, score) VALUES (1, ?)", (score,))
+            conn.execute("UPDATE answers SET score = score + 1 WHERE id = 1")
+            conn.commit()
+        snap.ship()
+        snap.ship_rows(path, "answers", [1])
+
+    assert len(backend.list()) < 3
+    restored, _ = boot(image, tmp_path, "run2", backend)
+    assert dump(restored, "answers") == dump(path, "answers")
+
+
+def test_merge_segments_follows_added_columns():
+    old = {"db:t": {"schema": "CREATE TABLE t (id, a)", "columns": ["id", "a"], "rows": [[1, "x"], [2, "y"]]}}
+    new = {"db:t": {"schema": "CREATE TABLE t (id, a, b)", "columns": ["id", "a", "b"], "rows": [[2, "y2", "z"]]}}
+
+    merged = snapshot.merge_segments([old, new])
+
+    assert merged["db:t"]["columns"] == ["id", "a", "b"]
+    assert merged["db:t"]["rows"] == [[1, "x", None], [2, "y2", "z"]]
+    assert snapshot.decode_segment(snapshot.encode_segment(merged)) == merged
+
+
+def test_backend_from_url(tmp_path):
+    assert snapshot.backend_from_url(f"file://{tmp_path}/a").path == f"{tmp_path}/a"
+    assert snapshot.backend_from_url(str(tmp_path / "b")).path == str(tmp_path / "b")
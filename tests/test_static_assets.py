@@ -0,0 +1,80 @@
+import gzip
+import os
+
+import static_assets
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def test_manifest_round_trip(tmp_path):
+    write(tmp_path / "style.css", b"body { color: red }")
+    write(tmp_path / "js" / "app.js", b"console.log(1)")
+    write(tmp_path / "style.css.gz", b"ignored")
+
+    manifest = static_assets.build_manifest(str(tmp_path))
+
+    assert set(manifest) == {"style.css", "js/app.js"}
+    for original, hashed in manifest.items():
+        assert static_assets.resolve_hashed(hashed, manifest) == original
+
+
+def test_resolve_rejects_stale_or_unknown_hash(tmp_path):
+    write(tmp_path / "style.css", b"v1")
+    manifest = static_assets.build_manifest(str(tmp_path))
+    stale = static_assets.hashed_name("style.css", "0" * static_assets.HASH_LEN)
+
+    assert static_assets.resolve_hashed(stale, manifest) is None
+    assert static_assets.resolve_hashed("style.css", manifest) is None
+    assert static_assets.resolve_hashed("other.0123456789.css", manifest) is None
+
+
+def test_hash_changes_with_content(tmp_path):
+    path = write(tmp_path / "a.js", b"one")
+    before = static_assets.file_digest(str(path))
+    path.write_bytes(b"two")
+    assert static_assets.file_digest(str(path)) != before
+
+
+def test_precompress_skips_small_files_and_is_deterministic(tmp_path):
+    small = write(tmp_path / "small.css", b"x" * (static_assets.MIN_COMPRESS_SIZE - 1))
+    big = write(tmp_path / "big.css", b"body{}" * 200)
+
+    assert static_assets.precompress_file(str(small)) == []
+    written = static_assets.precompress_file(str(big))
+    first = (tmp_path / "big.css.gz").read_bytes()
+    static_assets.precompress_file(str(big))
+
+    assert str(tmp_path / "big.css.gz") in written
+    assert gzip.decompress(first) == big.read_bytes()
+    assert (tmp_path / "big.css.gz").read_bytes() == first
+
+
+def test_pick_encoding(tmp_path):
+    original = write(tmp_path / "big.css", b"body{}" * 200)
+    static_assets.precompress_file(str(original))
+    path = str(original)
+
+    assert static_assets.pick_encoding("gzip, deflate", path) == ("gzip", path + ".gz")
+    assert static_assets.pick_encoding("gzip;q=0", path) == (None, path)
+    assert static_assets.pick_encoding(None, path) == (None, path)
+    # .br が無ければ br を受け付けても gzip にする
+    if not static_assets.HAS_BROTLI:
+        assert static_assets.pick_encoding("br, gzip", path) == ("gzip", path + ".gz")
+
+
+def test_stale_precompressed_file_is_not_served(tmp_path):
+    original = write(tmp_path / "big.css", b"body{}" * 200)
+    static_assets.precompress_file(str(original))
+    path = str(original)
+    # 前のビルドの .gz を残したまま元ファイルだけ更新された
+    original.write_bytes(b"main{}" * 200)
+    stat = original.stat()
+    os.utime(path + ".gz", ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 ** 9))
+
+    assert static_assets.pick_encoding("gzip", path) == (None, path)
+    static_assets.precompress_file(path)
+    assert static_assets.pick_encoding("gzip", path) == ("gzip", path + ".gz")
@@ -0,0 +1,124 @@
+import io
+
+import pytest
+
+import toeic_store
+from db import connect as db_connect
+
+LEGACY_QUESTIONS = """1. What is the main topic?
+(A) A new store
+(B) A festival
+(C) A train delay
+that lasted hours
+(D) A recipe
+2．When does it start
+on weekdays?
+(b) Monday
+(A) Sunday
+"""
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("B", "B"), ("(b)", "B"), ("Ｂ.", "B"), ("（Ｃ）", "C"), (" d ", "D"), ("E", "E"),
+    ("", None), (None, None), ("AB", None), ("Z", None), (2, None), (["B"], None),
+])
+def test_normalize_choice(value, expected):
+    assert toeic_store.normalize_choice(value) == expected
+
+
+def test_parse_legacy_choices():
+    items = toeic_store.parse_legacy(LEGACY_QUESTIONS, "(D),(a)")
+
+    assert [i["number"] for i in items] == [1, 2]
+    assert items[0]["question"] == "What is the main topic?"
+    assert items[0]["choices"][2] == ("C", "A train delay that lasted hours")
+    assert items[0]["answer"] == "D"
+    # 設問文の続きの行、小文字の選択肢記号、並び順はそのまま
+    assert items[1]["question"] == "When does it start\non weekdays?"
+    assert items[1]["choices"] == [("B", "Monday"), ("A", "Sunday")]
+    assert items[1]["answer"] == "A"
+
+
+def test_parse_legacy_free_text_and_missing_answers():
+    items = toeic_store.parse_legacy('["Why?", "How?"]', '["Because."]')
+    assert items == [
+        {"number": 1, "question": "Why?", "choices": [], "answer": "Because."},
+        {"number": 2, "question": "How?", "choices": [], "answer": None},
+    ]
+    assert toeic_store.parse_legacy("", "") == []
+    with pytest.raises(ValueError):
+        toeic_store.parse_legacy("[broken", "")
+
+
+def test_grade_choice():
+    question = {"answer": "B", "choices": [{"label": "A", "text": "cat"}, {"label": "B", "text": "dog"}]}
+    assert toeic_store.grade_choice(question, "(b)") == (100, "正解です。")
+    assert toeic_store.grade_choice(question, "A") == (0, "不正解です。正解は (B) dog")
+    assert toeic_store.grade_choice(question, "")[0] == 0
+    assert toeic_store.grade_choice(question, "nonsense") == (0, "回答が選択されていません。")
+
+
+def test_migrate_legacy_keeps_ids(tmp_path):
+    path = str(tmp_path / "toeic.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE reading (id INTEGER PRIMARY KEY, text TEXT, questions TEXT, answers TEXT)")
+        conn.execute("INSERT INTO reading VALUES (7, 'passage', ?, '(D),(A)')", (LEGACY_QUESTIONS,))
+        conn.execute("INSERT INTO reading VALUES (8, 'broken', '[oops', '')")
+        conn.commit()
+
+    toeic_store.init_store(path)
+    toeic_store.init_store(path)   # 2 回目は何もしない
+
+    passage = toeic_store.get_passage(path, 7)
+    assert passage["text"] == "passage"
+    assert [q["answer"] for q in passage["questions"]] == ["D", "A"]
+    assert [c["label"] for c in passage["questions"][0]["choices"]] == ["A", "B", "C", "D"]
+    assert toeic_store.get_passage(path, 8) is None
+    assert "answer" not in toeic_store.get_passage(path, 7, with_answers=False)["questions"][0]
+
+
+def test_import_jsonl_and_csv(tmp_path):
+    path = str(tmp_path / "toeic.db")
+    jsonl = io.StringIO(
+        '{"id": "p1", "passage": "P1", "questions": [{"question": "Q1", "choices": ["x", "y"], "answer": "(b)"}]}\n'
+        "not json\n"
+        '{"id": "p2", "passage": "P2", "questions": [{"question": "Q2", "choices": {"A": "u", "B": "v"}, "answer": "A"}]}\n'
+        '{"id": "p3", "passage": "", "questions": []}\n'
+    )
+    assert toeic_store.import_records(path, toeic_store.read_jsonl(jsonl), batch_size=1) == 2
+
+    csv_text = io.StringIO(
+        "passage_id,passage,number,question,choice_a,choice_b,choice_c,choice_d,answer\n"
+        "p1,P1 new,1,Q1 new,a,b,c,d,C\n"
+        "p1,P1 new,2,Q2 new,a,b,,,A\n"
+        "p9,P9,1,Q9,a,b,c,d,D\n"
+    )
+    assert toeic_store.import_records(path, toeic_store.read_csv(csv_text)) == 2
+
+    listed = toeic_store.list_passages(path)
+    assert [(p["preview"], p["questions"]) for p in listed] == [("P1 new", 2), ("P2", 1), ("P9", 1)]
+    # 同じ external_id は設問ごと置き換わる
+    p1 = toeic_store.get_passage(path, listed[0]["id"])
+    assert [(q["question"], q["answer"], len(q["choices"])) for q in p1["questions"]] == [
+        ("Q1 new", "C", 4), ("Q2 new", "A", 2)]
+    assert toeic_store.list_passages(path, after_id=listed[1]["id"]) == listed[2:]
+    assert sorted(toeic_store.random_passage_ids(path, 10)) == [p["id"] for p in listed]
+
+
+def test_grade_endpoint(client):
+    item = client.get("/api/toeic/random").get_json()["items"][0]
+    first = item["questions"][0]
+
+    resp = client.post(f"/api/toeic/{item['id']}/grade", json={"answers": {str(first["id"]): "Z", "x": 1}})
+
+    assert resp.status_code == 200
+    results = resp.get_json()["results"]
+    assert results[0]["question_id"] == first["id"] and results[0]["score"] == 0
+    assert client.post("/api/toeic/999999/grade", json={"answers": {}}).status_code == 404
+
+
+@pytest.mark.parametrize("body", [{"answers": ["A", "B"]}, {"answers": "A"}, ["A"]])
+def test_grade_endpoint_rejects_malformed_answers(client, body):
+    item = client.get("/api/toeic/random").get_json()["items"][0]
+    resp = client.post(f"/api/toeic/{item['id']}/grade", json=body)
+    assert resp.status_code == 400
@@ -0,0 +1,76 @@
+import random
+import string
+
+import pytest
+
+import word_index
+from db import connect as db_connect
+
+
+def make_db(path, rows):
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT, definition_ja TEXT, pos TEXT)")
+        conn.executemany("INSERT INTO words (id, word, definition_ja, pos) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    word_index.init_word_version(path)
+    return path
+
+
+def test_exact_is_case_insensitive():
+    table = word_index.WordTable([
+        (1, "Apple", "りんご", "noun"), (2, "apple", "りんご（小文字）", None), (3, "apply", "適用する", "verb"),
+    ])
+    hits = table.exact(" APPLE ")
+    assert [(h["id"], h["word"]) for h in hits] == [(1, "Apple"), (2, "apple")]
+    assert hits[0]["pos"] == "noun" and hits[1]["pos"] is None
+    assert table.exact("appl") == []
+    assert table.exact("") == []
+
+
+def test_prefix_matches_linear_scan():
+    rng = random.Random(1)
+    words = sorted({"".join(rng.choice("abcde") for _ in range(rng.randint(1, 6))) for _ in range(3000)})
+    table = word_index.WordTable([(i, w, f"意味{i}", None) for i, w in enumerate(words)])
+
+    for prefix in ["a", "ab", "cde", "eeeeee", "z", "b" * 7] + rng.sample(words, 50):
+        expected = [w for w in words if w.startswith(prefix)]
+        hits, total = table.prefix(prefix, limit=5)
+        assert total == len(expected)
+        assert [h["word"] for h in hits] == expected[:5]
+
+
+def test_bisect_left_agrees_with_bisect():
+    import bisect
+    words = sorted("".join(random.Random(i).choices(string.ascii_lowercase, k=4)) for i in range(1000))
+    packed = word_index._Packed(words, sampled=True)
+    for key in words[::37] + ["", "zzzzz", "mmm"]:
+        assert packed.bisect_left(key) == bisect.bisect_left(words, key)
+
+
+def test_index_reloads_when_words_change(tmp_path):
+    path = make_db(str(tmp_path / "w.db"), [(1, "cat", "猫", "noun")])
+    index = word_index.WordIndex(path, check_interval=0)
+    assert [h["id"] for h in index.exact("cat")] == [1]
+    first = index.table()
+
+    with db_connect(path) as conn:
+        conn.execute("INSERT INTO words (id, word, definition_ja) VALUES (2, 'catalog', '目録')")
+        conn.commit()
+
+    assert index.table() is not first
+    assert index.prefix("cat")[1] == 2
+    # 変わっていなければ作り直さない
+    assert index.table() is index.table()
+
+
+@pytest.mark.parametrize("statement", [
+    "UPDATE words SET definition_ja = '猫（ねこ）' WHERE id = 1",
+    "DELETE FROM words WHERE id = 1",
+])
+def test_version_trigger(tmp_path, statement):
+    path = make_db(str(tmp_path / "w.db"), [(1, "cat", "猫", "noun")])
+    with db_connect(path) as conn:
+        before = conn.execute("SELECT version FROM words_version").fetchone()[0]
+        conn.execute(statement)
+        conn.commit()
+        assert conn.execute("SELECT version FROM words_version").fetchone()[0] == before + 1
@@ -0,0 +1,35 @@
+from db import connect as db_connect
+
+
+def word_count(app_module):
+    with db_connect(app_module.DB_FILE) as conn:
+        return conn.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+
+
+def test_returns_n_distinct_words_without_meanings(app_module, client):
+    resp = client.get("/api/word_session?n=5")
+
+    assert resp.status_code == 200
+    items = resp.get_json()["items"]
+    assert len(items) == min(5, word_count(app_module))
+    assert len({i["word_id"] for i in items}) == len(items)
+    # 答えになる意味は渡さない
+    assert all(set(i) == {"word_id", "word"} for i in items)
+
+
+def test_n_is_clamped(app_module, client):
+    total = word_count(app_module)
+    assert len(client.get("/api/word_session").get_json()["items"]) == min(app_module.WORD_SESSION_SIZE, total)
+    assert len(client.get("/api/word_session?n=0").get_json()["items"]) == 1
+    assert len(client.get("/api/word_session?n=9999").get_json()["items"]) == min(app_module.WORD_SESSION_MAX, total)
+
+
+def test_average_follows_submitted_answers(client):
+    session = client.get("/api/word_session?n=2").get_json()
+    assert session["average_score"] == 0
+
+    word_id = session["items"][0]["word_id"]
+    submitted = client.post("/api/submit_answer", data={"word_id": word_id, "answer": "テスト"}).get_json()
+
+    again = client.get("/api/word_session?n=2").get_json()
+    assert again["average_score"] == submitted["average_score"] == submitted["score"]
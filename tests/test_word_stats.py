@@ -0,0 +1,149 @@
+import contextlib
+
+import pytest
+
+import word_stats
+import write_behind
+from db import connect as db_connect
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "words.db")
+    with db_connect(path) as conn:
+        conn.execute("CREATE TABLE words (id INTEGER PRIMARY KEY, word TEXT, definition_ja TEXT)")
+        conn.executemany("INSERT INTO words VALUES (?, ?, ?)", [(1, "apple", "りんご"), (2, "run", "走る")])
+        for table in word_stats.ANSWER_TABLES:
+            conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                         "word_id, score, user_answer TEXT, attempt_date TEXT)")
+        conn.commit()
+    word_stats.init_word_stats(path)
+    return path
+
+
+ROWS = [
+    (1, 100, "りんご", "2025-01-01"),
+    (1, 20, "リンゴ？", "2025-01-02"),
+    (1, 10, "りんご", "2025-01-03"),
+    (1, 30, "ばなな", "2025-01-04"),
+    (2, 50, "歩く", "2025-01-05"),
+    (2, 95, "走る", "2025-01-06"),
+]
+
+
+def add(path, table, rows):
+    with db_connect(path) as conn:
+        conn.executemany(f"INSERT INTO {table} (word_id, score, user_answer, attempt_date) VALUES (?, ?, ?, ?)",
+                         rows)
+        conn.commit()
+
+
+def snapshot_tables(path):
+    with db_connect(path) as conn:
+        return [conn.execute(sql).fetchall() for sql in (
+            "SELECT word_id, attempts, total_score, misses, miss_rate FROM word_stats ORDER BY 1",
+            "SELECT word_id, bucket, count FROM word_score_hist ORDER BY 1, 2",
+            "SELECT word_id, answer, count, example, last_seen FROM word_wrong_answers ORDER BY 1, 2",
+        )]
+
+
+def test_normalize_answer():
+    assert word_stats.normalize_answer("リンゴ？") == word_stats.normalize_answer(" りんご ") == "りんご"
+    assert word_stats.normalize_answer("ＡＢＣ　def!") == "abcdef"
+    assert word_stats.normalize_answer(None) == ""
+
+
+def test_valid_rows_skips_only_bad_rows(caplog):
+    rows = [("3", "70", "a", None), ("x", 50, "b", None), (-1, 50, "c", None), (2, None, "d", None),
+            (None, 10, "e", None), (word_stats.MAX_WORD_ID + 1, 10, "f", None), (4, "NaN", "g", None)]
+    assert word_stats._valid_rows(rows) == [(3, 70, "a", None)]
+    assert "skipped 4 rows" in caplog.text
+
+
+def test_record_accumulates_and_top_words(db):
+    word_stats.record(db, ROWS[:3])
+    word_stats.record(db, ROWS[3:] + [("bad", 10, "x", None)])
+
+    top = word_stats.top_words(db, sort="misses")
+    assert [(w["word_id"], w["attempts"], w["misses"], w["avg_score"]) for w in top] == [
+        (1, 4, 3, 40.0), (2, 2, 1, 72.5)]
+    apple = top[0]
+    assert apple["word"] == "apple"
+    assert apple["histogram"][1] == 1 and apple["histogram"][9] == 1
+    # 表記ゆれはまとめ、例には最後の回答を残す
+    assert apple["wrong_answers"][0] == {"answer": "りんご", "count": 2, "example": "りんご", "last_seen": "2025-01-03"}
+    assert [w["word_id"] for w in word_stats.top_words(db, sort="miss_rate")] == [1, 2]
+    assert word_stats.top_words(db, min_attempts=3) == top[:1]
+    with pytest.raises(ValueError):
+        word_stats.top_words(db, sort="nope")
+
+
+def test_word_detail(db):
+    assert word_stats.word_detail(db, 2) is None
+    word_stats.record(db, ROWS)
+    detail = word_stats.word_detail(db, 2)
+    assert (detail["word"], detail["attempts"], detail["misses"]) == ("run", 2, 1)
+    assert [w["answer"] for w in detail["wrong_answers"]] == ["歩く"]
+
+
+def test_rebuild_matches_incremental(db):
+    add(db, "student_answers", ROWS[:4])
+    add(db, "word_choice_answers", ROWS[4:] + [("oops", 10, "z", None)])
+    word_stats.record(db, ROWS)
+    incremental = snapshot_tables(db)
+
+    assert word_stats.rebuild(db) == len(ROWS)
+    assert snapshot_tables(db) == incremental
+
+
+def test_answers_written_during_rebuild_are_counted_once(db):
+    writer = write_behind.WriteBehind(flush_interval=0)
+    writer.register("student_answers", db,
+                    "INSERT INTO student_answers (word_id, score, user_answer, attempt_date) VALUES (?, ?, ?, ?)",
+                    on_flush=lambda rows: word_stats.record(db, rows))
+    add(db, "student_answers", ROWS[:1])
+
+    @contextlib.contextmanager
+    def pause():
+        # 全件を読んだ後、置き換える前に回答が 1 件コミットされ、record() も済んだ
+        writer.add("student_answers", ROWS[1])
+        assert writer.flush()
+        with writer.paused():
+            # 止めている間の回答は、置き換えた後で record() される
+            writer.add("student_answers", ROWS[2])
+            yield
+
+    assert word_stats.rebuild(db, pause=pause) == 2
+    assert writer.flush()
+    writer.close()
+
+    detail = word_stats.word_detail(db, 1)
+    assert (detail["attempts"], detail["misses"]) == (3, 2)
+
+
+def test_rebuild_counts_archived_rows(db):
+    add(db, "student_answers", ROWS)
+    with db_connect(db) as conn:
+        conn.execute("CREATE TABLE student_answers_archive (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                     "word_id INTEGER, score INTEGER, attempt_date TEXT)")
+        conn.execute("INSERT INTO student_answers_archive VALUES (100, 1, 2, 0, '2024-01-01')")
+        conn.commit()
+
+    assert word_stats.rebuild(db) == len(ROWS) + 1
+    assert word_stats.word_detail(db, 2)["misses"] == 2
+
+
+def test_teacher_api_needs_the_token(app_module, client, monkeypatch):
+    assert client.get("/api/teacher/word_stats").status_code == 401
+    monkeypatch.setattr(app_module, "TEACHER_TOKEN", "s3cret")
+
+    assert client.get("/api/teacher/word_stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    resp = client.get("/api/teacher/word_stats?sort=bogus&min_attempts=1",
+                      headers={"Authorization": "Bearer s3cret"})
+    assert resp.status_code == 200
+    assert resp.get_json()["sort"] == "misses"
+
+    assert client.post("/teacher/login", data={"token": "wrong"}).status_code == 401
+    resp = client.post("/teacher/login?next=//evil.example", data={"token": "s3cret"})
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/teacher/word_stats")
+    assert client.get("/teacher/word_stats").status_code == 200
@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+
+import pytest
+
+import metrics
+import write_behind
+from db import connect as db_connect
+
+SQL = "INSERT INTO answers (user_id, score) VALUES (?, ?)"
+
+
+def counter(name, **labels):
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+def make_db(path):
+    with db_connect(path) as conn:
+        # score は整数のみ（CHECK で悪い行を作れるようにする）
+        conn.execute("CREATE TABLE answers (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                     "score INTEGER CHECK (typeof(score) = 'integer'))")
+        conn.commit()
+    return path
+
+
+def rows(path):
+    with db_connect(path) as conn:
+        return conn.execute("SELECT user_id, score FROM answers ORDER BY id").fetchall()
+
+
+@pytest.fixture
+def writer():
+    w = write_behind.WriteBehind(flush_interval=0.001, max_batch=50)
+    yield w
+    w.close()
+
+
+def test_flush_writes_everything_and_calls_on_flush(tmp_path, writer):
+    path = make_db(str(tmp_path / "a.db"))
+    flushed = []
+    writer.register("answers", path, SQL, on_flush=flushed.extend)
+
+    threads = [threading.Thread(target=lambda u=u: [writer.add("answers", (u, i)) for i in range(20)])
+               for u in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert writer.flush()
+
+    assert sorted(rows(path)) == sorted((u, i) for u in range(5) for i in range(20))
+    assert sorted(flushed) == sorted(rows(path))
+    assert writer.pending("answers") == []
+
+
+def test_read_sees_pending_rows(tmp_path):
+    path = make_db(str(tmp_path / "a.db"))
+    # スレッドを動かさず、pending に残ったままの状態を作る
+    w = write_behind.WriteBehind(enabled=True)
+    w.register("answers", path, SQL)
+    w._pending.append(("answers", (1, 90)))
+
+    def count(pending):
+        return len(rows(path)) + len(pending)
+
+    assert w.read("answers", count) == 1
+    w.close()
+    assert rows(path) == [(1, 90)]
+
+
+def test_unknown_target(writer):
+    with pytest.raises(KeyError):
+        writer.add("nope", (1,))
+
+
+def test_retries_when_locked(tmp_path, writer, monkeypatch):
+    path = make_db(str(tmp_path / "a.db"))
+    writer.register("answers", path, SQL)
+    monkeypatch.setattr(write_behind.time, "sleep", lambda s: None)
+    real_connect = write_behind.db_connect
+    calls = []
+
+    def flaky(db_file):
+        calls.append(db_file)
+        if len(calls) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        return real_connect(db_file)
+
+    monkeypatch.setattr(write_behind, "db_connect", flaky)
+
+    writer.add("answers", (1, 80))
+    assert writer.flush()
+
+    assert rows(path) == [(1, 80)]
+    assert len(calls) == 3
+
+
+def test_gives_up_after_retries(tmp_path, writer, monkeypatch):
+    path = make_db(str(tmp_path / "a.db"))
+    flushed = []
+    writer.register("answers", path, SQL, on_flush=flushed.extend)
+    monkeypatch.setattr(write_behind.time, "sleep", lambda s: None)
+
+    def locked(db_file):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(write_behind, "db_connect", locked)
+    before = counter("answer_write_errors_total")
+
+    writer.add("answers", (1, 80))
+    assert writer.flush()
+
+    assert counter("answer_write_errors_total") == before + 1
+    assert flushed == []
+    # スレッドは止まらず、次の行は書ける
+    monkeypatch.undo()
+    writer.add("answers", (2, 70))
+    assert writer.flush()
+    assert rows(path) == [(2, 70)]
+    assert writer._thread.is_alive()
+
+
+def test_bad_row_does_not_drop_the_batch(tmp_path, writer):
+    path = make_db(str(tmp_path / "a.db"))
+    flushed = []
+    writer.register("answers", path, SQL, on_flush=flushed.extend)
+    before = counter("answer_write_errors_total")
+
+    # まとめて書くと CHECK で失敗するので、1 行ずつ書き直して悪い行だけ捨てる
+    writer._pending.extend([("answers", (1, 10)), ("answers", (2, "bad")), ("answers", (3, 30))])
+    writer._flush_pending()
+
+    assert rows(path) == [(1, 10), (3, 30)]
+    assert flushed == [(1, 10), (3, 30)]
+    assert counter("answer_write_errors_total") == before + 1
+
+
+def test_one_db_failing_does_not_block_another(tmp_path, writer):
+    good = make_db(str(tmp_path / "good.db"))
+    missing_table = str(tmp_path / "empty.db")
+    writer.register("answers", good, SQL)
+    writer.register("broken", missing_table, SQL)
+
+    writer._pending.extend([("broken", (1, 1)), ("answers", (2, 2))])
+    writer._flush_pending()
+
+    assert rows(good) == [(2, 2)]
+    assert writer.pending("broken") == []
+
+
+def test_on_flush_error_is_contained(tmp_path, writer):
+    path = make_db(str(tmp_path / "a.db"))
+
+    def boom(rows):
+        raise RuntimeError("boom")
+
+    writer.register("answers", path, SQL, on_flush=boom)
+    writer.add("answers", (1, 50))
+    assert writer.flush()
+    writer.add("answers", (2, 60))
+    assert writer.flush()
+    assert rows(path) == [(1, 50), (2, 60)]
+
+
+def test_disabled_and_closed_write_immediately(tmp_path):
+    path = make_db(str(tmp_path / "a.db"))
+    w = write_behind.WriteBehind(enabled=False)
+    w.register("answers", path, SQL)
+    w.add("answers", (1, 1))
+    assert rows(path) == [(1, 1)]
+    assert w._thread is None
+
+    w2 = write_behind.WriteBehind()
+    w2.register("answers", path, SQL)
+    w2.close()
+    w2.add("answers", (2, 2))
+    assert rows(path) == [(1, 1), (2, 2)]
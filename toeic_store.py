@@ -0,0 +1,357 @@
+# toeic_store.py
+# TOEIC リーディング問題の正規化ストア（toeic_r.db）。
+#
+#   toeic_passages  : 本文 1 件 = 1 行（external_id は取り込み元の ID、legacy_id は旧 reading.id）
+#   toeic_questions : 設問 1 件 = 1 行（answer は選択肢のラベル "A"〜"D"。記述式は正答の文）
+#   toeic_choices   : 選択肢 1 件 = 1 行
+#
+# 旧 reading テーブル（questions / answers を 1 つの文字列に詰めたもの）は起動時に移行する。
+# 旧データには「設問と (A)〜(D) を改行でつないだ文字列 + "(D),(A)"」と、
+# 「JSON 配列（記述式）」の 2 通りの形があるので、parse_legacy() で両方読む。
+#
+# 一括取り込み（1 行ずつ読んで batch_size 件ごとにコミットするので、大きなファイルでも
+# メモリに全部載せない）:
+#   python toeic_store.py import questions.jsonl [--db toeic_r.db]
+#   python toeic_store.py import questions.csv
+#
+# JSONL は 1 行 1 本文:
+#   {"id": "p1", "passage": "...", "questions": [
+#       {"question": "...", "choices": {"A": "...", "B": "..."}, "answer": "B"}, ...]}
+#   （choices は ["...", "..."] の配列でもよい。先頭から A, B, C, D）
+# CSV は 1 行 1 設問（同じ passage_id の行が本文ごとにまとまっていること）:
+#   passage_id,passage,number,question,choice_a,choice_b,choice_c,choice_d,answer
+import argparse
+import csv
+import datetime
+import json
+import logging
+import random
+import re
+import sys
+
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+LABELS = "ABCDEFGH"
+IMPORT_BATCH = 500
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS toeic_passages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        external_id TEXT UNIQUE,
+        legacy_id INTEGER UNIQUE,
+        text TEXT NOT NULL,
+        created_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS toeic_questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        passage_id INTEGER NOT NULL REFERENCES toeic_passages(id),
+        number INTEGER NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        UNIQUE (passage_id, number)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS toeic_choices (
+        question_id INTEGER NOT NULL REFERENCES toeic_questions(id),
+        label TEXT NOT NULL,
+        text TEXT NOT NULL,
+        PRIMARY KEY (question_id, label)
+    ) WITHOUT ROWID''',
+]
+
+_QUESTION_LINE = re.compile(r"^\s*(\d+)\s*[.．)]\s*(.*)$")
+_CHOICE_LINE = re.compile(r"^\s*[(（]\s*([A-Ha-h])\s*[)）]\s*(.*)$")
+_CHOICE_ANSWER = re.compile(r"^[(（]?\s*([A-Ha-h])\s*[)）.．]?$")
+_FULLWIDTH = str.maketrans("ＡＢＣＤＥＦＧＨ", "ABCDEFGH")
+
+
+def init_store(db_file):
+    """テーブルを作り、旧 reading テーブルのまだ移行していない行を移す"""
+    with db_connect(db_file) as conn:
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        conn.commit()
+        migrate_legacy(conn)
+
+
+# ======================================================
+# 旧形式の読み込み
+# ======================================================
+def normalize_choice(value):
+    """"B" / "(b)" / "Ｂ." などを "B" に。選択肢の記号でなければ None"""
+    if not isinstance(value, str):
+        return None
+    m = _CHOICE_ANSWER.match(value.strip().upper().translate(_FULLWIDTH))
+    return m.group(1).upper() if m else None
+
+
+def _split_answers(answers_text):
+    text = (answers_text or "").strip()
+    if text.startswith("["):
+        return [str(a) for a in json.loads(text)]
+    return [a.strip() for a in re.split(r"[,\n]", text) if a.strip()]
+
+
+def parse_legacy(questions_text, answers_text):
+    """
+    旧 reading の questions / answers -> 設問のリスト
+    [{"number", "question", "choices": [(label, text)], "answer"}]
+    """
+    text = (questions_text or "").strip()
+    answers = _split_answers(answers_text)
+    if text.startswith("["):
+        # 記述式（JSON 配列）
+        questions = [str(q) for q in json.loads(text)]
+        return [
+            {"number": i + 1, "question": q, "choices": [],
+             "answer": answers[i] if i < len(answers) else None}
+            for i, q in enumerate(questions)
+        ]
+
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        q = _QUESTION_LINE.match(line)
+        c = _CHOICE_LINE.match(line)
+        if q and not c:
+            items.append({"number": int(q.group(1)), "question": q.group(2).strip(), "choices": []})
+        elif c and items:
+            items[-1]["choices"].append((c.group(1).upper(), c.group(2).strip()))
+        elif items:
+            # 設問文・選択肢の続きの行
+            if items[-1]["choices"]:
+                label, prev = items[-1]["choices"][-1]
+                items[-1]["choices"][-1] = (label, f"{prev} {line.strip()}")
+            else:
+                items[-1]["question"] = f"{items[-1]['question']}\n{line.strip()}"
+    for i, item in enumerate(items):
+        raw = answers[i] if i < len(answers) else None
+        item["answer"] = (normalize_choice(raw) if item["choices"] else raw)
+    return items
+
+
+def migrate_legacy(conn):
+    try:
+        rows = conn.execute("""
+            SELECT r.id, r.text, r.questions, r.answers FROM reading r
+            LEFT JOIN toeic_passages p ON p.legacy_id = r.id
+            WHERE p.id IS NULL
+        """).fetchall()
+    except Exception:
+        return 0   # 旧テーブルが無い
+    for legacy_id, text, questions_text, answers_text in rows:
+        try:
+            questions = parse_legacy(questions_text, answers_text)
+        except ValueError as e:
+            logger.warning("TOEIC legacy row %s skipped: %s", legacy_id, e)
+            continue
+        # 旧 URL（/toeic_r/<reading.id>）がそのまま使えるよう、空いていれば同じ id にする
+        taken = conn.execute("SELECT 1 FROM toeic_passages WHERE id = ?", (legacy_id,)).fetchone()
+        _insert_passage(conn, None, text, questions,
+                        legacy_id=legacy_id, passage_id=None if taken else legacy_id)
+    conn.commit()
+    if rows:
+        logger.info("TOEIC legacy rows migrated: %d", len(rows))
+    return len(rows)
+
+
+# ======================================================
+# 書き込み
+# ======================================================
+def _insert_passage(conn, external_id, text, questions, legacy_id=None, passage_id=None):
+    """本文と設問を追加する。external_id が既にあれば設問ごと置き換える"""
+    now = datetime.datetime.utcnow().isoformat()
+    existing = None
+    if external_id is not None:
+        existing = conn.execute("SELECT id FROM toeic_passages WHERE external_id = ?", (external_id,)).fetchone()
+        if existing:
+            passage_id = existing[0]
+            conn.execute("UPDATE toeic_passages SET text = ? WHERE id = ?", (text, passage_id))
+            conn.execute("""DELETE FROM toeic_choices WHERE question_id IN
+                            (SELECT id FROM toeic_questions WHERE passage_id = ?)""", (passage_id,))
+            conn.execute("DELETE FROM toeic_questions WHERE passage_id = ?", (passage_id,))
+    if existing is None:
+        cur = conn.execute(
+            "INSERT INTO toeic_passages (id, external_id, legacy_id, text, created_at) VALUES (?, ?, ?, ?, ?)",
+            (passage_id, external_id, legacy_id, text, now),
+        )
+        passage_id = cur.lastrowid
+
+    choices = []
+    for q in questions:
+        cur = conn.execute(
+            "INSERT INTO toeic_questions (passage_id, number, question, answer) VALUES (?, ?, ?, ?)",
+            (passage_id, q["number"], q["question"], q.get("answer")),
+        )
+        choices.extend((cur.lastrowid, label, choice_text) for label, choice_text in q["choices"])
+    conn.executemany("INSERT INTO toeic_choices (question_id, label, text) VALUES (?, ?, ?)", choices)
+    return passage_id
+
+
+def _question_from_record(number, q):
+    choices = q.get("choices") or []
+    if isinstance(choices, dict):
+        choices = [(k.upper(), str(v)) for k, v in choices.items()]
+    else:
+        choices = [(LABELS[i], str(v)) for i, v in enumerate(choices)]
+    answer = q.get("answer")
+    if choices:
+        answer = normalize_choice(str(answer)) if answer is not None else None
+    return {"number": int(q.get("number") or number), "question": str(q.get("question") or ""),
+            "choices": choices, "answer": answer}
+
+
+def read_jsonl(f):
+    """JSONL -> (external_id, passage, questions) を 1 件ずつ"""
+    for lineno, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            logger.warning("line %d skipped: %s", lineno, e)
+            continue
+        questions = [_question_from_record(i + 1, q) for i, q in enumerate(rec.get("questions") or [])]
+        external_id = rec.get("id")
+        yield (str(external_id) if external_id is not None else None), rec.get("passage") or "", questions
+
+
+def read_csv(f):
+    """CSV（1 行 1 設問）-> (external_id, passage, questions)。passage_id が変わるたびに 1 件"""
+    current, passage, questions = None, "", []
+    for row in csv.DictReader(f):
+        pid = row.get("passage_id")
+        if pid != current and questions:
+            yield current, passage, questions
+            questions = []
+        if pid != current:
+            current, passage = pid, row.get("passage") or ""
+        choices = [row.get(f"choice_{c}") for c in "abcdefgh"]
+        questions.append(_question_from_record(len(questions) + 1, {
+            "number": row.get("number"),
+            "question": row.get("question"),
+            "choices": [c for c in choices if c],
+            "answer": row.get("answer"),
+        }))
+    if questions:
+        yield current, passage, questions
+
+
+def import_records(db_file, records, batch_size=IMPORT_BATCH):
+    """records: (external_id, passage, questions) の iterable。batch_size 件ごとにコミット"""
+    total = 0
+    with db_connect(db_file) as conn:
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        for external_id, passage, questions in records:
+            if not passage or not questions:
+                continue
+            _insert_passage(conn, external_id, passage, questions)
+            total += 1
+            if total % batch_size == 0:
+                conn.commit()
+                logger.info("TOEIC import: %d passages", total)
+        conn.commit()
+    return total
+
+
+# ======================================================
+# 読み出し
+# ======================================================
+def get_passage(db_file, passage_id, with_answers=True):
+    """{"id", "text", "questions": [{"id", "number", "question", "choices": [{label, text}], "answer"}]}"""
+    with db_connect(db_file) as conn:
+        row = conn.execute("SELECT id, text FROM toeic_passages WHERE id = ?", (passage_id,)).fetchone()
+        if not row:
+            return None
+        questions = conn.execute(
+            "SELECT id, number, question, answer FROM toeic_questions WHERE passage_id = ? ORDER BY number",
+            (passage_id,),
+        ).fetchall()
+        choices = conn.execute("""
+            SELECT c.question_id, c.label, c.text FROM toeic_choices c
+            JOIN toeic_questions q ON q.id = c.question_id
+            WHERE q.passage_id = ? ORDER BY c.question_id, c.label
+        """, (passage_id,)).fetchall()
+    by_question = {}
+    for qid, label, text in choices:
+        by_question.setdefault(qid, []).append({"label": label, "text": text})
+    items = []
+    for qid, number, question, answer in questions:
+        item = {"id": qid, "number": number, "question": question, "choices": by_question.get(qid, [])}
+        if with_answers:
+            item["answer"] = answer
+        items.append(item)
+    return {"id": row[0], "text": row[1], "questions": items}
+
+
+def list_passages(db_file, after_id=0, limit=20):
+    """id 順に after_id より後の本文（先頭 80 文字と設問数）"""
+    with db_connect(db_file) as conn:
+        rows = conn.execute("""
+            SELECT p.id, substr(p.text, 1, 80),
+                   (SELECT COUNT(*) FROM toeic_questions q WHERE q.passage_id = p.id)
+            FROM toeic_passages p WHERE p.id > ? ORDER BY p.id LIMIT ?
+        """, (after_id, limit)).fetchall()
+    return [{"id": r[0], "preview": r[1], "questions": r[2]} for r in rows]
+
+
+def random_passage_ids(db_file, n, rng=random):
+    """ランダムな本文 id を最大 n 個（id の範囲から乱数を引いて索引で次の行を取る）"""
+    with db_connect(db_file) as conn:
+        lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM toeic_passages").fetchone()
+        if lo is None:
+            return []
+        picked = []
+        for _ in range(n * 3):
+            if len(picked) >= n:
+                break
+            row = conn.execute("SELECT id FROM toeic_passages WHERE id >= ? ORDER BY id LIMIT 1",
+                               (rng.randint(lo, hi),)).fetchone()
+            if row and row[0] not in picked:
+                picked.append(row[0])
+    return picked
+
+
+# ======================================================
+# 採点（選択式は Gemini を使わない）
+# ======================================================
+def grade_choice(question, user_answer):
+    """選択式の設問を採点する。戻り値: (score, feedback)"""
+    chosen = normalize_choice(user_answer)
+    correct = question.get("answer")
+    if not chosen:
+        return 0, "回答が選択されていません。"
+    if chosen == correct:
+        return 100, "正解です。"
+    text = next((c["text"] for c in question["choices"] if c["label"] == correct), "")
+    return 0, f"不正解です。正解は ({correct}) {text}".rstrip()
+
+
+# ======================================================
+# コマンドライン
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TOEIC 問題の一括取り込み")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="JSONL / CSV を取り込む")
+    imp.add_argument("path")
+    imp.add_argument("--db", default="toeic_r.db")
+    imp.add_argument("--format", choices=("jsonl", "csv"), help="省略時は拡張子で判断")
+    imp.add_argument("--batch-size", type=int, default=IMPORT_BATCH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    init_store(args.db)
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "jsonl")
+    with open(args.path, encoding="utf-8", newline="") as f:
+        records = read_csv(f) if fmt == "csv" else read_jsonl(f)
+        total = import_records(args.db, records, args.batch_size)
+    print(f"imported {total} passages into {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+# word_index.py
+# words テーブルの綴り検索（完全一致・前方一致）用のメモリ上の索引。
+#
+# 単語ごとに Python オブジェクトを持つと 37 万語で数十 MB になるので、
+#   - 小文字化した綴りをソートして 1 本の文字列に連結し、開始位置を array に持つ
+#   - definition_ja も 1 本の文字列 + 開始位置
+#   - id は array('i')、pos は種類が少ないので番号（array('B')）
+# にしてある。検索は 64 件おきの見出しリストで当たりを付けてから、連結文字列の上で bisect する。
+#
+# words が変わったかどうかはトリガーで増やす words_version で見る
+# （student_answers など他のテーブルの更新では作り直さない）。
+import bisect
+import logging
+import threading
+import time
+from array import array
+
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+VERSION_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS words_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''',
+    "INSERT OR IGNORE INTO words_version (id, version) VALUES (1, 0)",
+    '''CREATE TRIGGER IF NOT EXISTS words_version_ai AFTER INSERT ON words BEGIN
+        UPDATE words_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS words_version_au AFTER UPDATE ON words BEGIN
+        UPDATE words_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS words_version_ad AFTER DELETE ON words BEGIN
+        UPDATE words_version SET version = version + 1 WHERE id = 1;
+    END''',
+]
+
+
+def init_word_version(db_file):
+    with db_connect(db_file) as conn:
+        c = conn.cursor()
+        for stmt in VERSION_STATEMENTS:
+            c.execute(stmt)
+        conn.commit()
+
+
+class _Packed:
+    """連結文字列 + 開始位置。packed[i] で i 番目の文字列を切り出す（bisect に渡せる）"""
+    __slots__ = ("text", "offsets", "samples")
+
+    SAMPLE_EVERY = 64
+
+    def __init__(self, items, sampled=False):
+        self.text = "".join(items)
+        self.offsets = array("I", [0])
+        pos = 0
+        for s in items:
+            pos += len(s)
+            self.offsets.append(pos)
+        # ソート済みのときだけ使う見出し（SAMPLE_EVERY 件おき）。bisect の大半を C で済ませる
+        self.samples = items[::self.SAMPLE_EVERY] if sampled else None
+
+    def bisect_left(self, key, lo=0):
+        """ソート済み前提。bisect.bisect_left(self, key, lo) と同じ結果"""
+        b = bisect.bisect_left(self.samples, key)
+        # samples[b-1] < key <= samples[b] なので、答えは ((b-1)*K, b*K] にある
+        start = max(lo, (b - 1) * self.SAMPLE_EVERY + 1) if b else lo
+        end = min(len(self), b * self.SAMPLE_EVERY)
+        return bisect.bisect_left(self, key, start, max(start, end))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+
+class WordTable:
+    """ある時点の words の中身（読み取り専用）"""
+    __slots__ = ("keys", "words", "ids", "definitions", "pos_codes", "pos_names")
+
+    def __init__(self, rows):
+        """rows: [(id, word, definition_ja, pos)]"""
+        rows = sorted((r for r in rows if r[1]), key=lambda r: (r[1].lower(), r[0]))
+        self.keys = _Packed([r[1].lower() for r in rows], sampled=True)
+        # 大文字を含む綴りは少ないので、元の綴りは違うものだけ持つ
+        self.words = {i: r[1] for i, r in enumerate(rows) if r[1] != r[1].lower()}
+        self.ids = array("i", (r[0] for r in rows))
+        self.definitions = _Packed([r[2] or "" for r in rows])
+        self.pos_names = sorted({r[3] or "" for r in rows})
+        if len(self.pos_names) > 255:
+            raise ValueError("too many distinct pos values")
+        pos_index = {p: i for i, p in enumerate(self.pos_names)}
+        self.pos_codes = array("B", (pos_index[r[3] or ""] for r in rows))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def entry(self, i):
+        return {
+            "id": self.ids[i],
+            "word": self.words.get(i) or self.keys[i],
+            "definition_ja": self.definitions[i],
+            "pos": self.pos_names[self.pos_codes[i]] or None,
+        }
+
+    def exact(self, word):
+        key = (word or "").strip().lower()
+        if not key:
+            return []
+        lo = hi = self.keys.bisect_left(key)
+        while hi < len(self.keys) and self.keys[hi] == key:
+            hi += 1
+        return [self.entry(i) for i in range(lo, hi)]
+
+    def prefix(self, prefix, limit=10):
+        """前方一致。戻り値: (先頭 limit 件, 一致した総数)"""
+        key = (prefix or "").strip().lower()
+        if not key:
+            return [], 0
+        lo = self.keys.bisect_left(key)
+        # key で始まる文字列は key 以上 key + U+10FFFF 未満に並んでいる
+        hi = self.keys.bisect_left(key + "\U0010ffff", lo)
+        return [self.entry(i) for i in range(lo, min(hi, lo + limit))], hi - lo
+
+
+class WordIndex:
+    """
+    WordTable を 1 つ持ち、words_version が変わっていたら作り直して差し替える。
+    バージョン確認は check_interval 秒に 1 回まで。
+    """
+
+    def __init__(self, db_file, check_interval=5.0):
+        self.db_file = db_file
+        self.check_interval = check_interval
+        self._table = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _current_version(self, conn):
+        row = conn.execute("SELECT version FROM words_version WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def _load(self):
+        with db_connect(self.db_file) as conn:
+            version = self._current_version(conn)
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(words)")]
+            pos_col = "pos" if "pos" in cols else "NULL"
+            rows = conn.execute(f"SELECT id, word, definition_ja, {pos_col} FROM words").fetchall()
+        start = time.perf_counter()
+        table = WordTable(rows)
+        logger.info("word index loaded: %d words in %.2fs (version %s)",
+                    len(table), time.perf_counter() - start, version)
+        return table, version
+
+    def table(self):
+        now = time.monotonic()
+        if self._table is not None and now - self._checked_at < self.check_interval:
+            return self._table
+        with self._lock:
+            if self._table is not None and now - self._checked_at < self.check_interval:
+                return self._table
+            if self._table is not None:
+                with db_connect(self.db_file) as conn:
+                    changed = self._current_version(conn) != self._version
+            else:
+                changed = True
+            if changed:
+                self._table, self._version = self._load()
+            self._checked_at = now
+            return self._table
+
+    def exact(self, word):
+        return self.table().exact(word)
+
+    def prefix(self, prefix, limit=10):
+        return self.table().prefix(prefix, limit)
@@ -0,0 +1,413 @@
+# word_stats.py
+# 単語ごとの正答状況（回数・点数の分布・よくある誤答）の集計テーブル。
+#
+#   word_stats        : word_id ごとの回数・合計点・60 点未満の回数・誤答率
+#   word_score_hist   : (word_id, 10 点刻みの区間) ごとの回数
+#   word_wrong_answers: (word_id, 正規化した誤答) ごとの回数と、実際の回答の例
+#
+# 回答が書き込まれるたびに record() で差分だけ足し（write-behind の on_flush から呼ぶ）、
+# 先生用の画面・API は top_words() / word_detail() でこのテーブルだけを読む。
+# student_answers を毎回 GROUP BY しない。
+#
+# rebuild() は全件からの作り直し（初回・スナップショットから戻したとき・CLI）。
+# ANSWER_TABLES（自由記述の student_answers と 4 択の word_choice_answers）と
+# それぞれの *_archive を id 順にページで読み、回数・合計・分布は
+# numpy の bincount でまとめて数える。読んでいる間に増えた行は、置き換えるトランザクションの
+# 中で足すので取りこぼさない。write-behind が動いているときは pause（ANSWER_WRITER.paused）を
+# 渡す。止めずに足すと、コミット済みでまだ record() されていない行を二重に数える
+# （アーカイブの移動と同時に走ると数件ずれることがあるので、起動時はアーカイブのタイマーより前に呼ぶ）。
+#
+#   python word_stats.py rebuild [--db english_learning.db]
+#   python word_stats.py top [--sort misses|miss_rate|attempts] [--limit 20] [--min-attempts 5]
+import argparse
+import contextlib
+import datetime
+import logging
+import sys
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+ANSWER_TABLES = ("student_answers", "word_choice_answers")   # 自由記述と 4 択
+MISS_BELOW = 60            # これ未満の点数を「間違えた」に数える（app.MISSED_SCORE と同じ）
+HIST_BUCKETS = 10          # 0-9, 10-19, ..., 90-100
+MAX_CLUSTERS = 50          # 作り直すときに残す、単語ごとの誤答の種類
+PAGE_ROWS = 20000
+MAX_WORD_ID = 10_000_000   # これより大きい word_id は壊れた行として数えない（配列を word_id の大きさで取るため）
+SORTS = {
+    "misses": "s.misses DESC, s.attempts DESC",
+    "miss_rate": "s.miss_rate DESC, s.attempts DESC",
+    "attempts": "s.attempts DESC",
+}
+
+CREATE_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS word_stats (
+        word_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        total_score INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0,
+        miss_rate REAL NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_word_stats_misses ON word_stats(misses DESC, attempts DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_word_stats_miss_rate ON word_stats(miss_rate DESC, attempts DESC)",
+    '''CREATE TABLE IF NOT EXISTS word_score_hist (
+        word_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (word_id, bucket)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS word_wrong_answers (
+        word_id INTEGER NOT NULL,
+        answer TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        example TEXT,
+        last_seen TEXT,
+        PRIMARY KEY (word_id, answer)
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_word_wrong_answers_count ON word_wrong_answers(word_id, count DESC)",
+]
+
+STATS_UPSERT_SQL = '''
+    INSERT INTO word_stats (word_id, attempts, total_score, misses, miss_rate, updated_at)
+    VALUES (?, ?, ?, ?, CAST(? AS REAL) / ?, ?)
+    ON CONFLICT(word_id) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        total_score = total_score + excluded.total_score,
+        misses = misses + excluded.misses,
+        miss_rate = CAST(misses + excluded.misses AS REAL) / (attempts + excluded.attempts),
+        updated_at = excluded.updated_at
+'''
+
+HIST_UPSERT_SQL = '''
+    INSERT INTO word_score_hist (word_id, bucket, count) VALUES (?, ?, ?)
+    ON CONFLICT(word_id, bucket) DO UPDATE SET count = count + excluded.count
+'''
+
+WRONG_UPSERT_SQL = '''
+    INSERT INTO word_wrong_answers (word_id, answer, count, example, last_seen) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(word_id, answer) DO UPDATE SET
+        count = count + excluded.count,
+        example = excluded.example,
+        last_seen = MAX(COALESCE(last_seen, ''), COALESCE(excluded.last_seen, ''))
+'''
+
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize_answer(text):
+    """誤答をまとめるためのキー: 全角半角・大文字小文字・カタカナとひらがなをそろえ、空白と記号を除く"""
+    text = unicodedata.normalize("NFKC", text or "").lower().translate(_KATAKANA_TO_HIRAGANA)
+    return "".join(ch for ch in text if not ch.isspace() and unicodedata.category(ch)[0] not in "PS")
+
+
+def init_word_stats(db_file):
+    """テーブルを作る。新しく作ったとき True（呼び出し側で rebuild する）"""
+    with db_connect(db_file) as conn:
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'word_stats'"
+        ).fetchone() is None
+        for stmt in CREATE_STATEMENTS:
+            conn.execute(stmt)
+        conn.commit()
+    return created
+
+
+# ======================================================
+# 集計（差分・全件で共通）
+# ======================================================
+def _valid_rows(rows):
+    """word_id と score を int にした行だけを返す（"12" のような文字列は数える。範囲外の word_id は数えない）"""
+    valid, skipped = [], 0
+    for word_id, score, answer, attempt_date in rows:
+        if word_id is None or score is None:
+            continue
+        try:
+            word_id, score = int(word_id), int(score)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if not 0 <= word_id <= MAX_WORD_ID:
+            skipped += 1
+            continue
+        valid.append((word_id, score, answer, attempt_date))
+    if skipped:
+        logger.warning("word_stats: skipped %d rows with a bad word_id or score", skipped)
+    return valid
+
+
+class _Tally:
+    """回答の山を数える。数値は numpy の配列、誤答は Counter"""
+
+    def __init__(self, size=1):
+        self.attempts = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size, dtype=np.int64)
+        self.misses = np.zeros(size, dtype=np.int64)
+        self.hist = np.zeros((size, HIST_BUCKETS), dtype=np.int64)
+        self.wrong = Counter()     # (word_id, 正規化した誤答) -> 回数
+        self.examples = {}         # (word_id, 正規化した誤答) -> (実際の回答, 日時)
+
+    def _grow(self, size):
+        if size <= len(self.attempts):
+            return
+        size = max(size, len(self.attempts) * 2)
+        for name in ("attempts", "total", "misses"):
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate([arr, np.zeros(size - len(arr), dtype=np.int64)]))
+        self.hist = np.vstack([self.hist, np.zeros((size - len(self.hist), HIST_BUCKETS), dtype=np.int64)])
+
+    def add(self, rows):
+        """
+        rows: [(word_id, score, user_answer, attempt_date)]。
+        score が NULL の行、word_id / score が整数にできない行は数えない（ほかの行は数える）。
+        """
+        rows = _valid_rows(rows)
+        if not rows:
+            return
+        word_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        scores = np.clip(np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)), 0, 100)
+        size = int(word_ids.max()) + 1
+        self._grow(size)
+        missed = scores < MISS_BELOW
+        buckets = np.minimum(scores // 10, HIST_BUCKETS - 1)
+        self.attempts[:size] += np.bincount(word_ids, minlength=size)
+        self.total[:size] += np.bincount(word_ids, weights=scores, minlength=size).astype(np.int64)
+        self.misses[:size] += np.bincount(word_ids[missed], minlength=size)
+        self.hist[:size] += np.bincount(
+            word_ids * HIST_BUCKETS + buckets, minlength=size * HIST_BUCKETS
+        ).reshape(size, HIST_BUCKETS)
+        for (word_id, _, answer, attempt_date), miss in zip(rows, missed):
+            if not miss or not answer:
+                continue
+            key = (word_id, normalize_answer(answer))
+            if not key[1]:
+                continue
+            self.wrong[key] += 1
+            self.examples[key] = (answer, attempt_date)
+
+    def stats_rows(self, now):
+        for word_id in np.nonzero(self.attempts)[0]:
+            a, t, m = int(self.attempts[word_id]), int(self.total[word_id]), int(self.misses[word_id])
+            yield int(word_id), a, t, m, m, a, now
+
+    def hist_rows(self):
+        word_ids, buckets = np.nonzero(self.hist)
+        for word_id, bucket in zip(word_ids, buckets):
+            yield int(word_id), int(bucket), int(self.hist[word_id, bucket])
+
+    def wrong_rows(self, limit=None):
+        items = self.wrong.items()
+        if limit is not None:
+            # 単語ごとに多い順 limit 種類まで
+            by_word = {}
+            for (word_id, answer), count in items:
+                by_word.setdefault(word_id, []).append((count, answer))
+            items = [
+                ((word_id, answer), count)
+                for word_id, pairs in by_word.items()
+                for count, answer in sorted(pairs, reverse=True)[:limit]
+            ]
+        for (word_id, answer), count in items:
+            example, seen = self.examples[(word_id, answer)]
+            yield word_id, answer, count, example, seen
+
+
+def _write(conn, tally):
+    now = datetime.datetime.utcnow().isoformat()
+    conn.executemany(STATS_UPSERT_SQL, tally.stats_rows(now))
+    conn.executemany(HIST_UPSERT_SQL, tally.hist_rows())
+    conn.executemany(WRONG_UPSERT_SQL, tally.wrong_rows())
+
+
+# ======================================================
+# 差分更新（回答ごと）
+# ======================================================
+def record(db_file, rows):
+    """書き込まれた回答 [(word_id, score, user_answer, attempt_date)] を足す（1 トランザクション）"""
+    tally = _Tally()
+    tally.add(rows)
+    if not tally.attempts.any():
+        return
+    try:
+        with db_connect(db_file) as conn:
+            _write(conn, tally)
+            conn.commit()
+    except Exception as e:
+        # 集計に失敗しても回答の保存は失敗させない（rebuild で整合する）
+        logger.error("word_stats record error: %s", e)
+
+
+# ======================================================
+# 全件からの作り直し
+# ======================================================
+def _scan(db_file, table, columns, tally, after_id=0, upto_id=None, conn=None):
+    """table の id > after_id（upto_id 以下）の行を tally に足す。最後に読んだ id を返す"""
+    last_id = after_id
+    while True:
+        sql = f"SELECT id, {columns} FROM {table} WHERE id > ?"
+        args = [last_id]
+        if upto_id is not None:
+            sql += " AND id <= ?"
+            args.append(upto_id)
+        sql += " ORDER BY id LIMIT ?"
+        args.append(PAGE_ROWS)
+        if conn is None:
+            with db_connect(db_file) as c:
+                rows = c.execute(sql, args).fetchall()
+        else:
+            rows = conn.execute(sql, args).fetchall()
+        if not rows:
+            return last_id
+        tally.add([r[1:] for r in rows])
+        last_id = rows[-1][0]
+        if len(rows) < PAGE_ROWS:
+            return last_id
+
+
+def _has_column(conn, table, column):
+    return column in {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def rebuild(db_file, pause=None):
+    """
+    ANSWER_TABLES（とアーカイブ済みの行）から集計し直して置き換える。数えた回答数を返す。
+    pause は回答の書き込み（とコミット後の record()）を止める context manager を返す関数で、
+    読んでいる間に増えた行を足して置き換える間だけ止める。
+    """
+    tally = _Tally()
+    hot = []   # (表, 読む列, 読み始めたときの最大 id)
+    with db_connect(db_file) as conn:
+        for table in ANSWER_TABLES:
+            if not _has_column(conn, table, "id"):
+                continue
+            upto_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            answer_col = "user_answer" if _has_column(conn, table, "user_answer") else "NULL"
+            hot.append((table, f"word_id, score, {answer_col}, attempt_date", upto_id,
+                        _has_column(conn, f"{table}_archive", "id")))
+    for table, hot_columns, upto_id, has_archive in hot:
+        _scan(db_file, table, hot_columns, tally, upto_id=upto_id)
+        if has_archive:
+            # アーカイブには回答の本文が無いので、回数と分布だけ
+            _scan(db_file, f"{table}_archive", "word_id, score, NULL, attempt_date", tally)
+
+    with pause() if pause is not None else contextlib.nullcontext(), \
+            db_connect(db_file, isolation_level=None) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 読んでいる間に書き込まれた回答も足してから置き換える
+            for table, hot_columns, upto_id, _ in hot:
+                _scan(db_file, table, hot_columns, tally, after_id=upto_id, conn=conn)
+            now = datetime.datetime.utcnow().isoformat()
+            conn.execute("DELETE FROM word_stats")
+            conn.execute("DELETE FROM word_score_hist")
+            conn.execute("DELETE FROM word_wrong_answers")
+            conn.executemany(STATS_UPSERT_SQL, tally.stats_rows(now))
+            conn.executemany(HIST_UPSERT_SQL, tally.hist_rows())
+            conn.executemany(WRONG_UPSERT_SQL, tally.wrong_rows(limit=MAX_CLUSTERS))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    total = int(tally.attempts.sum())
+    logger.info("word_stats rebuilt from %d answers (%d words)", total, int(np.count_nonzero(tally.attempts)))
+    return total
+
+
+# ======================================================
+# 読み出し（先生用の画面・API）
+# ======================================================
+def _wrong_answers(conn, word_id, limit):
+    rows = conn.execute(
+        "SELECT answer, count, example, last_seen FROM word_wrong_answers "
+        "WHERE word_id = ? ORDER BY count DESC LIMIT ?", (word_id, limit)
+    ).fetchall()
+    return [{"answer": r[0], "count": r[1], "example": r[2], "last_seen": r[3]} for r in rows]
+
+
+def _histogram(conn, word_id):
+    hist = [0] * HIST_BUCKETS
+    for bucket, count in conn.execute(
+        "SELECT bucket, count FROM word_score_hist WHERE word_id = ?", (word_id,)
+    ):
+        hist[bucket] = count
+    return hist
+
+
+def top_words(db_file, sort="misses", limit=20, offset=0, min_attempts=1, wrong_limit=3):
+    """よく間違えられる単語の一覧（sort: misses / miss_rate / attempts）"""
+    if sort not in SORTS:
+        raise ValueError(f"unknown sort: {sort}")
+    with db_connect(db_file) as conn:
+        rows = conn.execute(
+            f"""SELECT s.word_id, w.word, w.definition_ja, s.attempts, s.total_score, s.misses, s.miss_rate
+                FROM word_stats s LEFT JOIN words w ON w.id = s.word_id
+                WHERE s.attempts >= ?
+                ORDER BY {SORTS[sort]} LIMIT ? OFFSET ?""",
+            (min_attempts, limit, offset),
+        ).fetchall()
+        result = []
+        for word_id, word, definition, attempts, total, misses, miss_rate in rows:
+            result.append({
+                "word_id": word_id, "word": word, "definition_ja": definition,
+                "attempts": attempts, "avg_score": round(total / attempts, 1) if attempts else 0,
+                "misses": misses, "miss_rate": round(miss_rate, 3),
+                "histogram": _histogram(conn, word_id),
+                "wrong_answers": _wrong_answers(conn, word_id, wrong_limit),
+            })
+    return result
+
+
+def word_detail(db_file, word_id, wrong_limit=20):
+    """1 単語分の集計。まだ回答が無ければ None"""
+    with db_connect(db_file) as conn:
+        row = conn.execute(
+            """SELECT w.word, w.definition_ja, s.attempts, s.total_score, s.misses, s.miss_rate, s.updated_at
+               FROM word_stats s LEFT JOIN words w ON w.id = s.word_id WHERE s.word_id = ?""",
+            (word_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        word, definition, attempts, total, misses, miss_rate, updated_at = row
+        return {
+            "word_id": word_id, "word": word, "definition_ja": definition,
+            "attempts": attempts, "avg_score": round(total / attempts, 1) if attempts else 0,
+            "misses": misses, "miss_rate": round(miss_rate, 3), "updated_at": updated_at,
+            "histogram": _histogram(conn, word_id),
+            "wrong_answers": _wrong_answers(conn, word_id, wrong_limit),
+        }
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="単語ごとの正答状況の集計")
+    parser.add_argument("--db", default="english_learning.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="回答の全件から作り直す")
+    top_p = sub.add_parser("top", help="よく間違えられる単語")
+    top_p.add_argument("--sort", choices=sorted(SORTS), default="misses")
+    top_p.add_argument("--limit", type=int, default=20)
+    top_p.add_argument("--min-attempts", type=int, default=5)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    init_word_stats(args.db)
+    if args.command == "rebuild":
+        print(f"{rebuild(args.db)} answers")
+        return 0
+    for r in top_words(args.db, args.sort, args.limit, min_attempts=args.min_attempts):
+        wrong = ", ".join(f"{w['example']}({w['count']})" for w in r["wrong_answers"])
+        print(f"{r['word'] or r['word_id']:20s} {r['attempts']:6d} 回  誤答 {r['misses']:5d}"
+              f" ({r['miss_rate'] * 100:4.1f}%)  平均 {r['avg_score']:5.1f}  {wrong}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
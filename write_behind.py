@@ -0,0 +1,233 @@
+# write_behind.py
+# 回答の INSERT をメモリにためて、数ミリ秒ごと（または N 行たまったら）に
+# 1 トランザクションでまとめて書き込む（group commit）。
+#
+#   writer = WriteBehind(flush_interval=0.005, max_batch=200)
+#   writer.register("student_answers", DB_FILE, "INSERT INTO student_answers ... VALUES (?,?,...)",
+#                   on_flush=lambda rows: ...)   # コミット後に呼ばれる（ランキング反映など）
+#   writer.add("student_answers", (user_id, word_id, ...))
+#
+# まだ書き込まれていない行も pending() で見えるので、read() を使えば
+# 「自分の書いた回答が平均点に入っていない」ことは起きない。
+# プロセス終了時（atexit / close()）には残りを必ず書き込む。
+import atexit
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import metrics
+from db import connect as db_connect
+
+logger = logging.getLogger(__name__)
+
+ROW_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+WRITE_RETRIES = 3
+
+
+class WriteBehind:
+    def __init__(self, flush_interval=0.005, max_batch=200, enabled=True):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self._targets = {}            # name -> (db_file, sql, on_flush)
+        self._pending = []            # [(name, params)]（コミットされるまで残す）
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._seq = 0                 # 書き込み中は奇数（読み手の整合性チェック用）
+        self._closing = False
+        self._thread = None
+        atexit.register(self.close)
+
+    def register(self, name, db_file, sql, on_flush=None):
+        self._targets[name] = (db_file, sql, on_flush)
+
+    # ======================================================
+    # 書き込み
+    # ======================================================
+    def add(self, name, params):
+        if name not in self._targets:
+            raise KeyError(f"unknown write-behind target: {name}")
+        if not self.enabled or self._closing:
+            # 無効時・終了処理中は今まで通りその場で書く
+            with self._flush_lock:
+                self._write([(name, params)])
+            return
+        with self._cond:
+            self._pending.append((name, params))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        # 何があってもこのスレッドは止めない（止まると以降の add() が溜まる一方になる）
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # 少し待って他のリクエストの分もまとめる（max_batch に達したらすぐ）
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_batch and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self._flush_pending()
+            except Exception:
+                logger.exception("write-behind: flush failed")
+
+    def _flush_pending(self):
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._pending)
+            if not batch:
+                return
+            self._seq += 1
+            try:
+                self._write(batch)
+            except Exception:
+                # _write は DB ごとに例外を拾うので、ここに来るのは想定外のときだけ
+                logger.exception("write-behind: dropping %d rows", len(batch))
+                metrics.inc("answer_write_errors_total", len(batch))
+            finally:
+                with self._cond:
+                    del self._pending[:len(batch)]
+                    self._seq += 1
+                    self._cond.notify_all()
+
+    def _write(self, batch):
+        """batch を DB ごとに 1 トランザクションで書き、コミット後に on_flush を呼ぶ"""
+        by_db = defaultdict(lambda: defaultdict(list))
+        for name, params in batch:
+            by_db[self._targets[name][0]][name].append(params)
+
+        for db_file, groups in by_db.items():
+            # 1 つの DB で失敗しても、ほかの DB の分は書く
+            try:
+                written = self._write_db(db_file, groups)
+            except Exception:
+                dropped = sum(len(r) for r in groups.values())
+                logger.exception("write-behind: dropping %d rows for %s", dropped, db_file)
+                metrics.inc("answer_write_errors_total", dropped)
+                continue
+
+            for name, rows in written.items():
+                metrics.inc("answer_flushes_total", table=name)
+                metrics.observe("answer_flush_rows", len(rows), buckets=ROW_BUCKETS, table=name)
+                on_flush = self._targets[name][2]
+                if on_flush is not None:
+                    try:
+                        on_flush(rows)
+                    except Exception:
+                        logger.exception("write-behind on_flush error: %s", name)
+
+    def _write_db(self, db_file, groups):
+        """
+        groups（name -> rows）を 1 トランザクションで書き、書けた分を返す。
+        ロック待ちなど（OperationalError）は少し待ってやり直す。
+        それ以外（バインドできない値などの行の問題）は 1 行ずつ書き直し、書けない行だけ捨てる。
+        """
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                with db_connect(db_file) as conn:
+                    for name, rows in groups.items():
+                        conn.executemany(self._targets[name][1], rows)
+                    conn.commit()
+                return groups
+            except sqlite3.OperationalError as e:
+                if attempt == WRITE_RETRIES:
+                    dropped = sum(len(r) for r in groups.values())
+                    logger.error("write-behind: giving up %d rows for %s: %s", dropped, db_file, e)
+                    metrics.inc("answer_write_errors_total", dropped)
+                    return {}
+                time.sleep(0.05 * 2 ** attempt)
+            except sqlite3.Error as e:
+                logger.warning("write-behind: batch for %s failed (%s); writing rows one by one", db_file, e)
+                return self._write_rows(db_file, groups)
+        return {}
+
+    def _write_rows(self, db_file, groups):
+        written = defaultdict(list)
+        dropped = 0
+        with db_connect(db_file) as conn:
+            for name, rows in groups.items():
+                sql = self._targets[name][1]
+                for params in rows:
+                    try:
+                        conn.execute(sql, params)
+                    except sqlite3.OperationalError:
+                        raise
+                    except sqlite3.Error as e:
+                        dropped += 1
+                        logger.error("write-behind: dropping a %s row: %s", name, e)
+                        continue
+                    written[name].append(params)
+            conn.commit()
+        if dropped:
+            metrics.inc("answer_write_errors_total", dropped)
+        return written
+
+    # ======================================================
+    # 読み取り（read-your-writes）
+    # ======================================================
+    def pending(self, name):
+        """まだコミットされていない name の行"""
+        with self._cond:
+            return [params for n, params in self._pending if n == name]
+
+    def read(self, name, fn):
+        """
+        fn(pending_rows) を、DB と pending が食い違わない状態で呼ぶ。
+        fn の中で DB を読む間にコミットが挟まったらやり直す（二重に数えないため）。
+        """
+        for _ in range(3):
+            seq = self._seq
+            if seq % 2 == 0:
+                result = fn(self.pending(name))
+                if self._seq == seq:
+                    return result
+            time.sleep(0.001)
+        with self._flush_lock:
+            return fn(self.pending(name))
+
+    @contextlib.contextmanager
+    def paused(self):
+        """
+        この中では書き込み（とコミット後の on_flush）が走らない。add() された分は溜めておき、
+        抜けた後で書く。全再集計が、コミット済みの回答と on_flush の反映のずれを見ないための区切り。
+        """
+        with self._flush_lock:
+            yield
+
+    # ======================================================
+    # 終了処理
+    # ======================================================
+    def flush(self, timeout=10.0):
+        """今たまっている分が書き込まれるまで待つ"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending and self._thread is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=30)
+        # スレッドが止まっていても残りは書く
+        self._flush_pending()